@@ -81,8 +81,30 @@ class Settings(BaseSettings):
     # На Mac Studio рекомендуется 10–20, чтобы не перегружать Ollama/MLX (см. docs/MAC_STUDIO_LOAD_AND_VICTORIA.md).
     max_concurrent_victoria: int = int(os.getenv("MAX_CONCURRENT_VICTORIA", "50"))
     victoria_concurrent_wait_sec: float = float(os.getenv("VICTORIA_CONCURRENT_WAIT_SEC", "45.0"))
+    # Адаптивный лимит (AIMD по задержке Victoria): стартует с initial, держится в [min, max_concurrent_victoria]
+    victoria_admission_initial_concurrency: int = int(os.getenv("VICTORIA_ADMISSION_INITIAL", "10"))
+    victoria_admission_min_concurrency: int = int(os.getenv("VICTORIA_ADMISSION_MIN", "2"))
+    # Очередь ожидания ограничена: сверх неё — явный отказ 503 сразу, без ожидания
+    victoria_admission_max_queue: int = int(os.getenv("VICTORIA_ADMISSION_MAX_QUEUE", "100"))
+    # Во сколько раз задержка первого ответа может превысить базовую, прежде чем лимит снижается
+    victoria_admission_latency_tolerance: float = float(os.getenv("VICTORIA_ADMISSION_LATENCY_TOLERANCE", "2.0"))
+    # Прокси, которым доверяется X-Forwarded-For при определении IP клиента (CIDR через запятую; nginx фронтенда — в docker-сети)
+    trusted_proxies: str = os.getenv("TRUSTED_PROXIES", "127.0.0.1/32,::1/128,172.16.0.0/12")
+    # Интервал SSE-событий queued (позиция и ETA) для ожидающих клиентов
+    victoria_admission_update_sec: float = float(os.getenv("VICTORIA_ADMISSION_UPDATE_SEC", "2.0"))
     # Лимит шагов Victoria для чата (чтобы не упираться в 500 и не ждать долго на локальных моделях)
     victoria_max_steps_chat: int = int(os.getenv("VICTORIA_MAX_STEPS_CHAT", "50"))
+
+    # Общие HTTP-клиенты к апстримам (Victoria, Ollama): пул соединений на процесс вместо клиента на запрос
+    http_pool_max_connections: int = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+    http_pool_max_keepalive: int = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+    http_pool_keepalive_expiry: float = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "30.0"))
+    # HTTP/2 к апстримам (нужен пакет h2: pip install 'httpx[http2]'); без h2 — HTTP/1.1
+    http_client_http2: bool = os.getenv("HTTP_CLIENT_HTTP2", "false").lower() == "true"
+    # Бюджет повторов: повторов не больше этой доли от запросов (плюс небольшой запас) — без лавины при сбое
+    http_retry_budget_ratio: float = float(os.getenv("HTTP_RETRY_BUDGET_RATIO", "0.2"))
+    # Кэш health/status апстримов (UI опрашивает их постоянно)
+    upstream_health_cache_ttl_sec: float = float(os.getenv("UPSTREAM_HEALTH_CACHE_TTL_SEC", "5.0"))
     
     # Security
     secret_key: str = os.getenv("SECRET_KEY", "change-me-in-production")
@@ -99,6 +121,10 @@ class Settings(BaseSettings):
     # Cache
     cache_enabled: bool = os.getenv("CACHE_ENABLED", "true").lower() == "true"
     cache_ttl: int = int(os.getenv("CACHE_TTL", "300"))  # секунды
+    # Единый кэш (services/cache.py): лимит L1 на пространство имён, XFetch и ожидание пересчёта другим воркером
+    cache_l1_max_bytes: int = int(os.getenv("CACHE_L1_MAX_BYTES", str(16 * 1024 * 1024)))
+    cache_xfetch_beta: float = float(os.getenv("CACHE_XFETCH_BETA", "1.0"))  # 0 — без раннего обновления
+    cache_lock_wait_sec: float = float(os.getenv("CACHE_LOCK_WAIT_SEC", "2.0"))
 
     # RAG-light (Фаза 2: быстрый ответ на фактуальные вопросы из БЗ)
     rag_light_enabled: bool = os.getenv("RAG_LIGHT_ENABLED", "true").lower() == "true"
@@ -149,6 +175,16 @@ class Settings(BaseSettings):
     conversation_context_max_messages: int = int(os.getenv("CONVERSATION_CONTEXT_MAX_MESSAGES", "50"))
     conversation_context_max_chars: int = int(os.getenv("CONVERSATION_CONTEXT_MAX_CHARS", "8000"))
     conversation_context_use_redis: bool = os.getenv("CONVERSATION_CONTEXT_USE_REDIS", "false").lower() == "true"
+    # Старая часть диалога сворачивается в summary (фоном): бюджет summary, число последних реплик дословно
+    conversation_summary_max_chars: int = int(os.getenv("CONVERSATION_SUMMARY_MAX_CHARS", "1600"))
+    conversation_recent_max_messages: int = int(os.getenv("CONVERSATION_RECENT_MAX_MESSAGES", "20"))
+    conversation_summary_use_llm: bool = os.getenv("CONVERSATION_SUMMARY_USE_LLM", "true").lower() == "true"
+    conversation_summary_model: Optional[str] = os.getenv("CONVERSATION_SUMMARY_MODEL") or None
+
+    # Возобновляемые SSE-стримы чата: буфер событий прогона (Last-Event-ID), хранение после завершения
+    chat_stream_replay_max_events: int = int(os.getenv("CHAT_STREAM_REPLAY_MAX_EVENTS", "5000"))
+    chat_stream_replay_retention_sec: float = float(os.getenv("CHAT_STREAM_REPLAY_RETENTION_SEC", "600"))
+    chat_stream_replay_use_redis: bool = os.getenv("CHAT_STREAM_REPLAY_USE_REDIS", "false").lower() == "true"
 
     # Фаза 4, Неделя 4: мультимодальность (изображения, документы)
     moondream_station_url: str = os.getenv("MOONDREAM_STATION_URL", "http://localhost:2020")
@@ -179,6 +179,10 @@ async def lifespan(app: FastAPI):
         except asyncio.CancelledError:
             pass
 
+    from app.services.http_pool import close_upstreams
+    await close_upstreams()
+    logger.info("HTTP-клиенты апстримов закрыты")
+
     if getattr(app.state, "knowledge_os_pool", None) is not None:
         await app.state.knowledge_os_pool.close()
         app.state.knowledge_os_pool = None
@@ -209,7 +213,7 @@ app.add_middleware(
     allow_credentials=settings.cors_allow_credentials,
     allow_methods=settings.cors_allow_methods,
     allow_headers=settings.cors_allow_headers,
-    expose_headers=["X-Process-Time"]
+    expose_headers=["X-Process-Time", "X-Run-ID", "X-Client-Id"]
 )
 
 # Обработчики ошибок
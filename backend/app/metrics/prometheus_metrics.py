@@ -131,6 +131,26 @@ CACHE_SIZE = Gauge(
     ["cache_type"],
 )
 
+# Единый кэш (services/cache.py): попадания/промахи и задержка по пространствам имён
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by namespace and result",
+    ["namespace", "result"],  # hit_l1 | hit_l2 | miss | early_refresh | coalesced
+)
+
+CACHE_LATENCY = Histogram(
+    "cache_operation_seconds",
+    "Cache operation latency (get — lookup, compute — recompute on miss)",
+    ["namespace", "op"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+CACHE_BYTES = Gauge(
+    "cache_l1_bytes",
+    "Approximate size of the in-process cache level",
+    ["namespace"],
+)
+
 ERROR_COUNTER = Counter(
     "errors_total",
     "Total errors",
@@ -159,6 +179,62 @@ TELEGRAM_BOT_HEARTBEAT_AGE = Gauge(
     "Seconds since last Telegram bot heartbeat",
 )
 
+# === Admission control чата (concurrency_limiter) ===
+
+ADMISSION_QUEUE_WAIT = Histogram(
+    "chat_admission_queue_wait_seconds",
+    "Time a chat request waited in the admission queue",
+    buckets=(0.01, 0.1, 0.5, 1, 2, 5, 10, 20, 30, 45, 60),
+)
+
+ADMISSION_SERVICE_TIME = Histogram(
+    "chat_admission_service_seconds",
+    "Time a chat request held a Victoria slot",
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300),
+)
+
+ADMISSION_SHED = Counter(
+    "chat_admission_shed_total",
+    "Chat requests rejected by admission control",
+    ["reason"],  # queue_full | timeout
+)
+
+ADMISSION_LIMIT = Gauge(
+    "chat_admission_concurrency_limit",
+    "Current adaptive concurrency limit for Victoria",
+)
+
+ADMISSION_QUEUE_LENGTH = Gauge(
+    "chat_admission_queue_length",
+    "Chat requests waiting for a Victoria slot",
+)
+
+# === Пулы HTTP-клиентов к апстримам (http_pool) ===
+
+HTTP_POOL_CONNECTIONS = Gauge(
+    "upstream_http_pool_connections",
+    "Connections in the upstream HTTP pool",
+    ["upstream", "state"],  # active | idle
+)
+
+HTTP_POOL_MAX_CONNECTIONS = Gauge(
+    "upstream_http_pool_max_connections",
+    "Configured connection limit of the upstream HTTP pool",
+    ["upstream"],
+)
+
+HTTP_POOL_PENDING = Gauge(
+    "upstream_http_pool_pending_requests",
+    "Requests waiting for a free connection in the upstream HTTP pool",
+    ["upstream"],
+)
+
+HTTP_UPSTREAM_RETRIES = Counter(
+    "upstream_http_retries_total",
+    "Upstream request retries",
+    ["upstream", "result"],  # retried | budget_exhausted
+)
+
 # П.4 PRINCIPLE_EXPERTS_FIRST: метрика «ответил эксперт» vs fallback
 CHAT_EXPERT_ANSWER_TOTAL = Counter(
     "chat_expert_answer_total",
@@ -1,51 +1,68 @@
 """
-Structured Logging Middleware
+Structured Logging Middleware (чистый ASGI — тело ответа, в т.ч. SSE, не буферизуется и не оборачивается)
 """
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
+import json
 import logging
 import time
-import json
-from typing import Dict, Any
+from typing import Any, Dict
+from urllib.parse import parse_qsl
 
 logger = logging.getLogger(__name__)
 
 
-class StructuredLoggingMiddleware(BaseHTTPMiddleware):
-    """Middleware для структурированного логирования"""
-    
-    async def dispatch(self, request: Request, call_next):
+class StructuredLoggingMiddleware:
+    """
+    Middleware для структурированного логирования.
+
+    X-Process-Time — время до начала ответа (для стрима — до первого байта);
+    process_time в логе ответа — до последнего чанка тела.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
         start_time = time.time()
-        
+        path = scope["path"]
+        client_ip = scope["client"][0] if scope.get("client") else None
+        headers = dict(scope.get("headers") or [])
+        user_agent = headers.get(b"user-agent")
+
         # Логируем запрос
         log_data: Dict[str, Any] = {
             "type": "request",
-            "method": request.method,
-            "path": str(request.url.path),
-            "query_params": dict(request.query_params),
-            "client_ip": request.client.host if request.client else None,
-            "user_agent": request.headers.get("user-agent")
-        }
-        
-        logger.info(json.dumps(log_data))
-        
-        # Выполняем запрос
-        response = await call_next(request)
-        
-        # Логируем ответ
-        process_time = time.time() - start_time
-        log_data = {
-            "type": "response",
-            "method": request.method,
-            "path": str(request.url.path),
-            "status_code": response.status_code,
-            "process_time": round(process_time, 3),
-            "client_ip": request.client.host if request.client else None
+            "method": scope["method"],
+            "path": path,
+            "query_params": dict(parse_qsl(scope.get("query_string", b"").decode("latin-1"))),
+            "client_ip": client_ip,
+            "user_agent": user_agent.decode("latin-1") if user_agent else None,
         }
-        
         logger.info(json.dumps(log_data))
-        
-        # Добавляем заголовок с временем обработки
-        response.headers["X-Process-Time"] = str(round(process_time, 3))
-        
-        return response
+
+        status_code = None
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                # Добавляем заголовок с временем обработки
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-process-time", str(round(time.time() - start_time, 3)).encode())
+                ]
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                # Логируем ответ (после последнего чанка тела)
+                logger.info(json.dumps({
+                    "type": "response",
+                    "method": scope["method"],
+                    "path": path,
+                    "status_code": status_code,
+                    "process_time": round(time.time() - start_time, 3),
+                    "client_ip": client_ip,
+                }))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
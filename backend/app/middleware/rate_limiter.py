@@ -1,122 +1,138 @@
 """
-Rate Limiting Middleware
+Rate Limiting Middleware (чистый ASGI — без обёртки ответа, SSE-стримы идут напрямую).
+
+Лимиты по (IP, путь) за минуту и за час — скользящее окно на двух счётчиках:
+оценка = count_prev * доля_предыдущего_окна_в_скользящем + count_curr. O(1) на запрос и
+O(1) памяти на клиента; устаревшие клиенты вытесняются с головы OrderedDict по мере запросов
+(без периодического прохода по всем ключам).
 """
-from fastapi import Request, HTTPException, status
-from starlette.middleware.base import BaseHTTPMiddleware
-from collections import defaultdict
-import time
+import json
 import logging
-from typing import Dict, Tuple
+import time
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
 
 from app.config import get_settings
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Пути без лимита: health checks, docs, метрики
+EXEMPT_PATHS = frozenset({"/health", "/docs", "/openapi.json", "/", "/metrics", "/metrics/summary"})
+
+
+class SlidingWindowCounter:
+    """Приближённое скользящее окно: два соседних фиксированных окна на ключ"""
+
+    def __init__(self, limit: int, window: float, clock: Callable[[], float] = time.time):
+        self.limit = limit
+        self.window = window
+        self._clock = clock
+        # key -> [начало текущего окна, счётчик текущего, счётчик предыдущего]
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        # Голова — давно не обращавшиеся ключи; старше двух окон счётчики уже нулевые
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry[0] < 2 * self.window:
+                break
+            del self._entries[key]
+
+    def estimate(self, key: str, now: Optional[float] = None) -> float:
+        now = self._clock() if now is None else now
+        entry = self._entries.get(key)
+        if entry is None:
+            return 0.0
+        start, current, previous = entry
+        elapsed = now - start
+        if elapsed >= 2 * self.window:
+            return 0.0
+        if elapsed >= self.window:
+            return current * (1 - (elapsed - self.window) / self.window)
+        return previous * (1 - elapsed / self.window) + current
+
+    def hit(self, key: str, now: Optional[float] = None) -> None:
+        now = self._clock() if now is None else now
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = [now - now % self.window, 0, 0]
+            self._entries[key] = entry
+        else:
+            self._entries.move_to_end(key)
+        shift = int((now - entry[0]) // self.window)
+        if shift == 1:
+            entry[0], entry[1], entry[2] = entry[0] + self.window, 0, entry[1]
+        elif shift > 1:
+            entry[0], entry[1], entry[2] = now - now % self.window, 0, 0
+        entry[1] += 1
+        self._evict(now)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
 
 class RateLimiter:
-    """Простой in-memory rate limiter"""
-    
-    def __init__(self):
-        self.requests_per_minute: Dict[str, list] = defaultdict(list)
-        self.requests_per_hour: Dict[str, list] = defaultdict(list)
-        self.cleanup_interval = 60  # секунды
-        self.last_cleanup = time.time()
-    
-    def _get_client_id(self, request: Request) -> str:
-        """Получить идентификатор клиента"""
-        # Используем IP адрес
-        client_ip = request.client.host if request.client else "unknown"
-        return f"{client_ip}:{request.url.path}"
-    
-    def _cleanup_old_requests(self):
-        """Очистить старые записи"""
-        current_time = time.time()
-        if current_time - self.last_cleanup < self.cleanup_interval:
-            return
-        
-        # Очистка запросов старше минуты
-        minute_ago = current_time - 60
-        for client_id in list(self.requests_per_minute.keys()):
-            self.requests_per_minute[client_id] = [
-                ts for ts in self.requests_per_minute[client_id] if ts > minute_ago
-            ]
-            if not self.requests_per_minute[client_id]:
-                del self.requests_per_minute[client_id]
-        
-        # Очистка запросов старше часа
-        hour_ago = current_time - 3600
-        for client_id in list(self.requests_per_hour.keys()):
-            self.requests_per_hour[client_id] = [
-                ts for ts in self.requests_per_hour[client_id] if ts > hour_ago
-            ]
-            if not self.requests_per_hour[client_id]:
-                del self.requests_per_hour[client_id]
-        
-        self.last_cleanup = current_time
-    
-    def check_rate_limit(self, request: Request) -> Tuple[bool, str]:
+    """In-memory rate limiter: минутное и часовое скользящие окна"""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._clock = clock
+        self.per_minute = SlidingWindowCounter(settings.rate_limit_per_minute, 60, clock)
+        self.per_hour = SlidingWindowCounter(settings.rate_limit_per_hour, 3600, clock)
+
+    def check_rate_limit(self, client_id: str) -> Tuple[bool, str]:
         """
-        Проверить rate limit
-        
+        Проверить rate limit (и учесть запрос, если он разрешён)
+
         Returns:
             (allowed, message)
         """
         if not settings.rate_limit_enabled:
             return True, ""
-        
-        self._cleanup_old_requests()
-        
-        client_id = self._get_client_id(request)
-        current_time = time.time()
-        
-        # Проверка лимита в минуту
-        minute_requests = self.requests_per_minute[client_id]
-        minute_requests = [ts for ts in minute_requests if ts > current_time - 60]
-        self.requests_per_minute[client_id] = minute_requests
-        
-        if len(minute_requests) >= settings.rate_limit_per_minute:
-            return False, f"Rate limit exceeded: {settings.rate_limit_per_minute} requests per minute"
-        
-        # Проверка лимита в час
-        hour_requests = self.requests_per_hour[client_id]
-        hour_requests = [ts for ts in hour_requests if ts > current_time - 3600]
-        self.requests_per_hour[client_id] = hour_requests
-        
-        if len(hour_requests) >= settings.rate_limit_per_hour:
-            return False, f"Rate limit exceeded: {settings.rate_limit_per_hour} requests per hour"
-        
-        # Добавляем текущий запрос
-        minute_requests.append(current_time)
-        hour_requests.append(current_time)
-        
+        now = self._clock()
+        if self.per_minute.estimate(client_id, now) >= self.per_minute.limit:
+            return False, f"Rate limit exceeded: {self.per_minute.limit} requests per minute"
+        if self.per_hour.estimate(client_id, now) >= self.per_hour.limit:
+            return False, f"Rate limit exceeded: {self.per_hour.limit} requests per hour"
+        self.per_minute.hit(client_id, now)
+        self.per_hour.hit(client_id, now)
         return True, ""
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """Middleware для rate limiting"""
-    
+class RateLimitMiddleware:
+    """ASGI middleware для rate limiting (429 до вызова приложения)"""
+
     def __init__(self, app):
-        super().__init__(app)
+        self.app = app
         self.rate_limiter = RateLimiter()
-    
-    async def dispatch(self, request: Request, call_next):
-        # Пропускаем health checks, docs, метрики
-        if request.url.path in ["/health", "/docs", "/openapi.json", "/", "/metrics", "/metrics/summary"]:
-            return await call_next(request)
-        
-        allowed, message = self.rate_limiter.check_rate_limit(request)
-        
-        if not allowed:
-            logger.warning(f"Rate limit exceeded for {request.client.host}: {message}")
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail={
-                    "error": "rate_limit_exceeded",
-                    "message": message,
-                    "retry_after": 60
-                }
-            )
-        
-        response = await call_next(request)
-        return response
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        client_ip = scope["client"][0] if scope.get("client") else "unknown"
+        allowed, message = self.rate_limiter.check_rate_limit(f"{client_ip}:{scope['path']}")
+        if allowed:
+            await self.app(scope, receive, send)
+            return
+
+        logger.warning(f"Rate limit exceeded for {client_ip}: {message}")
+        body = json.dumps({
+            "error": {
+                "type": "http_exception",
+                "message": {"error": "rate_limit_exceeded", "message": message, "retry_after": 60},
+                "status_code": 429,
+                "path": scope["path"],
+            }
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"60"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,5 +1,5 @@
 """
-API мониторинга кэша (RAG Context Cache).
+API мониторинга кэша (RAG Context Cache + пространства имён единого кэша).
 """
 from fastapi import APIRouter
 
@@ -8,10 +8,11 @@ router = APIRouter(prefix="/api/cache", tags=["cache"])
 
 @router.get("/stats")
 async def get_cache_stats():
-    """Статистика RAG Context Cache: hit rate, hits, misses."""
+    """Статистика RAG Context Cache (hit rate, hits, misses) и всех пространств имён кэша."""
     try:
+        from app.services.cache import all_stats
         from app.services.rag_context_cache import get_cache_monitor
         monitor = get_cache_monitor()
-        return {"status": "ok", **monitor.get_stats()}
+        return {"status": "ok", **monitor.get_stats(), "namespaces": all_stats()}
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -2,18 +2,22 @@
 Chat Router - SSE стриминг для AI чата (Singularity 14.0 Unified)
 Прокси-роутер, передающий все запросы в Victoria Agent.
 """
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from pydantic import BaseModel, Field
-from typing import Optional, AsyncGenerator
+from typing import Callable, Optional, AsyncGenerator
 import json
 import logging
+import time
 import uuid
 
 from app.services.victoria import VictoriaClient, get_victoria_client
 from app.services.knowledge_os import KnowledgeOSClient, get_knowledge_os_client
 from app.services.conversation_context import get_conversation_context_manager
-from app.services.concurrency_limiter import acquire_victoria_slot, release_victoria_slot, with_victoria_slot
+from app.services.streaming import SSETranscript
+from app.services.stream_replay import get_stream_replay_registry
+from app.config import get_settings
+from app.services.concurrency_limiter import CLIENT_ID_HEADER, admission_identity, get_admission_controller
 from app.metrics.prometheus_metrics import metrics as prometheus_metrics, CHAT_EXPERT_ANSWER_TOTAL
 
 logger = logging.getLogger(__name__)
@@ -29,6 +33,23 @@ class ChatMessage(BaseModel):
     user_id: Optional[str] = Field(default=None, max_length=128)
     session_id: Optional[str] = Field(default=None, max_length=128)
 
+class AdmissionStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse с гарантированной очисткой: on_close вызывается, даже если генератор
+    так и не стартовал (send(http.response.start) упал — клиент ушёл до начала ответа),
+    иначе тикет очереди держал бы слот / место в очереди навсегда.
+    """
+
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
 class ChatResponse(BaseModel):
     """Ответ от чата"""
     content: str
@@ -48,8 +69,8 @@ async def send_message(
         chat_history = []
         if session_id:
             ctx_mgr = get_conversation_context_manager()
-            recent = await ctx_mgr.get_recent(session_id, last_n=10)
-            chat_history = ctx_mgr.to_victoria_chat_history(recent)
+            window = await ctx_mgr.get_context(session_id)
+            chat_history = ctx_mgr.to_victoria_chat_history(window.messages, window.summary)
 
         result = await victoria.run(
             prompt=message.content,
@@ -85,15 +106,25 @@ async def send_message(
 @prometheus_metrics.track_request(mode="stream", endpoint="stream")
 async def stream_message(
     message: ChatMessage,
+    request: Request,
     victoria: VictoriaClient = Depends(get_victoria_client)
 ):
-    """SSE стриминг ответа (Singularity 14.0 Unified) — прокси к Victoria /stream"""
-    acquired = await acquire_victoria_slot()
-    if not acquired:
+    """
+    SSE стриминг ответа (Singularity 14.0 Unified) — прокси к Victoria /stream.
+    События нумеруются (id:), первое — run с run_id; после обрыва — GET /stream/{run_id}.
+    Если слотов нет — стрим открывается сразу, клиент получает события queued (позиция, ETA);
+    при переполненной очереди — 503 без ожидания.
+    """
+    settings = get_settings()
+    # Справедливость очереди — по выданному сервером X-Client-Id (или IP за доверенным прокси),
+    # а не по user_id/session_id из тела запроса
+    user_key, client_token = admission_identity(request)
+    ticket = get_admission_controller().try_enqueue(user_key)
+    if ticket is None:
         return JSONResponse(
             status_code=503,
-            content={"error": "service_busy", "detail": "Too many concurrent requests."},
-            headers={"Retry-After": "60"}
+            content={"error": "service_busy", "detail": "Too many queued requests."},
+            headers={"Retry-After": "60", CLIENT_ID_HEADER: client_token}
         )
 
     correlation_id = str(uuid.uuid4())
@@ -101,47 +132,104 @@ async def stream_message(
     
     chat_history = []
     if session_id:
-        ctx_mgr = get_conversation_context_manager()
-        recent = await ctx_mgr.get_recent(session_id, last_n=10)
-        chat_history = ctx_mgr.to_victoria_chat_history(recent)
+        try:
+            ctx_mgr = get_conversation_context_manager()
+            window = await ctx_mgr.get_context(session_id)
+            chat_history = ctx_mgr.to_victoria_chat_history(window.messages, window.summary)
+        except BaseException:
+            ticket.release()
+            raise
+
+    run_id = str(uuid.uuid4())
+    registry = get_stream_replay_registry()
+
+    async def upstream():
+        """Прогон Victoria: байты как пришли; дочитывается до конца даже без зрителей"""
+        transcript = SSETranscript() if session_id else None
+        started = time.monotonic()
+        first_chunk = True
+        async for chunk in victoria.run_stream_raw(
+            prompt=message.content,
+            expert_name=message.expert_name,
+            session_id=session_id,
+            chat_history=chat_history,
+            correlation_id=correlation_id,
+            mode=message.mode or "agent"
+        ):
+            if first_chunk:
+                ticket.observe_latency(time.monotonic() - started)
+                first_chunk = False
+            yield chunk
+            if transcript is not None:
+                transcript.feed(chunk)
+
+        # Сохраняем историю после завершения стрима
+        if transcript is not None and transcript.parts:
+            ctx_mgr = get_conversation_context_manager()
+            await ctx_mgr.append(session_id, "user", message.content)
+            await ctx_mgr.append(session_id, "assistant", transcript.text)
+
+    run_started = False
+
+    def release_unless_started():
+        # После старта прогона слот отпускает on_done прогона
+        if not run_started:
+            ticket.release()
 
     async def proxy_generator():
-        full_response = []
+        nonlocal run_started
         try:
-            async for line in victoria.run_stream(
-                prompt=message.content,
-                expert_name=message.expert_name,
-                session_id=session_id,
-                chat_history=chat_history,
-                correlation_id=correlation_id,
-                mode=message.mode or "agent"
+            async for status in ticket.updates(
+                interval=settings.victoria_admission_update_sec,
+                timeout=settings.victoria_concurrent_wait_sec,
             ):
-                yield line + "\n\n"
-                # Пытаемся извлечь контент для сохранения в историю
-                if line.startswith("data: "):
-                    try:
-                        data = json.loads(line[6:])
-                        if data.get("type") == "chunk":
-                            full_response.append(data.get("content", ""))
-                    except:
-                        pass
-            
-            # Сохраняем историю после завершения стрима
-            if session_id and full_response:
-                ctx_mgr = get_conversation_context_manager()
-                await ctx_mgr.append(session_id, "user", message.content)
-                await ctx_mgr.append(session_id, "assistant", "".join(full_response))
-                
+                yield f"data: {json.dumps({'type': 'queued', **status})}\n\n"
+            if not ticket.granted:
+                yield f"data: {json.dumps({'type': 'error', 'error': 'service_busy', 'content': 'Сервер перегружен. Подождите и попробуйте снова.'}, ensure_ascii=False)}\n\n"
+                return
+
+            # Слот освобождается по завершении прогона, а не при уходе зрителя
+            registry.start(run_id, upstream, on_done=lambda failed: ticket.release(success=not failed))
+            run_started = True
+            async for frame in registry.subscribe(run_id):
+                yield frame
         finally:
-            release_victoria_slot()
+            release_unless_started()
 
-    return StreamingResponse(
+    return AdmissionStreamingResponse(
         proxy_generator(),
+        on_close=release_unless_started,
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+            "X-Run-ID": run_id,
+            CLIENT_ID_HEADER: client_token,
+        }
+    )
+
+@router.get("/stream/{run_id}")
+async def resume_stream(run_id: str, request: Request, last_event_id: Optional[int] = None):
+    """
+    Переподключение к прогону: события после Last-Event-ID (заголовок или ?last_event_id=)
+    из буфера, затем живой хвост. Victoria повторно не вызывается.
+    """
+    registry = get_stream_replay_registry()
+    if registry.get(run_id) is None and not registry.use_redis:
+        raise HTTPException(status_code=404, detail="Stream run not found or expired")
+    header = request.headers.get("last-event-id")
+    if last_event_id is None:
+        last_event_id = int(header) if header and header.isdigit() else 0
+
+    return StreamingResponse(
+        registry.subscribe(run_id, last_event_id),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
             "X-Accel-Buffering": "no",
+            "X-Run-ID": run_id,
         }
     )
 
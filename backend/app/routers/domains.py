@@ -34,7 +34,7 @@ async def list_domains(
     cache = get_cache()
     cache_key = "domains:list"
 
-    cached = cache.get(cache_key)
+    cached = await cache.get(cache_key)
     if cached is not None:
         logger.debug("Domains list served from cache")
         return cached
@@ -50,7 +50,7 @@ async def list_domains(
             )
             for d in rows
         ]
-        cache.set(cache_key, result, ttl=300)
+        await cache.set(cache_key, result, ttl=300)
         return result
     except Exception as e:
         logger.error(f"List domains error: {e}", exc_info=True)
@@ -36,7 +36,7 @@ async def list_experts(
     cache_key = "experts:list"
     
     # Проверяем кэш
-    cached = cache.get(cache_key)
+    cached = await cache.get(cache_key)
     if cached is not None:
         logger.debug("Experts list served from cache")
         return cached
@@ -55,7 +55,7 @@ async def list_experts(
         ]
         
         # Сохраняем в кэш
-        cache.set(cache_key, result, ttl=60)  # 1 мин — быстрее видеть новых (автономных) экспертов
+        await cache.set(cache_key, result, ttl=60)  # 1 мин — быстрее видеть новых (автономных) экспертов
         
         return result
     except Exception as e:
@@ -92,7 +92,7 @@ async def get_expert(
     cache_key = f"expert:{expert_id}"
     
     # Проверяем кэш
-    cached = cache.get(cache_key)
+    cached = await cache.get(cache_key)
     if cached is not None:
         logger.debug(f"Expert {expert_id} served from cache")
         return cached
@@ -115,7 +115,7 @@ async def get_expert(
         )
         
         # Сохраняем в кэш
-        cache.set(cache_key, result, ttl=60)  # 1 мин — быстрее видеть обновления
+        await cache.set(cache_key, result, ttl=60)  # 1 мин — быстрее видеть обновления
         
         return result
     except HTTPException:
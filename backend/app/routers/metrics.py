@@ -6,6 +6,7 @@ from fastapi import APIRouter, Response
 from prometheus_client import CONTENT_TYPE_LATEST
 
 from app.metrics.prometheus_metrics import get_metrics
+from app.services.http_pool import update_pool_metrics, upstreams_stats
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +17,7 @@ router = APIRouter(tags=["metrics"])
 async def metrics_endpoint():
     """Эндпоинт для сбора метрик Prometheus (scrape target)."""
     try:
+        update_pool_metrics()
         metrics_data = get_metrics()
         return Response(
             content=metrics_data,
@@ -77,4 +79,6 @@ async def metrics_summary():
         summary["chat_expert_answer_total"] = "see /metrics"
         summary["chat_fallback_total"] = "see /metrics"
 
+    summary["upstream_http_pools"] = upstreams_stats()
+
     return summary
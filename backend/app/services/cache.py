@@ -1,115 +1,411 @@
 """
-Кэширование для Singularity 9.0
-In-memory cache с TTL и LRU eviction
+Единый кэш бэкенда: пространства имён (планы, RAG-контекст, ответы RAG-light, справочники)
+поверх общего механизма вместо собственных схем ключей/TTL/Redis в каждом сервисе.
+
+- L1: LRU в процессе с учётом размера в байтах (и числа записей);
+- L2 (опционально): Redis, значения — msgpack, иначе orjson, иначе json (без pickle);
+- защита от «стада» при истечении популярного ключа:
+  вероятностное раннее обновление XFetch (чем ближе истечение и дороже пересчёт — тем вероятнее
+  один запрос пересчитает заранее), объединение одновременных пересчётов ключа в процессе
+  и короткая блокировка в Redis между воркерами;
+- версия пространства имён: invalidate_all() сбрасывает все ключи разом (INCR версии в Redis);
+- единые метрики: cache_requests_total / cache_operation_seconds / cache_l1_bytes и stats()
+  для роутера cache_stats.
 """
-import time
-import logging
-from typing import Any, Optional, Dict
-from collections import OrderedDict
+import asyncio
 import hashlib
 import json
+import logging
+import math
+import random
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
 
 from app.config import get_settings
+from app.metrics.prometheus_metrics import CACHE_BYTES, CACHE_LATENCY, CACHE_REQUESTS, record_cache_hit
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
+try:
+    import msgpack
+
+    def _dumps(value: Any) -> bytes:
+        return msgpack.packb(value, use_bin_type=True)
+
+    def _loads(raw: bytes) -> Any:
+        return msgpack.unpackb(raw, raw=False)
+
+    CODEC = "msgpack"
+except ImportError:
+    try:
+        import orjson
+
+        _dumps = orjson.dumps
+        _loads = orjson.loads
+        CODEC = "orjson"
+    except ImportError:
+        def _dumps(value: Any) -> bytes:
+            return json.dumps(value, ensure_ascii=False).encode()
+
+        def _loads(raw: bytes) -> Any:
+            return json.loads(raw)
+
+        CODEC = "json"
+
+_redis_client = None
+
+
+def _get_redis():
+    """Общий Redis-клиент кэша (бинарный: значения сериализуются кодеком)"""
+    global _redis_client
+    if _redis_client is not None:
+        return _redis_client
+    try:
+        import redis.asyncio as aioredis
+        url = getattr(settings, "redis_url", None)
+        if url:
+            _redis_client = aioredis.from_url(url, decode_responses=False)
+            return _redis_client
+    except ImportError:
+        logger.debug("Redis package not installed, cache will use memory only")
+    except Exception as e:
+        logger.debug("Redis not available for cache: %s", e)
+    return None
 
+
+def _sizeof(value: Any) -> int:
+    """Размер значения в байтах: длина сериализации, для несериализуемых — оценка sys.getsizeof"""
+    try:
+        return len(_dumps(value))
+    except Exception:
+        size = sys.getsizeof(value)
+        if isinstance(value, (list, tuple)):
+            size += sum(sys.getsizeof(v) for v in value)
+        return size
+
+
+@dataclass
 class CacheEntry:
-    """Запись в кэше"""
-    def __init__(self, value: Any, ttl: int):
-        self.value = value
-        self.created_at = time.time()
+    """Запись кэша: значение, момент истечения и стоимость пересчёта (delta, для XFetch)"""
+
+    value: Any
+    expires_at: float
+    delta: float = 0.0
+    size: int = 0
+
+    def is_expired(self, now: Optional[float] = None) -> bool:
+        return (time.time() if now is None else now) >= self.expires_at
+
+    def should_refresh_early(self, beta: float, now: Optional[float] = None) -> bool:
+        """XFetch: now − delta·beta·ln(rand) ≥ expiry"""
+        if self.delta <= 0 or beta <= 0:
+            return False
+        now = time.time() if now is None else now
+        return now - self.delta * beta * math.log(1.0 - random.random()) >= self.expires_at
+
+
+class CacheNamespace:
+    """Пространство имён кэша: L1 LRU по байтам, опционально Redis L2, XFetch и объединение пересчётов"""
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float = 300,
+        max_items: int = 1000,
+        max_bytes: Optional[int] = None,
+        use_redis: bool = False,
+        beta: Optional[float] = None,
+        lock_wait: Optional[float] = None,
+        redis_client: Any = None,
+    ):
+        self.name = name
         self.ttl = ttl
-    
-    def is_expired(self) -> bool:
-        """Проверить, истек ли TTL"""
-        return time.time() - self.created_at > self.ttl
-
-
-class LRUCache:
-    """LRU Cache с TTL для Singularity 9.0"""
-    
-    def __init__(self, max_size: int = 1000, default_ttl: int = 300):
-        self.max_size = max_size
-        self.default_ttl = default_ttl
-        self.cache: OrderedDict[str, CacheEntry] = OrderedDict()
-    
-    def _generate_key(self, *args, **kwargs) -> str:
-        """Генерировать ключ кэша"""
-        key_data = json.dumps({"args": args, "kwargs": kwargs}, sort_keys=True)
-        return hashlib.md5(key_data.encode()).hexdigest()
-    
-    def get(self, key: str) -> Optional[Any]:
-        """Получить значение из кэша"""
-        if key not in self.cache:
+        self.max_items = max_items
+        self.max_bytes = max_bytes if max_bytes is not None else getattr(settings, "cache_l1_max_bytes", 16 * 1024 * 1024)
+        self.beta = beta if beta is not None else getattr(settings, "cache_xfetch_beta", 1.0)
+        self.lock_wait = lock_wait if lock_wait is not None else getattr(settings, "cache_lock_wait_sec", 2.0)
+        self.redis = redis_client or (_get_redis() if use_redis else None)
+        self.use_redis = self.redis is not None
+        self.version = 0
+        self._version_checked = 0.0
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats = {"hits_l1": 0, "hits_l2": 0, "misses": 0, "early_refreshes": 0, "coalesced": 0}
+        self._get_time = 0.0
+        self._gets = 0
+        self._started = time.time()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_items > 0 and self.ttl > 0
+
+    # --- L1 ---
+
+    def get_local(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
             return None
-        
-        entry = self.cache[key]
-        
-        # Проверяем TTL
         if entry.is_expired():
-            del self.cache[key]
+            self._remove(key)
             return None
-        
-        # Перемещаем в конец (LRU)
-        self.cache.move_to_end(key)
-        
-        return entry.value
-    
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> None:
-        """Установить значение в кэш"""
-        ttl = ttl or self.default_ttl
-        
-        # Если ключ уже существует, обновляем
-        if key in self.cache:
-            self.cache.move_to_end(key)
-        
-        # Добавляем новую запись
-        self.cache[key] = CacheEntry(value, ttl)
-        
-        # Если превышен размер, удаляем самый старый
-        if len(self.cache) > self.max_size:
-            self.cache.popitem(last=False)
-    
-    def delete(self, key: str) -> None:
-        """Удалить ключ из кэша"""
-        if key in self.cache:
-            del self.cache[key]
-    
-    def clear(self) -> None:
-        """Очистить весь кэш"""
-        self.cache.clear()
-    
-    def cleanup_expired(self) -> int:
-        """Очистить истекшие записи"""
-        expired_keys = [
-            key for key, entry in self.cache.items()
-            if entry.is_expired()
-        ]
-        
-        for key in expired_keys:
-            del self.cache[key]
-        
-        return len(expired_keys)
-
-
-# Глобальный экземпляр кэша
-_cache: Optional[LRUCache] = None
-
-
-def get_cache() -> LRUCache:
-    """Получить глобальный экземпляр кэша"""
-    global _cache
-    if _cache is None:
-        _cache = LRUCache(
-            max_size=1000,
-            default_ttl=settings.cache_ttl
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put_local(self, key: str, entry: CacheEntry) -> None:
+        if not self.enabled:
+            return
+        if key in self._entries:
+            self._remove(key)
+        if entry.size > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += entry.size
+        while self._entries and (len(self._entries) > self.max_items or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+        CACHE_BYTES.labels(namespace=self.name).set(self._bytes)
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    # --- L2 ---
+
+    def _l2_key(self, key: str) -> str:
+        return f"cache:{self.name}:v{self.version}:{key}"
+
+    async def _sync_version(self) -> None:
+        """Версия пространства имён из Redis (не чаще раза в 5 с); смена версии сбрасывает L1"""
+        if not self.use_redis or time.time() - self._version_checked < 5.0:
+            return
+        self._version_checked = time.time()
+        try:
+            raw = await self.redis.get(f"cache:{self.name}:version")
+            version = int(raw) if raw else 0
+        except Exception as e:
+            logger.debug("Cache %s version read: %s", self.name, e)
+            return
+        if version != self.version:
+            self.version = version
+            self._entries.clear()
+            self._bytes = 0
+
+    async def _get_l2(self, key: str) -> Optional[CacheEntry]:
+        try:
+            raw = await self.redis.get(self._l2_key(key))
+        except Exception as e:
+            logger.debug("Cache %s redis get: %s", self.name, e)
+            return None
+        if not raw:
+            return None
+        try:
+            value, expires_at, delta = _loads(raw)
+        except Exception as e:
+            logger.debug("Cache %s decode: %s", self.name, e)
+            return None
+        return CacheEntry(value, expires_at, delta, len(raw))
+
+    async def _set_l2(self, key: str, entry: CacheEntry) -> None:
+        try:
+            raw = _dumps([entry.value, entry.expires_at, entry.delta])
+            ttl = max(1, int(math.ceil(entry.expires_at - time.time())))
+            await self.redis.set(self._l2_key(key), raw, ex=ttl)
+        except Exception as e:
+            logger.debug("Cache %s redis set: %s", self.name, e)
+
+    # --- API ---
+
+    async def get_entry(self, key: str) -> Optional[CacheEntry]:
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        await self._sync_version()
+        entry = self.get_local(key)
+        result = "hit_l1"
+        if entry is None and self.use_redis:
+            entry = await self._get_l2(key)
+            if entry is not None and not entry.is_expired():
+                self._put_local(key, entry)
+                result = "hit_l2"
+            else:
+                entry = None
+        if entry is None:
+            result = "miss"
+        self._stats["misses" if result == "miss" else f"hits_{result[4:]}"] += 1
+        elapsed = time.perf_counter() - started
+        self._get_time += elapsed
+        self._gets += 1
+        CACHE_REQUESTS.labels(namespace=self.name, result=result).inc()
+        CACHE_LATENCY.labels(namespace=self.name, op="get").observe(elapsed)
+        if result != "miss":
+            record_cache_hit(self.name)
+        return entry
+
+    async def get(self, key: str) -> Any:
+        entry = await self.get_entry(key)
+        return entry.value if entry is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None, delta: float = 0.0,
+                  local_only: bool = False) -> None:
+        if not self.enabled:
+            return
+        entry = CacheEntry(value, time.time() + (ttl or self.ttl), delta, _sizeof(value))
+        self._put_local(key, entry)
+        if self.use_redis and not local_only:
+            await self._set_l2(key, entry)
+
+    async def delete(self, key: str) -> None:
+        self._remove(key)
+        if self.use_redis:
+            try:
+                await self.redis.delete(self._l2_key(key))
+            except Exception as e:
+                logger.debug("Cache %s redis delete: %s", self.name, e)
+
+    async def invalidate_all(self) -> int:
+        """Сбросить всё пространство имён: новая версия (старые ключи Redis истекут сами)"""
+        count = len(self._entries)
+        self._entries.clear()
+        self._bytes = 0
+        CACHE_BYTES.labels(namespace=self.name).set(0)
+        if self.use_redis:
+            try:
+                self.version = int(await self.redis.incr(f"cache:{self.name}:version"))
+                self._version_checked = time.time()
+            except Exception as e:
+                logger.debug("Cache %s version bump: %s", self.name, e)
+                self.version += 1
+        else:
+            self.version += 1
+        return count
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        ttl: Optional[float] = None,
+        cache_none: bool = False,
+    ) -> Any:
+        """
+        Значение из кэша или compute(); на промахе (или при раннем обновлении XFetch) — один
+        пересчёт на ключ в процессе, между воркерами — короткая блокировка в Redis.
+        """
+        entry = await self.get_entry(key)
+        if entry is not None:
+            if not entry.should_refresh_early(self.beta):
+                return entry.value
+            if key in self._inflight:
+                return entry.value  # обновление уже идёт — отдаём текущее значение
+            self._stats["early_refreshes"] += 1
+            CACHE_REQUESTS.labels(namespace=self.name, result="early_refresh").inc()
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._stats["coalesced"] += 1
+            CACHE_REQUESTS.labels(namespace=self.name, result="coalesced").inc()
+            return await asyncio.shield(inflight)
+
+        # Пересчёт — отдельная задача: отмена первого вызвавшего не отменяет его для ожидающих
+        task = asyncio.ensure_future(
+            self._compute_locked(key, compute, ttl, cache_none, have_stale=entry is not None)
         )
-    return _cache
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._compute_done(key, done))
+        return await asyncio.shield(task)
+
+    def _compute_done(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # ожидающих может не быть
+
+    async def _compute_locked(self, key, compute, ttl, cache_none, have_stale: bool) -> Any:
+        lock_key = f"cache:{self.name}:lock:{key}"
+        locked = False
+        if self.use_redis and not have_stale:
+            try:
+                locked = bool(await self.redis.set(lock_key, b"1", nx=True, px=int(self.lock_wait * 1000)))
+                if not locked:
+                    # Другой воркер уже пересчитывает — ждём его результат в L2
+                    deadline = time.time() + self.lock_wait
+                    while time.time() < deadline:
+                        await asyncio.sleep(0.05)
+                        entry = await self._get_l2(key)
+                        if entry is not None and not entry.is_expired():
+                            self._put_local(key, entry)
+                            return entry.value
+            except Exception as e:
+                logger.debug("Cache %s lock: %s", self.name, e)
+        started = time.perf_counter()
+        try:
+            value = await compute()
+        finally:
+            CACHE_LATENCY.labels(namespace=self.name, op="compute").observe(time.perf_counter() - started)
+            if locked:
+                try:
+                    await self.redis.delete(lock_key)
+                except Exception:
+                    pass
+        if value is not None or cache_none:
+            await self.set(key, value, ttl=ttl, delta=time.perf_counter() - started)
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self._stats["hits_l1"] + self._stats["hits_l2"]
+        total = hits + self._stats["misses"]
+        return {
+            "namespace": self.name,
+            "hit_rate_pct": round(hits / total * 100, 1) if total else 0.0,
+            "hits": hits,
+            "misses": self._stats["misses"],
+            "total": total,
+            **self._stats,
+            "items": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "avg_get_ms": round(self._get_time / self._gets * 1000, 3) if self._gets else 0.0,
+            "ttl": self.ttl,
+            "version": self.version,
+            "redis": self.use_redis,
+            "codec": CODEC,
+            "uptime_sec": round(time.time() - self._started, 1),
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_namespaces: Dict[str, CacheNamespace] = {}
+
+
+def register_namespace(namespace: CacheNamespace) -> CacheNamespace:
+    """Зарегистрировать пространство имён (для stats и метрик); то же имя заменяется"""
+    _namespaces[namespace.name] = namespace
+    return namespace
+
+
+def get_namespace(name: str, **options) -> CacheNamespace:
+    """Пространство имён из реестра (создаётся при первом обращении с options)"""
+    namespace = _namespaces.get(name)
+    if namespace is None:
+        namespace = register_namespace(CacheNamespace(name, **options))
+    return namespace
+
+
+def all_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: ns.stats() for name, ns in _namespaces.items()}
+
+
+def get_cache() -> CacheNamespace:
+    """Общий кэш справочников (эксперты, домены): только L1"""
+    return get_namespace("default", ttl=settings.cache_ttl, max_items=1000)
 
 
 def cache_key(*args, **kwargs) -> str:
     """Генерировать ключ кэша"""
-    cache = get_cache()
-    return cache._generate_key(*args, **kwargs)
+    key_data = json.dumps({"args": args, "kwargs": kwargs}, sort_keys=True, default=str)
+    return hashlib.sha256(key_data.encode()).hexdigest()[:32]
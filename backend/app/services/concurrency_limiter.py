@@ -1,58 +1,350 @@
 """
-Ограничение одновременных запросов к Victoria (снижение 500 при нагрузке).
-При перегрузке возвращаем 503 вместо обрушения бэкенда.
+Admission control для запросов к Victoria (снижение 500 при нагрузке).
+
+Вместо голого семафора:
+- очередь с взвешенным справедливым обслуживанием по пользователям (WFQ по виртуальному времени):
+  пользователь с десятью вкладками не забирает все слоты — его запросы встают за чужими;
+- очередь ограничена: сверх max_queue — явный отказ сразу (503), а не ожидание 45 с впустую;
+- ожидающий запрос видит позицию и ETA (SSE-события queued в /api/chat/stream);
+- лимит одновременных запросов адаптивный (AIMD по задержке первого ответа Victoria):
+  рост +1 за «окно», пока средняя задержка короткого окна близка к средней длинного,
+  ×0.9 при превышении в tolerance раз или ошибке; границы [min, max_concurrent_victoria];
+- ключ справедливости — выданный сервером подписанный X-Client-Id (фронтенд хранит и
+  присылает его), без него — IP клиента (X-Forwarded-For учитывается только от доверенных прокси).
+
+Метрики Prometheus: время в очереди, время обслуживания, отказы, текущий лимит, длина очереди.
 """
 import asyncio
+import hashlib
+import hmac
+import heapq
+import ipaddress
 import logging
-from typing import AsyncGenerator, TypeVar
+import math
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Callable, Deque, Dict, List, Optional, Tuple
 
 from app.config import get_settings
+from app.metrics.prometheus_metrics import (
+    ADMISSION_LIMIT,
+    ADMISSION_QUEUE_LENGTH,
+    ADMISSION_QUEUE_WAIT,
+    ADMISSION_SERVICE_TIME,
+    ADMISSION_SHED,
+)
 
 logger = logging.getLogger(__name__)
 
-_semaphore: asyncio.Semaphore | None = None
-_wait_sec: float = 45.0
+# Длинное окно задержек — базовая (средняя) задержка Victoria; короткое — текущая
+LATENCY_WINDOW = 200
+LATENCY_SHORT_WINDOW = 10
+# Снижение лимита не чаще раза в столько секунд (одна перегрузка — одно снижение)
+DECREASE_COOLDOWN_SEC = 1.0
+# Время обслуживания по умолчанию для ETA, пока нет измерений
+DEFAULT_SERVICE_SEC = 10.0
 
 
-def _ensure_semaphore() -> asyncio.Semaphore:
-    global _semaphore, _wait_sec
-    if _semaphore is None:
-        s = get_settings()
-        limit = getattr(s, "max_concurrent_victoria", 25)
-        _wait_sec = getattr(s, "victoria_concurrent_wait_sec", 45.0)
-        _semaphore = asyncio.Semaphore(limit)
-        logger.info("Concurrency limiter: max_concurrent_victoria=%s, wait_sec=%s", limit, _wait_sec)
-    return _semaphore
+@dataclass(eq=False)
+class AdmissionTicket:
+    """Место в очереди к Victoria; после grant — занятый слот (release() обязателен)"""
 
+    controller: "AdmissionController"
+    user: str
+    tag: float
+    seq: int
+    enqueued_at: float
+    state: str = "queued"  # queued | granted | cancelled | released
+    granted_at: Optional[float] = None
+    _granted: asyncio.Event = field(default_factory=asyncio.Event)
 
-async def acquire_victoria_slot() -> bool:
-    """
-    Захватить слот на запрос к Victoria (с таймаутом).
-    Returns:
-        True — слот получен, False — таймаут (нужно вернуть 503).
-    """
-    sem = _ensure_semaphore()
-    try:
-        await asyncio.wait_for(sem.acquire(), timeout=_wait_sec)
-        return True
-    except asyncio.TimeoutError:
-        logger.warning("Victoria concurrency limit: wait timeout (%.0fs)", _wait_sec)
-        return False
+    @property
+    def granted(self) -> bool:
+        return self.state == "granted"
+
+    def position(self) -> int:
+        """1 — следующий на вход; 0 — уже допущен"""
+        return self.controller.position(self)
+
+    def eta_seconds(self) -> float:
+        return self.controller.eta(self.position())
+
+    async def wait(self, timeout: float) -> bool:
+        """Ждать слот не дольше timeout; False — отказ по таймауту (место в очереди снято)"""
+        async for _ in self.updates(interval=timeout, timeout=timeout):
+            pass
+        return self.granted
+
+    async def updates(self, interval: float, timeout: float) -> AsyncGenerator[Dict[str, Any], None]:
+        """Статус ожидания ({position, eta_seconds}) раз в interval, пока слот не выдан или не истёк timeout"""
+        deadline = self.enqueued_at + timeout
+        while self.state == "queued":
+            remaining = deadline - self.controller._clock()
+            if remaining <= 0:
+                self.controller.cancel(self, reason="timeout")
+                return
+            yield {"position": self.position(), "eta_seconds": round(self.eta_seconds(), 1)}
+            try:
+                await asyncio.wait_for(self._granted.wait(), timeout=min(interval, remaining))
+            except asyncio.TimeoutError:
+                pass
+
+    def observe_latency(self, seconds: float) -> None:
+        """Задержка первого ответа Victoria — сигнал для адаптивного лимита"""
+        self.controller.on_latency(seconds)
+
+    def release(self, success: bool = True) -> None:
+        """Освободить слот (или снять ожидание из очереди); повторный вызов безопасен"""
+        if self.state == "granted":
+            self.controller._release(self, success)
+        elif self.state == "queued":
+            self.controller.cancel(self)
+
+
+class AdmissionController:
+    """Взвешенная справедливая очередь к Victoria с адаптивным лимитом одновременности"""
+
+    def __init__(
+        self,
+        initial_limit: int = 10,
+        min_limit: int = 2,
+        max_limit: int = 50,
+        max_queue: int = 100,
+        latency_tolerance: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.max_queue = max_queue
+        self.latency_tolerance = latency_tolerance
+        self._clock = clock
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self._inflight = 0
+        self._heap: List[Tuple[float, int, AdmissionTicket]] = []
+        self._queued = 0
+        self._seq = 0
+        self._virtual_time = 0.0
+        self._user_tags: Dict[str, float] = {}
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._recent: Deque[float] = deque(maxlen=LATENCY_SHORT_WINDOW)
+        self._service_ewma: Optional[float] = None
+        self._last_decrease = 0.0
+        ADMISSION_LIMIT.set(self.limit)
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def try_enqueue(self, user: str, weight: float = 1.0) -> Optional[AdmissionTicket]:
+        """
+        Встать в очередь к Victoria.
+        Returns:
+            Ticket (возможно, сразу granted) или None — очередь полна, запрос отклонён.
+        """
+        now = self._clock()
+        if self._queued == 0 and self._inflight < self.limit:
+            ticket = AdmissionTicket(self, user, self._virtual_time, self._next_seq(), now)
+            self._grant(ticket)
+            return ticket
+        if self._queued >= self.max_queue:
+            ADMISSION_SHED.labels(reason="queue_full").inc()
+            logger.warning("Victoria admission: queue full (%d), request from %s rejected", self._queued, user)
+            return None
+        # Виртуальное время завершения: пользователь с множеством запросов уходит в хвост
+        tag = max(self._virtual_time, self._user_tags.get(user, 0.0)) + 1.0 / max(weight, 0.01)
+        self._user_tags[user] = tag
+        ticket = AdmissionTicket(self, user, tag, self._next_seq(), now)
+        heapq.heappush(self._heap, (tag, ticket.seq, ticket))
+        self._queued += 1
+        ADMISSION_QUEUE_LENGTH.set(self._queued)
+        return ticket
+
+    def _next_seq(self) -> int:
+        self._seq += 1
+        return self._seq
+
+    def _grant(self, ticket: AdmissionTicket) -> None:
+        ticket.state = "granted"
+        ticket.granted_at = self._clock()
+        ticket._granted.set()
+        self._inflight += 1
+        ADMISSION_QUEUE_WAIT.observe(ticket.granted_at - ticket.enqueued_at)
+
+    def _dispatch(self) -> None:
+        while self._heap and self._inflight < self.limit:
+            tag, _, ticket = heapq.heappop(self._heap)
+            if ticket.state != "queued":
+                continue
+            self._queued -= 1
+            self._virtual_time = max(self._virtual_time, tag)
+            self._grant(ticket)
+        if len(self._user_tags) > 1000:
+            self._user_tags = {u: t for u, t in self._user_tags.items() if t > self._virtual_time}
+        ADMISSION_QUEUE_LENGTH.set(self._queued)
+
+    def position(self, ticket: AdmissionTicket) -> int:
+        if ticket.state != "queued":
+            return 0
+        key = (ticket.tag, ticket.seq)
+        return 1 + sum(1 for tag, seq, t in self._heap if t.state == "queued" and (tag, seq) < key)
 
+    def eta(self, position: int) -> float:
+        """Оценка ожидания: волны по limit запросов, каждая — среднее время обслуживания"""
+        if position <= 0:
+            return 0.0
+        service = self._service_ewma if self._service_ewma is not None else DEFAULT_SERVICE_SEC
+        return math.ceil(position / self.limit) * service
 
-def release_victoria_slot() -> None:
-    """Освободить слот после завершения запроса к Victoria."""
-    sem = _ensure_semaphore()
-    sem.release()
+    def cancel(self, ticket: AdmissionTicket, reason: Optional[str] = None) -> None:
+        """Снять запрос из очереди (клиент ушёл или истёк таймаут ожидания)"""
+        if ticket.state != "queued":
+            return
+        ticket.state = "cancelled"
+        self._queued -= 1
+        if len(self._heap) > 2 * max(self.max_queue, 1):
+            # Снятые записи удаляются лениво; при большом «мусоре» — перестроить кучу
+            self._heap = [e for e in self._heap if e[2].state == "queued"]
+            heapq.heapify(self._heap)
+        ADMISSION_QUEUE_LENGTH.set(self._queued)
+        if reason:
+            ADMISSION_SHED.labels(reason=reason).inc()
+            logger.warning("Victoria admission: %s after %.1fs in queue (%s)",
+                           reason, self._clock() - ticket.enqueued_at, ticket.user)
 
+    def _release(self, ticket: AdmissionTicket, success: bool) -> None:
+        ticket.state = "released"
+        self._inflight -= 1
+        service = self._clock() - (ticket.granted_at or ticket.enqueued_at)
+        ADMISSION_SERVICE_TIME.observe(service)
+        self._service_ewma = service if self._service_ewma is None else 0.8 * self._service_ewma + 0.2 * service
+        if not success:
+            self._decrease()
+        self._dispatch()
 
-T = TypeVar("T")
+    def on_latency(self, sample: float) -> None:
+        """AIMD по задержке: среднее короткого окна против среднего длинного.
 
+        Около базовой — +1 за окно из limit ответов, выше в tolerance раз — ×0.9.
+        Базовая — среднее, а не минимум: один быстрый ответ не занижает её навсегда.
+        """
+        self._latencies.append(sample)
+        self._recent.append(sample)
+        baseline = sum(self._latencies) / len(self._latencies)
+        current = sum(self._recent) / len(self._recent)
+        if len(self._recent) == LATENCY_SHORT_WINDOW and current > baseline * self.latency_tolerance:
+            self._decrease()
+        elif current <= baseline * self.latency_tolerance and self._inflight >= self.limit - 1:
+            # Рост только когда лимит реально используется
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+            ADMISSION_LIMIT.set(self.limit)
+            self._dispatch()
 
-async def with_victoria_slot(agen: AsyncGenerator[T, None]) -> AsyncGenerator[T, None]:
-    """Обёртка над async generator: освобождает слот в finally."""
-    try:
-        async for x in agen:
-            yield x
-    finally:
-        release_victoria_slot()
+    def _decrease(self) -> None:
+        now = self._clock()
+        if now - self._last_decrease < DECREASE_COOLDOWN_SEC:
+            return
+        self._last_decrease = now
+        self._limit = max(float(self.min_limit), self._limit * 0.9)
+        ADMISSION_LIMIT.set(self.limit)
+        logger.info("Victoria admission: limit decreased to %d (inflight=%d)", self.limit, self._inflight)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "inflight": self._inflight,
+            "queued": self._queued,
+            "baseline_latency_sec": round(sum(self._latencies) / len(self._latencies), 3) if self._latencies else None,
+            "recent_latency_sec": round(sum(self._recent) / len(self._recent), 3) if self._recent else None,
+            "avg_service_sec": round(self._service_ewma, 3) if self._service_ewma is not None else None,
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+CLIENT_ID_HEADER = "X-Client-Id"
+
+
+def _sign_client_id(client_id: str, secret: str) -> str:
+    return hmac.new(secret.encode(), client_id.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def issue_client_token(secret: str) -> str:
+    """Новый идентификатор клиента: «id.подпись» (подделать чужой или новый без секрета нельзя)"""
+    client_id = uuid.uuid4().hex
+    return f"{client_id}.{_sign_client_id(client_id, secret)}"
+
+
+def verify_client_token(token: Optional[str], secret: str) -> Optional[str]:
+    """id клиента из подписанного токена или None"""
+    client_id, _, signature = (token or "").partition(".")
+    if not client_id or not hmac.compare_digest(signature, _sign_client_id(client_id, secret)):
+        return None
+    return client_id
+
+
+def client_ip(request: Any, trusted_proxies: List[str]) -> str:
+    """IP клиента; X-Forwarded-For разбирается справа налево только пока адреса — доверенные прокси"""
+    peer = request.client.host if request.client else None
+    if peer is None:
+        return "anonymous"
+    networks = []
+    for proxy in trusted_proxies:
+        try:
+            networks.append(ipaddress.ip_network(proxy.strip(), strict=False))
+        except ValueError:
+            continue
+
+    def trusted(address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in net for net in networks)
+
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    address = peer
+    while trusted(address) and hops:
+        address = hops.pop()
+    return address
+
+
+def admission_identity(request: Any) -> Tuple[str, str]:
+    """(ключ справедливости, токен X-Client-Id для ответа).
+
+    Действительный токен из заголовка — ключ по клиенту; иначе ключ по IP и выдаётся новый токен.
+    """
+    s = get_settings()
+    secret = getattr(s, "secret_key", "")
+    token = request.headers.get(CLIENT_ID_HEADER)
+    client_id = verify_client_token(token, secret)
+    if client_id is not None:
+        return f"client:{client_id}", token
+    trusted = getattr(s, "trusted_proxies", "127.0.0.1/32,::1/128").split(",")
+    return f"ip:{client_ip(request, trusted)}", issue_client_token(secret)
+
+
+def get_admission_controller() -> AdmissionController:
+    """Глобальный admission controller для Victoria (настройки из config)"""
+    global _controller
+    if _controller is None:
+        s = get_settings()
+        max_limit = getattr(s, "max_concurrent_victoria", 25)
+        _controller = AdmissionController(
+            initial_limit=min(getattr(s, "victoria_admission_initial_concurrency", 10), max_limit),
+            min_limit=getattr(s, "victoria_admission_min_concurrency", 2),
+            max_limit=max_limit,
+            max_queue=getattr(s, "victoria_admission_max_queue", 100),
+            latency_tolerance=getattr(s, "victoria_admission_latency_tolerance", 2.0),
+        )
+        logger.info("Victoria admission controller: %s, max_queue=%s", _controller.stats(), _controller.max_queue)
+    return _controller
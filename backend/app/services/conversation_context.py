@@ -2,7 +2,17 @@
 Фаза 4, Неделя 2: Контекстуализация ответов (multi-turn).
 
 ConversationContextManager: хранение истории диалога (session_id → сообщения).
-Окно контекста: последние N сообщений, ограничение по токенам (приближённо).
+Окно контекста = краткое содержание старой части диалога + последние реплики в пределах
+бюджета токенов (приближённо), поэтому размер промпта не растёт с длиной сессии:
+- реплики, вышедшие за бюджет, сворачиваются в summary инкрементально и в фоне
+  (предыдущее summary + только новые вышедшие реплики), пока свёртка не готова —
+  они попадают в окно в сжатом виде;
+- добавление без глобальной блокировки: состояние сессии меняется синхронно (одно событие
+  цикла), свёртка — не больше одной фоновой задачи на сессию;
+- опционально Redis: список реплик и summary, операции одним pipeline; Redis — общий источник
+  истины для нескольких процессов: сессия, которой нет в памяти (рестарт, другой процесс),
+  поднимается из Redis, свёртка идёт от состояния в Redis, а summary записывается
+  compare-and-set по upto (Lua), чтобы процессы не затирали свёртки друг друга.
 Рекомендации: Backend (единая точка хранения), SRE (TTL, опционально Redis), QA (предсказуемый формат).
 """
 import asyncio
@@ -10,7 +20,9 @@ import json
 import logging
 import os
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 from app.config import get_settings
 
@@ -18,6 +30,74 @@ logger = logging.getLogger(__name__)
 
 # Приблизительно 4 символа на токен для ограничения контекста
 CHARS_PER_TOKEN_APPROX = 4
+# Сколько символов реплики попадает в сжатый (экстрактивный) пересказ
+EXTRACT_CHARS_PER_MESSAGE = 200
+
+# Записать summary, только если в Redis всё ещё то upto, от которого строилась свёртка
+_SAVE_SUMMARY_LUA = """
+local current = redis.call('GET', KEYS[1])
+local upto = 0
+if current then
+    upto = tonumber(cjson.decode(current)['upto']) or 0
+end
+if upto ~= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+Summarizer = Callable[[str, List[Dict[str, Any]]], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text or "") + CHARS_PER_TOKEN_APPROX - 1) // CHARS_PER_TOKEN_APPROX
+
+
+def _label(role: str) -> str:
+    return "Пользователь" if role == "user" else "Ассистент"
+
+
+def extractive_summary(previous: str, messages: List[Dict[str, Any]], max_chars: int) -> str:
+    """Сжатый пересказ без LLM: начало каждой реплики; при переполнении — самое свежее"""
+    lines = [previous.strip()] if previous and previous.strip() else []
+    for m in messages:
+        content = " ".join((m.get("content") or "").split())
+        if not content:
+            continue
+        if len(content) > EXTRACT_CHARS_PER_MESSAGE:
+            content = content[:EXTRACT_CHARS_PER_MESSAGE].rstrip() + "…"
+        lines.append(f"{_label(m.get('role', 'user'))}: {content}")
+    text = "\n".join(lines)
+    return text if len(text) <= max_chars else "…" + text[-(max_chars - 1):]
+
+
+async def llm_summary(previous: str, messages: List[Dict[str, Any]], max_chars: int) -> str:
+    """Обновить summary через локальную модель (Ollama); при ошибке — экстрактивный пересказ"""
+    dialog = "\n".join(
+        f"{_label(m.get('role', 'user'))}: {(m.get('content') or '').strip()[:2000]}" for m in messages
+    )
+    prompt = (
+        "Обнови краткое содержание диалога. Сохрани факты, решения, имена, числа и открытые вопросы; "
+        f"не более {max_chars // CHARS_PER_TOKEN_APPROX} токенов, без вступлений.\n\n"
+        f"Текущее краткое содержание:\n{previous or '(пусто)'}\n\nНовые реплики:\n{dialog}\n\n"
+        "Обновлённое краткое содержание:"
+    )
+    try:
+        from app.services.ollama import get_ollama_client
+        client = await get_ollama_client()
+        settings = get_settings()
+        result = await client.generate(
+            prompt,
+            model=getattr(settings, "conversation_summary_model", None) or client.FAST_MODEL,
+        )
+        text = (result.get("response") or "").strip()
+        if text:
+            return text[:max_chars]
+        logger.debug("ConversationContext LLM summary empty: %s", result.get("error"))
+    except Exception as e:
+        logger.debug("ConversationContext LLM summary failed: %s", e)
+    return extractive_summary(previous, messages, max_chars)
 
 
 def _get_redis():
@@ -38,6 +118,27 @@ def _get_redis():
         return None
 
 
+@dataclass
+class ContextWindow:
+    """Окно контекста для промпта: summary старой части + последние реплики"""
+
+    summary: str = ""
+    messages: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.summary) + sum(estimate_tokens(m.get("content") or "") for m in self.messages)
+
+
+@dataclass
+class _Session:
+    messages: List[Dict[str, Any]] = field(default_factory=list)  # ещё не свёрнутые в summary
+    summary: str = ""
+    summarized_upto: int = 0  # seq последней свёрнутой реплики
+    seq: int = 0
+    touched: float = 0.0
+
+
 class ConversationContextManager:
     """
     Управление контекстом диалога для multi-turn чата.
@@ -50,29 +151,162 @@ class ConversationContextManager:
         max_messages_per_session: int = 50,
         max_context_chars: int = 8000,
         use_redis: bool = False,
+        summary_max_chars: int = 1600,
+        recent_max_messages: int = 20,
+        summarizer: Optional[Summarizer] = None,
     ):
         self.ttl_sec = ttl_sec
         self.max_messages_per_session = max_messages_per_session
         self.max_context_chars = max_context_chars
         self.use_redis = use_redis
-        self._memory: Dict[str, List[Dict[str, Any]]] = {}
-        self._memory_ts: Dict[str, float] = {}
-        self._lock = asyncio.Lock()
+        self.summary_max_chars = summary_max_chars
+        self.recent_max_messages = recent_max_messages
+        # Бюджет последних реплик = общий бюджет минус место под summary
+        self.recent_max_chars = max(max_context_chars - summary_max_chars, max_context_chars // 2)
+        self._summarizer = summarizer or self._extractive
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._folding: Dict[str, asyncio.Task] = {}
+
+    async def _extractive(self, previous: str, messages: List[Dict[str, Any]]) -> str:
+        return extractive_summary(previous, messages, self.summary_max_chars)
+
+    def _session(self, session_id: str, create: bool = False) -> Optional[_Session]:
+        now = time.time()
+        # Голова OrderedDict — давно не использовавшиеся сессии
+        while self._sessions:
+            sid, s = next(iter(self._sessions.items()))
+            if now - s.touched <= self.ttl_sec:
+                break
+            del self._sessions[sid]
+        session = self._sessions.get(session_id)
+        if session is None and create:
+            session = _Session()
+            self._sessions[session_id] = session
+        if session is not None:
+            session.touched = now
+            self._sessions.move_to_end(session_id)
+        return session
+
+    @staticmethod
+    def _adopt(session: _Session, summary: str, upto: int, messages: List[Dict[str, Any]]) -> None:
+        """Заменить состояние сессии состоянием из Redis"""
+        session.summary = summary
+        session.summarized_upto = upto
+        session.messages = [m for m in messages if m.get("seq", 0) > upto]
+        session.seq = max([session.seq, upto] + [m.get("seq", 0) for m in messages])
+
+    async def _load_session(self, session_id: str) -> _Session:
+        """Сессия из памяти; если её нет (рестарт, другой процесс) — из Redis"""
+        session = self._session(session_id)
+        if session is not None:
+            return session
+        loaded = await self._redis_load(session_id) if self.use_redis else None
+        session = self._session(session_id)  # могли создать, пока ждали Redis
+        if session is None:
+            session = self._session(session_id, create=True)
+            if loaded is not None:
+                self._adopt(session, *loaded)
+        return session
+
+    def _split(self, messages: List[Dict[str, Any]], upto: int):
+        """(вышедшие за бюджет, последние в бюджете) среди ещё не свёрнутых реплик"""
+        pending = [m for m in messages if m.get("seq", 0) > upto]
+        total = 0
+        start = len(pending)
+        while start > 0 and len(pending) - start < self.recent_max_messages:
+            size = len(pending[start - 1].get("content") or "")
+            if total + size > self.recent_max_chars and start < len(pending):
+                break
+            total += size
+            start -= 1
+        return pending[:start], pending[start:]
 
     async def append(self, session_id: str, role: str, content: str) -> None:
         """Добавить сообщение в историю сессии. role: 'user' | 'assistant'."""
         if not session_id or not content:
             return
-        item = {"role": role, "content": content[:50000], "ts": time.time()}
-        async with self._lock:
-            self._memory_ts[session_id] = time.time()
-            if session_id not in self._memory:
-                self._memory[session_id] = []
-            self._memory[session_id].append(item)
-            if len(self._memory[session_id]) > self.max_messages_per_session:
-                self._memory[session_id] = self._memory[session_id][-self.max_messages_per_session:]
+        session = await self._load_session(session_id)
+        # seq — время в мкс (не меньше предыдущего + 1): порядок сохраняется и между процессами с общим Redis
+        session.seq = max(session.seq + 1, int(time.time() * 1_000_000))
+        item = {"role": role, "content": content[:50000], "ts": time.time(), "seq": session.seq}
+        session.messages.append(item)
+        if len(session.messages) > self.max_messages_per_session:
+            # Страховка: свёртка не успевает — самые старые уходят в summary без LLM
+            overflow = session.messages[:-self.max_messages_per_session]
+            base_upto = session.summarized_upto
+            session.summary = extractive_summary(session.summary, overflow, self.summary_max_chars)
+            session.summarized_upto = overflow[-1]["seq"]
+            session.messages = session.messages[-self.max_messages_per_session:]
+            if self.use_redis:
+                await self._redis_save_summary(session_id, session.summary, base_upto, session.summarized_upto)
         if self.use_redis:
             await self._redis_append(session_id, item)
+        aged, _ = self._split(session.messages, session.summarized_upto)
+        if aged and session_id not in self._folding:
+            self._folding[session_id] = asyncio.create_task(self._fold(session_id))
+
+    async def _fold(self, session_id: str) -> None:
+        """
+        Фоновая свёртка вышедших за бюджет реплик в summary (пока есть что сворачивать).
+        С Redis свёртка строится от состояния в Redis (там и реплики других процессов), а запись
+        проходит только если upto в Redis не изменился; иначе состояние перечитывается.
+        """
+        try:
+            while True:
+                session = self._sessions.get(session_id)
+                if session is None:
+                    return
+                if self.use_redis:
+                    loaded = await self._redis_load(session_id)
+                    if self._sessions.get(session_id) is not session:
+                        return
+                    if loaded is not None:
+                        self._adopt(session, *loaded)
+                aged, _ = self._split(session.messages, session.summarized_upto)
+                if not aged:
+                    return
+                base_summary, base_upto = session.summary, session.summarized_upto
+                try:
+                    summary = await self._summarizer(base_summary, aged)
+                except Exception as e:
+                    logger.debug("ConversationContext summarizer failed: %s", e)
+                    summary = extractive_summary(base_summary, aged, self.summary_max_chars)
+                if self._sessions.get(session_id) is not session:
+                    return  # сессию очистили во время свёртки
+                summary = summary[:self.summary_max_chars]
+                upto = aged[-1]["seq"]
+                if self.use_redis and await self._redis_save_summary(session_id, summary, base_upto, upto) is False:
+                    continue  # другой процесс свернул раньше — перечитать и свернуть остаток
+                session.summary = summary
+                session.summarized_upto = upto
+                session.messages = [m for m in session.messages if m["seq"] > upto]
+        finally:
+            self._folding.pop(session_id, None)
+
+    async def get_context(self, session_id: str) -> ContextWindow:
+        """
+        Окно контекста для очередного хода: summary + последние реплики в бюджете токенов.
+        Реплики, ещё не свёрнутые фоном, добавляются к summary в сжатом виде.
+        """
+        if not session_id:
+            return ContextWindow()
+        summary, upto, messages = "", 0, []
+        if self.use_redis:
+            loaded = await self._redis_load(session_id)
+            if loaded is not None:
+                summary, upto, messages = loaded
+        if not messages and not summary:
+            session = self._session(session_id)
+            if session is None:
+                return ContextWindow()
+            summary, upto, messages = session.summary, session.summarized_upto, list(session.messages)
+        aged, recent = self._split(messages, upto)
+        if aged:
+            summary = extractive_summary(summary, aged, self.summary_max_chars)
+        if len(recent) == 1 and len(recent[0].get("content") or "") > self.recent_max_chars:
+            # Одна реплика больше бюджета — в окно идёт её конец
+            recent = [dict(recent[0], content="…" + recent[0]["content"][-(self.recent_max_chars - 1):])]
+        return ContextWindow(summary=summary, messages=recent)
 
     async def get_recent(
         self,
@@ -81,27 +315,14 @@ class ConversationContextManager:
         max_chars: Optional[int] = None,
     ) -> List[Dict[str, Any]]:
         """
-        Последние сообщения сессии (окно контекста).
-        Сначала берём из Redis при use_redis, иначе из memory; обрезаем по last_n и max_chars.
+        Последние сообщения сессии (без summary; для окна с summary — get_context).
+        Обрезаем по last_n и max_chars.
         """
-        if not session_id:
-            return []
+        window = await self.get_context(session_id)
         max_chars = max_chars or self.max_context_chars
-        messages: List[Dict[str, Any]] = []
-        if self.use_redis:
-            messages = await self._redis_get_recent(session_id, last_n)
-        async with self._lock:
-            if session_id in self._memory_ts:
-                if time.time() - self._memory_ts[session_id] > self.ttl_sec:
-                    self._memory.pop(session_id, None)
-                    self._memory_ts.pop(session_id, None)
-                    return []
-            if not messages and session_id in self._memory:
-                messages = list(self._memory[session_id][-last_n:])
-        # Ограничение по длине
         total = 0
         out: List[Dict[str, Any]] = []
-        for m in reversed(messages):
+        for m in reversed(window.messages[-last_n:]):
             c = (m.get("content") or "")[:50000]
             if total + len(c) > max_chars:
                 break
@@ -109,32 +330,35 @@ class ConversationContextManager:
             total += len(c)
         return out
 
-    def build_context_prefix(self, messages: List[Dict[str, Any]]) -> str:
+    def build_context_prefix(self, messages: List[Dict[str, Any]], summary: str = "") -> str:
         """
         Форматирование истории для префикса к промпту.
         Рекомендация Technical Writer: единообразные формулировки «Пользователь» / «Ассистент».
         """
-        if not messages:
-            return ""
         lines = []
-        for m in messages:
+        for m in messages or []:
             role = m.get("role", "user")
             content = (m.get("content") or "").strip()
             if not content:
                 continue
-            label = "Пользователь" if role == "user" else "Ассистент"
-            lines.append(f"{label}: {content}")
-        if not lines:
-            return ""
-        return "Предыдущий диалог:\n" + "\n".join(lines) + "\n\n"
-
-    def to_victoria_chat_history(self, messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
-        """Конвертирует [{"role", "content"}] в формат Victoria [{"user", "assistant"}]."""
-        if not messages:
-            return []
+            lines.append(f"{_label(role)}: {content}")
+        prefix = f"Краткое содержание ранее:\n{summary.strip()}\n\n" if summary and summary.strip() else ""
+        if lines:
+            prefix += "Предыдущий диалог:\n" + "\n".join(lines) + "\n\n"
+        return prefix
+
+    def to_victoria_chat_history(
+        self, messages: List[Dict[str, Any]], summary: str = ""
+    ) -> List[Dict[str, str]]:
+        """
+        Конвертирует [{"role", "content"}] в формат Victoria [{"user", "assistant"}].
+        summary (если есть) — первой парой, чтобы Victoria видела начало длинного диалога.
+        """
         out: List[Dict[str, str]] = []
+        if summary and summary.strip():
+            out.append({"user": "Краткое содержание предыдущей части диалога", "assistant": summary.strip()})
         current: Dict[str, str] = {}
-        for m in messages:
+        for m in messages or []:
             role = m.get("role", "user")
             content = (m.get("content") or "").strip()
             if role == "user":
@@ -151,42 +375,74 @@ class ConversationContextManager:
         """Очистить историю сессии."""
         if not session_id:
             return
-        async with self._lock:
-            self._memory.pop(session_id, None)
-            self._memory_ts.pop(session_id, None)
+        self._sessions.pop(session_id, None)
+        task = self._folding.pop(session_id, None)
+        if task is not None:
+            task.cancel()
         if self.use_redis:
             await self._redis_clear(session_id)
 
+    # --- Redis: conv_ctx:{id} — список реплик, conv_ctx:{id}:summary — {summary, upto} ---
+
     async def _redis_append(self, session_id: str, item: Dict[str, Any]) -> None:
         r = _get_redis()
         if not r:
             return
         try:
             key = f"conv_ctx:{session_id}"
-            await r.rpush(key, json.dumps(item, ensure_ascii=False))
-            await r.expire(key, self.ttl_sec)
-            await r.ltrim(key, -self.max_messages_per_session, -1)
+            async with r.pipeline(transaction=False) as pipe:
+                pipe.rpush(key, json.dumps(item, ensure_ascii=False))
+                pipe.ltrim(key, -self.max_messages_per_session, -1)
+                pipe.expire(key, self.ttl_sec)
+                pipe.expire(f"{key}:summary", self.ttl_sec)
+                await pipe.execute()
         except Exception as e:
             logger.debug("ConversationContext Redis append failed: %s", e)
 
-    async def _redis_get_recent(self, session_id: str, last_n: int) -> List[Dict[str, Any]]:
+    async def _redis_save_summary(
+        self, session_id: str, summary: str, base_upto: int, upto: int
+    ) -> Optional[bool]:
+        """Compare-and-set summary по upto: False — в Redis уже чужая свёртка, None — Redis недоступен"""
+        r = _get_redis()
+        if not r:
+            return None
+        try:
+            saved = await r.eval(
+                _SAVE_SUMMARY_LUA,
+                1,
+                f"conv_ctx:{session_id}:summary",
+                base_upto,
+                json.dumps({"summary": summary, "upto": upto}, ensure_ascii=False),
+                self.ttl_sec,
+            )
+            return bool(int(saved))
+        except Exception as e:
+            logger.debug("ConversationContext Redis summary failed: %s", e)
+            return None
+
+    async def _redis_load(self, session_id: str):
         r = _get_redis()
         if not r:
-            return []
+            return None
         try:
             key = f"conv_ctx:{session_id}"
-            raw = await r.lrange(key, -last_n, -1)
-            return [json.loads(x) for x in raw if x]
+            async with r.pipeline(transaction=False) as pipe:
+                pipe.get(f"{key}:summary")
+                pipe.lrange(key, -self.max_messages_per_session, -1)
+                raw_summary, raw_messages = await pipe.execute()
+            state = json.loads(raw_summary) if raw_summary else {}
+            messages = [json.loads(x) for x in raw_messages if x]
+            return state.get("summary", ""), int(state.get("upto", 0)), messages
         except Exception as e:
             logger.debug("ConversationContext Redis get failed: %s", e)
-            return []
+            return None
 
     async def _redis_clear(self, session_id: str) -> None:
         r = _get_redis()
         if not r:
             return
         try:
-            await r.delete(f"conv_ctx:{session_id}")
+            await r.delete(f"conv_ctx:{session_id}", f"conv_ctx:{session_id}:summary")
         except Exception as e:
             logger.debug("ConversationContext Redis clear failed: %s", e)
 
@@ -203,10 +459,17 @@ def get_conversation_context_manager() -> ConversationContextManager:
         max_messages = int(getattr(settings, "conversation_context_max_messages", 50))
         max_chars = int(getattr(settings, "conversation_context_max_chars", 8000))
         use_redis = getattr(settings, "conversation_context_use_redis", False)
+        summary_chars = int(getattr(settings, "conversation_summary_max_chars", 1600))
+        summarizer = None
+        if getattr(settings, "conversation_summary_use_llm", True):
+            summarizer = lambda previous, messages: llm_summary(previous, messages, summary_chars)  # noqa: E731
         _conversation_context_manager = ConversationContextManager(
             ttl_sec=ttl,
             max_messages_per_session=max_messages,
             max_context_chars=max_chars,
             use_redis=use_redis,
+            summary_max_chars=summary_chars,
+            recent_max_messages=int(getattr(settings, "conversation_recent_max_messages", 20)),
+            summarizer=summarizer,
         )
     return _conversation_context_manager
@@ -60,7 +60,10 @@ class EmbeddingFallback:
         if not self.keyword_fallback_enabled or not knowledge_os:
             return None
         try:
-            rows = await knowledge_os.search_knowledge(query, limit=1)
+            if hasattr(knowledge_os, "lexical_search"):
+                rows = await knowledge_os.lexical_search(query, limit=1)
+            else:
+                rows = await knowledge_os.search_knowledge(query, limit=1)
             if rows:
                 content = rows[0].get("content") or ""
                 if content:
@@ -0,0 +1,281 @@
+"""
+Общие HTTP-клиенты к апстримам (Victoria, Ollama): один пул соединений на апстрим и процесс.
+
+Раньше каждый вызов создавал httpx.AsyncClient — TCP/TLS-рукопожатие на запрос, без keep-alive.
+Здесь:
+- реестр клиентов по имени апстрима: настроенные лимиты пула, keep-alive, опционально HTTP/2;
+- таймауты по эндпоинтам (health — секунды, run/stream — минуты);
+- повторы только там, где они не умножают нагрузку: неидемпотентные POST повторяются лишь
+  при ошибке установки соединения (запрос не ушёл), и все повторы ограничены бюджетом —
+  не больше доли ratio от числа запросов;
+- кратковременный кэш ответов (health/status) с объединением одновременных опросов;
+- закрытие всех клиентов в lifespan, загрузка пулов — в /metrics.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+
+from app.config import get_settings
+from app.metrics.prometheus_metrics import (
+    HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_MAX_CONNECTIONS,
+    HTTP_POOL_PENDING,
+    HTTP_UPSTREAM_RETRIES,
+    record_cache_hit,
+    record_cache_miss,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, при которых запрос гарантированно не дошёл до апстрима — повтор безопасен для любого метода
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Ответы, которые имеет смысл повторить для идемпотентных запросов
+RETRY_STATUSES = frozenset({502, 503, 504})
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class RetryBudget:
+    """
+    Бюджет повторов: каждый запрос пополняет его на ratio, каждый повтор тратит 1.
+    min_tokens — запас на редкие сбои при малом трафике; при массовом сбое повторы
+    быстро кончаются, и апстрим получает не больше (1 + ratio) × запросов.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = min_tokens
+        self._tokens = min_tokens
+
+    def deposit(self) -> None:
+        self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class UpstreamClient:
+    """Пул соединений, таймауты эндпоинтов, бюджет повторов и кэш ответов одного апстрима"""
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        timeouts: Optional[Dict[str, httpx.Timeout]] = None,
+        max_retries: int = 3,
+        retry_delay: float = 1.0,
+        limits: Optional[httpx.Limits] = None,
+        http2: Optional[bool] = None,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        s = get_settings()
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = dict(timeouts or {})
+        self.timeouts.setdefault("default", httpx.Timeout(30.0, connect=10.0))
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.limits = limits or httpx.Limits(
+            max_connections=getattr(s, "http_pool_max_connections", 100),
+            max_keepalive_connections=getattr(s, "http_pool_max_keepalive", 20),
+            keepalive_expiry=getattr(s, "http_pool_keepalive_expiry", 30.0),
+        )
+        want_http2 = getattr(s, "http_client_http2", False) if http2 is None else http2
+        self.http2 = want_http2 and _http2_available()
+        if want_http2 and not self.http2:
+            logger.warning("HTTP/2 for %s requested, but h2 is not installed — using HTTP/1.1", name)
+        self.budget = RetryBudget(ratio=getattr(s, "http_retry_budget_ratio", 0.2))
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._cache: Dict[str, Tuple[float, Any]] = {}
+        self._cache_inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Общий httpx.AsyncClient (создаётся при первом обращении и после закрытия)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeouts["default"],
+                limits=self.limits,
+                http2=self.http2,
+                transport=self._transport,
+            )
+            HTTP_POOL_MAX_CONNECTIONS.labels(upstream=self.name).set(self.limits.max_connections or 0)
+        return self._client
+
+    def timeout(self, endpoint: str) -> httpx.Timeout:
+        return self.timeouts.get(endpoint, self.timeouts["default"])
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        endpoint: str = "default",
+        idempotent: Optional[bool] = None,
+        retries: Optional[int] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Запрос через общий пул; raise_for_status выполняется здесь.
+        Повторы: идемпотентные — при сетевых ошибках и 502/503/504, остальные — только при
+        ошибке соединения; каждый повтор списывается из бюджета.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in ("GET", "HEAD", "OPTIONS")
+        attempts = self.max_retries if retries is None else max(1, retries)
+        kwargs.setdefault("timeout", self.timeout(endpoint))
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await self.client.request(method, path, **kwargs)
+                response.raise_for_status()
+                return response
+            except httpx.HTTPError as e:
+                if attempt >= attempts or not self._retryable(e, idempotent):
+                    raise
+                if not self.budget.try_withdraw():
+                    HTTP_UPSTREAM_RETRIES.labels(upstream=self.name, result="budget_exhausted").inc()
+                    logger.warning("%s %s failed, retry budget exhausted: %s", self.name, path, e)
+                    raise
+                HTTP_UPSTREAM_RETRIES.labels(upstream=self.name, result="retried").inc()
+                delay = self.retry_delay * (2 ** (attempt - 1))
+                logger.warning(
+                    f"{self.name} request {path} failed (attempt {attempt}/{attempts}), "
+                    f"retrying in {delay}s: {e}"
+                )
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    def _retryable(error: httpx.HTTPError, idempotent: bool) -> bool:
+        if isinstance(error, CONNECT_ERRORS):
+            return True
+        if not idempotent:
+            return False
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRY_STATUSES
+        return isinstance(error, httpx.TransportError)
+
+    def stream(self, method: str, path: str, endpoint: str = "stream", **kwargs):
+        """Стриминговый запрос через общий пул (async with ... as response); без повторов"""
+        kwargs.setdefault("timeout", self.timeout(endpoint))
+        return self.client.stream(method, path, **kwargs)
+
+    async def cached(self, key: str, ttl: float, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Результат factory() на ttl секунд; одновременные вызовы с тем же key ждут один запрос.
+        Исключения не кэшируются. factory() выполняется отдельной задачей: отмена вызвавшего
+        (например, отключившегося клиента UI) не отменяет запрос для остальных ожидающих.
+        """
+        now = time.monotonic()
+        hit = self._cache.get(key)
+        if hit is not None and hit[0] > now:
+            record_cache_hit(f"upstream_{self.name}")
+            return hit[1]
+        inflight = self._cache_inflight.get(key)
+        if inflight is None:
+            record_cache_miss(f"upstream_{self.name}")
+            inflight = asyncio.ensure_future(self._fill(key, ttl, factory))
+            self._cache_inflight[key] = inflight
+            inflight.add_done_callback(lambda task: self._fill_done(key, task))
+        return await asyncio.shield(inflight)
+
+    async def _fill(self, key: str, ttl: float, factory: Callable[[], Awaitable[Any]]) -> Any:
+        value = await factory()
+        self._cache[key] = (time.monotonic() + ttl, value)
+        return value
+
+    def _fill_done(self, key: str, task: asyncio.Future) -> None:
+        if self._cache_inflight.get(key) is task:
+            del self._cache_inflight[key]
+        if not task.cancelled():
+            task.exception()  # ожидающих может не быть — не логировать «never retrieved»
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        if key is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(key, None)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Соединения пула: active / idle / pending (внутренности httpcore — best effort)"""
+        stats = {
+            "upstream": self.name,
+            "http2": self.http2,
+            "max_connections": self.limits.max_connections,
+            "active": 0,
+            "idle": 0,
+            "pending": 0,
+            "retry_budget": round(self.budget.tokens, 2),
+        }
+        if self._client is None or self._client.is_closed:
+            return stats
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        try:
+            for conn in getattr(pool, "connections", []):
+                if conn.is_idle():
+                    stats["idle"] += 1
+                else:
+                    stats["active"] += 1
+            stats["pending"] = sum(1 for r in getattr(pool, "_requests", []) if r.connection is None)
+        except Exception as e:
+            logger.debug("Pool stats for %s: %s", self.name, e)
+        return stats
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+
+_upstreams: Dict[str, UpstreamClient] = {}
+
+
+def get_upstream(name: str, base_url: str, **options) -> UpstreamClient:
+    """Клиент апстрима из реестра (создаётся при первом обращении; тот же name+base_url — тот же пул)"""
+    key = f"{name}|{base_url.rstrip('/')}"
+    upstream = _upstreams.get(key)
+    if upstream is None:
+        upstream = UpstreamClient(name, base_url, **options)
+        _upstreams[key] = upstream
+    return upstream
+
+
+def upstreams_stats() -> Dict[str, Dict[str, Any]]:
+    return {key: upstream.pool_stats() for key, upstream in _upstreams.items()}
+
+
+def update_pool_metrics() -> None:
+    """Обновить gauge'и загрузки пулов (вызывается перед отдачей /metrics)"""
+    for upstream in _upstreams.values():
+        stats = upstream.pool_stats()
+        HTTP_POOL_CONNECTIONS.labels(upstream=upstream.name, state="active").set(stats["active"])
+        HTTP_POOL_CONNECTIONS.labels(upstream=upstream.name, state="idle").set(stats["idle"])
+        HTTP_POOL_PENDING.labels(upstream=upstream.name).set(stats["pending"])
+
+
+async def close_upstreams() -> None:
+    """Закрыть все пулы (lifespan shutdown)"""
+    for upstream in list(_upstreams.values()):
+        try:
+            await upstream.aclose()
+        except Exception as e:
+            logger.debug("Closing %s HTTP client: %s", upstream.name, e)
@@ -9,6 +9,12 @@ import logging
 from fastapi import Request
 from app.config import get_settings
 
+# Общий лексический поиск Knowledge OS (tsvector + pg_trgm); без пакета knowledge_os — ILIKE
+try:
+    from knowledge_os.app.lexical_search import lexical_search as _lexical_search
+except ImportError:
+    _lexical_search = None
+
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
@@ -198,6 +204,18 @@ class KnowledgeOSClient:
                 """, f"%{query}%", limit)
             return [dict(row) for row in rows]
     
+    async def lexical_search(self, query: str, limit: int = 5) -> List[dict]:
+        """
+        Лексический поиск (full-text + триграммы, ранжирование с usage_count) —
+        тот же путь, что у похожих задач Victoria и enhanced_search.keyword_search.
+        """
+        if _lexical_search is None:
+            return await self.search_knowledge(query, limit=limit)
+        if self._pool is None:
+            await self.connect()
+        async with self._pool.acquire() as conn:
+            return await _lexical_search(conn, query, limit=limit, min_confidence=0.3)
+
     async def get_stats(self) -> dict:
         """Статистика Knowledge OS"""
         if self._pool is None:
@@ -1,7 +1,7 @@
 """
 Ollama Client (Улучшенная версия)
 HTTP клиент для локальных LLM моделей
-Retry logic, timeout handling, connection pooling
+Общий пул соединений (services/http_pool), таймауты по эндпоинтам, бюджет повторов, кэш health
 Поддержка Ollama Cloud Models и Claude Code Integration
 """
 import os
@@ -9,9 +9,9 @@ import httpx
 from typing import AsyncGenerator, Optional, List
 import logging
 import json
-import asyncio
 
 from app.config import get_settings
+from app.services.http_pool import UpstreamClient, get_upstream
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -78,46 +78,34 @@ class OllamaClient:
         self.max_retries = 2
         self.retry_delay = 2.0
         self.use_cloud = use_cloud
-    
-    async def _retry_request(self, func, *args, **kwargs):
-        """Повторная попытка запроса"""
-        last_error = None
-        
-        for attempt in range(self.max_retries):
-            try:
-                return await func(*args, **kwargs)
-            except (httpx.HTTPError, httpx.TimeoutException) as e:
-                last_error = e
-                if attempt < self.max_retries - 1:
-                    delay = self.retry_delay * (2 ** attempt)
-                    logger.warning(
-                        f"Ollama request failed (attempt {attempt + 1}/{self.max_retries}), "
-                        f"retrying in {delay}s: {e}"
-                    )
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error(f"Ollama request failed after {self.max_retries} attempts: {e}")
-        
-        raise last_error
-    
+        self.health_cache_ttl = getattr(settings, "upstream_health_cache_ttl_sec", 5.0)
+
+    @property
+    def http(self) -> UpstreamClient:
+        """Общий пул соединений к Ollama (один на процесс и base_url)"""
+        return get_upstream(
+            "ollama_cloud" if self.use_cloud else "ollama",
+            self.base_url,
+            timeouts={
+                "default": self.timeout,
+                "stream": self.timeout,
+                "pull": httpx.Timeout(300.0),
+                "health": httpx.Timeout(5.0),
+            },
+            max_retries=self.max_retries,
+            retry_delay=self.retry_delay,
+        )
+
+    def _headers(self) -> dict:
+        if self.use_cloud and self.api_key:
+            return {"Authorization": f"Bearer {self.api_key}"}
+        return {}
+
     async def list_models(self) -> List[dict]:
         """Получить список доступных моделей"""
-        async def _make_request():
-            headers = {}
-            if self.use_cloud and self.api_key:
-                headers["Authorization"] = f"Bearer {self.api_key}"
-            
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(
-                    f"{self.base_url}/api/tags",
-                    headers=headers
-                )
-                response.raise_for_status()
-                return response.json()
-        
         try:
-            data = await self._retry_request(_make_request)
-            return data.get("models", [])
+            response = await self.http.request("GET", "/api/tags", headers=self._headers())
+            return response.json().get("models", [])
         except httpx.HTTPError as e:
             logger.error(f"Ollama list_models error: {e}")
             return []
@@ -132,23 +120,13 @@ class OllamaClient:
         Returns:
             Результат загрузки
         """
-        async def _make_request():
-            headers = {}
-            if self.use_cloud and self.api_key:
-                headers["Authorization"] = f"Bearer {self.api_key}"
-            
-            async with httpx.AsyncClient(timeout=httpx.Timeout(300.0)) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/pull",
-                    json={"name": model_name},
-                    headers=headers
-                )
-                response.raise_for_status()
-                return response.json()
-        
         try:
             logger.info(f"📥 Загрузка модели: {model_name}")
-            return await self._retry_request(_make_request)
+            response = await self.http.request(
+                "POST", "/api/pull", endpoint="pull", idempotent=True,
+                json={"name": model_name}, headers=self._headers(),
+            )
+            return response.json()
         except httpx.HTTPError as e:
             logger.error(f"Ollama pull_model error: {e}")
             return {"error": str(e)}
@@ -195,27 +173,15 @@ class OllamaClient:
         if system:
             payload["system"] = system
         
-        async def _make_request():
-            headers = {}
-            if self.use_cloud and self.api_key:
-                headers["Authorization"] = f"Bearer {self.api_key}"
-            
-            logger.info(f"📤 Отправка запроса в Ollama: {self.base_url}/api/generate")
-            logger.info(f"📦 Payload: model={payload.get('model')}, prompt_length={len(payload.get('prompt', ''))}")
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.post(
-                    f"{self.base_url}/api/generate",
-                    json=payload,
-                    headers=headers
-                )
-                logger.info(f"📥 Ответ Ollama: HTTP {response.status_code}")
-                if response.status_code != 200:
-                    logger.error(f"❌ Ошибка Ollama: {response.status_code} - {response.text[:200]}")
-                response.raise_for_status()
-                return response.json()
-        
+        logger.info(f"📤 Отправка запроса в Ollama: {self.base_url}/api/generate")
+        logger.info(f"📦 Payload: model={payload.get('model')}, prompt_length={len(payload.get('prompt', ''))}")
         try:
-            return await self._retry_request(_make_request)
+            response = await self.http.request("POST", "/api/generate", json=payload, headers=self._headers())
+            logger.info(f"📥 Ответ Ollama: HTTP {response.status_code}")
+            return response.json()
+        except httpx.HTTPStatusError as e:
+            logger.error(f"❌ Ошибка Ollama: {e.response.status_code} - {e.response.text[:200]}")
+            return {"error": str(e)}
         except httpx.HTTPError as e:
             logger.error(f"Ollama generate error: {e}")
             return {"error": str(e)}
@@ -242,45 +208,33 @@ class OllamaClient:
         if system:
             payload["system"] = system
         
-        headers = {}
-        if self.use_cloud and self.api_key:
-            headers["Authorization"] = f"Bearer {self.api_key}"
-        
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            try:
-                async with client.stream(
-                    "POST",
-                    f"{self.base_url}/api/generate",
-                    json=payload,
-                    headers=headers
-                ) as response:
-                    response.raise_for_status()
-                    async for line in response.aiter_lines():
-                        if line:
-                            yield line
-            except httpx.HTTPError as e:
-                logger.error(f"Ollama stream error: {e}")
-                yield json.dumps({"error": str(e)})
-    
-    async def health(self) -> dict:
-        """Health check Ollama"""
-        async def _make_request():
-            headers = {}
-            if self.use_cloud and self.api_key:
-                headers["Authorization"] = f"Bearer {self.api_key}"
-            
-            async with httpx.AsyncClient(timeout=httpx.Timeout(5.0)) as client:
-                response = await client.get(
-                    f"{self.base_url}/api/tags",
-                    headers=headers
-                )
-                response.raise_for_status()
-                return {"status": "healthy", "mode": "cloud" if self.use_cloud else "local"}
-        
         try:
-            return await self._retry_request(_make_request)
+            async with self.http.stream(
+                "POST",
+                "/api/generate",
+                json=payload,
+                headers=self._headers()
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        yield line
         except httpx.HTTPError as e:
-            return {"status": "unhealthy", "error": str(e), "mode": "cloud" if self.use_cloud else "local"}
+            logger.error(f"Ollama stream error: {e}")
+            yield json.dumps({"error": str(e)})
+    
+    async def health(self) -> dict:
+        """Health check Ollama (кэшируется на health_cache_ttl, без повторов)"""
+        mode = "cloud" if self.use_cloud else "local"
+
+        async def _fetch():
+            try:
+                await self.http.request("GET", "/api/tags", endpoint="health", retries=1, headers=self._headers())
+                return {"status": "healthy", "mode": mode}
+            except httpx.HTTPError as e:
+                return {"status": "unhealthy", "error": str(e), "mode": mode}
+
+        return await self.http.cached("health", self.health_cache_ttl, _fetch)
 
 
 # Singleton instance
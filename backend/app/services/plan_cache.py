@@ -1,41 +1,20 @@
 """
-Кэш планов (Фаза 3): двухуровневый кэш (память + опционально Redis).
+Кэш планов (Фаза 3): пространство имён "plan" единого кэша (память + опционально Redis).
 Ускоряет повторные запросы планов по одному и тому же goal + project_context.
 """
 import hashlib
 import logging
-import pickle
-from typing import Any, Dict, Optional
+from typing import Any, Awaitable, Callable, Dict, Optional
 
 from app.config import get_settings
+from app.services.cache import CacheNamespace, _get_redis, register_namespace
 
 logger = logging.getLogger(__name__)
 
-try:
-    from cachetools import TTLCache
-except ImportError:
-    TTLCache = None  # type: ignore
-
-_redis_client = None
-
 
 def _get_redis_client():
     """Опциональный Redis-клиент (async). Требует redis>=5.0."""
-    global _redis_client
-    if _redis_client is not None:
-        return _redis_client
-    try:
-        import redis.asyncio as aioredis
-        settings = get_settings()
-        url = getattr(settings, "redis_url", None) or getattr(settings, "REDIS_URL", None)
-        if url:
-            _redis_client = aioredis.from_url(url, decode_responses=False)
-            return _redis_client
-    except ImportError:
-        logger.debug("Redis package not installed, plan cache will use memory only")
-    except Exception as e:
-        logger.debug("Redis not available for plan cache: %s", e)
-    return None
+    return _get_redis()
 
 
 class PlanCacheService:
@@ -50,12 +29,15 @@ class PlanCacheService:
     ):
         self._maxsize = maxsize
         self._ttl = ttl
-        self.use_redis = use_redis and (redis_client is not None or _get_redis_client() is not None)
-        self.redis = redis_client or (_get_redis_client() if self.use_redis else None)
-        if maxsize == 0 or TTLCache is None:
-            self.local_cache: Dict[str, Any] = {}
-        else:
-            self.local_cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.cache = register_namespace(CacheNamespace(
+            "plan",
+            ttl=ttl,
+            max_items=maxsize,
+            use_redis=use_redis,
+            redis_client=redis_client if use_redis else None,
+        ))
+        self.use_redis = self.cache.use_redis
+        self.redis = self.cache.redis
 
     def _generate_key(self, goal: str, project_context: Optional[str] = None) -> str:
         normalized = " ".join((goal or "").strip().lower().split())
@@ -68,34 +50,15 @@ class PlanCacheService:
         self, goal: str, project_context: Optional[str] = None
     ) -> Optional[Dict]:
         key = self._generate_key(goal, project_context)
-
-        if key in self.local_cache:
+        plan = await self.cache.get(key)
+        if plan is not None:
             try:
-                from app.metrics.prometheus_metrics import PLAN_CACHE_HITS, record_cache_hit
+                from app.metrics.prometheus_metrics import PLAN_CACHE_HITS
                 PLAN_CACHE_HITS.inc()
-                record_cache_hit("plan_cache")
             except Exception:
                 pass
-            logger.debug("Plan cache hit (local): %s", key)
-            return self.local_cache[key]
-
-        if self.use_redis and self.redis:
-            try:
-                cached = await self.redis.get(key)
-                if cached:
-                    try:
-                        from app.metrics.prometheus_metrics import PLAN_CACHE_HITS, record_cache_hit
-                        PLAN_CACHE_HITS.inc()
-                        record_cache_hit("plan_cache")
-                    except Exception:
-                        pass
-                    plan = pickle.loads(cached)
-                    self.local_cache[key] = plan
-                    logger.debug("Plan cache hit (redis): %s", key)
-                    return plan
-            except Exception as e:
-                logger.warning("Redis plan cache get error: %s", e)
-        return None
+            logger.debug("Plan cache hit: %s", key)
+        return plan
 
     async def set(
         self,
@@ -104,18 +67,38 @@ class PlanCacheService:
         project_context: Optional[str] = None,
         ttl: int = 3600,
     ) -> None:
-        if self._maxsize == 0:
-            return
         key = self._generate_key(goal, project_context)
-        self.local_cache[key] = plan
+        await self.cache.set(key, plan, ttl=ttl)
+        logger.debug("Plan saved to cache: %s", key)
+
+    async def get_or_compute(
+        self,
+        goal: str,
+        compute: Callable[[], Awaitable[Optional[Dict]]],
+        project_context: Optional[str] = None,
+        ttl: Optional[int] = None,
+    ) -> Optional[Dict]:
+        """
+        План из кэша или compute() через CacheNamespace.get_or_compute: XFetch, один
+        пересчёт на ключ, NX-блокировка в Redis. None от compute() не кэшируется.
+        """
+        key = self._generate_key(goal, project_context)
+        computed = False
+
+        async def _compute():
+            nonlocal computed
+            computed = True
+            return await compute()
 
-        if self.use_redis and self.redis:
+        plan = await self.cache.get_or_compute(key, _compute, ttl=ttl)
+        if not computed and plan is not None:
             try:
-                serialized = pickle.dumps(plan)
-                await self.redis.setex(key, ttl, serialized)
-                logger.debug("Plan saved to cache: %s", key)
-            except Exception as e:
-                logger.error("Failed to save plan to Redis: %s", e)
+                from app.metrics.prometheus_metrics import PLAN_CACHE_HITS
+                PLAN_CACHE_HITS.inc()
+            except Exception:
+                pass
+            logger.debug("Plan cache hit: %s", key)
+        return plan
 
     async def clear(
         self,
@@ -123,39 +106,18 @@ class PlanCacheService:
         project_context: Optional[str] = None,
     ) -> None:
         if goal is not None:
-            key = self._generate_key(goal, project_context)
-            if key in self.local_cache:
-                del self.local_cache[key]
-            if self.use_redis and self.redis:
-                try:
-                    await self.redis.delete(key)
-                except Exception as e:
-                    logger.warning("Redis plan cache delete error: %s", e)
+            await self.cache.delete(self._generate_key(goal, project_context))
         else:
-            self.local_cache.clear()
-            if self.use_redis and self.redis:
-                try:
-                    keys = await self.redis.keys("plan:*")
-                    if keys:
-                        await self.redis.delete(*keys)
-                except Exception as e:
-                    logger.warning("Redis plan cache clear error: %s", e)
+            await self.cache.invalidate_all()
 
     async def stats(self) -> Dict:
-        size = len(self.local_cache) if hasattr(self.local_cache, "__len__") else 0
+        size = len(self.cache)
         try:
             from app.metrics.prometheus_metrics import update_cache_size
             update_cache_size("plan_cache", size)
         except Exception:
             pass
-        out = {"local_cache_size": size}
-        if self.use_redis and self.redis:
-            try:
-                keys = await self.redis.keys("plan:*")
-                out["redis_cache_size"] = len(keys)
-            except Exception as e:
-                out["redis_error"] = str(e)
-        return out
+        return {"local_cache_size": size, **self.cache.stats()}
 
 
 _plan_cache_instance: Optional[PlanCacheService] = None
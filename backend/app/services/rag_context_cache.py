@@ -5,68 +5,32 @@ RAG Context Cache — кэш результатов векторного пои
 import hashlib
 import json
 import logging
-import os
-from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 
 from app.config import get_settings
+from app.services.cache import CacheNamespace, all_stats, register_namespace
 
 logger = logging.getLogger(__name__)
 
-_redis_client = None
 _cache_monitor: Optional["CacheMonitor"] = None
 
 
 class CacheMonitor:
-    """Счётчик hits/misses для мониторинга эффективности кэша."""
-
-    def __init__(self):
-        self.hits = 0
-        self.misses = 0
-        self.hits_local = 0
-        self.hits_redis = 0
-        self.start_time = datetime.now()
-
-    def record_hit(self, source: str = "local"):
-        self.hits += 1
-        if source == "redis":
-            self.hits_redis += 1
-        else:
-            self.hits_local += 1
-
-    def record_miss(self):
-        self.misses += 1
+    """Hits/misses RAG-кэша для мониторинга (по статистике пространства имён rag_ctx)."""
 
     def get_stats(self) -> Dict[str, Any]:
-        total = self.hits + self.misses
-        hit_rate = (self.hits / total * 100) if total > 0 else 0.0
+        stats = all_stats().get("rag_ctx", {})
         return {
-            "hit_rate_pct": round(hit_rate, 1),
-            "hits": self.hits,
-            "misses": self.misses,
-            "hits_local": self.hits_local,
-            "hits_redis": self.hits_redis,
-            "total": total,
-            "uptime_sec": (datetime.now() - self.start_time).total_seconds(),
+            "hit_rate_pct": stats.get("hit_rate_pct", 0.0),
+            "hits": stats.get("hits", 0),
+            "misses": stats.get("misses", 0),
+            "hits_local": stats.get("hits_l1", 0),
+            "hits_redis": stats.get("hits_l2", 0),
+            "total": stats.get("total", 0),
+            "uptime_sec": stats.get("uptime_sec", 0.0),
         }
 
 
-def _get_redis():
-    global _redis_client
-    if _redis_client is not None:
-        return _redis_client
-    try:
-        import redis.asyncio as aioredis
-        settings = get_settings()
-        url = getattr(settings, "redis_url", None) or os.getenv("REDIS_URL")
-        if url:
-            _redis_client = aioredis.from_url(url, decode_responses=True)
-            return _redis_client
-    except Exception as e:
-        logger.debug("Redis for RAG cache: %s", e)
-    return None
-
-
 def _generate_key(
     goal: str,
     user_id: Optional[str] = None,
@@ -118,21 +82,28 @@ class RAGContextCache:
         use_redis: bool = True,
         local_maxsize: int = 200,
     ):
-        self.ttl = ttl
-        self.use_redis = use_redis
-        self._local: Dict[str, Tuple[List[Tuple[str, float]], float]] = {}
-        self._local_max = local_maxsize
+        self.cache = register_namespace(CacheNamespace(
+            "rag_ctx",
+            ttl=ttl,
+            max_items=local_maxsize,
+            use_redis=use_redis,
+        ))
+        self.use_redis = self.cache.use_redis
         self.monitor = get_cache_monitor()
         self._min_ttl = 60
         self._max_ttl = 600
 
+    @property
+    def ttl(self) -> int:
+        return int(self.cache.ttl)
+
     def get_current_ttl(self) -> int:
         """Текущий TTL в секундах (для Auto-Optimizer)."""
         return self.ttl
 
     def set_ttl(self, ttl: int) -> None:
         """Динамическое изменение TTL (для Auto-Optimizer)."""
-        self.ttl = max(self._min_ttl, min(ttl, self._max_ttl))
+        self.cache.ttl = max(self._min_ttl, min(ttl, self._max_ttl))
 
     async def get_context(
         self,
@@ -143,30 +114,12 @@ class RAGContextCache:
     ) -> Optional[List[Tuple[str, float]]]:
         """Получить кэшированный контекст [(content, score), ...]."""
         key = _generate_key(goal, user_id, limit=limit, threshold=threshold)
-
-        if key in self._local:
-            chunks, _ = self._local[key]
-            self.monitor.record_hit("local")
-            logger.info("✅ RAG cache hit (local): %s...", (goal or "")[:40])
-            return chunks
-
-        if self.use_redis:
-            r = _get_redis()
-            if r:
-                try:
-                    raw = await r.get(key)
-                    if raw:
-                        data = json.loads(raw)
-                        chunks = [tuple(c) for c in data.get("chunks", [])]
-                        self.monitor.record_hit("redis")
-                        logger.info("✅ RAG cache hit (redis): %s...", (goal or "")[:40])
-                        return chunks
-                except Exception as e:
-                    logger.debug("RAG cache redis get: %s", e)
-
-        self.monitor.record_miss()
-        logger.debug("🔄 RAG cache miss: %s...", (goal or "")[:40])
-        return None
+        chunks = await self.cache.get(key)
+        if chunks is None:
+            logger.debug("🔄 RAG cache miss: %s...", (goal or "")[:40])
+            return None
+        logger.info("✅ RAG cache hit: %s...", (goal or "")[:40])
+        return [tuple(c) for c in chunks]
 
     async def save_context(
         self,
@@ -180,37 +133,38 @@ class RAGContextCache:
         if not chunks:
             return
         key = _generate_key(goal, user_id, limit=limit, threshold=threshold)
-        data = {"chunks": list(chunks)}
+        await self.cache.set(key, [list(c) for c in chunks])
+
+    async def get_or_compute(
+        self,
+        goal: str,
+        compute: Callable[[], Awaitable[List[Tuple[str, float]]]],
+        user_id: Optional[str] = None,
+        limit: int = 3,
+        threshold: float = 0.65,
+    ) -> List[Tuple[str, float]]:
+        """
+        Контекст из кэша или compute() (эмбеддинг + векторный поиск) через
+        CacheNamespace.get_or_compute: XFetch, один пересчёт на ключ, NX-блокировка в Redis.
+        Пустой результат не кэшируется (как в save_context).
+        """
+        key = _generate_key(goal, user_id, limit=limit, threshold=threshold)
 
-        while len(self._local) >= self._local_max and self._local:
-            self._local.pop(next(iter(self._local)))
-        self._local[key] = (chunks, 0.0)
+        async def _compute():
+            logger.debug("🔄 RAG cache miss: %s...", (goal or "")[:40])
+            chunks = await compute()
+            return [list(c) for c in chunks] if chunks else None
 
-        if self.use_redis:
-            r = _get_redis()
-            if r:
-                try:
-                    await r.setex(key, self.ttl, json.dumps(data, ensure_ascii=False))
-                except Exception as e:
-                    logger.debug("RAG cache redis set: %s", e)
+        chunks = await self.cache.get_or_compute(key, _compute)
+        return [tuple(c) for c in chunks or ()]
 
     async def clear_all(self) -> int:
         """
         Очистка кэша (Self-healing: при падении качества RAG — инвалидация кэша).
         Рекомендации Backend (Игорь): единая точка инвалидации для пайплайна качества.
-        Возвращает число очищенных ключей (local + redis).
+        Новая версия пространства имён: старые ключи Redis больше не читаются и истекают по TTL.
+        Возвращает число очищенных локальных записей.
         """
-        count = len(self._local)
-        self._local.clear()
-        if self.use_redis:
-            r = _get_redis()
-            if r:
-                try:
-                    keys = await r.keys("rag_ctx:*")
-                    if keys:
-                        await r.delete(*keys)
-                        count += len(keys)
-                except Exception as e:
-                    logger.debug("RAG cache redis clear: %s", e)
+        count = await self.cache.invalidate_all()
         logger.info("RAG context cache cleared: %s entries", count)
         return count
@@ -11,6 +11,7 @@ from typing import Any, Dict, List, Optional, Tuple
 import httpx
 
 from app.config import get_settings
+from app.services.cache import CacheNamespace, cache_key, register_namespace
 
 logger = logging.getLogger(__name__)
 
@@ -75,8 +76,11 @@ class RAGLightService:
         self.use_query_rewriter = (
             config.get("query_rewriter_enabled", True) if config else True
         )
-        self._cache: dict = {}
-        self._cache_max = 200
+        self._answers = register_namespace(CacheNamespace(
+            "rag_light_answer",
+            ttl=getattr(get_settings(), "rag_light_cache_ttl", 300),
+            max_items=200,
+        ))
         self.rag_context_cache: Any = None
         self.embedding_batch_processor: Any = None
         self.prefetch_service: Any = None
@@ -206,27 +210,24 @@ class RAGLightService:
             return []
         th = threshold if threshold is not None else self.similarity_threshold
 
-        if self.rag_context_cache:
-            cached = await self.rag_context_cache.get_context(query, user_id, limit=limit, threshold=th)
-            if cached:
-                return cached
+        async def _search() -> List[Tuple[str, float]]:
+            search_query = await self._prepare_query_for_search(query)
+            embedding = await self._get_embedding_optimized(search_query)
+            if not embedding:
+                return []
+            rows = await self.knowledge_os.search_knowledge_by_vector(
+                embedding,
+                limit=limit,
+                threshold=th,
+            )
+            return [
+                (r.get("content") or "", float(r.get("similarity", 0)))
+                for r in rows
+            ]
 
-        search_query = await self._prepare_query_for_search(query)
-        embedding = await self._get_embedding_optimized(search_query)
-        if not embedding:
-            return []
-        rows = await self.knowledge_os.search_knowledge_by_vector(
-            embedding,
-            limit=limit,
-            threshold=th,
-        )
-        result = [
-            (r.get("content") or "", float(r.get("similarity", 0)))
-            for r in rows
-        ]
-        if result and self.rag_context_cache:
-            await self.rag_context_cache.save_context(query, result, user_id, limit=limit, threshold=th)
-        return result
+        if self.rag_context_cache:
+            return await self.rag_context_cache.get_or_compute(query, _search, user_id, limit=limit, threshold=th)
+        return await _search()
 
     async def search_with_reranking(
         self,
@@ -312,29 +313,26 @@ class RAGLightService:
             return None
         th = threshold if threshold is not None else self.similarity_threshold
 
-        if self.rag_context_cache:
-            cached = await self.rag_context_cache.get_context(query, user_id, limit=1, threshold=th)
-            if cached:
-                return cached[0]
+        async def _search() -> List[Tuple[str, float]]:
+            search_query = await self._prepare_query_for_search(query)
+            embedding = await self._get_embedding_optimized(search_query)
+            if not embedding:
+                return []
+            rows = await self.knowledge_os.search_knowledge_by_vector(
+                embedding,
+                limit=limit,
+                threshold=th,
+            )
+            if not rows:
+                return []
+            r = rows[0]
+            return [(r.get("content") or "", float(r.get("similarity", 0)))]
 
-        search_query = await self._prepare_query_for_search(query)
-        embedding = await self._get_embedding_optimized(search_query)
-        if not embedding:
-            return None
-        rows = await self.knowledge_os.search_knowledge_by_vector(
-            embedding,
-            limit=limit,
-            threshold=th,
-        )
-        if not rows:
-            return None
-        r = rows[0]
-        content = r.get("content") or ""
-        sim = float(r.get("similarity", 0))
-        result = (content, sim)
         if self.rag_context_cache:
-            await self.rag_context_cache.save_context(query, [result], user_id, limit=1, threshold=th)
-        return result
+            chunks = await self.rag_context_cache.get_or_compute(query, _search, user_id, limit=1, threshold=th)
+        else:
+            chunks = await _search()
+        return chunks[0] if chunks else None
 
     def extract_direct_answer(self, query: str, chunk: str) -> str:
         """
@@ -408,24 +406,15 @@ class RAGLightService:
                 )
             except Exception:
                 pass
-        cache_key = hash(query.strip().lower())
-        if cache_key in self._cache:
-            try:
-                from app.metrics.prometheus_metrics import record_cache_hit
-                record_cache_hit("rag_light_context")
-            except Exception:
-                pass
-            return self._cache[cache_key]
         import time
-        t0 = time.perf_counter()
-        try:
+
+        async def compute() -> Optional[str]:
+            t0 = time.perf_counter()
             result = await asyncio.wait_for(
                 self._fast_fact_answer_impl(query, threshold=threshold_override),
                 timeout=timeout_ms / 1000.0,
             )
             duration_ms = (time.perf_counter() - t0) * 1000
-            if result and len(self._cache) < self._cache_max:
-                self._cache[cache_key] = result
             if self.ab_testing and user_id:
                 try:
                     self.ab_testing.track_event(
@@ -437,6 +426,10 @@ class RAGLightService:
                 except Exception:
                     pass
             return result
+
+        try:
+            # Одинаковые одновременные вопросы — один поиск по БЗ (get_or_compute объединяет)
+            return await self._answers.get_or_compute(cache_key(query.strip().lower()), compute)
         except asyncio.TimeoutError:
             logger.warning("RAG-light timeout for query: %s...", query[:50])
         except Exception as e:
@@ -0,0 +1,300 @@
+"""
+Возобновляемые SSE-стримы Victoria: run id, нумерованные события, буфер повтора.
+
+Прогон Victoria (минуты работы LLM) не привязан к вкладке браузера:
+- upstream-стрим запускается один раз на run и дочитывается до конца, даже если зрители ушли;
+- события нумеруются монотонно (SSE id:) и хранятся в ограниченном буфере прогона;
+- переподключение с Last-Event-ID получает пропущенные события, затем живой хвост — без
+  повторного вызова Victoria; несколько зрителей одного run делят одно upstream-соединение;
+- опционально события зеркалируются в Redis (другой процесс бэкенда отдаст повтор по run id):
+  повтор читает список с позиции курсора (id событий идут подряд), а владелец прогона пишет
+  heartbeat-ключ с TTL — если процесс-владелец умер, зрители перестают опрашивать Redis.
+
+Если зритель отстал сильнее размера буфера — получает событие gap (часть событий потеряна).
+"""
+import asyncio
+import itertools
+import json
+import logging
+import time
+from collections import deque
+from typing import AsyncGenerator, AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+from app.config import get_settings
+from app.services.streaming import create_sse_event
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is not None:
+        return _redis_client
+    try:
+        import redis.asyncio as aioredis
+        url = getattr(get_settings(), "redis_url", None)
+        if url:
+            _redis_client = aioredis.from_url(url, decode_responses=True)
+            return _redis_client
+    except Exception as e:
+        logger.debug("Redis for stream replay: %s", e)
+    return None
+
+
+def _frame(event_id: int, event: bytes) -> bytes:
+    return b"id: %d\n" % event_id + event + b"\n\n"
+
+
+class StreamRun:
+    """Один прогон: буфер последних событий и ожидание новых"""
+
+    def __init__(self, run_id: str, max_events: int):
+        self.run_id = run_id
+        self.events: Deque[Tuple[int, bytes]] = deque(maxlen=max_events)
+        self.last_id = 0
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.viewers = 0
+        self.task: Optional[asyncio.Task] = None
+        # Сигнал «появились события»: заменяется новым после каждого set (без блокировок —
+        # зритель просыпается сразу, без повторного захвата lock, как у Condition)
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def append(self, event: bytes) -> int:
+        self.last_id += 1
+        self.events.append((self.last_id, event))
+        self._notify()
+        return self.last_id
+
+    async def finish(self) -> None:
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    async def wait_after(self, event_id: int) -> None:
+        while self.last_id <= event_id and not self.done:
+            await self._changed.wait()
+
+
+class StreamReplayRegistry:
+    """Реестр прогонов процесса: запуск upstream один раз, подписка с любого события"""
+
+    def __init__(
+        self,
+        max_events: int = 5000,
+        retention_sec: float = 600.0,
+        use_redis: bool = False,
+        heartbeat_sec: float = 5.0,
+        replay_poll_sec: float = 0.5,
+    ):
+        self.max_events = max_events
+        self.retention_sec = retention_sec
+        self.use_redis = use_redis
+        self.heartbeat_sec = heartbeat_sec
+        self.replay_poll_sec = replay_poll_sec
+        self._runs: Dict[str, StreamRun] = {}
+
+    def get(self, run_id: str) -> Optional[StreamRun]:
+        return self._runs.get(run_id)
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for run_id in [
+            rid for rid, run in self._runs.items()
+            if run.done and run.viewers == 0 and now - run.finished_at > self.retention_sec
+        ]:
+            del self._runs[run_id]
+
+    def start(
+        self,
+        run_id: str,
+        source: Callable[[], AsyncIterator[bytes]],
+        on_done: Optional[Callable[[bool], None]] = None,
+    ) -> StreamRun:
+        """
+        Запустить upstream прогона (один раз). source() — сырые байты SSE;
+        on_done(failed) вызывается по завершении upstream.
+        """
+        self._purge()
+        run = StreamRun(run_id, self.max_events)
+        self._runs[run_id] = run
+        run.task = asyncio.create_task(self._pump(run, source, on_done))
+        return run
+
+    async def _pump(self, run: StreamRun, source, on_done) -> None:
+        failed = False
+        buffer = b""
+        heartbeat = None
+        try:
+            if self.use_redis:
+                await self._redis_mark_alive(run.run_id)  # до первого события: зритель не примет прогон за брошенный
+                heartbeat = asyncio.create_task(self._redis_heartbeat(run.run_id))
+            await self._publish(run, create_sse_event("run", {"type": "run", "run_id": run.run_id}).encode())
+            async for chunk in source():
+                buffer += chunk
+                if b"\n\n" not in buffer:
+                    continue
+                *events, buffer = buffer.split(b"\n\n")
+                for event in events:
+                    if event.strip():
+                        await self._publish(run, event)
+            if buffer.strip():
+                await self._publish(run, buffer)
+        except Exception as e:
+            failed = True
+            logger.error("Stream run %s upstream error: %s", run.run_id, e)
+            await self._publish(run, f"data: {json.dumps({'type': 'error', 'content': str(e)})}".encode())
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            await run.finish()
+            if self.use_redis:
+                await self._redis_finish(run)
+            if on_done is not None:
+                try:
+                    on_done(failed)
+                except Exception as e:
+                    logger.debug("Stream run on_done: %s", e)
+
+    async def _publish(self, run: StreamRun, event: bytes) -> None:
+        event = event.rstrip(b"\n")
+        event_id = await run.append(event)
+        if self.use_redis:
+            await self._redis_append(run.run_id, event_id, event)
+
+    async def subscribe(self, run_id: str, last_event_id: int = 0) -> AsyncGenerator[bytes, None]:
+        """События прогона после last_event_id: сначала из буфера, затем живой хвост"""
+        run = self._runs.get(run_id)
+        if run is None:
+            async for frame in self._redis_replay(run_id, last_event_id):
+                yield frame
+            return
+        run.viewers += 1
+        cursor = last_event_id
+        try:
+            while True:
+                if run.events and run.events[0][0] > cursor + 1:
+                    missed_to = run.events[0][0] - 1
+                    yield create_sse_event("gap", {"type": "gap", "from": cursor + 1, "to": missed_to}).encode()
+                    cursor = missed_to
+                # id событий идут подряд: позиция в буфере вычисляется, а не ищется перебором;
+                # срез копируется — буфер может пополниться, пока кадры отдаются клиенту
+                start = cursor - run.events[0][0] + 1 if run.events else 0
+                pending = list(itertools.islice(run.events, start, None))
+                for event_id, event in pending:
+                    yield _frame(event_id, event)
+                    cursor = event_id
+                if run.done and cursor >= run.last_id:
+                    return
+                await run.wait_after(cursor)
+        finally:
+            run.viewers -= 1
+
+    # --- Redis (опционально): повтор прогона, запущенного другим процессом ---
+
+    async def _redis_append(self, run_id: str, event_id: int, event: bytes) -> None:
+        redis = _get_redis()
+        if redis is None:
+            return
+        key = f"sse_run:{run_id}"
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.rpush(key, json.dumps([event_id, event.decode("utf-8", "replace")]))
+                pipe.ltrim(key, -self.max_events, -1)
+                pipe.expire(key, int(self.retention_sec) + 3600)
+                await pipe.execute()
+        except Exception as e:
+            logger.debug("Stream replay Redis append: %s", e)
+
+    async def _redis_mark_alive(self, run_id: str) -> None:
+        """Ключ :alive живёт 3 периода heartbeat: умер процесс-владелец — ключ истекает"""
+        redis = _get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.set(f"sse_run:{run_id}:alive", 1, px=int(self.heartbeat_sec * 3000))
+        except Exception as e:
+            logger.debug("Stream replay Redis heartbeat: %s", e)
+
+    async def _redis_heartbeat(self, run_id: str) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_sec)
+            await self._redis_mark_alive(run_id)
+
+    async def _redis_finish(self, run: StreamRun) -> None:
+        redis = _get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.set(f"sse_run:{run.run_id}:done", run.last_id, ex=int(self.retention_sec))
+        except Exception as e:
+            logger.debug("Stream replay Redis finish: %s", e)
+
+    async def _redis_replay(self, run_id: str, last_event_id: int) -> AsyncGenerator[bytes, None]:
+        if not self.use_redis or _get_redis() is None:
+            return
+        redis = _get_redis()
+        key = f"sse_run:{run_id}"
+        cursor = last_event_id
+        first_id: Optional[int] = None  # id головы списка (после LTRIM)
+        while True:
+            try:
+                if first_id is None:
+                    head = await redis.lindex(key, 0)
+                    if head is None:
+                        return
+                    first_id = json.loads(head)[0]
+                # id идут подряд: событие cursor + 1 лежит на позиции cursor + 1 - first_id
+                offset = max(cursor + 1 - first_id, 0)
+                async with redis.pipeline(transaction=True) as pipe:
+                    pipe.lindex(key, 0)
+                    pipe.lrange(key, offset, -1)
+                    pipe.get(f"{key}:done")
+                    pipe.exists(f"{key}:alive")
+                    head, items, done, alive = await pipe.execute()
+            except Exception as e:
+                logger.debug("Stream replay Redis read: %s", e)
+                return
+            if head is None:
+                return
+            head_id = json.loads(head)[0]
+            if head_id != first_id:
+                first_id = head_id  # список обрезали между чтениями — пересчитать позицию
+                continue
+            for raw in items:
+                event_id, event = json.loads(raw)
+                if event_id <= cursor:
+                    continue
+                if event_id > cursor + 1:
+                    yield create_sse_event("gap", {"type": "gap", "from": cursor + 1, "to": event_id - 1}).encode()
+                yield _frame(event_id, event.encode())
+                cursor = event_id
+            if done is not None and cursor >= int(done):
+                return
+            if done is None and not alive:
+                # Процесс-владелец умер, не дописав прогон: :done не появится
+                yield create_sse_event("error", {"type": "error", "content": "Прогон прерван: процесс недоступен"}).encode()
+                return
+            await asyncio.sleep(self.replay_poll_sec)
+
+
+_registry: Optional[StreamReplayRegistry] = None
+
+
+def get_stream_replay_registry() -> StreamReplayRegistry:
+    """Глобальный реестр прогонов (настройки из config)"""
+    global _registry
+    if _registry is None:
+        s = get_settings()
+        _registry = StreamReplayRegistry(
+            max_events=getattr(s, "chat_stream_replay_max_events", 5000),
+            retention_sec=getattr(s, "chat_stream_replay_retention_sec", 600.0),
+            use_redis=getattr(s, "chat_stream_replay_use_redis", False),
+        )
+    return _registry
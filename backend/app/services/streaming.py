@@ -164,3 +164,37 @@ def create_sse_event(
     lines.append("")
     
     return "\n".join(lines) + "\n"
+
+
+class SSETranscript:
+    """
+    Инкрементальный сбор текста ответа из сырого SSE-потока (прокси отдаёт байты как есть).
+
+    feed() принимает чанки произвольной нарезки; JSON разбирается только у строк
+    data: с событием chunk — остальные события (step, start, end) не парсятся.
+    """
+
+    def __init__(self, event_type: str = "chunk"):
+        self._marker = f'"{event_type}"'.encode()
+        self._event_type = event_type
+        self._tail = b""
+        self.parts: list = []
+
+    def feed(self, data: bytes) -> None:
+        if b"\n" not in data:
+            self._tail += data
+            return
+        lines = (self._tail + data).split(b"\n")
+        self._tail = lines.pop()
+        for line in lines:
+            if line.startswith(b"data: ") and self._marker in line:
+                try:
+                    event = json.loads(line[6:])
+                except ValueError:
+                    continue
+                if isinstance(event, dict) and event.get("type") == self._event_type:
+                    self.parts.append(event.get("content", ""))
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
@@ -1,10 +1,9 @@
 """
 Victoria Agent Client (Улучшенная версия)
 HTTP клиент для взаимодействия с Victoria (общий для всех проектов)
-Retry logic, timeout handling, error recovery
+Общий пул соединений (services/http_pool), таймауты по эндпоинтам, бюджет повторов, кэш health/status
 """
 import httpx
-import asyncio
 import os
 import uuid
 from typing import AsyncGenerator, Optional
@@ -13,6 +12,7 @@ import json
 from datetime import datetime
 
 from app.config import get_settings
+from app.services.http_pool import UpstreamClient, get_upstream
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -29,47 +29,44 @@ class VictoriaClient:
         )
         self.max_retries = 3
         self.retry_delay = 1.0
-    
-    async def _retry_request(self, func, *args, **kwargs):
-        """Повторная попытка запроса с экспоненциальной задержкой"""
-        last_error = None
-        
-        for attempt in range(self.max_retries):
-            try:
-                return await func(*args, **kwargs)
-            except (httpx.HTTPError, httpx.TimeoutException) as e:
-                last_error = e
-                if attempt < self.max_retries - 1:
-                    delay = self.retry_delay * (2 ** attempt)
-                    logger.warning(
-                        f"Victoria request failed (attempt {attempt + 1}/{self.max_retries}), "
-                        f"retrying in {delay}s: {e}"
-                    )
-                    await asyncio.sleep(delay)
-                else:
-                    logger.error(f"Victoria request failed after {self.max_retries} attempts: {e}")
-        
-        raise last_error
-    
+        self.health_cache_ttl = getattr(settings, "upstream_health_cache_ttl_sec", 5.0)
+
+    @property
+    def http(self) -> UpstreamClient:
+        """Общий пул соединений к Victoria (один на процесс и base_url)"""
+        return get_upstream(
+            "victoria",
+            self.base_url,
+            timeouts={
+                "default": self.timeout,
+                "stream": self.timeout,
+                "status": httpx.Timeout(10.0, connect=5.0),
+                "health": httpx.Timeout(5.0),
+            },
+            max_retries=self.max_retries,
+            retry_delay=self.retry_delay,
+        )
+
     async def plan(self, goal: str, project_context: Optional[str] = None) -> dict:
         """
         Только план (режим Plan). Один вызов LLM, без выполнения инструментов.
+        Успешные планы берутся из кэша планов (get_or_compute): повтор того же goal +
+        project_context не вызывает LLM, одновременные одинаковые запросы — один вызов.
         """
-        async def _make_request():
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                payload = {"goal": goal}
-                if project_context:
-                    payload["project_context"] = project_context
-                response = await client.post(
-                    f"{self.base_url}/plan",
-                    json=payload
-                )
-                response.raise_for_status()
-                return response.json()
-        try:
-            data = await self._retry_request(_make_request)
+        from app.services.plan_cache import get_plan_cache_service
+
+        payload = {"goal": goal}
+        if project_context:
+            payload["project_context"] = project_context
+
+        async def compute() -> dict:
+            response = await self.http.request("POST", "/plan", json=payload)
+            data = response.json()
             plan = data.get("plan", "")
             return {"status": "success", "result": plan, "response": plan, "raw": data}
+
+        try:
+            return await get_plan_cache_service().get_or_compute(goal, compute, project_context)
         except httpx.HTTPError as e:
             logger.error(f"Victoria plan error: {e}")
             return {"status": "error", "error": str(e), "result": None}
@@ -102,32 +99,28 @@ class VictoriaClient:
         from app.config import get_settings
         settings = get_settings()
         max_steps = getattr(settings, "victoria_max_steps_chat", 50)
-        async def _make_request():
+        payload = {
+            "goal": prompt,  # Victoria expects 'goal', not 'prompt'
+            "max_steps": max_steps,  # VICTORIA_MAX_STEPS_CHAT (50) — меньше «превышен лимит 500» на локальных моделях
+            "project_context": project_context or os.getenv("PROJECT_NAME", "atra-web-ide"),  # Контекст проекта
+        }
+        if session_id:
+            payload["session_id"] = session_id
+        if chat_history:
+            payload["chat_history"] = chat_history[-30:]  # Последние 30 пар
+        req_kw = {"json": payload}
+        if correlation_id:
+            req_kw["headers"] = {"X-Correlation-ID": correlation_id}
+            logger.info("[VICTORIA_CYCLE] correlation_id=%s", correlation_id[:8])
+
+        try:
             logger.info("[VICTORIA_CYCLE] client POST /run goal_preview=%s timeout=%s max_steps=%s",
                         (prompt or "")[:80], self.timeout, max_steps)
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                payload = {
-                    "goal": prompt,  # Victoria expects 'goal', not 'prompt'
-                    "max_steps": max_steps,  # VICTORIA_MAX_STEPS_CHAT (50) — меньше «превышен лимит 500» на локальных моделях
-                    "project_context": project_context or os.getenv("PROJECT_NAME", "atra-web-ide"),  # Контекст проекта
-                }
-                if session_id:
-                    payload["session_id"] = session_id
-                if chat_history:
-                    payload["chat_history"] = chat_history[-30:]  # Последние 30 пар
-                req_kw = {"json": payload}
-                if correlation_id:
-                    req_kw["headers"] = {"X-Correlation-ID": correlation_id}
-                    logger.info("[VICTORIA_CYCLE] correlation_id=%s", correlation_id[:8])
-                response = await client.post(f"{self.base_url}/run", **req_kw)
-                response.raise_for_status()
-                data = response.json()
-                logger.info("[VICTORIA_CYCLE] client response status=%s output_len=%s",
-                            data.get("status"), len(data.get("output") or data.get("result") or ""))
-                return data
-        
-        try:
-            data = await self._retry_request(_make_request)
+            # POST /run неидемпотентен: повтор только если соединение не установилось
+            response = await self.http.request("POST", "/run", **req_kw)
+            data = response.json()
+            logger.info("[VICTORIA_CYCLE] client response status=%s output_len=%s",
+                        data.get("status"), len(data.get("output") or data.get("result") or ""))
             # Map Victoria response to expected format
             # Victoria может вернуть output в разных форматах
             output = data.get("output", "")
@@ -154,6 +147,35 @@ class VictoriaClient:
                 "result": None
             }
     
+    def _stream_kwargs(
+        self,
+        prompt: str,
+        expert_name: Optional[str],
+        project_context: Optional[str],
+        session_id: Optional[str],
+        chat_history: Optional[list],
+        correlation_id: Optional[str],
+        mode: str,
+    ) -> dict:
+        """Тело и заголовки запроса к Victoria /stream"""
+        max_steps = getattr(settings, "victoria_max_steps_chat", 50)
+        payload = {
+            "goal": prompt,
+            "max_steps": max_steps,
+            "project_context": project_context or os.getenv("PROJECT_NAME", "atra-web-ide"),
+            "session_id": session_id,
+            "mode": mode,
+        }
+        if expert_name:
+            payload["expert_name"] = expert_name
+        if chat_history:
+            payload["chat_history"] = chat_history[-30:]
+
+        stream_kw = {"json": payload}
+        if correlation_id:
+            stream_kw["headers"] = {"X-Correlation-ID": correlation_id}
+        return stream_kw
+
     async def run_stream(
         self,
         prompt: str,
@@ -168,78 +190,80 @@ class VictoriaClient:
         Стриминг ответа от Victoria (Singularity 14.0 Unified).
         Вызывает эндпоинт /stream на сервере Victoria.
         """
-        from app.config import get_settings
-        settings = get_settings()
-        max_steps = getattr(settings, "victoria_max_steps_chat", 50)
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            payload = {
-                "goal": prompt,
-                "max_steps": max_steps,
-                "project_context": project_context or os.getenv("PROJECT_NAME", "atra-web-ide"),
-                "session_id": session_id,
-                "mode": mode,
-            }
-            if expert_name:
-                payload["expert_name"] = expert_name
-            if chat_history:
-                payload["chat_history"] = chat_history[-30:]
-            
-            stream_kw = {"json": payload}
-            if correlation_id:
-                stream_kw["headers"] = {"X-Correlation-ID": correlation_id}
-
-            try:
-                # Вызываем новый эндпоинт /stream
-                async with client.stream("POST", f"{self.base_url}/stream", **stream_kw) as response:
-                    response.raise_for_status()
-                    async for line in response.aiter_lines():
-                        if line:
-                            yield line
-            except httpx.HTTPError as e:
-                logger.error("Victoria stream error: %s", e)
-                yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
-                yield f"data: {json.dumps({'type': 'end'})}\n\n"
-    
-    async def status(self) -> dict:
-        """Получить статус Victoria"""
-        async def _make_request():
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(f"{self.base_url}/status")
-                response.raise_for_status()
-                return response.json()
-        
+        stream_kw = self._stream_kwargs(
+            prompt, expert_name, project_context, session_id, chat_history, correlation_id, mode
+        )
         try:
-            return await self._retry_request(_make_request)
+            # Вызываем новый эндпоинт /stream
+            async with self.http.stream("POST", "/stream", **stream_kw) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if line:
+                        yield line
         except httpx.HTTPError as e:
-            logger.error(f"Victoria status error: {e}")
-            return {"status": "offline", "error": str(e)}
+            logger.error("Victoria stream error: %s", e)
+            yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n"
+            yield f"data: {json.dumps({'type': 'end'})}\n\n"
     
-    async def health(self) -> dict:
-        """Health check Victoria"""
-        async def _make_request():
-            async with httpx.AsyncClient(timeout=httpx.Timeout(5.0)) as client:
-                response = await client.get(f"{self.base_url}/health")
-                response.raise_for_status()
-                return response.json()
-        
+    async def run_stream_raw(
+        self,
+        prompt: str,
+        expert_name: Optional[str] = None,
+        project_context: Optional[str] = None,
+        session_id: Optional[str] = None,
+        chat_history: Optional[list] = None,
+        correlation_id: Optional[str] = None,
+        mode: str = "agent",
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Стриминг ответа Victoria сырыми байтами (как пришли от /stream, без разбора на строки).
+        Для SSE-прокси: каждый полученный чанк сразу уходит клиенту.
+        """
+        stream_kw = self._stream_kwargs(
+            prompt, expert_name, project_context, session_id, chat_history, correlation_id, mode
+        )
         try:
-            result = await self._retry_request(_make_request)
-            # Принимаем как 'healthy', так и 'ok' (Victoria может вернуть разное)
-            status = "healthy" if result.get("status") in ("healthy", "ok") else "unhealthy"
-            return {"status": status, "victoria": result}
+            async with self.http.stream("POST", "/stream", **stream_kw) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_raw():
+                    if chunk:
+                        yield chunk
         except httpx.HTTPError as e:
-            return {"status": "unhealthy", "error": str(e)}
+            logger.error("Victoria stream error: %s", e)
+            yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n".encode()
+            yield f"data: {json.dumps({'type': 'end'})}\n\n".encode()
+
+    async def status(self) -> dict:
+        """Получить статус Victoria (кэшируется на health_cache_ttl — UI опрашивает постоянно)"""
+        async def _fetch():
+            try:
+                response = await self.http.request("GET", "/status", endpoint="status")
+                return response.json()
+            except httpx.HTTPError as e:
+                logger.error(f"Victoria status error: {e}")
+                return {"status": "offline", "error": str(e)}
+
+        return await self.http.cached("status", self.health_cache_ttl, _fetch)
+
+    async def health(self) -> dict:
+        """Health check Victoria (кэшируется на health_cache_ttl, без повторов)"""
+        async def _fetch():
+            try:
+                response = await self.http.request("GET", "/health", endpoint="health", retries=1)
+                result = response.json()
+                # Принимаем как 'healthy', так и 'ok' (Victoria может вернуть разное)
+                status = "healthy" if result.get("status") in ("healthy", "ok") else "unhealthy"
+                return {"status": status, "victoria": result}
+            except httpx.HTTPError as e:
+                return {"status": "unhealthy", "error": str(e)}
+
+        return await self.http.cached("health", self.health_cache_ttl, _fetch)
 
     async def get_hidden_thoughts(self, session_id: str) -> dict:
         """Получить скрытые рассуждения для сессии (Summary Reader)"""
-        async def _make_request():
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                response = await client.get(f"{self.base_url}/api/hidden-thoughts/{session_id}")
-                response.raise_for_status()
-                return response.json()
-        
         try:
-            return await self._retry_request(_make_request)
+            response = await self.http.request("GET", f"/api/hidden-thoughts/{session_id}")
+            return response.json()
         except httpx.HTTPError as e:
             logger.error(f"Victoria hidden thoughts error: {e}")
             return {"status": "error", "error": str(e)}
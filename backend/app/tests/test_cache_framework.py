@@ -0,0 +1,165 @@
+"""
+Тесты единого кэша: объединение пересчётов (и их устойчивость к отмене первого вызвавшего),
+раннее обновление XFetch, вытеснение по байтам, сброс пространства имён версией, L2 через общий Redis.
+Запуск: cd backend && python -m pytest app/tests/test_cache_framework.py -v
+"""
+import asyncio
+import time
+
+from app.services.cache import CacheNamespace
+
+
+class _FakeRedis:
+    """Минимальный async Redis (get/set/delete/incr) для проверки L2 между «воркерами»"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def incr(self, key):
+        self.data[key] = str(int(self.data.get(key) or 0) + 1).encode()
+        return int(self.data[key])
+
+
+def test_concurrent_misses_are_coalesced():
+    async def scenario():
+        ns = CacheNamespace("t_coalesce", ttl=60)
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.02)
+            return {"answer": 42}
+
+        results = await asyncio.gather(*(ns.get_or_compute("k", compute) for _ in range(50)))
+        assert calls == 1
+        assert all(r == {"answer": 42} for r in results)
+        stats = ns.stats()
+        assert stats["coalesced"] == 49 and stats["misses"] == 50
+        assert await ns.get_or_compute("k", compute) == {"answer": 42} and calls == 1
+
+    asyncio.run(scenario())
+
+
+def test_xfetch_refreshes_before_expiry():
+    async def scenario():
+        ns = CacheNamespace("t_xfetch", ttl=60, beta=1.0)
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        assert await ns.get_or_compute("k", compute) == 1
+        # Очень дорогой пересчёт и до истечения 0.5 с: P(обновления) = exp(-0.5 / delta) ≈ 1
+        entry = ns.get_local("k")
+        entry.delta, entry.expires_at = 10_000.0, time.time() + 0.5
+        assert await ns.get_or_compute("k", compute) == 2
+        assert ns.stats()["early_refreshes"] == 1
+        # Дешёвый пересчёт далеко от истечения — значение из кэша
+        for _ in range(20):
+            assert await ns.get_or_compute("k", compute) == 2
+
+    asyncio.run(scenario())
+
+
+def test_l1_is_bounded_by_bytes():
+    async def scenario():
+        ns = CacheNamespace("t_bytes", ttl=60, max_items=1000, max_bytes=1000)
+        for i in range(20):
+            await ns.set(f"k{i}", "x" * 100)
+        stats = ns.stats()
+        assert stats["bytes"] <= 1000 and stats["items"] < 20
+        assert await ns.get("k19") is not None and await ns.get("k0") is None
+        await ns.set("huge", "x" * 5000)  # больше всего лимита — не кэшируется
+        assert await ns.get("huge") is None
+
+    asyncio.run(scenario())
+
+
+def test_version_invalidation_across_workers():
+    async def scenario():
+        redis = _FakeRedis()
+        a = CacheNamespace("t_version", ttl=60, use_redis=True, redis_client=redis)
+        b = CacheNamespace("t_version", ttl=60, use_redis=True, redis_client=redis)
+        await a.set("k", [["chunk", 0.9]])
+        assert await b.get("k") == [["chunk", 0.9]]  # L2 общий
+        assert b.stats()["hits_l2"] == 1
+        await a.invalidate_all()
+        assert await a.get("k") is None
+        b._version_checked = 0  # второй воркер перечитывает версию (раз в 5 с)
+        assert await b.get("k") is None
+
+    asyncio.run(scenario())
+
+
+def test_rag_vector_search_goes_through_get_or_compute():
+    from app.services.rag_context_cache import RAGContextCache
+    from app.services.rag_light import RAGLightService
+
+    class _KnowledgeOS:
+        calls = 0
+
+        async def search_knowledge_by_vector(self, embedding, limit, threshold):
+            self.calls += 1
+            await asyncio.sleep(0.02)
+            return [{"content": "ответ", "similarity": 0.9}]
+
+    async def scenario():
+        kos = _KnowledgeOS()
+        service = RAGLightService(knowledge_os=kos, config={"query_rewriter_enabled": False,
+                                                            "query_expansion_enabled": False})
+        service.rag_context_cache = RAGContextCache(use_redis=False)
+        await service.rag_context_cache.clear_all()
+
+        async def embedding(_query):
+            return [0.1, 0.2]
+
+        service._get_embedding_optimized = embedding
+        results = await asyncio.gather(*(service.search_chunks("что такое RAG", limit=2) for _ in range(10)))
+        assert kos.calls == 1  # одновременные промахи объединены в один поиск
+        assert all(r == [("ответ", 0.9)] for r in results)
+        assert await service.search_chunks("что такое RAG", limit=2) == [("ответ", 0.9)] and kos.calls == 1
+        assert await service.search_one_chunk("что такое RAG") == ("ответ", 0.9) and kos.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_first_caller_does_not_cancel_waiters():
+    async def scenario():
+        ns = CacheNamespace("t_cancel", ttl=60)
+        release = asyncio.Event()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "fresh"
+
+        first = asyncio.create_task(ns.get_or_compute("k", compute))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(ns.get_or_compute("k", compute)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        release.set()
+        assert await asyncio.wait_for(asyncio.gather(*waiters), 1) == ["fresh"] * 3
+        assert first.cancelled() and calls == 1
+        assert await ns.get_or_compute("k", compute) == "fresh" and calls == 1
+
+    asyncio.run(scenario())
@@ -0,0 +1,183 @@
+"""
+Тесты admission control для Victoria (справедливая очередь, отказ при переполнении, AIMD-лимит,
+освобождение тикета /stream, если ответ так и не начался).
+Запуск: cd backend && python -m pytest app/tests/test_concurrency_limiter.py -v
+"""
+import asyncio
+import json
+
+from app.services.concurrency_limiter import AdmissionController
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_fair_queue_interleaves_users_and_sheds_when_full():
+    ctl = AdmissionController(initial_limit=1, min_limit=1, max_limit=1, max_queue=4, clock=_Clock())
+    first = ctl.try_enqueue("alice")
+    assert first.granted
+    tabs = [ctl.try_enqueue("alice") for _ in range(3)]
+    bob = ctl.try_enqueue("bob")
+    assert ctl.try_enqueue("carol") is None  # очередь полна — явный отказ
+    # bob встал после трёх вкладок alice, но обслуживается вторым
+    assert bob.position() == 2 and tabs[0].position() == 1 and tabs[2].position() == 4
+
+    order = []
+    current = first
+    for _ in range(4):
+        current.release()
+        current = next(t for t in tabs + [bob] if t.granted)
+        order.append("bob" if current is bob else "alice")
+    assert order == ["alice", "bob", "alice", "alice"]
+
+
+def test_queued_updates_report_position_and_time_out():
+    clock = _Clock()
+    ctl = AdmissionController(initial_limit=1, min_limit=1, max_limit=1, max_queue=10, clock=clock)
+    holder = ctl.try_enqueue("a")
+    waiter = ctl.try_enqueue("b")
+
+    async def _run():
+        seen = []
+        async for status in waiter.updates(interval=0.01, timeout=5):
+            seen.append(status)
+            if len(seen) == 2:
+                holder.release()
+        return seen
+
+    seen = asyncio.run(_run())
+    assert seen[0]["position"] == 1 and seen[0]["eta_seconds"] > 0
+    assert waiter.granted and ctl.inflight == 1
+
+    late = ctl.try_enqueue("c")
+    clock.now = 10.0
+
+    async def _timeout():
+        return await late.wait(timeout=5)
+
+    assert asyncio.run(_timeout()) is False
+    assert ctl.queued == 0 and late.position() == 0
+
+
+def test_limit_adapts_to_victoria_latency():
+    clock = _Clock()
+    ctl = AdmissionController(initial_limit=4, min_limit=2, max_limit=8, max_queue=10, clock=clock)
+    tickets = [ctl.try_enqueue(f"u{i}") for i in range(4)]
+    for _ in range(20):
+        tickets[0].observe_latency(1.0)  # около базовой и лимит занят — растёт
+    assert ctl.limit > 4
+    grown = ctl.limit
+    clock.now = 5.0
+    tickets[0].observe_latency(5.0)  # один медленный ответ — среднее короткого окна почти не сдвинулось
+    assert ctl.limit == grown
+    for _ in range(9):
+        tickets[0].observe_latency(5.0)  # короткое окно в 5 раз медленнее — снижение
+    assert ctl.limit < grown
+    clock.now = 5.5
+    before = ctl.limit
+    tickets[1].release(success=False)  # в пределах cooldown повторного снижения нет
+    assert ctl.limit == before
+
+
+def test_fast_outlier_does_not_ratchet_baseline():
+    clock = _Clock()
+    ctl = AdmissionController(initial_limit=4, min_limit=2, max_limit=8, max_queue=10, clock=clock)
+    ticket = ctl.try_enqueue("u")
+    ticket.observe_latency(0.05)  # случайный быстрый ответ (кэш) не становится базовой
+    for _ in range(30):
+        ticket.observe_latency(1.0)
+    assert ctl.limit == 4
+    assert 0.9 < ctl.stats()["baseline_latency_sec"] < 1.0
+
+
+class _Headers(dict):
+    """Заголовки без учёта регистра, как в Starlette"""
+
+    def get(self, key, default=None):
+        return super().get(key.lower(), default)
+
+
+class _Request:
+    def __init__(self, peer, headers=None):
+        self.client = type("Client", (), {"host": peer})()
+        self.headers = _Headers({k.lower(): v for k, v in (headers or {}).items()})
+
+
+def test_admission_identity_uses_signed_client_id():
+    from app.services.concurrency_limiter import admission_identity
+
+    key, token = admission_identity(_Request("172.18.0.5", {"X-Forwarded-For": "203.0.113.7"}))
+    assert key == "ip:203.0.113.7"  # nginx в docker-сети — доверенный прокси
+    same_key, same_token = admission_identity(_Request("172.18.0.5", {"X-Client-Id": token}))
+    assert same_key == f"client:{token.split('.')[0]}" and same_token == token
+    forged, _ = admission_identity(_Request("172.18.0.5", {"X-Client-Id": "attacker.0000"}))
+    assert forged.startswith("ip:")
+
+
+def test_client_ip_ignores_forwarded_for_from_untrusted_peer():
+    from app.services.concurrency_limiter import client_ip
+
+    trusted = ["127.0.0.1/32", "172.16.0.0/12"]
+    assert client_ip(_Request("198.51.100.9", {"X-Forwarded-For": "1.2.3.4"}), trusted) == "198.51.100.9"
+    # Подделанный левый элемент цепочки не учитывается: берётся последний недоверенный адрес
+    spoofed = _Request("172.18.0.5", {"X-Forwarded-For": "1.2.3.4, 203.0.113.7"})
+    assert client_ip(spoofed, trusted) == "203.0.113.7"
+
+
+def _chat_app(monkeypatch, ctl):
+    from fastapi import FastAPI
+
+    from app.routers import chat
+
+    class _Victoria:
+        async def run_stream_raw(self, **kwargs):
+            yield b"data: {}\n\n"
+
+    monkeypatch.setattr(chat, "get_admission_controller", lambda: ctl)
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api/chat")
+    app.dependency_overrides[chat.get_victoria_client] = lambda: _Victoria()
+    return app
+
+
+async def _post_with_failing_start(app):
+    """Клиент ушёл до начала ответа: send(http.response.start) падает (ASGI 2.4: OSError)"""
+    body = json.dumps({"content": "привет"}).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            raise OSError("connection reset")
+
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+             "method": "POST", "path": "/api/chat/stream", "raw_path": b"/api/chat/stream", "query_string": b"",
+             "headers": [(b"content-type", b"application/json")], "client": ("10.0.0.1", 1234),
+             "server": ("test", 80), "scheme": "http", "root_path": ""}
+    try:
+        await app(scope, receive, send)
+    except Exception:
+        pass
+
+
+def test_stream_ticket_released_when_response_never_starts(monkeypatch):
+    async def scenario():
+        ctl = AdmissionController(initial_limit=1, min_limit=1, max_limit=1, max_queue=10, clock=_Clock())
+        app = _chat_app(monkeypatch, ctl)
+        # Слот свободен: выданный тикет не должен занять его навсегда
+        await _post_with_failing_start(app)
+        assert ctl._inflight == 0
+        # Слот занят: тикет в очереди не должен остаться в куче и получить слот позже
+        holder = ctl.try_enqueue("other")
+        await _post_with_failing_start(app)
+        assert ctl._queued == 0
+        holder.release()
+        assert ctl._inflight == 0
+
+    asyncio.run(scenario())
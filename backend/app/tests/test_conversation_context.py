@@ -0,0 +1,196 @@
+"""
+Тесты контекста диалога: summary + последние реплики в бюджете, фоновая свёртка, независимость сессий,
+восстановление сессии из Redis после рестарта и compare-and-set summary между процессами.
+Запуск: cd backend && python -m pytest app/tests/test_conversation_context.py -v
+"""
+import asyncio
+import json
+
+from app.services.conversation_context import ConversationContextManager
+
+
+def test_prompt_size_stays_bounded_for_long_sessions():
+    async def scenario():
+        mgr = ConversationContextManager(max_context_chars=2000, summary_max_chars=600, recent_max_messages=6)
+        sizes = []
+        for turn in range(200):
+            await mgr.append("s", "user", f"вопрос {turn}: " + "как настроить сервис " * 5)
+            await mgr.append("s", "assistant", f"ответ {turn}: " + "нужно сделать так " * 10)
+            await asyncio.sleep(0)  # даём фоновой свёртке отработать
+            window = await mgr.get_context("s")
+            history = mgr.to_victoria_chat_history(window.messages, window.summary)
+            sizes.append(sum(len(p.get("user", "")) + len(p.get("assistant", "")) for p in history))
+        assert max(sizes) <= 2000 + 200  # бюджет окна + подписи summary
+        assert max(sizes[50:]) - min(sizes[50:]) < 400  # размер не растёт с длиной сессии
+        assert history[0]["assistant"]  # старая часть диалога — в summary первой парой
+        assert window.messages[-1]["content"].startswith("ответ 199")
+
+    asyncio.run(scenario())
+
+
+def test_summary_is_folded_incrementally_in_background():
+    calls = []
+
+    async def summarizer(previous, messages):
+        calls.append((previous, [m["content"] for m in messages]))
+        return (previous + " | " if previous else "") + ",".join(m["content"] for m in messages)
+
+    async def scenario():
+        mgr = ConversationContextManager(max_context_chars=40, summary_max_chars=1000,
+                                         recent_max_messages=2, summarizer=summarizer)
+        for i in range(6):
+            await mgr.append("s", "user", f"m{i}")
+        await asyncio.sleep(0.01)
+        window = await mgr.get_context("s")
+        assert [m["content"] for m in window.messages] == ["m4", "m5"]
+        assert window.summary.replace(" | ", ",").split(",") == ["m0", "m1", "m2", "m3"]
+        # Каждая реплика свёрнута ровно один раз, с учётом предыдущего summary
+        folded = [c for _, batch in calls for c in batch]
+        assert folded == ["m0", "m1", "m2", "m3"]
+        assert all(prev for prev, _ in calls[1:])
+
+    asyncio.run(scenario())
+
+
+def test_slow_summary_does_not_block_other_sessions():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def slow_summarizer(previous, messages):
+            await gate.wait()
+            return "итог"
+
+        mgr = ConversationContextManager(max_context_chars=20, summary_max_chars=10,
+                                         recent_max_messages=1, summarizer=slow_summarizer)
+        await mgr.append("a", "user", "первый")
+        await mgr.append("a", "user", "второй")  # свёртка "a" зависла на gate
+        await asyncio.wait_for(mgr.append("b", "user", "привет"), timeout=0.5)
+        window_b = await asyncio.wait_for(mgr.get_context("b"), timeout=0.5)
+        assert [m["content"] for m in window_b.messages] == ["привет"]
+        # Пока свёртка не готова, вышедшая реплика видна в сжатом виде
+        window_a = await mgr.get_context("a")
+        assert "первый" in window_a.summary and window_a.messages[-1]["content"] == "второй"
+        gate.set()
+        await asyncio.sleep(0.01)
+        assert (await mgr.get_context("a")).summary == "итог"
+        await mgr.clear("a")
+        assert (await mgr.get_context("a")).messages == []
+
+    asyncio.run(scenario())
+
+
+class FakeRedis:
+    """Redis в словаре: список реплик, summary и compare-and-set скрипта сохранения summary"""
+
+    def __init__(self):
+        self.data = {}
+        self.conflicts = 0
+
+    def pipeline(self, transaction=False):
+        return _FakePipeline(self)
+
+    async def rpush(self, key, value):
+        self.data.setdefault(key, []).append(value)
+
+    async def ltrim(self, key, start, end):
+        self.data[key] = self.data.get(key, [])[start:][: None if end == -1 else end + 1]
+
+    async def expire(self, key, ttl):
+        return key in self.data
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def lrange(self, key, start, end):
+        return self.data.get(key, [])[start:][: None if end == -1 else end + 1]
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def eval(self, script, numkeys, key, base_upto, value, ttl):
+        from app.services.conversation_context import _SAVE_SUMMARY_LUA
+        assert script == _SAVE_SUMMARY_LUA
+        current = json.loads(self.data[key])["upto"] if key in self.data else 0
+        if current != int(base_upto):
+            self.conflicts += 1
+            return 0
+        self.data[key] = value
+        return 1
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args: self.calls.append((name, args))
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args) for name, args in self.calls]
+
+
+def _redis_manager(monkeypatch, redis, summarizer):
+    from app.services import conversation_context
+    monkeypatch.setattr(conversation_context, "_get_redis", lambda: redis)
+    return ConversationContextManager(max_context_chars=40, summary_max_chars=1000, recent_max_messages=2,
+                                      use_redis=True, summarizer=summarizer)
+
+
+async def _join_summary(previous, messages):
+    return "|".join(([previous] if previous else []) + [m["content"] for m in messages])
+
+
+def test_restarted_manager_continues_summary_from_redis(monkeypatch):
+    async def scenario():
+        redis = FakeRedis()
+        first = _redis_manager(monkeypatch, redis, _join_summary)
+        for i in range(6):
+            await first.append("s", "user", f"A{i}")
+        await asyncio.sleep(0.01)
+        assert (await first.get_context("s")).summary == "A0|A1|A2|A3"
+        # Рестарт: новый процесс с тем же Redis и пустой памятью
+        restarted = _redis_manager(monkeypatch, redis, _join_summary)
+        for i in range(3):
+            await restarted.append("s", "user", f"B{i}")
+        await asyncio.sleep(0.01)
+        window = await restarted.get_context("s")
+        assert window.summary == "A0|A1|A2|A3|A4|A5|B0"
+        assert [m["content"] for m in window.messages] == ["B1", "B2"]
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_processes_do_not_overwrite_each_others_summary(monkeypatch):
+    async def scenario():
+        redis = FakeRedis()
+        gate = asyncio.Event()
+
+        async def slow_join(previous, messages):
+            await gate.wait()
+            return await _join_summary(previous, messages)
+
+        a = _redis_manager(monkeypatch, redis, _join_summary)
+        b = _redis_manager(monkeypatch, redis, slow_join)
+        for i in range(2):
+            await a.append("s", "user", f"A{i}")
+        await b.append("s", "user", "B0")  # b поднял сессию из Redis, его свёртка A0 ждёт gate
+        await asyncio.sleep(0.01)
+        await a.append("s", "user", "A2")  # a успевает свернуть A0, A1 (с репликой b из Redis)
+        await asyncio.sleep(0.01)
+        gate.set()
+        await asyncio.sleep(0.01)
+        assert redis.conflicts == 1  # запись b отклонена, b перечитал состояние
+        for manager in (a, b):
+            window = await manager.get_context("s")
+            assert window.summary == "A0|A1"
+            assert [m["content"] for m in window.messages] == ["B0", "A2"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,108 @@
+"""
+Тесты общих HTTP-клиентов апстримов (пул на процесс, повторы по бюджету, кэш health).
+Запуск: cd backend && python -m pytest app/tests/test_http_pool.py -v
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.http_pool import UpstreamClient, close_upstreams, get_upstream
+
+
+def _upstream(handler, **kwargs) -> UpstreamClient:
+    return UpstreamClient("test", "http://upstream", transport=httpx.MockTransport(handler),
+                          retry_delay=0.0, **kwargs)
+
+
+def test_registry_reuses_one_client_per_upstream():
+    async def scenario():
+        first = get_upstream("victoria", "http://victoria:8010/")
+        assert get_upstream("victoria", "http://victoria:8010") is first
+        client = first.client
+        assert first.client is client  # один httpx.AsyncClient на все вызовы
+        await close_upstreams()
+        assert client.is_closed
+        assert first.client is not client  # после shutdown клиент пересоздаётся лениво
+        await close_upstreams()
+
+    asyncio.run(scenario())
+
+
+def test_retries_only_idempotent_and_within_budget():
+    calls = {"GET": 0, "POST": 0}
+
+    def handler(request):
+        calls[request.method] += 1
+        return httpx.Response(503)
+
+    async def scenario():
+        upstream = _upstream(handler, max_retries=3)
+        with pytest.raises(httpx.HTTPStatusError):
+            await upstream.request("POST", "/run")
+        assert calls["POST"] == 1  # неидемпотентный POST не повторяется при ответе 503
+        with pytest.raises(httpx.HTTPStatusError):
+            await upstream.request("GET", "/status")
+        assert calls["GET"] == 3
+
+        # Массовый сбой: повторы ограничены бюджетом, а не max_retries × запросов
+        calls["GET"] = 0
+        for _ in range(50):
+            with pytest.raises(httpx.HTTPStatusError):
+                await upstream.request("GET", "/status")
+        assert calls["GET"] < 50 + 0.2 * 50 + 10
+        await upstream.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_cached_coalesces_concurrent_polls():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(200, json={"status": "ok"})
+
+    async def scenario():
+        upstream = _upstream(handler)
+
+        async def fetch():
+            response = await upstream.request("GET", "/health", endpoint="health")
+            return response.json()
+
+        results = await asyncio.gather(*(upstream.cached("health", 5.0, fetch) for _ in range(20)))
+        assert all(r == {"status": "ok"} for r in results)
+        assert await upstream.cached("health", 5.0, fetch) == {"status": "ok"}
+        assert calls == ["/health"]
+        upstream.invalidate("health")
+        await upstream.cached("health", 5.0, fetch)
+        assert len(calls) == 2
+        await upstream.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_first_caller_does_not_cancel_waiting_polls():
+    async def scenario():
+        upstream = _upstream(lambda request: httpx.Response(200))
+        release = asyncio.Event()
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await release.wait()
+            return {"status": "ok"}
+
+        first = asyncio.create_task(upstream.cached("health", 5.0, slow))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(upstream.cached("health", 5.0, slow)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()  # клиент UI отключился
+        await asyncio.gather(first, return_exceptions=True)
+        release.set()
+        results = await asyncio.wait_for(asyncio.gather(*waiters), 1)
+        assert results == [{"status": "ok"}] * 3 and calls == [1]
+        assert first.cancelled()
+        await upstream.aclose()
+
+    asyncio.run(scenario())
@@ -62,3 +62,29 @@ def test_plan_cache_disabled_maxsize_zero():
         await cache.set("goal", {"result": "y"})
         assert await cache.get("goal") is None
     asyncio.run(_run())
+
+
+def test_plan_cache_get_or_compute_coalesces_and_skips_failures():
+    async def _run():
+        cache = _cache()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.02)
+            return {"status": "success", "result": "Plan"}
+
+        plans = await asyncio.gather(*(cache.get_or_compute("собрать релиз", compute) for _ in range(5)))
+        assert calls == 1 and all(p["result"] == "Plan" for p in plans)
+        assert (await cache.get("собрать релиз"))["result"] == "Plan"
+
+        async def failing():
+            raise RuntimeError("LLM недоступна")
+
+        try:
+            await cache.get_or_compute("другая цель", failing)
+        except RuntimeError:
+            pass
+        assert await cache.get("другая цель") is None
+    asyncio.run(_run())
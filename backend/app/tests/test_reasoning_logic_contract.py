@@ -27,8 +27,7 @@ async def test_victoria_client_needs_clarification_returns_questions():
         "output": "",
     })
 
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_client.return_value.__aenter__.return_value.post = AsyncMock(return_value=fake_response)
+    with patch("app.services.http_pool.UpstreamClient.request", AsyncMock(return_value=fake_response)):
         client = VictoriaClient(base_url="http://localhost:8010")
         result = await client.run("Сделай что-то по проекту")
 
@@ -52,8 +51,7 @@ async def test_victoria_client_success_includes_knowledge_strategy_confidence():
         },
     })
 
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_client.return_value.__aenter__.return_value.post = AsyncMock(return_value=fake_response)
+    with patch("app.services.http_pool.UpstreamClient.request", AsyncMock(return_value=fake_response)):
         client = VictoriaClient(base_url="http://localhost:8010")
         result = await client.run("Привет")
 
@@ -78,8 +76,7 @@ async def test_victoria_client_decline_includes_output():
         },
     })
 
-    with patch("httpx.AsyncClient") as mock_client:
-        mock_client.return_value.__aenter__.return_value.post = AsyncMock(return_value=fake_response)
+    with patch("app.services.http_pool.UpstreamClient.request", AsyncMock(return_value=fake_response)):
         client = VictoriaClient(base_url="http://localhost:8010")
         result = await client.run("Запрос вне scope")
 
@@ -0,0 +1,74 @@
+"""
+Тесты SSE-прокси без разбора потока и чистых ASGI middleware.
+Запуск: cd backend && python -m pytest app/tests/test_sse_passthrough.py -v
+"""
+import asyncio
+import json
+
+from app.middleware.logging_middleware import StructuredLoggingMiddleware
+from app.middleware.rate_limiter import RateLimitMiddleware, SlidingWindowCounter
+from app.services.streaming import SSETranscript
+
+
+def test_transcript_handles_arbitrary_chunk_boundaries():
+    events = [
+        {"type": "start"},
+        {"type": "step", "content": "думаю про \"chunk\""},
+        {"type": "chunk", "content": "Привет, "},
+        {"type": "chunk", "content": "мир"},
+        {"type": "end"},
+    ]
+    raw = "".join(f"data: {json.dumps(e, ensure_ascii=False)}\n\n" for e in events).encode()
+    for size in (1, 3, 7, len(raw)):
+        transcript = SSETranscript()
+        for i in range(0, len(raw), size):
+            transcript.feed(raw[i:i + size])
+        assert transcript.text == "Привет, мир"
+
+
+def test_sliding_window_counter_is_o1_and_evicts_idle_clients():
+    now = [0.0]
+    counter = SlidingWindowCounter(limit=10, window=60, clock=lambda: now[0])
+    for _ in range(10):
+        counter.hit("a")
+    assert counter.estimate("a") == 10
+    now[0] = 90.0  # половина следующего окна: вклад прошлого окна — 50%
+    assert counter.estimate("a") == 5.0
+    counter.hit("b")
+    now[0] = 200.0
+    counter.hit("c")  # «a» и «b» старше двух окон — вытеснены при запросе
+    assert len(counter) == 1 and counter.estimate("a") == 0.0
+
+
+async def _call(app, path="/api/chat/stream"):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": path, "query_string": b"",
+             "headers": [], "client": ("10.0.0.1", 1234)}
+    await app(scope, receive, send)
+    return sent
+
+
+async def _streaming_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/event-stream")]})
+    for i in range(3):
+        await send({"type": "http.response.body", "body": f"data: {i}\n\n".encode(), "more_body": True})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def test_asgi_middleware_passes_stream_chunks_through_and_limits_rate(monkeypatch):
+    sent = asyncio.run(_call(StructuredLoggingMiddleware(_streaming_app)))
+    assert [m["type"] for m in sent] == ["http.response.start"] + ["http.response.body"] * 4
+    assert any(k == b"x-process-time" for k, _ in sent[0]["headers"])
+
+    limited = RateLimitMiddleware(_streaming_app)
+    monkeypatch.setattr(limited.rate_limiter.per_minute, "limit", 2)
+    statuses = [asyncio.run(_call(limited))[0]["status"] for _ in range(3)]
+    assert statuses == [200, 200, 429]
+    assert asyncio.run(_call(limited, "/health"))[0]["status"] == 200
@@ -0,0 +1,215 @@
+"""
+Тесты возобновляемых SSE-стримов (буфер повтора, Last-Event-ID, общий upstream, повтор из Redis
+с позиции курсора и остановка повтора, когда истёк heartbeat процесса-владельца).
+Запуск: cd backend && python -m pytest app/tests/test_stream_replay.py -v
+"""
+import asyncio
+import json
+import time
+
+from app.services.stream_replay import StreamReplayRegistry
+
+
+def _events(frames):
+    """(id, data) из кадров SSE; кадры без id (gap) — id None"""
+    out = []
+    for frame in frames:
+        event_id, data = None, None
+        for line in frame.decode().split("\n"):
+            if line.startswith("id: "):
+                event_id = int(line[4:])
+            elif line.startswith("data: "):
+                data = json.loads(line[6:])
+        out.append((event_id, data))
+    return out
+
+
+def _upstream(calls, n=5, delay=0.01):
+    async def source():
+        calls.append(1)
+        for i in range(n):
+            await asyncio.sleep(delay)
+            # События режутся на произвольные куски
+            raw = f"data: {json.dumps({'type': 'chunk', 'content': str(i)})}\n\n".encode()
+            yield raw[:7]
+            yield raw[7:]
+    return source
+
+
+def test_reconnect_with_last_event_id_replays_then_follows_live_tail():
+    calls, done = [], []
+
+    async def _run():
+        registry = StreamReplayRegistry(max_events=100)
+        registry.start("r1", _upstream(calls), on_done=done.append)
+        first = []
+        async for frame in registry.subscribe("r1"):
+            first.append(frame)
+            if len(first) == 3:
+                break  # вкладка закрыта посреди прогона
+        last_id = _events(first)[-1][0]
+        resumed = [f async for f in registry.subscribe("r1", last_event_id=last_id)]
+        return first, resumed
+
+    first, resumed = asyncio.run(_run())
+    ids = [i for i, _ in _events(first) + _events(resumed)]
+    assert ids == list(range(1, 7))  # run + 5 chunk, без пропусков и повторов
+    assert _events(first)[0][1] == {"type": "run", "run_id": "r1"}
+    assert [d["content"] for _, d in _events(resumed)] == ["2", "3", "4"]
+    assert calls == [1] and done == [False]
+
+
+def test_viewers_share_one_upstream_and_gap_is_reported():
+    calls = []
+
+    async def _run():
+        registry = StreamReplayRegistry(max_events=3)
+        registry.start("r2", _upstream(calls, n=6, delay=0.005))
+        a, b = await asyncio.gather(
+            _collect(registry.subscribe("r2")),
+            _collect(registry.subscribe("r2")),
+        )
+        late = await _collect(registry.subscribe("r2", last_event_id=1))
+        return a, b, late
+
+    async def _collect(agen):
+        return [f async for f in agen]
+
+    a, b, late = asyncio.run(_run())
+    assert calls == [1]
+    assert a == b and [i for i, _ in _events(a)] == list(range(1, 8))
+    events = _events(late)
+    assert events[0] == (None, {"type": "gap", "from": 2, "to": 4})
+    assert [i for i, _ in events[1:]] == [5, 6, 7]
+
+
+def test_resume_indexes_from_cursor_in_trimmed_buffer():
+    calls = []
+
+    async def _run():
+        registry = StreamReplayRegistry(max_events=10)
+        registry.start("r3", _upstream(calls, n=30, delay=0))
+        await registry.get("r3").task
+        # В буфере события 22..31 (run + 30 chunk, последние 10)
+        middle = [f async for f in registry.subscribe("r3", last_event_id=25)]
+        tail = [f async for f in registry.subscribe("r3", last_event_id=31)]
+        return middle, tail
+
+    middle, tail = asyncio.run(_run())
+    assert [i for i, _ in _events(middle)] == [26, 27, 28, 29, 30, 31]
+    assert [d["content"] for _, d in _events(middle)] == [str(i) for i in range(24, 30)]
+    assert tail == []
+
+
+class FakeRedis:
+    """Redis в словаре: списки, строки с TTL (px) и журнал LRANGE для проверки чтения с курсора"""
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lranges = []
+
+    def _alive(self, key):
+        if key in self.expires and time.monotonic() >= self.expires[key]:
+            del self.expires[key]
+            self.data.pop(key, None)
+        return key in self.data
+
+    def pipeline(self, transaction=False):
+        return _FakePipeline(self)
+
+    async def rpush(self, key, value):
+        self.data.setdefault(key, []).append(value)
+
+    async def ltrim(self, key, start, end):
+        self.data[key] = self.data.get(key, [])[start:]
+
+    async def expire(self, key, ttl):
+        return True
+
+    async def lindex(self, key, index):
+        items = self.data.get(key) or []
+        return items[index] if items else None
+
+    async def lrange(self, key, start, end):
+        self.lranges.append(start)
+        return list(self.data.get(key, [])[start:])
+
+    async def set(self, key, value, ex=None, px=None):
+        self.data[key] = str(value)
+        if px is not None:
+            self.expires[key] = time.monotonic() + px / 1000
+        elif ex is not None:
+            self.expires.pop(key, None)
+
+    async def get(self, key):
+        return self.data.get(key) if self._alive(key) else None
+
+    async def exists(self, key):
+        return int(self._alive(key))
+
+
+class _FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+def test_redis_replay_reads_from_cursor_in_trimmed_list(monkeypatch):
+    from app.services import stream_replay
+    redis = FakeRedis()
+    monkeypatch.setattr(stream_replay, "_get_redis", lambda: redis)
+
+    async def _run():
+        owner = StreamReplayRegistry(max_events=10, use_redis=True)
+        owner.start("r4", _upstream([], n=30, delay=0))
+        await owner.get("r4").task
+        # Другой процесс: прогона в памяти нет, в Redis события 22..31
+        viewer = StreamReplayRegistry(max_events=10, use_redis=True)
+        middle = [f async for f in viewer.subscribe("r4", last_event_id=25)]
+        late = [f async for f in viewer.subscribe("r4", last_event_id=3)]
+        return middle, late
+
+    middle, late = asyncio.run(_run())
+    assert [i for i, _ in _events(middle)] == [26, 27, 28, 29, 30, 31]
+    assert redis.lranges[0] == 4  # LRANGE с позиции курсора, а не весь список
+    assert _events(late)[0] == (None, {"type": "gap", "from": 4, "to": 21})
+    assert [i for i, _ in _events(late)[1:]] == list(range(22, 32))
+
+
+def test_redis_replay_stops_when_owner_heartbeat_expires(monkeypatch):
+    from app.services import stream_replay
+    redis = FakeRedis()
+    monkeypatch.setattr(stream_replay, "_get_redis", lambda: redis)
+
+    async def _run():
+        # Процесс-владелец записал два события и heartbeat, затем умер (без :done и продления)
+        owner = StreamReplayRegistry(use_redis=True, heartbeat_sec=0.02)
+        await owner._redis_mark_alive("r5")
+        for event_id in (1, 2):
+            await owner._redis_append("r5", event_id, f'data: {{"type": "chunk", "content": "{event_id}"}}'.encode())
+        viewer = StreamReplayRegistry(use_redis=True, replay_poll_sec=0.01)
+        started = time.monotonic()
+        frames = await asyncio.wait_for(_collect(viewer.subscribe("r5")), timeout=1.0)
+        return frames, time.monotonic() - started
+
+    async def _collect(agen):
+        return [f async for f in agen]
+
+    frames, elapsed = asyncio.run(_run())
+    events = _events(frames)
+    assert [i for i, _ in events[:2]] == [1, 2]
+    assert events[-1][1]["type"] == "error"
+    assert elapsed < 0.5  # а не до TTL списка (retention + 1 ч)
@@ -18,9 +18,34 @@ export const isStreaming = writable(false)
 // Ошибка
 export const error = writable(null)
 
+// Ожидание в очереди к Victoria: { position, eta_seconds } или null
+export const queueStatus = writable(null)
+
 // Режим чата (как в Cursor): agent | plan | ask
 export const chatMode = writable('agent')
 
+// Идентификатор клиента для справедливой очереди: выдаётся сервером (X-Client-Id), хранится в браузере
+const CLIENT_ID_KEY = 'atra_client_id'
+
+function clientIdHeaders() {
+  try {
+    const clientId = localStorage.getItem(CLIENT_ID_KEY)
+    return clientId ? { 'X-Client-Id': clientId } : {}
+  } catch (e) {
+    return {}
+  }
+}
+
+function rememberClientId(response) {
+  const clientId = response.headers.get('X-Client-Id')
+  if (!clientId) return
+  try {
+    localStorage.setItem(CLIENT_ID_KEY, clientId)
+  } catch (e) {
+    // Хранилище недоступно (приватный режим) — сервер выдаст новый id в следующий раз
+  }
+}
+
 // Добавить сообщение (assistant может иметь steps — шаги агента как в Cursor)
 export function addMessage(role, content, expertName = null) {
   messages.update(msgs => [
@@ -106,6 +131,9 @@ export async function loadExperts() {
   }
 }
 
+// Сколько раз переподключаться к прогону после обрыва стрима
+const STREAM_RESUME_ATTEMPTS = 5
+
 // Отправить сообщение через SSE
 export async function sendMessage(content, mode = null) {
   const expertValue = get(selectedExpert)
@@ -118,10 +146,11 @@ export async function sendMessage(content, mode = null) {
   addMessage('assistant', '', expertValue?.name)
 
   try {
-    const response = await fetch('/api/chat/stream', {
+    let response = await fetch('/api/chat/stream', {
       method: 'POST',
       headers: {
-        'Content-Type': 'application/json'
+        'Content-Type': 'application/json',
+        ...clientIdHeaders()
       },
       body: JSON.stringify({
         content,
@@ -130,77 +159,108 @@ export async function sendMessage(content, mode = null) {
         mode: modeValue  // agent | plan | ask — как в Cursor
       })
     })
+    rememberClientId(response)
     
     if (!response.ok) {
       const errorText = await response.text().catch(() => 'Неизвестная ошибка')
       throw new Error(`HTTP ${response.status}: ${errorText || response.statusText}`)
     }
     
-    const reader = response.body.getReader()
-    const decoder = new TextDecoder()
-    let buffer = ''
-    
-    while (true) {
-      const { done, value } = await reader.read()
-      if (done) break
-      
-      buffer += decoder.decode(value, { stream: true })
-      const lines = buffer.split('\n')
-      buffer = lines.pop() || '' // Keep incomplete line in buffer
-      
-      for (const line of lines) {
-        if (line.startsWith(':')) continue // SSE comment (flush), игнорируем
-        if (line.startsWith('data: ')) {
-          try {
-            const data = JSON.parse(line.slice(6))
-            console.log('SSE event:', data.type, data.content?.slice(0, 30))
-            
-            if (data.type === 'step') {
-              appendStep({
-                stepType: data.stepType || 'action',
-                title: data.title || '',
-                content: data.content || '',
-                duration: data.duration
-              })
-            } else if (data.type === 'chunk' && data.content) {
-              updateLastMessage(data.content)
-            } else if (data.type === 'error') {
-              const errorMsg = data.content || 'Ошибка при получении ответа'
-              error.set(errorMsg)
-              // Если есть пустое сообщение, заменяем его на сообщение об ошибке
-              messages.update(msgs => {
-                if (msgs.length > 0 && msgs[msgs.length - 1].role === 'assistant') {
-                  const last = msgs[msgs.length - 1]
-                  if (!last.content) {
-                    // Заменяем пустое сообщение на сообщение об ошибке
-                    return [
-                      ...msgs.slice(0, -1),
-                      { ...last, content: `⚠️ ${errorMsg}` }
-                    ]
-                  }
+    // Прогон Victoria переживает обрыв соединения: переподключаемся по run_id с Last-Event-ID
+    const stream = { runId: null, lastEventId: 0, ended: false }
+    for (let attempt = 0; ; attempt++) {
+      try {
+        const reader = response.body.getReader()
+        const decoder = new TextDecoder()
+        let buffer = ''
+
+        while (true) {
+          const { done, value } = await reader.read()
+          if (done) break
+
+          buffer += decoder.decode(value, { stream: true })
+          const lines = buffer.split('\n')
+          buffer = lines.pop() || '' // Keep incomplete line in buffer
+
+          for (const line of lines) {
+            if (line.startsWith(':')) continue // SSE comment (flush), игнорируем
+            if (line.startsWith('id: ')) {
+              stream.lastEventId = Number(line.slice(4)) || stream.lastEventId
+              continue
+            }
+            if (line.startsWith('data: ')) {
+              try {
+                const data = JSON.parse(line.slice(6))
+                console.log('SSE event:', data.type, data.content?.slice(0, 30))
+
+                if (data.type === 'run') {
+                  stream.runId = data.run_id
+                  continue
                 }
-                return msgs
-              })
-            } else if (data.type === 'end') {
-              console.log('Stream ended')
-              // Убеждаемся, что последнее сообщение не пустое
-              messages.update(msgs => {
-                if (msgs.length > 0 && msgs[msgs.length - 1].role === 'assistant' && !msgs[msgs.length - 1].content) {
-                  return [
-                    ...msgs.slice(0, -1),
-                    { ...msgs[msgs.length - 1], content: 'Извините, не удалось получить ответ.' }
-                  ]
+                if (data.type === 'queued') {
+                  queueStatus.set({ position: data.position, eta_seconds: data.eta_seconds })
+                  continue
                 }
-                return msgs
-              })
-            } else if (data.type === 'start') {
-              console.log('Stream started', data)
+                queueStatus.set(null)
+
+                if (data.type === 'step') {
+                  appendStep({
+                    stepType: data.stepType || 'action',
+                    title: data.title || '',
+                    content: data.content || '',
+                    duration: data.duration
+                  })
+                } else if (data.type === 'chunk' && data.content) {
+                  updateLastMessage(data.content)
+                } else if (data.type === 'error') {
+                  const errorMsg = data.content || 'Ошибка при получении ответа'
+                  error.set(errorMsg)
+                  // Если есть пустое сообщение, заменяем его на сообщение об ошибке
+                  messages.update(msgs => {
+                    if (msgs.length > 0 && msgs[msgs.length - 1].role === 'assistant') {
+                      const last = msgs[msgs.length - 1]
+                      if (!last.content) {
+                        // Заменяем пустое сообщение на сообщение об ошибке
+                        return [
+                          ...msgs.slice(0, -1),
+                          { ...last, content: `⚠️ ${errorMsg}` }
+                        ]
+                      }
+                    }
+                    return msgs
+                  })
+                } else if (data.type === 'end') {
+                  stream.ended = true
+                  console.log('Stream ended')
+                  // Убеждаемся, что последнее сообщение не пустое
+                  messages.update(msgs => {
+                    if (msgs.length > 0 && msgs[msgs.length - 1].role === 'assistant' && !msgs[msgs.length - 1].content) {
+                      return [
+                        ...msgs.slice(0, -1),
+                        { ...msgs[msgs.length - 1], content: 'Извините, не удалось получить ответ.' }
+                      ]
+                    }
+                    return msgs
+                  })
+                } else if (data.type === 'start') {
+                  console.log('Stream started', data)
+                }
+              } catch (e) {
+                console.warn('SSE parse error:', e, line)
+              }
             }
-          } catch (e) {
-            console.warn('SSE parse error:', e, line)
           }
         }
+      } catch (e) {
+        if (!stream.runId || attempt >= STREAM_RESUME_ATTEMPTS) throw e
+        console.warn('Stream interrupted, resuming run', stream.runId, e)
       }
+      if (stream.ended || !stream.runId || attempt >= STREAM_RESUME_ATTEMPTS) break
+      await new Promise(resolve => setTimeout(resolve, 1000 * (attempt + 1)))
+      response = await fetch(`/api/chat/stream/${stream.runId}`, {
+        headers: { 'Last-Event-ID': String(stream.lastEventId) }
+      })
+      if (!response.ok) break
     }
   } catch (e) {
     let errorMessage = e.message || 'Ошибка при отправке сообщения.'
@@ -220,6 +280,7 @@ export async function sendMessage(content, mode = null) {
       return msgs
     })
   } finally {
+    queueStatus.set(null)
     isStreaming.set(false)
     isLoading.set(false)
   }
@@ -135,6 +135,11 @@ except ImportError:
     get_circuit_breaker = None  # type: ignore
     CircuitBreakerOpenError = Exception
 
+try:
+    from component_container import ComponentContainer  # type: ignore
+except ImportError:
+    from app.component_container import ComponentContainer  # type: ignore
+
 try:
     from disaster_recovery import get_disaster_recovery, SystemMode  # type: ignore
 except ImportError:
@@ -614,6 +619,67 @@ async def _run_cloud_agent_async(prompt: str):
             logger.error(f"Knowledge retrieval error: {exc}")
             return ""
 
+# Тёплые компоненты воркера: строятся один раз на процесс, а не в каждом вызове
+# run_smart_agent_async. LocalAIRouter остаётся на задачу (force_local, _preferred_source).
+_components = ComponentContainer("ai_core")
+
+
+async def _build_quality_gate():
+    qa = await _components.get("qa")
+    return QualityGate(qa) if QualityGate and qa else None
+
+
+def _build_rag_engine():
+    try:
+        from model_enhancer import EnhancedRAGEngine  # type: ignore
+    except ImportError:
+        from app.model_enhancer import EnhancedRAGEngine  # type: ignore
+    return EnhancedRAGEngine()
+
+
+_components.register(
+    "semantic_cache",
+    lambda: SemanticAICache(db_url=os.getenv("DATABASE_URL")) if SemanticAICache else None,
+)
+_components.register("distiller", lambda: KnowledgeDistiller() if KnowledgeDistiller else None)
+_components.register(
+    "qa", lambda: QualityAssurance(min_quality_threshold=0.7) if QualityAssurance else None
+)
+_components.register("quality_gate", _build_quality_gate)
+_components.register(
+    "parallel_processor", lambda: ParallelProcessor(max_concurrent=3) if ParallelProcessor else None
+)
+_components.register("rag_engine", _build_rag_engine)
+_components.register("query_orchestrator", lambda: QueryOrchestrator() if QueryOrchestrator else None)
+_components.register(
+    "breaker_database",
+    lambda: get_circuit_breaker("database", failure_threshold=5, recovery_timeout=60) if get_circuit_breaker else None,
+)
+_components.register(
+    "breaker_local_models",
+    lambda: get_circuit_breaker("local_models", failure_threshold=3, recovery_timeout=30) if get_circuit_breaker else None,
+)
+_components.register(
+    "breaker_cloud",
+    lambda: get_circuit_breaker("cloud", failure_threshold=3, recovery_timeout=30) if get_circuit_breaker else None,
+)
+
+
+async def init_components() -> Dict[str, Dict[str, Any]]:
+    """Прогрев компонентов при старте воркера; возвращает состояние и время построения каждого"""
+    return await _components.init()
+
+
+async def shutdown_components() -> None:
+    """Остановка тёплых компонентов (в порядке, обратном построению)"""
+    await _components.shutdown()
+
+
+def components_health() -> Dict[str, Dict[str, Any]]:
+    """Состояние компонентов для health/метрик"""
+    return _components.health()
+
+
 async def run_smart_agent_async(
     prompt: str,
     expert_name: str = "Виктория",
@@ -727,7 +793,7 @@ async def run_smart_agent_async_impl(
             return "⚠️ Система временно недоступна. Пожалуйста, попробуйте позже."
     
     # 1. Initialization (кэш в той же БД, что дашборд/SLA — DATABASE_URL)
-    cache = SemanticAICache(db_url=os.getenv("DATABASE_URL")) if SemanticAICache else None
+    cache = await _components.get("semantic_cache")
     
     # [SINGULARITY 10.0+] Параллельная проверка кэша, роутинга и контекста
     async def get_cache_and_context():
@@ -749,10 +815,10 @@ async def run_smart_agent_async_impl(
     if local_router is None and getattr(_mod, '_current_router', None) is not None:
         setattr(_mod, '_current_router', None)  # сброс после взятия из глобала
     router = _router_preferred if _router_preferred is not None else (LocalAIRouter() if LocalAIRouter else None)
-    distiller = KnowledgeDistiller() if KnowledgeDistiller else None
-    qa = QualityAssurance(min_quality_threshold=0.7) if QualityAssurance else None
-    quality_gate = QualityGate(qa) if QualityGate and qa else None
-    parallel_processor = ParallelProcessor(max_concurrent=3) if ParallelProcessor else None
+    distiller = await _components.get("distiller")
+    qa = await _components.get("qa")
+    quality_gate = await _components.get("quality_gate")
+    parallel_processor = await _components.get("parallel_processor")
     
     # ML Router v2 для предсказания оптимального роутинга (Singularity 8.0)
     ml_router_v2 = get_ml_router_v2() if get_ml_router_v2 else None
@@ -760,9 +826,9 @@ async def run_smart_agent_async_impl(
     route_confidence = 0.0
     
     # Circuit breakers для критических компонентов
-    db_breaker = get_circuit_breaker("database", failure_threshold=5, recovery_timeout=60) if get_circuit_breaker else None
-    local_breaker = get_circuit_breaker("local_models", failure_threshold=3, recovery_timeout=30) if get_circuit_breaker else None
-    cloud_breaker = get_circuit_breaker("cloud", failure_threshold=3, recovery_timeout=30) if get_circuit_breaker else None
+    db_breaker = await _components.get("breaker_database")
+    local_breaker = await _components.get("breaker_local_models")
+    cloud_breaker = await _components.get("breaker_cloud")
     
     # 1.1. RAG: Поиск знаний в базе (учимся у коллег)
     kb_context = ""
@@ -782,8 +848,9 @@ async def run_smart_agent_async_impl(
             logger.debug(f"⚠️ [MONSTER] Ошибка создания скелета: {fe}")
 
     try:
-        from app.model_enhancer import EnhancedRAGEngine
-        rag_engine = EnhancedRAGEngine()
+        rag_engine = await _components.get("rag_engine")
+        if rag_engine is None:
+            raise RuntimeError("EnhancedRAGEngine недоступен")
         # Ищем релевантные знания (включая результаты работы других экспертов)
         contexts = await rag_engine.retrieve_enhanced_context(prompt, limit=3)
         if contexts:
@@ -816,7 +883,7 @@ async def run_smart_agent_async_impl(
     is_strategy_request = False
     if QueryOrchestrator and not session_id:
         try:
-            temp_orch = QueryOrchestrator()
+            temp_orch = await _components.get("query_orchestrator")
             query_type = temp_orch.classify_query(user_part)
             is_strategy_request = query_type == QueryType.STRATEGY
             
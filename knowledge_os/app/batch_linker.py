@@ -0,0 +1,339 @@
+"""
+[KNOWLEDGE OS] Batch Auto-Linker.
+Пакетное построение связей графа знаний по семантическому сходству.
+
+- эмбеддинги читаются чанками (keyset по id), корпус держится в памяти как
+  нормированная float32-матрица;
+- top-k соседей считается блочным матричным умножением (блок запросов × блок корпуса);
+  если корпус не помещается в AUTO_LINK_MAX_CORPUS_MB — через HNSW-индекс pgvector
+  (один LATERAL-запрос на блок);
+- инкрементальный проход (узлы без связей) корпус не грузит: сначала выбираются
+  несвязанные узлы, соседи ищутся через HNSW-индекс;
+- фильтр по порогу сходства и домену, тип связи — по домену (как в auto_detect_links);
+- все связи блока пишутся одним COPY во временную таблицу + INSERT ... ON CONFLICT;
+- полный проход возобновляем: водяной знак (последний обработанный id) хранится
+  в auto_link_state и фиксируется в той же транзакции, что и связи блока.
+"""
+
+import bisect
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_MIGRATION_PATH = Path(__file__).resolve().parents[1] / "db" / "migrations" / "add_auto_link_state.sql"
+
+AUTO_LINK_TOP_K = int(os.getenv("AUTO_LINK_TOP_K", "10"))
+AUTO_LINK_THRESHOLD = float(os.getenv("AUTO_LINK_THRESHOLD", "0.8"))
+AUTO_LINK_BLOCK_SIZE = int(os.getenv("AUTO_LINK_BLOCK_SIZE", "1024"))
+AUTO_LINK_MAX_CORPUS_MB = int(os.getenv("AUTO_LINK_MAX_CORPUS_MB", "1024"))
+CORPUS_CHUNK = 5000
+CORPUS_BLOCK = 16384
+
+FULL_REBUILD = "full_rebuild"
+
+CORPUS_CHUNK_SQL = """
+SELECT id, domain_id, embedding::real[] AS embedding
+FROM knowledge_nodes
+WHERE embedding IS NOT NULL AND ($1::uuid IS NULL OR id > $1)
+ORDER BY id
+LIMIT $2
+"""
+
+UNLINKED_NODES_SQL = """
+SELECT k.id
+FROM knowledge_nodes k
+WHERE k.embedding IS NOT NULL
+  AND ($1::uuid IS NULL OR k.id > $1)
+  AND NOT EXISTS (SELECT 1 FROM knowledge_links kl WHERE kl.source_node_id = k.id)
+  AND NOT EXISTS (SELECT 1 FROM knowledge_links kl WHERE kl.target_node_id = k.id)
+ORDER BY k.id
+LIMIT $2
+"""
+
+# ANN-путь: соседи каждого узла блока через HNSW-индекс, один запрос на блок
+ANN_NEIGHBORS_SQL = """
+SELECT q.id AS source_id, q.domain_id AS source_domain,
+       n.id AS target_id, n.domain_id AS target_domain, n.similarity
+FROM knowledge_nodes q
+CROSS JOIN LATERAL (
+    SELECT c.id, c.domain_id, 1 - (c.embedding <=> q.embedding) AS similarity
+    FROM knowledge_nodes c
+    WHERE c.id <> q.id AND c.embedding IS NOT NULL
+    ORDER BY c.embedding <=> q.embedding
+    LIMIT $2
+) n
+WHERE q.id = ANY($1::uuid[]) AND n.similarity >= $3
+"""
+
+UPSERT_LINKS_SQL = """
+INSERT INTO knowledge_links (source_node_id, target_node_id, link_type, strength, metadata)
+SELECT source_node_id, target_node_id, link_type, strength, '{"source": "auto_link"}'::jsonb
+FROM auto_link_batch
+ON CONFLICT (source_node_id, target_node_id, link_type)
+DO UPDATE SET
+    strength = EXCLUDED.strength,
+    updated_at = CURRENT_TIMESTAMP
+WHERE knowledge_links.strength IS DISTINCT FROM EXCLUDED.strength
+RETURNING id
+"""
+
+
+@dataclass
+class Corpus:
+    """Эмбеддинги узлов в памяти: строки нормированы, домены интернированы (−1 — без домена)."""
+    ids: List[str]
+    domains: np.ndarray
+    matrix: np.ndarray
+
+    def __post_init__(self):
+        self.index = {node_id: i for i, node_id in enumerate(self.ids)}
+
+
+def top_k_neighbors(
+    queries: np.ndarray,
+    query_rows: np.ndarray,
+    corpus: np.ndarray,
+    k: int,
+    block: int = CORPUS_BLOCK,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k по косинусному сходству блочным умножением (строки нормированы).
+
+    query_rows — индексы запросов в корпусе (сам узел исключается; −1 — не в корпусе).
+    Возвращает (indices, scores) формы (len(queries), k), по убыванию; пустые — (−1, −inf).
+    """
+    n_queries = len(queries)
+    best_idx = np.full((n_queries, k), -1, dtype=np.int64)
+    best_score = np.full((n_queries, k), -np.inf, dtype=np.float32)
+    rows = np.arange(n_queries)
+    for start in range(0, len(corpus), block):
+        scores = queries @ corpus[start:start + block].T
+        own = (query_rows >= start) & (query_rows < start + scores.shape[1])
+        scores[rows[own], query_rows[own] - start] = -np.inf
+        kk = min(k, scores.shape[1])
+        part = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+        cand_idx = np.concatenate((best_idx, part + start), axis=1)
+        cand_score = np.concatenate((best_score, np.take_along_axis(scores, part, axis=1)), axis=1)
+        keep = np.argpartition(-cand_score, k - 1, axis=1)[:, :k]
+        best_idx = np.take_along_axis(cand_idx, keep, axis=1)
+        best_score = np.take_along_axis(cand_score, keep, axis=1)
+    order = np.argsort(-best_score, axis=1)
+    return np.take_along_axis(best_idx, order, axis=1), np.take_along_axis(best_score, order, axis=1)
+
+
+def link_type_for(source_domain, target_domain) -> str:
+    """Тот же домен — related_to, разные — enhances."""
+    return "related_to" if source_domain == target_domain else "enhances"
+
+
+class BatchLinker:
+    """Пакетный поиск и запись связей между узлами знаний."""
+
+    def __init__(
+        self,
+        db_url: str,
+        threshold: float = AUTO_LINK_THRESHOLD,
+        top_k: int = AUTO_LINK_TOP_K,
+        block_size: int = AUTO_LINK_BLOCK_SIZE,
+        cross_domain: bool = True,
+        domain_ids: Optional[Sequence[str]] = None,
+        max_corpus_mb: int = AUTO_LINK_MAX_CORPUS_MB,
+    ):
+        self.db_url = db_url
+        self.threshold = threshold
+        self.top_k = top_k
+        self.block_size = block_size
+        self.cross_domain = cross_domain
+        self.domain_ids = {str(d) for d in domain_ids} if domain_ids else None
+        self.max_corpus_mb = max_corpus_mb
+        self._domain_codes: Dict[Any, int] = {}
+
+    # --- корпус ---
+
+    def _domain_code(self, domain_id) -> int:
+        if domain_id is None:
+            return -1
+        return self._domain_codes.setdefault(domain_id, len(self._domain_codes))
+
+    def _domain_allowed(self, domain_id) -> bool:
+        return self.domain_ids is None or (domain_id is not None and str(domain_id) in self.domain_ids)
+
+    async def _corpus_fits(self, conn) -> bool:
+        stats = await conn.fetchrow(
+            "SELECT count(*) AS n, max(vector_dims(embedding)) AS dim FROM knowledge_nodes WHERE embedding IS NOT NULL"
+        )
+        size_mb = (stats["n"] or 0) * (stats["dim"] or 0) * 4 / 1024 / 1024
+        return size_mb <= self.max_corpus_mb
+
+    async def load_corpus(self, conn) -> Corpus:
+        """Эмбеддинги всех узлов чанками по CORPUS_CHUNK (keyset по id)."""
+        ids: List[str] = []
+        domains: List[int] = []
+        vectors: List[np.ndarray] = []
+        last = None
+        while True:
+            rows = await conn.fetch(CORPUS_CHUNK_SQL, last, CORPUS_CHUNK)
+            if not rows:
+                break
+            last = rows[-1]["id"]
+            rows = [r for r in rows if self._domain_allowed(r["domain_id"])]
+            if rows:
+                ids.extend(str(r["id"]) for r in rows)
+                domains.extend(self._domain_code(r["domain_id"]) for r in rows)
+                vectors.append(np.asarray([r["embedding"] for r in rows], dtype=np.float32))
+        matrix = np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+        if len(matrix):
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms > 0, norms, 1.0)
+        return Corpus(ids=ids, domains=np.asarray(domains, dtype=np.int64), matrix=matrix)
+
+    # --- поиск соседей ---
+
+    def neighbors_in_memory(self, corpus: Corpus, node_ids: Sequence[str]) -> List[Tuple[str, str, str, float]]:
+        """Связи (source, target, link_type, strength) для node_ids по корпусу в памяти."""
+        rows = np.asarray([corpus.index[n] for n in node_ids if n in corpus.index], dtype=np.int64)
+        if not len(rows) or len(corpus.ids) < 2:
+            return []
+        idx, scores = top_k_neighbors(corpus.matrix[rows], rows, corpus.matrix, min(self.top_k, len(corpus.ids) - 1))
+        mask = (idx >= 0) & (scores >= self.threshold)
+        src_rows = np.broadcast_to(rows[:, None], idx.shape)[mask]
+        dst_rows, sims = idx[mask], scores[mask]
+        same = corpus.domains[src_rows] == corpus.domains[dst_rows]
+        if not self.cross_domain:
+            src_rows, dst_rows, sims, same = src_rows[same], dst_rows[same], sims[same], same[same]
+        return [
+            (corpus.ids[s], corpus.ids[t], "related_to" if eq else "enhances", float(w))
+            for s, t, w, eq in zip(src_rows.tolist(), dst_rows.tolist(), sims.tolist(), same.tolist())
+        ]
+
+    async def neighbors_ann(self, conn, node_ids: Sequence[str]) -> List[Tuple[str, str, str, float]]:
+        """Те же связи через HNSW-индекс (корпус не помещается в память)."""
+        rows = await conn.fetch(ANN_NEIGHBORS_SQL, list(node_ids), self.top_k, self.threshold)
+        links = []
+        for r in rows:
+            if not self._domain_allowed(r["source_domain"]) or not self._domain_allowed(r["target_domain"]):
+                continue
+            same = r["source_domain"] == r["target_domain"]
+            if same or self.cross_domain:
+                links.append((str(r["source_id"]), str(r["target_id"]),
+                              link_type_for(r["source_domain"], r["target_domain"]), float(r["similarity"])))
+        return links
+
+    # --- запись ---
+
+    async def upsert_links(self, conn, links: Sequence[Tuple[str, str, str, float]],
+                           watermark: Optional[Tuple[str, Any, int]] = None) -> List[str]:
+        """Все связи блока: COPY во временную таблицу и один INSERT ... ON CONFLICT.
+
+        watermark=(name, last_id, processed) фиксируется в той же транзакции.
+        """
+        async with conn.transaction():
+            ids: List[str] = []
+            if links:
+                await conn.execute("""
+                    CREATE TEMP TABLE auto_link_batch (
+                        source_node_id uuid, target_node_id uuid, link_type varchar(50), strength float8
+                    ) ON COMMIT DROP
+                """)
+                await conn.copy_records_to_table('auto_link_batch', records=links)
+                ids = [str(r["id"]) for r in await conn.fetch(UPSERT_LINKS_SQL)]
+            if watermark is not None:
+                name, last_id, processed = watermark
+                await conn.execute("""
+                    INSERT INTO auto_link_state (name, watermark, processed, links, updated_at)
+                    VALUES ($1, $2, $3, $4, NOW())
+                    ON CONFLICT (name) DO UPDATE SET
+                        watermark = EXCLUDED.watermark,
+                        processed = auto_link_state.processed + EXCLUDED.processed,
+                        links = auto_link_state.links + EXCLUDED.links,
+                        updated_at = NOW()
+                """, name, last_id, processed, len(ids))
+        return ids
+
+    # --- проходы ---
+
+    async def _ensure_schema(self, conn) -> None:
+        await conn.execute(_MIGRATION_PATH.read_text(encoding="utf-8"))
+
+    async def link_nodes(self, conn, node_ids: Sequence[str], corpus: Optional[Corpus] = None) -> List[str]:
+        """Связи для конкретных узлов (без водяного знака)."""
+        links = (self.neighbors_in_memory(corpus, node_ids) if corpus is not None
+                 else await self.neighbors_ann(conn, node_ids))
+        return await self.upsert_links(conn, links)
+
+    async def run(self, full: bool = False) -> Dict[str, Any]:
+        """Проход по узлам блоками.
+
+        full=True — все узлы с эмбеддингами (перестройка графа после импорта),
+        возобновляется с сохранённого водяного знака; корпус грузится в память, если помещается.
+        Иначе — только узлы без связей, через HNSW-индекс: корпус не загружается,
+        а если несвязанных узлов нет, проход завершается одним запросом.
+        """
+        import asyncpg
+        started = time.perf_counter()
+        stats = {"processed": 0, "links": 0, "blocks": 0, "mode": "ann"}
+        conn = await asyncpg.connect(self.db_url)
+        try:
+            if not full:
+                block = [str(r["id"]) for r in await conn.fetch(UNLINKED_NODES_SQL, None, self.block_size)]
+                if not block:
+                    stats["seconds"] = round(time.perf_counter() - started, 1)
+                    logger.debug("🔗 Auto-link: узлов без связей нет")
+                    return stats
+                await self._run_incremental(conn, block, stats)
+            else:
+                await self._run_full(conn, stats, started)
+        finally:
+            await conn.close()
+        stats["seconds"] = round(time.perf_counter() - started, 1)
+        logger.info("✅ Auto-link: %s", stats)
+        return stats
+
+    async def _run_incremental(self, conn, block: List[str], stats: Dict[str, Any]) -> None:
+        """Узлы без связей блоками через ANN; водяной знак пропускает узлы, оставшиеся без соседей."""
+        while block:
+            links = await self.neighbors_ann(conn, block)
+            created = await self.upsert_links(conn, links)
+            stats["processed"] += len(block)
+            stats["links"] += len(created)
+            stats["blocks"] += 1
+            block = [str(r["id"]) for r in await conn.fetch(UNLINKED_NODES_SQL, block[-1], self.block_size)]
+
+    async def _run_full(self, conn, stats: Dict[str, Any], started: float) -> None:
+        await self._ensure_schema(conn)
+        corpus = None
+        if await self._corpus_fits(conn):
+            corpus = await self.load_corpus(conn)
+            stats["mode"] = "in_memory"
+            logger.info("🔗 Auto-link: корпус %d узлов загружен за %.1f с",
+                        len(corpus.ids), time.perf_counter() - started)
+
+        watermark = await conn.fetchval("SELECT watermark FROM auto_link_state WHERE name = $1", FULL_REBUILD)
+        if watermark is not None:
+            logger.info("🔗 Auto-link: продолжение полного прохода с %s", watermark)
+
+        while True:
+            if corpus is not None:
+                start = 0 if watermark is None else bisect.bisect_right(corpus.ids, str(watermark))
+                block = corpus.ids[start:start + self.block_size]
+            else:
+                block = [str(r["id"]) for r in await conn.fetch(CORPUS_CHUNK_SQL, watermark, self.block_size)]
+            if not block:
+                break
+            watermark = block[-1]
+            links = (self.neighbors_in_memory(corpus, block) if corpus is not None
+                     else await self.neighbors_ann(conn, block))
+            created = await self.upsert_links(conn, links, (FULL_REBUILD, watermark, len(block)))
+            stats["processed"] += len(block)
+            stats["links"] += len(created)
+            stats["blocks"] += 1
+
+        # Проход завершён — следующий полный начнётся сначала
+        await conn.execute("UPDATE auto_link_state SET watermark = NULL, updated_at = NOW() WHERE name = $1",
+                           FULL_REBUILD)
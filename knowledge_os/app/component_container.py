@@ -0,0 +1,140 @@
+"""
+Component Container — тёплые компоненты процесса (воркер / API) с явным жизненным циклом.
+
+Компонент регистрируется фабрикой (sync или async) и строится один раз на процесс:
+- init() — прогрев при старте воркера (параллельно, ошибки не роняют старт);
+- get() — ленивое построение при первом обращении; одновременные вызовы ждут одну
+  сборку (single-flight), повторно фабрика не вызывается;
+- health() — состояние и время построения каждого компонента (регрессии старта видны в метриках);
+- shutdown() — закрытие в порядке, обратном построению.
+
+Неудачная сборка не кэшируется навсегда: get() возвращает None и повторяет попытку
+не раньше чем через retry_after секунд (медленная падающая фабрика не бьёт по каждой задаче).
+"""
+
+import asyncio
+import inspect
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Component:
+    name: str
+    factory: Callable[[], Any]
+    shutdown: Optional[Callable[[Any], Any]] = None
+    instance: Any = None
+    ready: bool = False
+    build_seconds: Optional[float] = None
+    error: Optional[str] = None
+    failed_at: float = 0.0
+    inflight: Optional[asyncio.Future] = None
+
+
+class ComponentContainer:
+    """Реестр компонентов процесса с ленивым single-flight построением"""
+
+    def __init__(self, name: str = "components", retry_after: float = 30.0):
+        self.name = name
+        self.retry_after = retry_after
+        self._components: Dict[str, _Component] = {}
+        self._built_order: List[str] = []
+
+    def register(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        shutdown: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        """factory() -> экземпляр (или awaitable); shutdown(instance) — при остановке процесса"""
+        self._components[name] = _Component(name=name, factory=factory, shutdown=shutdown)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._components
+
+    def peek(self, name: str) -> Any:
+        """Готовый экземпляр без построения (None, если ещё не собран)"""
+        comp = self._components.get(name)
+        return comp.instance if comp is not None and comp.ready else None
+
+    async def _build(self, comp: _Component) -> Any:
+        started = time.perf_counter()
+        try:
+            instance = comp.factory()
+            if inspect.isawaitable(instance):
+                instance = await instance
+        except Exception as e:
+            comp.error = f"{type(e).__name__}: {e}"
+            comp.failed_at = time.monotonic()
+            comp.build_seconds = time.perf_counter() - started
+            logger.warning("⚠️ [%s] компонент %s не построен: %s", self.name, comp.name, comp.error)
+            return None
+        finally:
+            comp.inflight = None
+        comp.build_seconds = time.perf_counter() - started
+        comp.instance, comp.ready, comp.error = instance, True, None
+        self._built_order.append(comp.name)
+        logger.info("✅ [%s] %s готов за %.1f мс", self.name, comp.name, comp.build_seconds * 1000)
+        return instance
+
+    async def get(self, name: str) -> Any:
+        """Экземпляр компонента; при первом обращении строится (один раз на все конкурентные вызовы)"""
+        comp = self._components.get(name)
+        if comp is None:
+            raise KeyError(f"Компонент не зарегистрирован: {name}")
+        if comp.ready:
+            return comp.instance
+        if comp.inflight is not None:
+            return await asyncio.shield(comp.inflight)
+        if comp.error is not None and time.monotonic() - comp.failed_at < self.retry_after:
+            return None
+        comp.inflight = asyncio.ensure_future(self._build(comp))
+        return await asyncio.shield(comp.inflight)
+
+    async def init(self, names: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Прогрев при старте процесса: строит компоненты параллельно, возвращает health()"""
+        targets = list(names) if names is not None else list(self._components)
+        started = time.perf_counter()
+        await asyncio.gather(*(self.get(name) for name in targets))
+        logger.info(
+            "🔥 [%s] прогрев %d компонентов за %.1f мс",
+            self.name, len(targets), (time.perf_counter() - started) * 1000,
+        )
+        return self.health()
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        """Состояние и время построения по каждому компоненту"""
+        out = {}
+        for name, comp in self._components.items():
+            if comp.ready:
+                state = "ready"
+            elif comp.inflight is not None:
+                state = "building"
+            elif comp.error is not None:
+                state = "failed"
+            else:
+                state = "idle"
+            out[name] = {
+                "state": state,
+                "build_ms": round(comp.build_seconds * 1000, 2) if comp.build_seconds is not None else None,
+                "error": comp.error,
+            }
+        return out
+
+    async def shutdown(self) -> None:
+        """Закрывает построенные компоненты в обратном порядке; после этого get() строит заново"""
+        for name in reversed(self._built_order):
+            comp = self._components[name]
+            if comp.shutdown is not None and comp.ready:
+                try:
+                    result = comp.shutdown(comp.instance)
+                    if inspect.isawaitable(result):
+                        await result
+                except Exception as e:
+                    logger.warning("⚠️ [%s] ошибка остановки %s: %s", self.name, name, e)
+            comp.instance, comp.ready = None, False
+        self._built_order.clear()
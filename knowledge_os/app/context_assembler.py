@@ -0,0 +1,208 @@
+"""
+Context Assembler — параллельная сборка контекста промпта с дедлайном.
+
+Все источники (RAG-эталоны, AI Research, история, похожие задачи, задачи проекта) стартуют
+одновременно на общем пуле БД (db_pool). У каждого свой бюджет времени, у сборки — общий
+дедлайн: в промпт попадает то, что успело прийти, в порядке приоритета источников.
+Эмбеддинг запроса считается один раз и делится между источниками (ContextRequest.embedding).
+По каждому источнику ведётся статистика: задержка, доля непустых ответов, таймауты, ошибки.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_DEADLINE = float(os.getenv("VICTORIA_CONTEXT_DEADLINE", "1.5"))
+SOURCE_BUDGET = float(os.getenv("VICTORIA_CONTEXT_SOURCE_BUDGET", "1.0"))
+
+
+@asynccontextmanager
+async def pooled_connection():
+    """
+    Соединение из общего пула Knowledge OS (вместо asyncpg.connect на каждый источник).
+    Без DATABASE_URL отдаёт None — источники контекста в этом случае пустые, как и раньше.
+    """
+    if not os.getenv("DATABASE_URL"):
+        yield None
+        return
+    try:
+        from db_pool import get_pool
+    except ImportError:
+        from app.db_pool import get_pool
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        yield conn
+
+
+async def _default_embedder(text: str) -> Optional[list]:
+    try:
+        from semantic_cache import get_embedding
+    except ImportError:
+        from app.semantic_cache import get_embedding
+    return await get_embedding(text)
+
+
+class ContextRequest:
+    """Запрос на сборку: цель, параметры источников и общий (ленивый) эмбеддинг"""
+
+    def __init__(self, goal: str, params: Optional[Dict[str, Any]] = None,
+                 embedder: Callable[[str], Awaitable[Optional[list]]] = _default_embedder):
+        self.goal = goal
+        self.params = params or {}
+        self._embedder = embedder
+        self._embedding_task: Optional[asyncio.Task] = None
+
+    def start_embedding(self) -> None:
+        if self._embedding_task is None:
+            self._embedding_task = asyncio.ensure_future(self._embedder(self.goal))
+
+    async def embedding(self) -> Optional[list]:
+        """Эмбеддинг цели: считается один раз, отмена одного источника его не прерывает"""
+        self.start_embedding()
+        return await asyncio.shield(self._embedding_task)
+
+    def close(self) -> None:
+        if self._embedding_task is not None and not self._embedding_task.done():
+            self._embedding_task.cancel()
+
+
+@dataclass
+class ContextSource:
+    """Источник контекста; меньше priority — раньше в промпте"""
+    name: str
+    fetch: Callable[[ContextRequest], Awaitable[str]]
+    priority: int = 100
+    budget: float = SOURCE_BUDGET
+    needs_embedding: bool = False
+    # Быстрая проверка без I/O (ключевые слова и т.п.): False — источник не запускается
+    applies: Optional[Callable[[ContextRequest], bool]] = None
+
+
+@dataclass
+class SourceStats:
+    calls: int = 0
+    hits: int = 0
+    timeouts: int = 0
+    late: int = 0
+    errors: int = 0
+    total_latency: float = 0.0
+    last_latency: float = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.calls, 3) if self.calls else 0.0,
+            "timeouts": self.timeouts,
+            "late": self.late,
+            "errors": self.errors,
+            "avg_latency_ms": round(self.total_latency / self.calls * 1000, 1) if self.calls else 0.0,
+            "last_latency_ms": round(self.last_latency * 1000, 1),
+        }
+
+
+@dataclass
+class AssembledContext:
+    """Результат сборки: тексты источников (успевших и непустых) в порядке приоритета"""
+    parts: Dict[str, str] = field(default_factory=dict)
+    latencies: Dict[str, float] = field(default_factory=dict)
+    missed: List[str] = field(default_factory=list)
+    elapsed: float = 0.0
+
+    def get(self, name: str) -> str:
+        return self.parts.get(name, "")
+
+
+class ContextAssembler:
+    """Параллельная сборка контекста из нескольких источников с общим дедлайном"""
+
+    def __init__(self, sources: List[ContextSource], deadline: float = CONTEXT_DEADLINE):
+        self.sources = sorted(sources, key=lambda s: s.priority)
+        self.deadline = deadline
+        self.stats: Dict[str, SourceStats] = {s.name: SourceStats() for s in self.sources}
+
+    async def _run_source(self, source: ContextSource, request: ContextRequest):
+        stats = self.stats[source.name]
+        started = time.perf_counter()
+        status = "ok"
+        text = ""
+        try:
+            text = await asyncio.wait_for(source.fetch(request), timeout=source.budget) or ""
+        except asyncio.TimeoutError:
+            status = "timeout"
+        except asyncio.CancelledError:
+            status = "late"
+            raise
+        except Exception as e:
+            status = "error"
+            logger.debug("Context source %s: %s", source.name, e)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats.calls += 1
+            stats.total_latency += elapsed
+            stats.last_latency = elapsed
+            if status == "timeout":
+                stats.timeouts += 1
+            elif status == "late":
+                stats.late += 1
+            elif status == "error":
+                stats.errors += 1
+            elif text:
+                stats.hits += 1
+        return text, elapsed
+
+    async def assemble(self, goal: str, params: Optional[Dict[str, Any]] = None,
+                       deadline: Optional[float] = None, only: Optional[Iterable[str]] = None,
+                       embedder: Optional[Callable[[str], Awaitable[Optional[list]]]] = None) -> AssembledContext:
+        """
+        Запускает применимые источники параллельно и ждёт не дольше дедлайна.
+        only — подмножество источников по имени (например, только похожие задачи для coding).
+        """
+        request = ContextRequest(goal, params, embedder or _default_embedder)
+        wanted = set(only) if only is not None else None
+        active = [
+            s for s in self.sources
+            if (wanted is None or s.name in wanted) and (s.applies is None or s.applies(request))
+        ]
+        result = AssembledContext()
+        if not active:
+            return result
+        started = time.perf_counter()
+        if any(s.needs_embedding for s in active):
+            request.start_embedding()
+        tasks = {s.name: asyncio.ensure_future(self._run_source(s, request)) for s in active}
+        try:
+            _, pending = await asyncio.wait(tasks.values(), timeout=deadline or self.deadline)
+        finally:
+            pending = [task for task in tasks.values() if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            request.close()
+        for source in active:
+            task = tasks[source.name]
+            if task.cancelled() or task.exception() is not None:
+                result.missed.append(source.name)
+                continue
+            text, elapsed = task.result()
+            result.latencies[source.name] = elapsed
+            if text:
+                result.parts[source.name] = text
+        result.elapsed = time.perf_counter() - started
+        logger.debug(
+            "Context assembled in %.0f ms: %s (missed: %s)",
+            result.elapsed * 1000,
+            {name: f"{lat * 1000:.0f}ms" for name, lat in result.latencies.items()},
+            result.missed or "-",
+        )
+        return result
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
@@ -205,6 +205,11 @@ try:
 except ImportError:
     async def run_auto_link_detection(): pass
 
+try:
+    from graphrag.community_detector import get_community_detector
+except ImportError:
+    get_community_detector = None  # type: ignore
+
 try:
     from task_rule_executor import execute_fallback as rule_executor_execute, can_handle as rule_executor_can_handle
 except ImportError:
@@ -1203,6 +1208,12 @@ async def run_enhanced_orchestration_cycle():
                 await run_auto_link_detection()
             except Exception as exc:  # pylint: disable=broad-exception-caught
                 logger.error("Auto-link detection error: %s", exc)
+            try:
+                # Инкрементально: пересматриваются только узлы с изменившимися связями
+                if get_community_detector is not None:
+                    await get_community_detector(DB_URL).detect_communities()
+            except Exception as exc:  # pylint: disable=broad-exception-caught
+                logger.error("Community detection error: %s", exc)
 
             logger.info("🧬 Phase 7: Knowledge Distillation & Auto-Upgrade...")
             try:
@@ -1,15 +1,25 @@
 """
 Event-Driven Architecture - Асинхронная обработка событий
 Основано на Microsoft AutoGen v0.4: event-driven и request/response паттерны
+
+Шина разбита на партиции (по умолчанию — по типу события): у каждой своя
+ограниченная очередь и свой потребитель, поэтому медленный подписчик задерживает
+только свою партицию. Обработчики изолированы (таймаут, исключения не выходят
+наружу), история хранится в deque, request/response разрешается через реестр
+correlation_id. Для подписчиков в других процессах — опциональная доставка через
+Redis Streams.
 """
 
 import asyncio
+import json
 import logging
-from typing import Dict, List, Optional, Callable, Any
+import os
+import time
+from typing import Dict, List, Optional, Callable, Any, Deque, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from enum import Enum
-from collections import defaultdict
+from collections import defaultdict, deque
 import uuid
 
 logger = logging.getLogger(__name__)
@@ -25,7 +35,7 @@ class EventType(Enum):
     KNOWLEDGE_UPDATED = "knowledge_updated"
     MODEL_RESPONSE = "model_response"
     SYSTEM_EVENT = "system_event"
-    
+
     # Новые события для инициативы (Event-Driven Architecture)
     FILE_CREATED = "file_created"
     FILE_MODIFIED = "file_modified"
@@ -37,7 +47,7 @@ class EventType(Enum):
     DEADLINE_PASSED = "deadline_passed"
     ERROR_DETECTED = "error_detected"
     PERFORMANCE_DEGRADED = "performance_degraded"
-    
+
     # События для саморасширения (Skill Registry)
     SKILL_NEEDED = "skill_needed"
     SKILL_ADDED = "skill_added"
@@ -56,68 +66,288 @@ class Event:
     timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
     correlation_id: Optional[str] = None
 
+    def to_dict(self) -> Dict[str, Any]:
+        """Сериализация для durable-доставки"""
+        return {
+            "event_id": self.event_id,
+            "event_type": self.event_type.value,
+            "payload": self.payload,
+            "source": self.source,
+            "timestamp": self.timestamp.isoformat(),
+            "correlation_id": self.correlation_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Event":
+        return cls(
+            event_id=data["event_id"],
+            event_type=EventType(data["event_type"]),
+            payload=data.get("payload") or {},
+            source=data.get("source", ""),
+            timestamp=datetime.fromisoformat(data["timestamp"]) if data.get("timestamp") else datetime.now(timezone.utc),
+            correlation_id=data.get("correlation_id"),
+        )
+
+
+@dataclass
+class HandlerMetrics:
+    """Метрики обработчика: вызовы, латентность, ошибки, таймауты"""
+    calls: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.calls += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_ms": round(self.total_seconds / self.calls * 1000, 2) if self.calls else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 2),
+        }
+
+
+class _Partition:
+    """Партиция шины: ограниченная очередь + собственный потребитель"""
+
+    __slots__ = ("key", "queue", "task", "processed", "dropped")
+
+    def __init__(self, key: str, maxsize: int):
+        self.key = key
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.task: Optional[asyncio.Task] = None
+        self.processed = 0
+        self.dropped = 0
+
+
+class RedisStreamTransport:
+    """Durable-доставка через Redis Streams для подписчиков в других процессах
+
+    Без группы (по умолчанию) — broadcast: каждый процесс читает весь поток через XREAD
+    со своей позиции, ничего не подтверждает и пропускает только собственные события.
+    С группой (EVENT_BUS_GROUP — имя сервиса) — XREADGROUP: группа получает все события,
+    процессы одного сервиса делят их между собой. События, опубликованные процессами
+    того же сервиса, уже обработаны у издателя — они подтверждаются без повторной доставки.
+    """
+
+    def __init__(
+        self,
+        redis_url: Optional[str] = None,
+        stream: str = "atra:events",
+        group: Optional[str] = None,
+        consumer: Optional[str] = None,
+        maxlen: int = 100_000,
+    ):
+        self.redis_url = redis_url or os.getenv("REDIS_URL", "redis://localhost:6379")
+        self.stream = stream
+        self.group = group or os.getenv("EVENT_BUS_GROUP") or None
+        self.consumer = consumer or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.maxlen = maxlen
+        self._client = None
+        self._last_id: Optional[str] = None  # позиция broadcast-чтения (XREAD)
+
+    async def _get_client(self):
+        if self._client is None:
+            import redis.asyncio as redis
+            self._client = redis.from_url(self.redis_url, decode_responses=True)
+            if self.group is None:
+                # Broadcast читает только события после подключения; "$" в каждом XREAD
+                # терял бы сообщения, пришедшие между вызовами, поэтому фиксируем конкретный id
+                last = await self._client.xrevrange(self.stream, count=1)
+                self._last_id = last[0][0] if last else "0-0"
+            else:
+                try:
+                    await self._client.xgroup_create(self.stream, self.group, id="$", mkstream=True)
+                except Exception as e:  # BUSYGROUP — группа уже есть
+                    if "BUSYGROUP" not in str(e):
+                        raise
+        return self._client
+
+    async def send(self, event: Event, origin: str) -> None:
+        client = await self._get_client()
+        await client.xadd(
+            self.stream,
+            {"origin": origin, "group": self.group or "", "event": json.dumps(event.to_dict(), default=str)},
+            maxlen=self.maxlen,
+            approximate=True,
+        )
+
+    async def receive(self, origin: str, block_ms: int = 5000, count: int = 100) -> List[Tuple[str, Event]]:
+        """События, опубликованные другими процессами (origin — id текущего процесса).
+
+        В режиме группы пропущенные сообщения своего сервиса сразу подтверждаются.
+        """
+        client = await self._get_client()
+        if self.group is None:
+            response = await client.xread({self.stream: self._last_id}, count=count, block=block_ms)
+        else:
+            response = await client.xreadgroup(self.group, self.consumer, {self.stream: ">"},
+                                               count=count, block=block_ms)
+        messages = []
+        for _stream, entries in response or []:
+            for message_id, fields in entries:
+                self._last_id = message_id
+                if fields.get("origin") == origin or (self.group is not None and fields.get("group") == self.group):
+                    await self.ack(message_id)
+                    continue
+                try:
+                    messages.append((message_id, Event.from_dict(json.loads(fields["event"]))))
+                except Exception as e:
+                    logger.warning(f"⚠️ Некорректное durable-событие {message_id}: {e}")
+                    await self.ack(message_id)
+        return messages
+
+    async def ack(self, message_id: str) -> None:
+        """Подтверждение в группе; в broadcast-режиме подтверждать нечего."""
+        if self.group is None:
+            return
+        client = await self._get_client()
+        await client.xack(self.stream, self.group, message_id)
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
 
 class EventBus:
     """
     Event Bus - центральная шина событий для асинхронной коммуникации
-    
+
     Паттерны:
     - Publish/Subscribe
     - Request/Response
     - Event-driven workflow
     """
-    
-    def __init__(self):
+
+    def __init__(
+        self,
+        queue_maxsize: int = 1000,
+        handler_timeout: float = 30.0,
+        max_history: int = 1000,
+        partition_key: Optional[Callable[[Event], str]] = None,
+        durable_transport: Optional[RedisStreamTransport] = None,
+    ):
         self.subscribers: Dict[EventType, List[Callable]] = defaultdict(list)
-        self.event_queue: asyncio.Queue = asyncio.Queue()
-        self.event_history: List[Event] = []
-        self.max_history: int = 1000
+        self.queue_maxsize = queue_maxsize
+        self.handler_timeout = handler_timeout
+        self.max_history: int = max_history
+        self.event_history: Deque[Event] = deque(maxlen=max_history)
         self.running: bool = False
-        self._processor_task: Optional[asyncio.Task] = None
-    
+        # По умолчанию партиция = тип события; можно задать свой ключ (например, по source)
+        self._partition_key = partition_key or (lambda event: event.event_type.value)
+        self._partitions: Dict[str, _Partition] = {}
+        self._pending_responses: Dict[str, asyncio.Future] = {}
+        self._handler_metrics: Dict[str, HandlerMetrics] = defaultdict(HandlerMetrics)
+        self.durable_transport = durable_transport
+        self._origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._durable_task: Optional[asyncio.Task] = None
+        self.published = 0
+
     async def start(self):
         """Запустить обработчик событий"""
         if self.running:
             return
-        
+
         self.running = True
-        self._processor_task = asyncio.create_task(self._process_events())
+        for partition in self._partitions.values():
+            self._start_consumer(partition)
+        if self.durable_transport is not None:
+            self._durable_task = asyncio.create_task(self._consume_durable())
         logger.info("🚀 Event Bus запущен")
-    
+
     async def stop(self):
-        """Остановить обработчик событий"""
+        """Остановить обработчик событий (с дообработкой уже принятых событий)"""
         self.running = False
-        if self._processor_task:
-            await self._processor_task
+        for partition in self._partitions.values():
+            if partition.task is not None:
+                await partition.queue.put(None)  # маркер остановки после уже принятых событий
+        for partition in self._partitions.values():
+            if partition.task is not None:
+                await partition.task
+                partition.task = None
+        # Пустые партиции пересоздаются при следующей публикации (очередь привязана к event loop)
+        self._partitions = {k: p for k, p in self._partitions.items() if not p.queue.empty()}
+        if self._durable_task is not None:
+            self._durable_task.cancel()
+            try:
+                await self._durable_task
+            except asyncio.CancelledError:
+                pass
+            self._durable_task = None
         logger.info("🛑 Event Bus остановлен")
-    
-    async def publish(self, event: Event):
+
+    def _start_consumer(self, partition: _Partition) -> None:
+        if partition.task is None or partition.task.done():
+            partition.task = asyncio.create_task(self._consume(partition))
+
+    def _get_partition(self, event: Event) -> _Partition:
+        key = self._partition_key(event)
+        partition = self._partitions.get(key)
+        if partition is None:
+            partition = self._partitions[key] = _Partition(key, self.queue_maxsize)
+            if self.running:
+                self._start_consumer(partition)
+        return partition
+
+    async def publish(self, event: Event, durable: bool = False):
         """
         Опубликовать событие
-        
+
         Args:
             event: Событие для публикации
+            durable: Дополнительно отправить в durable-транспорт (подписчики других процессов)
         """
-        await self.event_queue.put(event)
+        self.published += 1
+        if self._resolve_response(event):
+            return
+        # Ограниченная очередь: при переполнении издатель ждёт (backpressure)
+        await self._get_partition(event).queue.put(event)
+        if durable and self.durable_transport is not None:
+            try:
+                await self.durable_transport.send(event, self._origin)
+            except Exception as e:
+                logger.warning(f"⚠️ Durable-доставка {event.event_type.value} не удалась: {e}")
         logger.debug(f"📢 Событие опубликовано: {event.event_type.value} от {event.source}")
-    
+
+    def publish_nowait(self, event: Event) -> bool:
+        """Опубликовать без ожидания. False — партиция переполнена, событие отброшено."""
+        self.published += 1
+        if self._resolve_response(event):
+            return True
+        partition = self._get_partition(event)
+        try:
+            partition.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            partition.dropped += 1
+            logger.warning(f"⚠️ Партиция {partition.key} переполнена, событие {event.event_id} отброшено")
+            return False
+
     def subscribe(self, event_type: EventType, handler: Callable):
         """
         Подписаться на события
-        
+
         Args:
             event_type: Тип события
-            handler: Обработчик (async функция)
+            handler: Обработчик (async функция). Для запроса (request_response) может
+                вернуть dict — он станет ответом.
         """
         self.subscribers[event_type].append(handler)
         logger.debug(f"✅ Подписка на {event_type.value}: {handler.__name__}")
-    
+
     def unsubscribe(self, event_type: EventType, handler: Callable):
         """Отписаться от событий"""
         if handler in self.subscribers[event_type]:
             self.subscribers[event_type].remove(handler)
             logger.debug(f"❌ Отписка от {event_type.value}: {handler.__name__}")
-    
+
     async def request_response(
         self,
         event_type: EventType,
@@ -127,18 +357,18 @@ class EventBus:
     ) -> Optional[Dict]:
         """
         Request/Response паттерн
-        
+
         Args:
             event_type: Тип события
             payload: Данные запроса
             source: Источник
             timeout: Таймаут ожидания ответа
-        
+
         Returns:
-            Ответ или None
+            Ответ (dict, который вернул обработчик или передал в respond()) или None
         """
         correlation_id = str(uuid.uuid4())
-        
+
         # Создаем событие запроса
         request_event = Event(
             event_id=str(uuid.uuid4()),
@@ -147,81 +377,121 @@ class EventBus:
             source=source,
             correlation_id=correlation_id
         )
-        
-        # Создаем Future для ответа
-        response_future = asyncio.Future()
-        response_events = {}
-        response_events[correlation_id] = response_future
-        
-        # Публикуем запрос
-        await self.publish(request_event)
-        
-        # Ждем ответ
+
+        # Регистрируем Future до публикации, чтобы быстрый ответ не потерялся
+        response_future = asyncio.get_running_loop().create_future()
+        self._pending_responses[correlation_id] = response_future
+
         try:
-            response = await asyncio.wait_for(response_future, timeout=timeout)
-            return response
+            await self.publish(request_event)
+            return await asyncio.wait_for(response_future, timeout=timeout)
         except asyncio.TimeoutError:
             logger.warning(f"⏱️ Таймаут ожидания ответа на {event_type.value}")
             return None
         finally:
-            response_events.pop(correlation_id, None)
-    
-    async def _process_events(self):
-        """Обработчик событий (работает в фоне)"""
-        while self.running:
+            self._pending_responses.pop(correlation_id, None)
+
+    async def respond(self, request: Event, payload: Dict[str, Any], source: str = "event_bus"):
+        """Ответить на запрос request_response (можно из другого обработчика или позже)"""
+        await self.publish(Event(
+            event_id=str(uuid.uuid4()),
+            event_type=request.event_type,
+            payload={**payload, "_is_response": True},
+            source=source,
+            correlation_id=request.correlation_id,
+        ))
+
+    def _resolve_response(self, event: Event) -> bool:
+        """Ответ на ожидающий запрос разрешается сразу, минуя очередь"""
+        if not event.correlation_id or not event.payload.get("_is_response"):
+            return False
+        future = self._pending_responses.get(event.correlation_id)
+        if future is None or future.done():
+            return False
+        response = {k: v for k, v in event.payload.items() if k != "_is_response"}
+        future.set_result(response)
+        return True
+
+    async def _consume(self, partition: _Partition):
+        """Потребитель партиции: события одной партиции обрабатываются по порядку"""
+        while True:
+            event = await partition.queue.get()
+            if event is None:
+                return
             try:
-                # Получаем событие из очереди
-                event = await asyncio.wait_for(self.event_queue.get(), timeout=1.0)
-                
-                # Сохраняем в историю
-                self.event_history.append(event)
-                if len(self.event_history) > self.max_history:
-                    self.event_history.pop(0)
-                
-                # Находим подписчиков
-                handlers = self.subscribers.get(event.event_type, [])
-                
-                # Вызываем обработчики параллельно
-                if handlers:
-                    tasks = [handler(event) for handler in handlers]
-                    await asyncio.gather(*tasks, return_exceptions=True)
-                
-                # Обрабатываем request/response
-                if event.payload.get("_is_request"):
-                    await self._handle_request(event)
-                elif event.correlation_id:
-                    await self._handle_response(event)
-                
-            except asyncio.TimeoutError:
-                continue
+                await self._dispatch(event)
             except Exception as e:
                 logger.error(f"❌ Ошибка обработки события: {e}")
-    
-    async def _handle_request(self, event: Event):
-        """Обработать запрос (для request/response)"""
-        # В реальной системе здесь была бы маршрутизация к обработчику
-        logger.debug(f"📥 Обработка запроса: {event.event_id}")
-    
-    async def _handle_response(self, event: Event):
-        """Обработать ответ (для request/response)"""
-        # В реальной системе здесь был бы поиск соответствующего Future
-        logger.debug(f"📤 Обработка ответа: {event.event_id}")
-    
+            partition.processed += 1
+
+    async def _dispatch(self, event: Event):
+        self.event_history.append(event)
+        handlers = list(self.subscribers.get(event.event_type, []))
+        if not handlers:
+            return
+        results = await asyncio.gather(*(self._run_handler(h, event) for h in handlers))
+        if event.payload.get("_is_request") and event.correlation_id:
+            future = self._pending_responses.get(event.correlation_id)
+            reply = next((r for r in results if isinstance(r, dict)), None)
+            if future is not None and not future.done() and reply is not None:
+                future.set_result(reply)
+
+    async def _run_handler(self, handler: Callable, event: Event) -> Any:
+        """Вызов обработчика с таймаутом и изоляцией ошибок"""
+        name = getattr(handler, "__qualname__", repr(handler))
+        metrics = self._handler_metrics[f"{event.event_type.value}:{name}"]
+        started = time.perf_counter()
+        try:
+            result = handler(event)
+            if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+                result = await asyncio.wait_for(result, timeout=self.handler_timeout)
+            return result
+        except asyncio.TimeoutError:
+            metrics.timeouts += 1
+            logger.warning(f"⏱️ Обработчик {name} превысил {self.handler_timeout}s на {event.event_type.value}")
+        except Exception as e:
+            metrics.errors += 1
+            logger.error(f"❌ Обработчик {name} упал на {event.event_type.value}: {e}")
+        finally:
+            metrics.observe(time.perf_counter() - started)
+        return None
+
+    async def _consume_durable(self):
+        """Приём событий из durable-транспорта (опубликованных другими процессами)"""
+        while self.running:
+            try:
+                messages = await self.durable_transport.receive(self._origin)
+                for message_id, event in messages:
+                    await self._get_partition(event).queue.put(event)
+                    await self.durable_transport.ack(message_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"⚠️ Durable-транспорт недоступен: {e}")
+                await asyncio.sleep(5)
+
     def get_event_history(self, event_type: Optional[EventType] = None, limit: int = 100) -> List[Event]:
         """Получить историю событий"""
-        events = self.event_history
-        
+        events = list(self.event_history)
+
         if event_type:
             events = [e for e in events if e.event_type == event_type]
-        
+
         return events[-limit:]
-    
+
     def get_stats(self) -> Dict:
         """Получить статистику Event Bus"""
         stats = {
             "total_events": len(self.event_history),
+            "published": self.published,
             "subscribers": {et.value: len(handlers) for et, handlers in self.subscribers.items()},
-            "queue_size": self.event_queue.qsize(),
+            "queue_size": sum(p.queue.qsize() for p in self._partitions.values()),
+            "partitions": {
+                key: {"depth": p.queue.qsize(), "processed": p.processed, "dropped": p.dropped}
+                for key, p in self._partitions.items()
+            },
+            "handlers": {name: m.to_dict() for name, m in self._handler_metrics.items()},
+            "pending_requests": len(self._pending_responses),
             "running": self.running
         }
         return stats
@@ -235,7 +505,10 @@ def get_event_bus() -> EventBus:
     """Получить глобальный Event Bus"""
     global _global_event_bus
     if _global_event_bus is None:
-        _global_event_bus = EventBus()
+        durable = None
+        if os.getenv("EVENT_BUS_DURABLE", "false").lower() in ("true", "1", "yes"):
+            durable = RedisStreamTransport()
+        _global_event_bus = EventBus(durable_transport=durable)
     return _global_event_bus
 
 
@@ -243,14 +516,16 @@ async def main():
     """Пример использования"""
     bus = get_event_bus()
     await bus.start()
-    
+
     # Подписываемся на события
     async def handle_task_created(event: Event):
         print(f"📥 Получено событие: {event.event_type.value} от {event.source}")
         print(f"   Payload: {event.payload}")
-    
+        if event.payload.get("_is_request"):
+            return {"accepted": True}
+
     bus.subscribe(EventType.TASK_CREATED, handle_task_created)
-    
+
     # Публикуем событие
     event = Event(
         event_id=str(uuid.uuid4()),
@@ -258,15 +533,19 @@ async def main():
         payload={"task": "Пример задачи"},
         source="test_agent"
     )
-    
+
     await bus.publish(event)
-    
+
+    # Request/Response
+    reply = await bus.request_response(EventType.TASK_CREATED, {"task": "Запрос"}, source="test_agent", timeout=1.0)
+    print(f"Ответ: {reply}")
+
     # Ждем обработки
     await asyncio.sleep(0.1)
-    
+
     # Статистика
     print(f"\nСтатистика: {bus.get_stats()}")
-    
+
     await bus.stop()
 
 
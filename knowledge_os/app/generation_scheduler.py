@@ -0,0 +1,353 @@
+"""
+Generation Scheduler — планировщик генерации с батчингом на уровне итераций (continuous batching).
+
+Каждая итерация цикла:
+1. допуск новых последовательностей: классы приоритета (чат > задачи > фон) делят слоты
+   батча по весам (start-time fair queuing по токенам), допуск только в пределах бюджета KV-кэша;
+2. один шаг backend.step() для всего батча — по токену на каждую последовательность;
+3. раздача токенов подписчикам, освобождение бюджета завершившимися.
+Завершившаяся последовательность сразу уступает место ожидающей — батч не ждёт самую длинную.
+Простой без работы — ожидание asyncio.Condition (без sleep-поллинга).
+
+Бэкенд подключаемый: MLX (mlx_api_server.MLXBackend) или детерминированный FakeTokenBackend
+для тестов и бенчмарков без GPU (scripts/benchmark_generation_scheduler.py).
+"""
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета — значения RequestPriority (mlx_request_queue): 1 чат, 2 задачи, 3 фон.
+# Вес — доля слотов батча при конкуренции классов.
+DEFAULT_CLASS_WEIGHTS: Dict[int, float] = {1: 8.0, 2: 3.0, 3: 1.0}
+
+
+class AdmissionError(Exception):
+    """Запрос не помещается в бюджет KV-кэша даже на пустом сервере."""
+
+
+@dataclass(eq=False)
+class Sequence:
+    """Последовательность в планировщике: токены доступны потоком (stream) или целиком (result)."""
+    prompt: str
+    max_tokens: int
+    priority: int = 2
+    seq_id: int = 0
+    kv_cost: int = 0
+    deadline: Optional[float] = None
+    created_at: float = field(default_factory=time.monotonic)
+    state: Any = None  # состояние бэкенда (итератор генерации, KV-кэш)
+    tokens: List[str] = field(default_factory=list)
+    cancelled: bool = False
+    first_token_at: Optional[float] = None
+    _queue: asyncio.Queue = field(default_factory=asyncio.Queue, repr=False)
+    _future: Optional[asyncio.Future] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        self._future = asyncio.get_running_loop().create_future()
+
+    @property
+    def done(self) -> bool:
+        return self._future.done()
+
+    def cancel(self) -> None:
+        """Отмена: последовательность снимается с батча на следующей итерации."""
+        self.cancelled = True
+
+    async def result(self) -> str:
+        return await asyncio.shield(self._future)
+
+    async def stream(self) -> AsyncIterator[str]:
+        while True:
+            token = await self._queue.get()
+            if token is None:
+                break
+            yield token
+        if self._future.cancelled():
+            raise asyncio.CancelledError()
+        if self._future.exception() is not None:
+            raise self._future.exception()
+
+    def _emit(self, token: str) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+        self.tokens.append(token)
+        self._queue.put_nowait(token)
+
+    def _finish(self, error: Optional[BaseException] = None) -> None:
+        if self._future.done():
+            return
+        if error is None:
+            self._future.set_result("".join(self.tokens))
+        elif isinstance(error, asyncio.CancelledError):
+            self._future.cancel()
+        else:
+            self._future.set_exception(error)
+            self._future.exception()  # помечаем как полученное: ожидающих может не быть
+        self._queue.put_nowait(None)
+
+
+class GenerationBackend:
+    """
+    Интерфейс бэкенда генерации.
+    kv_cost — сколько бюджета занимает последовательность (байты KV-кэша на prompt + max_tokens);
+    prefill — подготовка состояния новых последовательностей;
+    step — следующий токен для каждой последовательности батча (None — последовательность закончилась);
+    release — освобождение состояния.
+    """
+
+    def kv_cost(self, seq: Sequence) -> int:
+        raise NotImplementedError
+
+    async def prefill(self, seqs: List[Sequence]) -> None:
+        return None
+
+    async def step(self, seqs: List[Sequence]) -> List[Optional[str]]:
+        raise NotImplementedError
+
+    def release(self, seq: Sequence) -> None:
+        seq.state = None
+
+
+class FakeTokenBackend(GenerationBackend):
+    """
+    Детерминированный бэкенд для тестов/бенчмарков: токены — хэш (prompt, позиция),
+    длина ответа — min(max_tokens, eos_after(prompt)). Время шага моделирует устройство:
+    step_seconds + per_seq_seconds * размер_батча (батч дешевле суммы одиночных шагов).
+    """
+
+    def __init__(self, step_seconds: float = 0.0, per_seq_seconds: float = 0.0,
+                 bytes_per_token: int = 1, eos_after=None):
+        self.step_seconds = step_seconds
+        self.per_seq_seconds = per_seq_seconds
+        self.bytes_per_token = bytes_per_token
+        self.eos_after = eos_after
+        self.batch_sizes: List[int] = []
+
+    @staticmethod
+    def token(prompt: str, position: int) -> str:
+        digest = hashlib.blake2b(f"{prompt}\x00{position}".encode(), digest_size=4).hexdigest()
+        return f"t{int(digest, 16) % 1000} "
+
+    @classmethod
+    def expected(cls, prompt: str, n: int) -> str:
+        return "".join(cls.token(prompt, i) for i in range(n))
+
+    def kv_cost(self, seq: Sequence) -> int:
+        return (len(seq.prompt.split()) + seq.max_tokens) * self.bytes_per_token
+
+    async def prefill(self, seqs: List[Sequence]) -> None:
+        for seq in seqs:
+            limit = self.eos_after(seq.prompt) if self.eos_after else seq.max_tokens
+            seq.state = {"pos": 0, "limit": min(limit, seq.max_tokens)}
+
+    async def step(self, seqs: List[Sequence]) -> List[Optional[str]]:
+        self.batch_sizes.append(len(seqs))
+        delay = self.step_seconds + self.per_seq_seconds * len(seqs)
+        if delay > 0:
+            await asyncio.sleep(delay)  # «время устройства», не ожидание работы
+        out: List[Optional[str]] = []
+        for seq in seqs:
+            state = seq.state
+            if state["pos"] >= state["limit"]:
+                out.append(None)
+                continue
+            out.append(self.token(seq.prompt, state["pos"]))
+            state["pos"] += 1
+        return out
+
+
+class GenerationScheduler:
+    """
+    Планировщик continuous batching поверх GenerationBackend.
+
+    Args:
+        backend: бэкенд генерации
+        kv_budget: бюджет KV-кэша (в единицах backend.kv_cost)
+        max_batch: максимум последовательностей в одном шаге
+        class_weights: веса классов приоритета (по умолчанию DEFAULT_CLASS_WEIGHTS)
+        high_priority_reserve: слоты батча, недоступные классам ниже самого приоритетного
+    """
+
+    def __init__(self, backend: GenerationBackend, kv_budget: int, max_batch: int = 8,
+                 class_weights: Optional[Dict[int, float]] = None,
+                 high_priority_reserve: int = 1, name: str = "default"):
+        self.backend = backend
+        self.kv_budget = kv_budget
+        self.max_batch = max(1, max_batch)
+        self.class_weights = dict(class_weights or DEFAULT_CLASS_WEIGHTS)
+        self.high_priority_reserve = min(high_priority_reserve, self.max_batch - 1)
+        self.name = name
+        self._top_class = min(self.class_weights)
+        self._waiting: Dict[int, Deque[Sequence]] = {}
+        self._running: List[Sequence] = []
+        self._kv_used = 0
+        self._vtime: Dict[int, float] = {}
+        self._vclock = 0.0
+        self._cond: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ids = itertools.count(1)
+        self.stats = {
+            "submitted": 0, "completed": 0, "cancelled": 0, "expired": 0, "failed": 0,
+            "rejected": 0, "steps": 0, "tokens": 0,
+        }
+
+    async def submit(self, prompt: str, max_tokens: int, priority: int = 2,
+                     timeout: Optional[float] = None) -> Sequence:
+        """Ставит последовательность в очередь своего класса. AdmissionError — не влезет в бюджет никогда."""
+        if priority not in self.class_weights:
+            priority = max(self.class_weights)
+        seq = Sequence(prompt=prompt, max_tokens=max_tokens, priority=priority, seq_id=next(self._ids),
+                       deadline=time.monotonic() + timeout if timeout else None)
+        seq.kv_cost = self.backend.kv_cost(seq)
+        if seq.kv_cost > self.kv_budget:
+            self.stats["rejected"] += 1
+            raise AdmissionError(f"KV budget exceeded: need {seq.kv_cost}, budget {self.kv_budget}")
+        self._waiting.setdefault(priority, deque()).append(seq)
+        self.stats["submitted"] += 1
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        async with self._cond:
+            self._cond.notify()
+        return seq
+
+    async def generate(self, prompt: str, max_tokens: int, priority: int = 2,
+                       timeout: Optional[float] = None) -> str:
+        seq = await self.submit(prompt, max_tokens, priority, timeout)
+        try:
+            return await seq.result()
+        except asyncio.CancelledError:
+            seq.cancel()
+            raise
+
+    def _has_work(self) -> bool:
+        return bool(self._running) or any(self._waiting.values())
+
+    async def _run(self) -> None:
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(self._has_work)
+            # Уступаем event loop между итерациями: новые запросы попадают в следующий шаг,
+            # даже если бэкенд не отдаёт управление (синхронный шаг)
+            await asyncio.sleep(0)
+            admitted = self._admit()
+            if admitted:
+                try:
+                    await self.backend.prefill(admitted)
+                except Exception as e:
+                    logger.error(f"❌ [SCHEDULER {self.name}] prefill: {e}", exc_info=True)
+                    for seq in admitted:
+                        self._retire(seq, e, "failed")
+            if not self._running:
+                continue
+            batch = list(self._running)
+            try:
+                tokens = await self.backend.step(batch)
+            except Exception as e:
+                logger.error(f"❌ [SCHEDULER {self.name}] step (батч {len(batch)}): {e}", exc_info=True)
+                for seq in batch:
+                    self._retire(seq, e, "failed")
+                continue
+            self.stats["steps"] += 1
+            now = time.monotonic()
+            for seq, token in zip(batch, tokens):
+                if seq.cancelled:
+                    self._retire(seq, asyncio.CancelledError(), "cancelled")
+                elif seq.deadline is not None and now > seq.deadline:
+                    self._retire(seq, asyncio.TimeoutError(), "expired")
+                elif token is None:
+                    self._retire(seq, None, "completed")
+                else:
+                    seq._emit(token)
+                    self.stats["tokens"] += 1
+                    if len(seq.tokens) >= seq.max_tokens:
+                        self._retire(seq, None, "completed")
+
+    def _pick_class(self, slots_free: int) -> Optional[int]:
+        """Класс с минимальным виртуальным временем среди ожидающих (start-time fair queuing)."""
+        best, best_vt = None, None
+        for cls, queue in self._waiting.items():
+            if not queue:
+                continue
+            if cls != self._top_class and slots_free <= self.high_priority_reserve:
+                continue
+            vt = max(self._vtime.get(cls, 0.0), self._vclock)
+            if best_vt is None or vt < best_vt or (vt == best_vt and cls < best):
+                best, best_vt = cls, vt
+        return best
+
+    def _admit(self) -> List[Sequence]:
+        admitted: List[Sequence] = []
+        now = time.monotonic()
+        for queue in self._waiting.values():
+            for seq in [s for s in queue if s.cancelled or (s.deadline is not None and now > s.deadline)]:
+                queue.remove(seq)
+                self._fail_waiting(seq)
+        while len(self._running) < self.max_batch:
+            cls = self._pick_class(self.max_batch - len(self._running))
+            if cls is None:
+                break
+            seq = self._waiting[cls][0]
+            if self._kv_used + seq.kv_cost > self.kv_budget:
+                break  # ждём освобождения бюджета; голова очереди не обгоняется мелкими запросами
+            self._waiting[cls].popleft()
+            start = max(self._vtime.get(cls, 0.0), self._vclock)
+            self._vtime[cls] = start + seq.max_tokens / self.class_weights[cls]
+            self._vclock = start
+            self._kv_used += seq.kv_cost
+            self._running.append(seq)
+            admitted.append(seq)
+        return admitted
+
+    def _fail_waiting(self, seq: Sequence) -> None:
+        if seq.cancelled:
+            self.stats["cancelled"] += 1
+            seq._finish(asyncio.CancelledError())
+        else:
+            self.stats["expired"] += 1
+            seq._finish(asyncio.TimeoutError())
+
+    def _retire(self, seq: Sequence, error: Optional[BaseException], outcome: str) -> None:
+        if seq in self._running:
+            self._running.remove(seq)
+            self._kv_used -= seq.kv_cost
+        try:
+            self.backend.release(seq)
+        except Exception as e:
+            logger.debug(f"[SCHEDULER {self.name}] release: {e}")
+        self.stats[outcome] += 1
+        seq._finish(error)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for seq in list(self._running):
+            self._retire(seq, asyncio.CancelledError(), "cancelled")
+        for queue in self._waiting.values():
+            while queue:
+                seq = queue.popleft()
+                seq.cancel()
+                self._fail_waiting(seq)
+
+    def get_stats(self) -> Dict[str, Any]:
+        steps = self.stats["steps"]
+        return {
+            **self.stats,
+            "name": self.name,
+            "running": len(self._running),
+            "waiting": {cls: len(q) for cls, q in self._waiting.items() if q},
+            "kv_used": self._kv_used,
+            "kv_budget": self.kv_budget,
+            "max_batch": self.max_batch,
+            "avg_batch": round(self.stats["tokens"] / steps, 2) if steps else 0.0,
+        }
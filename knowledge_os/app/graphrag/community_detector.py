@@ -1,120 +1,272 @@
 import logging
 import asyncio
-from typing import List, Dict, Any
+import time
+from pathlib import Path
+from typing import List, Dict, Any, Tuple
+
 import numpy as np
 
+from .community_engine import CommunityEngine, CommunityHierarchy, build_adjacency, carry_over_ids, hub_nodes
+
 logger = logging.getLogger(__name__)
 
+_MIGRATION_PATH = Path(__file__).resolve().parents[2] / "db" / "migrations" / "add_knowledge_communities.sql"
+
+# Сколько самых связанных узлов сообщества попадает в его summary
+SUMMARY_HUBS = 3
+SUMMARY_SNIPPET_CHARS = 200
+
+
 class CommunityDetector:
     """
     Группирует узлы знаний в иерархические сообщества.
-    Использует упрощенный алгоритм Label Propagation для работы в реальном времени.
+
+    Граф связей — разреженная матрица (scipy CSR), алгоритм в духе Leiden
+    (community_engine): локальный перенос, уточнение по связности, агрегация уровней.
+    Между запусками состояние хранится в процессе: повторный запуск пересматривает
+    только узлы с изменёнными связями. Результаты пишутся пакетно через COPY,
+    summaries сообществ — в knowledge_communities (для graphrag_service).
     """
-    def __init__(self, db_url: str):
+    def __init__(self, db_url: str, min_strength: float = 0.2, resolution: float = 1.0):
         self.db_url = db_url
+        self.min_strength = min_strength
+        self.engine = CommunityEngine(resolution=resolution)
+        self._ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._level_ids: List[List[str]] = []  # level -> community index -> community_id
+        self._node_path: Dict[int, Tuple[str, ...]] = {}  # записанный путь узла по уровням
+        self._signatures: Dict[Tuple[int, str], str] = {}
+        self._lock = asyncio.Lock()
 
-    async def detect_communities(self, iterations: int = 10) -> Dict[str, List[str]]:
+    def _intern(self, node_id) -> int:
+        key = str(node_id)
+        idx = self._index.get(key)
+        if idx is None:
+            idx = len(self._ids)
+            self._ids.append(key)
+            self._index[key] = idx
+        return idx
+
+    async def detect_communities(self, incremental: bool = True) -> Dict[str, List[str]]:
         """
         [SINGULARITY 10.0+] Иерархическая детекция сообществ.
-        Использует улучшенный Label Propagation с учетом весов связей и иерархии.
+        Возвращает сообщества нижнего уровня: community_id -> [node_id].
         """
         import asyncpg
-        import uuid
-        try:
-            conn = await asyncpg.connect(self.db_url)
-            # 1. Загружаем все связи с весами
-            links = await conn.fetch("SELECT source_node_id, target_node_id, strength FROM knowledge_links WHERE strength > 0.2")
-            
-            # 2. Строим взвешенный граф смежности
-            adj = {}
-            nodes = set()
-            for l in links:
-                s, t = str(l['source_node_id']), str(l['target_node_id'])
-                w = float(l['strength'])
-                nodes.add(s)
-                nodes.add(t)
-                if s not in adj: adj[s] = []
-                if t not in adj: adj[t] = []
-                adj[s].append((t, w))
-                adj[t].append((s, w))
-
-            if not nodes:
-                await conn.close()
+        async with self._lock:
+            try:
+                conn = await asyncpg.connect(self.db_url)
+                try:
+                    return await self._detect(conn, incremental)
+                finally:
+                    await conn.close()
+            except Exception as e:
+                logger.error(f"Community detection failed: {e}")
                 return {}
 
-            # 3. Улучшенный Label Propagation (Weighted)
-            labels = {node: node for node in nodes}
-            for _ in range(iterations):
-                changed = False
-                # Перемешиваем узлы для более стабильной сходимости
-                node_list = list(nodes)
-                np.random.shuffle(node_list)
-                
-                for node in node_list:
-                    if node in adj:
-                        label_weights = {}
-                        for neighbor, weight in adj[node]:
-                            l = labels[neighbor]
-                            label_weights[l] = label_weights.get(l, 0) + weight
-                        
-                        if label_weights:
-                            new_label = max(label_weights, key=label_weights.get)
-                            if labels[node] != new_label:
-                                labels[node] = new_label
-                                changed = True
-                if not changed:
-                    break
-
-            # 4. Группируем по меткам (Уровень 1)
-            communities = {}
-            for node, label in labels.items():
-                if label not in communities: communities[label] = []
-                communities[label].append(node)
-
-            # 5. Иерархическая обработка: Группируем маленькие сообщества в более крупные (Уровень 2)
-            # Если сообщество слишком маленькое, пытаемся найти ему 'родителя'
-            hierarchical_map = {}
-            for comm_id, node_ids in communities.items():
-                if len(node_ids) < 5:
-                    # Ищем самое сильное внешнее соединение
-                    external_weights = {}
-                    for node in node_ids:
-                        for neighbor, weight in adj.get(node, []):
-                            neighbor_label = labels[neighbor]
-                            if neighbor_label != comm_id:
-                                external_weights[neighbor_label] = external_weights.get(neighbor_label, 0) + weight
-                    
-                    if external_weights:
-                        parent_comm = max(external_weights, key=external_weights.get)
-                        hierarchical_map[comm_id] = parent_comm
-                    else:
-                        hierarchical_map[comm_id] = comm_id
-                else:
-                    hierarchical_map[comm_id] = comm_id
-
-            # 6. Сохраняем community_id и parent_community_id в БД пакетно
-            async with conn.transaction():
-                for comm_id, node_ids in communities.items():
-                    parent_id = hierarchical_map[comm_id]
-                    # Конвертируем обратно в UUID для корректного ANY($2::uuid[])
-                    uuid_list = [uuid.UUID(nid) for nid in node_ids]
-                    await conn.execute("""
-                        UPDATE knowledge_nodes 
-                        SET metadata = metadata || jsonb_build_object(
-                            'community_id', $1::text,
-                            'parent_community_id', $2::text,
-                            'community_updated_at', NOW()
-                        )
-                        WHERE id = ANY($3::uuid[])
-                    """, comm_id, parent_id, uuid_list)
-
-            await conn.close()
-            logger.info(f"✅ Обнаружено {len(communities)} сообществ. Иерархия выстроена.")
-            return communities
+    async def _detect(self, conn, incremental: bool) -> Dict[str, List[str]]:
+        started = time.perf_counter()
+        await conn.execute(_MIGRATION_PATH.read_text(encoding="utf-8"))
 
-        except Exception as e:
-            logger.error(f"Community detection failed: {e}")
+        # 1. Связи -> симметричная разреженная матрица
+        links = await conn.fetch(
+            "SELECT source_node_id, target_node_id, strength FROM knowledge_links WHERE strength > $1",
+            self.min_strength,
+        )
+        if not links:
             return {}
+        src = np.fromiter((self._intern(r['source_node_id']) for r in links), dtype=np.int64, count=len(links))
+        dst = np.fromiter((self._intern(r['target_node_id']) for r in links), dtype=np.int64, count=len(links))
+        weights = np.fromiter((float(r['strength']) for r in links), dtype=np.float64, count=len(links))
+        adj = build_adjacency(len(self._ids), src, dst, weights)
+
+        # 2. Детекция: полная или только по окрестностям изменённых узлов
+        previous = self.engine.adj
+        if incremental and previous is not None and self.engine.hierarchy is not None:
+            changed = self._changed_nodes(previous, adj)
+            if not len(changed) and adj.shape == previous.shape:
+                logger.info("Сообщества: связи не изменились, пересчёт не нужен")
+                return self._communities(self.engine.hierarchy)
+            hierarchy = await asyncio.to_thread(self.engine.update, adj, changed)
+        else:
+            hierarchy = await asyncio.to_thread(self.engine.detect, adj)
+            self._node_path.clear()
+
+        # 3. Стабильные ID, summaries, пакетная запись
+        self._assign_ids(adj, hierarchy)
+        written = await self._write_nodes(conn, hierarchy)
+        summaries = await self._write_summaries(conn, adj, hierarchy)
+
+        communities = self._communities(hierarchy)
+        logger.info(
+            f"✅ Обнаружено {len(communities)} сообществ, уровней: {len(hierarchy.levels)}, "
+            f"modularity={hierarchy.modularity:.3f}; записано узлов: {written}, summaries: {summaries} "
+            f"за {time.perf_counter() - started:.1f} с"
+        )
+        return communities
+
+    @staticmethod
+    def _changed_nodes(previous, adj) -> np.ndarray:
+        """Узлы, у которых изменились связи или веса (разность разреженных матриц)."""
+        n = previous.shape[0]
+        diff = (adj[:n, :n] - previous).tocoo()
+        mask = np.abs(diff.data) > 1e-9
+        return np.unique(np.concatenate((diff.row[mask], diff.col[mask])))
+
+    def _assign_ids(self, adj, hierarchy: CommunityHierarchy) -> None:
+        level_ids = []
+        for level, membership in enumerate(hierarchy.levels):
+            old = [self._node_path.get(i, ())[level] if len(self._node_path.get(i, ())) > level else None
+                   for i in range(len(membership))]
+            hubs = hub_nodes(adj, membership)
+            fallback = [self._ids[hubs[c][0]] for c in range(int(membership.max()) + 1)]
+            level_ids.append(carry_over_ids(membership, old, fallback))
+        self._level_ids = level_ids
+
+    def _path(self, hierarchy: CommunityHierarchy, node: int) -> Tuple[str, ...]:
+        return tuple(self._level_ids[level][membership[node]] for level, membership in enumerate(hierarchy.levels))
+
+    def _communities(self, hierarchy: CommunityHierarchy) -> Dict[str, List[str]]:
+        communities: Dict[str, List[str]] = {}
+        ids = self._level_ids[0]
+        for node, community in enumerate(hierarchy.levels[0].tolist()):
+            communities.setdefault(ids[community], []).append(self._ids[node])
+        return communities
+
+    async def _write_nodes(self, conn, hierarchy: CommunityHierarchy) -> int:
+        """COPY изменившихся назначений во временную таблицу и один UPDATE ... FROM."""
+        records = []
+        for node in range(len(hierarchy.levels[0])):
+            path = self._path(hierarchy, node)
+            if self._node_path.get(node) != path:
+                parent = path[1] if len(path) > 1 else path[0]
+                records.append((self._ids[node], path[0], parent, list(path)))
+        if not records:
+            return 0
+        async with conn.transaction():
+            await conn.execute("""
+                CREATE TEMP TABLE community_assignments (
+                    node_id uuid, community_id text, parent_community_id text, community_path text[]
+                ) ON COMMIT DROP
+            """)
+            await conn.copy_records_to_table(
+                'community_assignments', records=records,
+                columns=['node_id', 'community_id', 'parent_community_id', 'community_path'],
+            )
+            await conn.execute("""
+                UPDATE knowledge_nodes kn
+                SET metadata = COALESCE(kn.metadata, '{}'::jsonb) || jsonb_build_object(
+                    'community_id', ca.community_id,
+                    'parent_community_id', ca.parent_community_id,
+                    'community_path', to_jsonb(ca.community_path),
+                    'community_updated_at', NOW()
+                )
+                FROM community_assignments ca
+                WHERE kn.id = ca.node_id
+            """)
+        for node_id, *_, path in records:
+            self._node_path[self._index[node_id]] = tuple(path)
+        return len(records)
+
+    async def _write_summaries(self, conn, adj, hierarchy: CommunityHierarchy) -> int:
+        """Summaries сообществ всех уровней; пересобираются только изменившиеся сообщества."""
+        nodes = np.arange(len(hierarchy.levels[0]), dtype=np.float64)
+        rows = []  # (level, community_id, parent, size, hubs, signature)
+        for level, membership in enumerate(hierarchy.levels):
+            ids = self._level_ids[level]
+            parents = hierarchy.parents(level)
+            parent_ids = self._level_ids[level + 1] if level + 1 < len(self._level_ids) else None
+            # Сигнатура состава: размер, сумма и сумма квадратов индексов участников
+            size = np.bincount(membership)
+            s1 = np.bincount(membership, weights=nodes)
+            s2 = np.bincount(membership, weights=nodes ** 2)
+            hubs = hub_nodes(adj, membership, top=SUMMARY_HUBS)
+            for community, community_id in enumerate(ids):
+                if size[community] < 2:
+                    continue  # одиночные узлы не образуют сообщества
+                signature = f"{size[community]}:{s1[community]:.0f}:{s2[community]:.0f}"
+                parent = parent_ids[parents[community]] if parent_ids is not None else None
+                rows.append((level, community_id, parent, int(size[community]),
+                             [self._ids[h] for h in hubs.get(community, [])], signature))
+
+        current = {(r[0], r[1]): r[5] for r in rows}
+        changed = [r for r in rows if self._signatures.get((r[0], r[1])) != r[5]]
+        hub_ids = sorted({h for r in changed for h in r[4]})
+        contents = {}
+        if hub_ids:
+            fetched = await conn.fetch(
+                "SELECT id, content FROM knowledge_nodes WHERE id = ANY($1::uuid[])", hub_ids
+            )
+            contents = {str(r['id']): (r['content'] or '') for r in fetched}
+
+        records = []
+        for level, community_id, parent, size, hubs, signature in changed:
+            snippets = [contents[h][:SUMMARY_SNIPPET_CHARS].replace("\n", " ") for h in hubs if contents.get(h)]
+            summary = f"{size} узлов: " + " | ".join(snippets)
+            records.append((level, community_id, parent, size, hubs, summary, signature))
+
+        async with conn.transaction():
+            await conn.execute("""
+                CREATE TEMP TABLE community_summaries (
+                    level integer, community_id text, parent_community_id text, size integer,
+                    hub_node_ids uuid[], summary text, signature text
+                ) ON COMMIT DROP
+            """)
+            if records:
+                await conn.copy_records_to_table('community_summaries', records=records)
+                await conn.execute("""
+                    INSERT INTO knowledge_communities
+                        (level, community_id, parent_community_id, size, hub_node_ids, summary, signature, updated_at)
+                    SELECT level, community_id, parent_community_id, size, hub_node_ids, summary, signature, NOW()
+                    FROM community_summaries
+                    ON CONFLICT (level, community_id) DO UPDATE SET
+                        parent_community_id = EXCLUDED.parent_community_id,
+                        size = EXCLUDED.size,
+                        hub_node_ids = EXCLUDED.hub_node_ids,
+                        summary = EXCLUDED.summary,
+                        signature = EXCLUDED.signature,
+                        updated_at = NOW()
+                """)
+            # Родитель мог смениться без смены состава — обновляем его отдельно
+            reparented = [(r[0], r[1], r[2]) for r in rows if self._signatures.get((r[0], r[1])) == r[5]]
+            if reparented:
+                await conn.executemany(
+                    "UPDATE knowledge_communities SET parent_community_id = $3 "
+                    "WHERE level = $1 AND community_id = $2 AND parent_community_id IS DISTINCT FROM $3",
+                    reparented,
+                )
+            # Исчезнувшие сообщества
+            await conn.execute(
+                "DELETE FROM knowledge_communities kc WHERE NOT EXISTS ("
+                " SELECT 1 FROM unnest($1::int[], $2::text[]) AS cur(level, community_id)"
+                " WHERE cur.level = kc.level AND cur.community_id = kc.community_id)",
+                [k[0] for k in current], [k[1] for k in current],
+            )
+        self._signatures = current
+        return len(records)
+
+    async def get_community_summaries(self, pool, node_ids: List[str], limit: int = 3) -> List[Dict[str, Any]]:
+        """Summaries сообществ, в которые входят node_ids (от крупных уровней к мелким)."""
+        if not node_ids:
+            return []
+        try:
+            async with pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    SELECT kc.level, kc.community_id, kc.size, kc.summary, COUNT(*) AS hits
+                    FROM knowledge_nodes kn
+                    CROSS JOIN LATERAL jsonb_array_elements_text(kn.metadata->'community_path')
+                        WITH ORDINALITY AS p(community_id, ord)
+                    JOIN knowledge_communities kc
+                        ON kc.level = p.ord - 1 AND kc.community_id = p.community_id
+                    WHERE kn.id = ANY($1::uuid[]) AND kc.size > 1
+                    GROUP BY kc.level, kc.community_id, kc.size, kc.summary
+                    ORDER BY hits DESC, kc.level DESC, kc.size DESC
+                    LIMIT $2
+                """, [str(n) for n in node_ids], limit)
+            return [dict(r) for r in rows]
+        except Exception as e:
+            logger.debug(f"Community summaries unavailable: {e}")
+            return []
 
 _detector = None
 def get_community_detector(db_url: str):
@@ -0,0 +1,261 @@
+"""
+Community Engine - детекция сообществ графа знаний на разреженной матрице.
+
+Алгоритм в духе Leiden поверх scipy.sparse CSR:
+1. быстрый локальный перенос узлов (очередь, прирост модулярности с resolution);
+2. уточнение: сообщество разбивается на связные компоненты (связность гарантирована);
+3. агрегация уточнённых сообществ в супер-узлы (Pᵀ·A·P) и повтор на следующем уровне.
+
+Уровни дают иерархию: уровень 0 — самые мелкие сообщества, каждый следующий
+объединяет сообщества предыдущего. Инкрементальное обновление пересматривает
+на уровне 0 только изменённые узлы и их соседей; старшие уровни пересчитываются
+по агрегированному графу (он на порядки меньше исходного).
+"""
+
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+logger = logging.getLogger(__name__)
+
+
+def build_adjacency(
+    n: int, src: np.ndarray, dst: np.ndarray, weights: np.ndarray
+) -> sparse.csr_matrix:
+    """Симметричная взвешенная матрица смежности n×n (дубли связей суммируются)."""
+    mask = src != dst
+    src, dst, weights = src[mask], dst[mask], weights[mask]
+    rows = np.concatenate((src, dst))
+    cols = np.concatenate((dst, src))
+    data = np.concatenate((weights, weights)).astype(np.float64)
+    adj = sparse.csr_matrix((data, (rows, cols)), shape=(n, n))
+    adj.sum_duplicates()
+    return adj
+
+
+def modularity(adj: sparse.csr_matrix, membership: np.ndarray, resolution: float = 1.0) -> float:
+    degrees = np.asarray(adj.sum(axis=1)).ravel()
+    m2 = degrees.sum()
+    if m2 == 0:
+        return 0.0
+    coo = adj.tocoo()
+    internal = coo.data[membership[coo.row] == membership[coo.col]].sum()
+    tot = np.bincount(membership, weights=degrees)
+    return float(internal / m2 - resolution * np.sum(tot ** 2) / m2 ** 2)
+
+
+def _relabel(membership: np.ndarray) -> np.ndarray:
+    _, dense = np.unique(membership, return_inverse=True)
+    return dense.astype(np.int64)
+
+
+def local_moving(
+    adj: sparse.csr_matrix,
+    membership: np.ndarray,
+    queue_nodes: Optional[Iterable[int]] = None,
+    resolution: float = 1.0,
+    max_moves: Optional[int] = None,
+) -> int:
+    """Быстрый локальный перенос (Leiden fast local move). Меняет membership на месте.
+
+    Узел переходит в соседнее сообщество с максимальным приростом модулярности
+    k_i,in − γ·Σtot·k_i / 2m. После переноса в очередь добавляются соседи узла
+    из других сообществ. Возвращает число переносов.
+    """
+    n = adj.shape[0]
+    indptr, indices, data = adj.indptr, adj.indices, adj.data
+    degrees = np.asarray(adj.sum(axis=1)).ravel()
+    m2 = degrees.sum()
+    if m2 == 0:
+        return 0
+    tot = np.bincount(membership, weights=degrees, minlength=n).astype(np.float64)
+    if len(tot) < n:
+        tot = np.concatenate((tot, np.zeros(n - len(tot))))
+    nodes = np.arange(n) if queue_nodes is None else np.fromiter(set(queue_nodes), dtype=np.int64)
+    queue = deque(nodes.tolist())
+    in_queue = np.zeros(n, dtype=bool)
+    in_queue[nodes] = True
+    max_moves = max_moves if max_moves is not None else 50 * n
+    moves = 0
+
+    while queue and moves < max_moves:
+        i = queue.popleft()
+        in_queue[i] = False
+        lo, hi = indptr[i], indptr[i + 1]
+        if lo == hi:
+            continue
+        not_self = indices[lo:hi] != i  # петля супер-узла не влияет на выбор сообщества
+        neighbors = indices[lo:hi][not_self]
+        weights = data[lo:hi][not_self]
+        if not len(neighbors):
+            continue
+        current = membership[i]
+        k_i = degrees[i]
+        tot[current] -= k_i
+
+        communities, inverse = np.unique(membership[neighbors], return_inverse=True)
+        w_to = np.bincount(inverse, weights=weights)
+        gains = w_to - resolution * tot[communities] * k_i / m2
+        pos = np.searchsorted(communities, current)
+        stay = gains[pos] if pos < len(communities) and communities[pos] == current else (
+            -resolution * tot[current] * k_i / m2)
+        best = int(np.argmax(gains))
+        target = communities[best] if gains[best] > stay + 1e-12 else current
+
+        tot[target] += k_i
+        if target != current:
+            membership[i] = target
+            moves += 1
+            for j in neighbors[(membership[neighbors] != target) & ~in_queue[neighbors]].tolist():
+                in_queue[j] = True
+                queue.append(j)
+    return moves
+
+
+def refine_connected(adj: sparse.csr_matrix, membership: np.ndarray) -> np.ndarray:
+    """Разбивает каждое сообщество на связные компоненты (гарантия Leiden)."""
+    coo = adj.tocoo()
+    mask = membership[coo.row] == membership[coo.col]
+    intra = sparse.csr_matrix((coo.data[mask], (coo.row[mask], coo.col[mask])), shape=adj.shape)
+    _, components = connected_components(intra, directed=False)
+    return components.astype(np.int64)
+
+
+def aggregate(adj: sparse.csr_matrix, membership: np.ndarray) -> sparse.csr_matrix:
+    """Граф сообществ Pᵀ·A·P (внутренние веса — на диагонали)."""
+    n, c = adj.shape[0], int(membership.max()) + 1
+    p = sparse.csr_matrix((np.ones(n), (np.arange(n), membership)), shape=(n, c))
+    return (p.T @ adj @ p).tocsr()
+
+
+@dataclass
+class CommunityHierarchy:
+    """Результат детекции: membership узлов на каждом уровне (0 — самый мелкий)."""
+    levels: List[np.ndarray] = field(default_factory=list)
+    modularity: float = 0.0
+
+    def parents(self, level: int) -> Dict[int, int]:
+        """Сообщество уровня level -> сообщество уровня level + 1."""
+        if level + 1 >= len(self.levels):
+            return {}
+        pairs = np.unique(np.stack((self.levels[level], self.levels[level + 1]), axis=1), axis=0)
+        return {int(child): int(parent) for child, parent in pairs}
+
+
+class CommunityEngine:
+    """Иерархическая детекция сообществ с инкрементальным обновлением."""
+
+    def __init__(self, resolution: float = 1.0, max_levels: int = 4):
+        self.resolution = resolution
+        self.max_levels = max_levels
+        self.adj: Optional[sparse.csr_matrix] = None
+        self.hierarchy: Optional[CommunityHierarchy] = None
+
+    def _coarsen(self, adj: sparse.csr_matrix, base: np.ndarray) -> CommunityHierarchy:
+        """Уровни выше base: агрегация и локальный перенос на графах сообществ."""
+        levels = [base]
+        current_adj = aggregate(adj, base)
+        mapping = base
+        for _ in range(self.max_levels - 1):
+            n = current_adj.shape[0]
+            membership = np.arange(n, dtype=np.int64)
+            if local_moving(current_adj, membership, resolution=self.resolution) == 0:
+                break
+            membership = _relabel(refine_connected(current_adj, _relabel(membership)))
+            if membership.max() + 1 >= n:
+                break
+            mapping = membership[mapping]
+            levels.append(mapping)
+            current_adj = aggregate(current_adj, membership)
+        top = levels[-1]
+        return CommunityHierarchy(levels=levels, modularity=modularity(adj, top, self.resolution))
+
+    def _base_level(self, adj: sparse.csr_matrix, membership: np.ndarray,
+                    queue_nodes: Optional[Iterable[int]] = None) -> np.ndarray:
+        local_moving(adj, membership, queue_nodes, resolution=self.resolution)
+        return _relabel(refine_connected(adj, _relabel(membership)))
+
+    def detect(self, adj: sparse.csr_matrix) -> CommunityHierarchy:
+        """Полная детекция с нуля."""
+        n = adj.shape[0]
+        base = self._base_level(adj, np.arange(n, dtype=np.int64))
+        self.adj, self.hierarchy = adj, self._coarsen(adj, base)
+        return self.hierarchy
+
+    def update(self, adj: sparse.csr_matrix, changed_nodes: Iterable[int]) -> CommunityHierarchy:
+        """Инкрементальное обновление после изменения связей changed_nodes.
+
+        Новые узлы (индексы ≥ прежнего размера) стартуют отдельными сообществами.
+        На уровне 0 пересматриваются только изменённые узлы и их соседи.
+        """
+        if self.hierarchy is None or self.adj is None:
+            return self.detect(adj)
+        n, previous = adj.shape[0], self.hierarchy.levels[0]
+        membership = np.empty(n, dtype=np.int64)
+        keep = min(n, len(previous))
+        membership[:keep] = previous[:keep]
+        membership[keep:] = np.arange(n - keep) + (int(previous.max()) + 1 if len(previous) else 0)
+
+        changed = set(int(i) for i in changed_nodes if 0 <= int(i) < n)
+        changed.update(range(keep, n))
+        affected = set(changed)
+        for i in changed:
+            affected.update(adj.indices[adj.indptr[i]:adj.indptr[i + 1]].tolist())
+        # Сообщества, потерявшие связи, могли распасться — уточнение по связности ниже
+        base = self._base_level(adj, membership, affected)
+        self.adj, self.hierarchy = adj, self._coarsen(adj, base)
+        return self.hierarchy
+
+
+def carry_over_ids(
+    new_membership: np.ndarray,
+    old_ids: Sequence[Optional[str]],
+    fallback_ids: Sequence[str],
+) -> List[str]:
+    """Стабильные ID сообществ между запусками.
+
+    Новое сообщество наследует ID старого, с которым у него наибольшее пересечение
+    (каждый старый ID достаётся одному сообществу). Иначе — fallback_ids[community];
+    если этот ID уже занят (например, hub-узел раньше дал ID другому сообществу),
+    к нему добавляется суффикс «#k» — ID внутри уровня остаются уникальными.
+    """
+    count = int(new_membership.max()) + 1 if len(new_membership) else 0
+    overlaps: Dict[Tuple[int, str], int] = {}
+    for community, old in zip(new_membership.tolist(), old_ids):
+        if old is not None:
+            overlaps[(community, old)] = overlaps.get((community, old), 0) + 1
+    ids: List[Optional[str]] = [None] * count
+    taken: Set[str] = set()
+    for (community, old), _ in sorted(overlaps.items(), key=lambda kv: -kv[1]):
+        if ids[community] is None and old not in taken:
+            ids[community] = old
+            taken.add(old)
+    for c in range(count):
+        if ids[c] is None:
+            candidate, k = fallback_ids[c], 1
+            while candidate in taken:
+                candidate = f"{fallback_ids[c]}#{k}"
+                k += 1
+            ids[c] = candidate
+            taken.add(candidate)
+    return ids
+
+
+def hub_nodes(adj: sparse.csr_matrix, membership: np.ndarray, top: int = 1) -> Dict[int, List[int]]:
+    """Самые связанные внутри своего сообщества узлы (по внутреннему взвешенному degree)."""
+    coo = adj.tocoo()
+    mask = membership[coo.row] == membership[coo.col]
+    internal = np.bincount(coo.row[mask], weights=coo.data[mask], minlength=adj.shape[0])
+    order = np.lexsort((-internal, membership))
+    result: Dict[int, List[int]] = {}
+    for node in order.tolist():
+        bucket = result.setdefault(int(membership[node]), [])
+        if len(bucket) < top:
+            bucket.append(node)
+    return result
+
@@ -0,0 +1,462 @@
+"""
+Graph Store - граф знаний в памяти для multi-hop GraphRAG.
+
+knowledge_links загружаются один раз в CSR-смежность (NumPy, UUID узлов интернируются
+в int), эмбеддинги узлов — в параллельную float32-матрицу с нормированными строками
+(similarity = скалярное произведение). Изменения связей приходят по NOTIFY
+knowledge_links_changed (миграция add_knowledge_links_notify.sql) и применяются
+через оверлей, который сливается в CSR при накоплении. Best-first обход с
+query-aware scoring выполняется целиком в памяти, без рекурсивных CTE.
+"""
+
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LINKS_CHANNEL = "knowledge_links_changed"
+# Связи глубже первого шага проходятся только при strength > HOP_MIN_STRENGTH (как в CTE)
+HOP_MIN_STRENGTH = 0.5
+RELOAD_SECONDS = float(os.getenv("GRAPH_STORE_RELOAD_SECONDS", "900"))
+
+_MIGRATION_PATH = Path(__file__).resolve().parents[2] / "db" / "migrations" / "add_knowledge_links_notify.sql"
+
+LOAD_LINKS_SQL = "SELECT source_node_id, target_node_id, link_type, strength FROM knowledge_links"
+LOAD_EMBEDDINGS_SQL = """
+SELECT id, embedding::real[] AS embedding
+FROM knowledge_nodes
+WHERE id = ANY($1::uuid[]) AND embedding IS NOT NULL
+"""
+
+
+def path_score(strength, similarity, hop_count):
+    """Query-aware score шага: сила связи, близость узла к запросу, штраф за глубину."""
+    return strength * 0.4 + similarity * 0.5 - hop_count * 0.1
+
+
+class CSRGraph:
+    """Ориентированный граф связей в формате CSR с оверлеем инкрементальных изменений."""
+
+    def __init__(self, compact_ratio: float = 0.05, min_compact: int = 1024):
+        self.compact_ratio = compact_ratio
+        self.min_compact = min_compact
+        self._ids: List[str] = []
+        self._index: Dict[str, int] = {}
+        self._type_names: List[str] = []
+        self._type_index: Dict[str, int] = {}
+        # CSR: связи узла i — indices[indptr[i]:indptr[i + 1]]
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int32)
+        self.strengths = np.zeros(0, dtype=np.float32)
+        self.types = np.zeros(0, dtype=np.int16)
+        # Эмбеддинги: строка i — узел i (ёмкость растёт удвоением); нулевая строка — эмбеддинга нет.
+        # resolved — эмбеддинг узла уже запрошен из БД
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.resolved = np.zeros(0, dtype=bool)
+        # Оверлей: добавленные/обновлённые и удалённые связи поверх CSR
+        self._added: Dict[int, Dict[Tuple[int, int], float]] = {}
+        self._removed: Set[Tuple[int, int, int]] = set()
+        self._removed_sources: Dict[int, int] = {}
+        self._added_count = 0
+
+    # --- интернирование ---
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, node_id) -> bool:
+        return str(node_id) in self._index
+
+    def node_id(self, idx: int) -> str:
+        return self._ids[idx]
+
+    def index_of(self, node_id) -> Optional[int]:
+        return self._index.get(str(node_id))
+
+    def intern(self, node_id) -> int:
+        key = str(node_id)
+        idx = self._index.get(key)
+        if idx is None:
+            idx = len(self._ids)
+            self._ids.append(key)
+            self._index[key] = idx
+            self._ensure_capacity(idx + 1)
+        return idx
+
+    def _intern_type(self, link_type: str) -> int:
+        idx = self._type_index.get(link_type)
+        if idx is None:
+            idx = len(self._type_names)
+            self._type_names.append(link_type)
+            self._type_index[link_type] = idx
+        return idx
+
+    def _ensure_capacity(self, size: int) -> None:
+        capacity = len(self.resolved)
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2, 64)
+        embeddings = np.zeros((new_capacity, self.embeddings.shape[1]), dtype=np.float32)
+        embeddings[:capacity] = self.embeddings
+        resolved = np.zeros(new_capacity, dtype=bool)
+        resolved[:capacity] = self.resolved
+        self.embeddings, self.resolved = embeddings, resolved
+
+    # --- эмбеддинги ---
+
+    def set_embeddings(self, node_ids: Sequence[Any], vectors: Sequence[Sequence[float]]) -> None:
+        """Записывает эмбеддинги узлов (строки нормируются)."""
+        if not node_ids:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            return
+        if self.embeddings.shape[1] == 0:
+            self.embeddings = np.zeros((len(self.resolved), matrix.shape[1]), dtype=np.float32)
+        elif matrix.shape[1] != self.embeddings.shape[1]:
+            logger.warning("Graph store: размерность эмбеддингов %d != %d, пропуск",
+                           matrix.shape[1], self.embeddings.shape[1])
+            return
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms > 0, norms, 1.0)
+        rows = np.fromiter((self.intern(n) for n in node_ids), dtype=np.int64, count=len(node_ids))
+        self.embeddings[rows] = matrix
+        self.resolved[rows] = True
+
+    def mark_resolved(self, node_ids: Iterable[Any]) -> None:
+        for node_id in node_ids:
+            self.resolved[self.intern(node_id)] = True
+
+    def missing_embeddings(self) -> List[str]:
+        n = len(self._ids)
+        return [self._ids[i] for i in np.flatnonzero(~self.resolved[:n])]
+
+    def similarities(self, rows: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity узлов rows к нормированному запросу (0 для узлов без эмбеддинга)."""
+        if self.embeddings.shape[1] != len(query):
+            return np.zeros(len(rows), dtype=np.float32)
+        return self.embeddings[rows] @ query
+
+    # --- связи ---
+
+    def build(self, links: Iterable[Tuple[Any, Any, str, float]]) -> "CSRGraph":
+        """Полная постройка CSR из (source, target, link_type, strength)."""
+        src, dst, strengths, types = [], [], [], []
+        for source, target, link_type, strength in links:
+            src.append(self.intern(source))
+            dst.append(self.intern(target))
+            types.append(self._intern_type(link_type))
+            strengths.append(1.0 if strength is None else float(strength))
+        self._reset_overlay()
+        self._set_csr(
+            np.asarray(src, dtype=np.int32),
+            np.asarray(dst, dtype=np.int32),
+            np.asarray(strengths, dtype=np.float32),
+            np.asarray(types, dtype=np.int16),
+        )
+        return self
+
+    def _set_csr(self, src: np.ndarray, dst: np.ndarray, strengths: np.ndarray, types: np.ndarray) -> None:
+        order = np.argsort(src, kind="stable")
+        counts = np.bincount(src, minlength=len(self._ids)) if len(src) else np.zeros(len(self._ids), dtype=np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+        self.indices = dst[order]
+        self.strengths = strengths[order]
+        self.types = types[order]
+
+    def _reset_overlay(self) -> None:
+        self._added.clear()
+        self._removed.clear()
+        self._removed_sources.clear()
+        self._added_count = 0
+
+    @property
+    def overlay_size(self) -> int:
+        return self._added_count + len(self._removed)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices) - len(self._removed) + self._added_count
+
+    def upsert_link(self, source, target, link_type: str, strength: float) -> None:
+        s, t, k = self.intern(source), self.intern(target), self._intern_type(link_type)
+        self._mark_removed(s, t, k)  # старое значение в CSR (если было) перекрывается оверлеем
+        added = self._added.setdefault(s, {})
+        if (t, k) not in added:
+            self._added_count += 1
+        added[(t, k)] = 1.0 if strength is None else float(strength)
+        self._maybe_compact()
+
+    def remove_link(self, source, target, link_type: str) -> None:
+        s, t = self.index_of(source), self.index_of(target)
+        k = self._type_index.get(link_type)
+        if s is None or t is None or k is None:
+            return
+        added = self._added.get(s)
+        if added is not None and added.pop((t, k), None) is not None:
+            self._added_count -= 1
+            if not added:
+                del self._added[s]
+        self._mark_removed(s, t, k)
+        self._maybe_compact()
+
+    def _mark_removed(self, s: int, t: int, k: int) -> None:
+        if s >= len(self.indptr) - 1 or (s, t, k) in self._removed:
+            return
+        lo, hi = self.indptr[s], self.indptr[s + 1]
+        if np.any((self.indices[lo:hi] == t) & (self.types[lo:hi] == k)):
+            self._removed.add((s, t, k))
+            self._removed_sources[s] = self._removed_sources.get(s, 0) + 1
+
+    def _maybe_compact(self) -> None:
+        if self.overlay_size > max(self.min_compact, self.compact_ratio * len(self.indices)):
+            self.compact()
+
+    def compact(self) -> None:
+        """Сливает оверлей в CSR."""
+        if not self._added and not self._removed:
+            return
+        self._set_csr(*self._edge_arrays())
+        self._reset_overlay()
+
+    def _edge_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        n_csr = len(self.indptr) - 1
+        src = np.repeat(np.arange(n_csr, dtype=np.int32), np.diff(self.indptr))
+        keep = np.ones(len(self.indices), dtype=bool)
+        for s, t, k in self._removed:
+            lo, hi = self.indptr[s], self.indptr[s + 1]
+            keep[lo:hi] &= ~((self.indices[lo:hi] == t) & (self.types[lo:hi] == k))
+        extra = [(s, t, k, w) for s, added in self._added.items() for (t, k), w in added.items()]
+        return (
+            np.concatenate((src[keep], np.asarray([e[0] for e in extra], dtype=np.int32))),
+            np.concatenate((self.indices[keep], np.asarray([e[1] for e in extra], dtype=np.int32))),
+            np.concatenate((self.strengths[keep], np.asarray([e[3] for e in extra], dtype=np.float32))),
+            np.concatenate((self.types[keep], np.asarray([e[2] for e in extra], dtype=np.int16))),
+        )
+
+    def neighbors(self, node: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Исходящие связи узла: (targets, strengths, link_type ids) с учётом оверлея."""
+        if node < len(self.indptr) - 1:
+            lo, hi = self.indptr[node], self.indptr[node + 1]
+            targets, strengths, types = self.indices[lo:hi], self.strengths[lo:hi], self.types[lo:hi]
+            if self._removed_sources.get(node):
+                keep = np.fromiter(
+                    ((node, int(t), int(k)) not in self._removed for t, k in zip(targets, types)),
+                    dtype=bool, count=len(targets),
+                )
+                targets, strengths, types = targets[keep], strengths[keep], types[keep]
+        else:
+            targets = np.zeros(0, dtype=np.int32)
+            strengths = np.zeros(0, dtype=np.float32)
+            types = np.zeros(0, dtype=np.int16)
+        added = self._added.get(node)
+        if added:
+            targets = np.concatenate((targets, np.fromiter((t for t, _ in added), dtype=np.int32)))
+            types = np.concatenate((types, np.fromiter((k for _, k in added), dtype=np.int16)))
+            strengths = np.concatenate((strengths, np.fromiter(added.values(), dtype=np.float32)))
+        return targets, strengths, types
+
+    def link_type_name(self, type_id: int) -> str:
+        return self._type_names[type_id]
+
+    # --- обход ---
+
+    def expand(
+        self,
+        seeds: Sequence[Tuple[Any, int]],
+        query: np.ndarray,
+        min_strength: float = HOP_MIN_STRENGTH,
+        max_results: int = 60,
+        max_expansions: int = 256,
+    ) -> List[Dict[str, Any]]:
+        """Best-first multi-hop обход от seed-узлов.
+
+        seeds — пары (node_id, глубина обхода от этого seed). Узлы раскрываются в порядке
+        убывания path score; для каждого достигнутого узла остаётся лучший путь.
+        Первый шаг от seed проходит по любой связи, последующие — только при
+        strength > min_strength (семантика прежнего рекурсивного CTE).
+        """
+        query = np.asarray(query, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm > 0:
+            query = query / norm
+        heap: List[Tuple[float, int, int, int]] = []
+        for node_id, depth in seeds:
+            idx = self.index_of(node_id)
+            if idx is not None and depth > 0:
+                # Seeds раскрываются первыми; глубина — оставшийся бюджет шагов
+                heapq.heappush(heap, (-float("inf"), idx, 0, depth))
+
+        best: Dict[int, Tuple[float, int, int, int]] = {}  # node -> (score, hop, source, type)
+        expanded: Dict[int, int] = {}  # node -> оставшийся бюджет при раскрытии
+        expansions = 0
+        while heap and expansions < max_expansions:
+            _, node, hop, budget = heapq.heappop(heap)
+            remaining = budget - hop
+            if remaining <= 0 or expanded.get(node, 0) >= remaining:
+                continue
+            expanded[node] = remaining
+            expansions += 1
+            targets, strengths, types = self.neighbors(node)
+            if hop >= 1:
+                mask = strengths > min_strength
+                targets, strengths, types = targets[mask], strengths[mask], types[mask]
+            if not len(targets):
+                continue
+            next_hop = hop + 1
+            scores = path_score(strengths, self.similarities(targets, query), next_hop)
+            for target, score, type_id in zip(targets.tolist(), scores.tolist(), types.tolist()):
+                current = best.get(target)
+                if current is None or score > current[0]:
+                    best[target] = (score, next_hop, node, type_id)
+                if next_hop < budget:
+                    heapq.heappush(heap, (-score, target, next_hop, budget))
+
+        ranked = heapq.nlargest(max_results, best.items(), key=lambda kv: kv[1][0])
+        return [
+            {
+                "id": self._ids[node],
+                "similarity": score,
+                "is_hop": True,
+                "hop_count": hop,
+                "hop_source": self._ids[source],
+                "link_type": self._type_names[type_id],
+            }
+            for node, (score, hop, source, type_id) in ranked
+        ]
+
+
+class KnowledgeGraphStore:
+    """CSR-граф knowledge_links процесса, синхронизируемый с БД через LISTEN/NOTIFY."""
+
+    def __init__(self, db_url: str, reload_seconds: float = RELOAD_SECONDS):
+        self.db_url = db_url
+        self.reload_seconds = reload_seconds
+        self.graph: Optional[CSRGraph] = None
+        self.loaded_at = 0.0
+        self._load_lock = asyncio.Lock()
+        self._listen_conn = None
+        self._buffer: Optional[List[Dict[str, Any]]] = None  # уведомления во время загрузки
+        self.stats = {"loads": 0, "upserts": 0, "deletes": 0, "embedding_fetches": 0}
+
+    @property
+    def ready(self) -> bool:
+        return self.graph is not None
+
+    async def ensure_schema(self, conn) -> None:
+        """Ставит триггер уведомлений, если его ещё нет (идемпотентно)."""
+        exists = await conn.fetchval(
+            "SELECT 1 FROM pg_trigger WHERE tgname = 'knowledge_links_notify_changed'"
+        )
+        if not exists:
+            await conn.execute(_MIGRATION_PATH.read_text(encoding="utf-8"))
+            logger.info("Graph store: триггер %s установлен", LINKS_CHANNEL)
+
+    async def ensure_ready(self, pool) -> Optional[CSRGraph]:
+        """Граф, загруженный при первом обращении и перезагружаемый раз в reload_seconds."""
+        stale = time.monotonic() - self.loaded_at > self.reload_seconds
+        if self.graph is None or stale or self._listen_conn is None or self._listen_conn.is_closed():
+            async with self._load_lock:
+                listening = self._listen_conn is not None and not self._listen_conn.is_closed()
+                if self.graph is None or not listening or time.monotonic() - self.loaded_at > self.reload_seconds:
+                    await self.load(pool)
+        elif len(self.graph.missing_embeddings()):
+            await self.sync_embeddings(pool)
+        return self.graph
+
+    async def load(self, pool) -> None:
+        """Полная загрузка: LISTEN поднимается до чтения, изменения за время чтения доигрываются."""
+        started = time.perf_counter()
+        self._buffer = []
+        try:
+            await self._listen()
+            async with pool.acquire() as conn:
+                try:
+                    await self.ensure_schema(conn)
+                except Exception as e:
+                    logger.debug("Graph store: триггер не установлен: %s", e)
+                links = await conn.fetch(LOAD_LINKS_SQL)
+                graph = CSRGraph().build(
+                    (r["source_node_id"], r["target_node_id"], r["link_type"], r["strength"]) for r in links
+                )
+                await self._fetch_embeddings(conn, graph, graph.missing_embeddings())
+            for change in self._buffer:
+                self._apply(graph, change)
+            graph.compact()
+            self.graph = graph
+            self.loaded_at = time.monotonic()
+            self.stats["loads"] += 1
+            logger.info("🕸️ Graph store: %d узлов, %d связей за %.0f мс",
+                        len(graph), graph.edge_count, (time.perf_counter() - started) * 1000)
+        finally:
+            self._buffer = None
+
+    async def sync_embeddings(self, pool) -> None:
+        """Догружает эмбеддинги узлов, появившихся из уведомлений."""
+        graph = self.graph
+        missing = graph.missing_embeddings() if graph else []
+        if not missing:
+            return
+        async with pool.acquire() as conn:
+            await self._fetch_embeddings(conn, graph, missing)
+
+    async def _fetch_embeddings(self, conn, graph: CSRGraph, node_ids: List[str]) -> None:
+        if not node_ids:
+            return
+        rows = await conn.fetch(LOAD_EMBEDDINGS_SQL, node_ids)
+        self.stats["embedding_fetches"] += 1
+        graph.set_embeddings([r["id"] for r in rows], [r["embedding"] for r in rows])
+        graph.mark_resolved(node_ids)  # узлы без эмбеддинга в БД повторно не запрашиваются
+
+    async def _listen(self) -> None:
+        if self._listen_conn is not None and not self._listen_conn.is_closed():
+            return
+        import asyncpg
+        self._listen_conn = await asyncpg.connect(self.db_url)
+        await self._listen_conn.add_listener(LINKS_CHANNEL, self._on_notify)
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        try:
+            change = json.loads(payload)
+        except (TypeError, ValueError):
+            return
+        if self._buffer is not None:
+            self._buffer.append(change)
+        if self.graph is not None:
+            self._apply(self.graph, change)
+
+    def _apply(self, graph: CSRGraph, change: Dict[str, Any]) -> None:
+        source, target, link_type = change.get("source"), change.get("target"), change.get("link_type")
+        if not source or not target or not link_type:
+            return
+        if change.get("op") == "delete":
+            graph.remove_link(source, target, link_type)
+            self.stats["deletes"] += 1
+        else:
+            graph.upsert_link(source, target, link_type, change.get("strength"))
+            self.stats["upserts"] += 1
+
+    async def close(self) -> None:
+        if self._listen_conn is not None and not self._listen_conn.is_closed():
+            try:
+                await self._listen_conn.remove_listener(LINKS_CHANNEL, self._on_notify)
+            finally:
+                await self._listen_conn.close()
+        self._listen_conn = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        graph = self.graph
+        return {
+            **self.stats,
+            "nodes": len(graph) if graph else 0,
+            "edges": graph.edge_count if graph else 0,
+            "overlay": graph.overlay_size if graph else 0,
+        }
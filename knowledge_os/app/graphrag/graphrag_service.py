@@ -54,6 +54,15 @@ class GraphRAGService:
                 for n in hop_nodes[:5]:
                     context += f"- [Связь через {n.get('hop_source', '...')[:8]}]: {n['content'][:600]}\n"
 
+            # Сообщества найденных узлов: обзор темы шире отдельных фактов
+            communities = await self.detector.get_community_summaries(
+                await self.retriever.get_pool(), [n['id'] for n in nodes], limit=3
+            )
+            if communities:
+                context += "\n--- СООБЩЕСТВА ЗНАНИЙ (Community Summaries) ---\n"
+                for c in communities:
+                    context += f"- [Уровень {c['level']}] {c['summary'][:700]}\n"
+
             # 3. Извлечение сущностей из запроса для подсветки (опционально)
             entities = await self.extractor.extract_entities(query)
             if entities:
@@ -1,106 +1,168 @@
 import logging
 import asyncio
+import os
 from typing import List, Dict, Any, Optional
-import json
+
+from .graph_store import HOP_MIN_STRENGTH, KnowledgeGraphStore, path_score
 
 logger = logging.getLogger(__name__)
 
+# in-memory обход графа (graph_store); false — прежний путь через рекурсивные CTE
+GRAPH_STORE_ENABLED = os.getenv("GRAPHRAG_IN_MEMORY", "true").lower() == "true"
+# Сколько лучших seed-узлов обходится на полную глубину (остальные — на 1 шаг)
+DEEP_SEEDS = 2
+
+SEED_SQL = """
+    SELECT id, content, confidence_score, domain_id,
+           (1 - (embedding <=> $1::vector)) as similarity
+    FROM knowledge_nodes
+    WHERE embedding IS NOT NULL
+    ORDER BY embedding <=> $1::vector
+    LIMIT $2
+"""
+
+HOP_CONTENT_SQL = "SELECT id, content, domain_id FROM knowledge_nodes WHERE id = ANY($1::uuid[])"
+
+HOPS_CTE_SQL = """
+    WITH RECURSIVE graph_path AS (
+        SELECT source_node_id, target_node_id, link_type, strength, 1 as hop_count
+        FROM knowledge_links
+        WHERE source_node_id = ANY($1::uuid[])
+
+        UNION ALL
+
+        SELECT l.source_node_id, l.target_node_id, l.link_type, l.strength, gp.hop_count + 1
+        FROM knowledge_links l
+        INNER JOIN graph_path gp ON l.source_node_id = gp.target_node_id
+        WHERE gp.hop_count < $2 AND l.strength > 0.5
+    )
+    SELECT gp.*, kn.content, kn.domain_id,
+           (1 - (kn.embedding <=> $3::vector)) as node_similarity
+    FROM graph_path gp
+    JOIN knowledge_nodes kn ON gp.target_node_id = kn.id
+    ORDER BY gp.strength DESC, gp.hop_count ASC
+    LIMIT 30
+"""
+
+
 class MultiHopRetriever:
     """
     Реализует многошаговый поиск по графу знаний (Multi-Hop Reasoning).
     Находит не только похожие узлы, но и логически связанные цепочки.
+
+    Seed-узлы ищутся в БД (HNSW), обход связей — в памяти по CSR-графу
+    (graph_store), который синхронизируется с knowledge_links через LISTEN/NOTIFY.
     """
-    def __init__(self, db_url: str):
+    def __init__(self, db_url: str, use_graph_store: bool = GRAPH_STORE_ENABLED):
         self.db_url = db_url
+        self.use_graph_store = use_graph_store
+        self.graph_store = KnowledgeGraphStore(db_url)
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+    async def get_pool(self):
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    import asyncpg
+                    self._pool = await asyncpg.create_pool(self.db_url, min_size=1, max_size=4)
+        return self._pool
 
     async def retrieve_with_hops(self, query_embedding: List[float], max_hops: int = 2, limit: int = 5) -> List[Dict[str, Any]]:
         """
-        [SINGULARITY 10.0+] Параллельный многошаговый поиск.
+        [SINGULARITY 10.0+] Многошаговый поиск.
         1. Находит 'seed' узлы через векторный поиск.
-        2. Параллельно обходит связи (hops) и оценивает их релевантность запросу.
+        2. Обходит связи (hops) best-first и оценивает их релевантность запросу.
         """
-        import asyncpg
+        if not self.use_graph_store:
+            return await self.retrieve_with_hops_cte(query_embedding, max_hops, limit)
         try:
-            conn = await asyncpg.connect(self.db_url)
-            
-            # Шаг 1: Seed nodes (векторный поиск)
-            seeds = await conn.fetch("""
-                SELECT id, content, confidence_score, domain_id,
-                       (1 - (embedding <=> $1::vector)) as similarity
-                FROM knowledge_nodes
-                WHERE embedding IS NOT NULL
-                ORDER BY embedding <=> $1::vector
-                LIMIT $2
-            """, query_embedding, limit)
+            pool = await self.get_pool()
+            graph = await self.graph_store.ensure_ready(pool)
+            async with pool.acquire() as conn:
+                # Шаг 1: Seed nodes (векторный поиск)
+                seeds = await conn.fetch(SEED_SQL, query_embedding, limit)
+                if not seeds:
+                    return []
+                all_results = {str(s['id']): dict(s) for s in seeds}
+
+                # Шаг 2: обход в памяти. Самые релевантные семена — глубже, остальные — 1 шаг
+                seed_depths = [
+                    (s['id'], max_hops if i < DEEP_SEEDS else min(max_hops, 1))
+                    for i, s in enumerate(seeds)
+                ]
+                hops = graph.expand(seed_depths, query_embedding, min_strength=HOP_MIN_STRENGTH,
+                                    max_results=limit * 2)
+                hops = [h for h in hops if h['similarity'] > all_results.get(h['id'], {}).get('similarity', 0)]
+                if hops:
+                    rows = await conn.fetch(HOP_CONTENT_SQL, [h['id'] for h in hops])
+                    contents = {str(r['id']): r['content'] for r in rows}
+                    for h in hops:
+                        if h['id'] in contents:
+                            all_results[h['id']] = {**h, "content": contents[h['id']]}
+
+            # Шаг 3: сортируем по итоговому score
+            sorted_results = sorted(all_results.values(), key=lambda x: x['similarity'], reverse=True)
+            return sorted_results[:limit * 2]
+
+        except Exception as e:
+            logger.error(f"Multi-hop retrieval failed: {e}")
+            return []
 
+    async def retrieve_with_hops_cte(self, query_embedding: List[float], max_hops: int = 2, limit: int = 5) -> List[Dict[str, Any]]:
+        """Прежний путь: обход рекурсивными CTE в PostgreSQL (fallback и база для бенчмарка)."""
+        try:
+            pool = await self.get_pool()
+            async with pool.acquire() as conn:
+                seeds = await conn.fetch(SEED_SQL, query_embedding, limit)
             if not seeds:
-                await conn.close()
                 return []
 
             seed_ids = [s['id'] for s in seeds]
             all_results = {str(s['id']): dict(s) for s in seeds}
 
-            # Шаг 2: Параллельный обход и Query-Aware Scoring
-            # Мы используем asyncio.gather для параллельного выполнения запросов по разным путям или типам связей
-            # В данном случае оптимизируем через разделение на 'сильные' и 'семантические' пути
-            
+            # Один запрос на соединение: asyncpg не выполняет запросы параллельно на одном соединении
             async def fetch_hops(ids, depth):
-                return await conn.fetch("""
-                    WITH RECURSIVE graph_path AS (
-                        SELECT source_node_id, target_node_id, link_type, strength, 1 as hop_count
-                        FROM knowledge_links
-                        WHERE source_node_id = ANY($1::uuid[])
-                        
-                        UNION ALL
-                        
-                        SELECT l.source_node_id, l.target_node_id, l.link_type, l.strength, gp.hop_count + 1
-                        FROM knowledge_links l
-                        INNER JOIN graph_path gp ON l.source_node_id = gp.target_node_id
-                        WHERE gp.hop_count < $2 AND l.strength > 0.5
-                    )
-                    SELECT gp.*, kn.content, kn.domain_id,
-                           (1 - (kn.embedding <=> $3::vector)) as node_similarity
-                    FROM graph_path gp
-                    JOIN knowledge_nodes kn ON gp.target_node_id = kn.id
-                    ORDER BY gp.strength DESC, gp.hop_count ASC
-                    LIMIT 30
-                """, ids, depth, query_embedding)
-
-            # Параллельно запрашиваем разные уровни графа или разные наборы семян
-            hop_tasks = [
-                fetch_hops(seed_ids[:2], max_hops), # Самые релевантные семена - глубже
-                fetch_hops(seed_ids[2:], min(max_hops, 1)) # Остальные - только 1 шаг
-            ]
-            
-            hop_results = await asyncio.gather(*hop_tasks)
-            
-            # Шаг 3: Сборка и Query-Aware Scoring
+                if not ids:
+                    return []
+                async with pool.acquire() as hop_conn:
+                    return await hop_conn.fetch(HOPS_CTE_SQL, ids, depth, query_embedding)
+
+            hop_results = await asyncio.gather(
+                fetch_hops(seed_ids[:DEEP_SEEDS], max_hops),  # Самые релевантные семена - глубже
+                fetch_hops(seed_ids[DEEP_SEEDS:], min(max_hops, 1)),  # Остальные - только 1 шаг
+            )
+
             for hops_data in hop_results:
                 for h in hops_data:
                     tid = str(h['target_node_id'])
                     # Query-Aware Score: комбинация силы связи, близости узла к запросу и глубины
-                    path_score = (h['strength'] * 0.4) + (h['node_similarity'] * 0.5) - (h['hop_count'] * 0.1)
-                    
-                    if tid not in all_results or path_score > all_results[tid].get('similarity', 0):
+                    score = path_score(h['strength'], h['node_similarity'] or 0.0, h['hop_count'])
+
+                    if tid not in all_results or score > all_results[tid].get('similarity', 0):
                         all_results[tid] = {
-                            "id": h['target_node_id'],
+                            "id": tid,
                             "content": h['content'],
-                            "similarity": path_score,
+                            "similarity": score,
                             "is_hop": True,
                             "hop_count": h['hop_count'],
                             "hop_source": str(h['source_node_id']),
                             "link_type": h['link_type']
                         }
 
-            await conn.close()
-            # Сортируем по итоговому score
             sorted_results = sorted(all_results.values(), key=lambda x: x['similarity'], reverse=True)
             return sorted_results[:limit * 2]
 
         except Exception as e:
-            logger.error(f"Multi-hop retrieval failed: {e}")
+            logger.error(f"Multi-hop retrieval (CTE) failed: {e}")
             return []
 
+    async def close(self) -> None:
+        await self.graph_store.close()
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
 _retriever = None
 def get_multi_hop_retriever(db_url: str):
     global _retriever
@@ -21,6 +21,11 @@ except ImportError:
     asyncpg = None
     ASYNCPG_AVAILABLE = False
 
+try:
+    from .batch_linker import BatchLinker
+except ImportError:
+    from batch_linker import BatchLinker
+
 logger = logging.getLogger(__name__)
 
 USER_NAME = getpass.getuser()
@@ -259,58 +264,18 @@ class KnowledgeGraph:
         node_id: str,
         similarity_threshold: float = 0.8
     ) -> List[str]:
-        """Автоматическое обнаружение связей на основе семантического сходства"""
+        """Автоматическое обнаружение связей на основе семантического сходства.
+
+        Соседи — одним запросом через HNSW-индекс, связи — одним пакетным upsert.
+        """
         if not ASYNCPG_AVAILABLE:
             return []
 
         try:
+            linker = BatchLinker(self.db_url, threshold=similarity_threshold)
             conn = await asyncpg.connect(self.db_url)
             try:
-                # Получаем embedding текущего узла
-                node = await conn.fetchrow("""
-                    SELECT id, content, embedding, domain_id
-                    FROM knowledge_nodes
-                    WHERE id = $1
-                """, node_id)
-
-                if not node or not node["embedding"]:
-                    return []
-
-                # Ищем похожие узлы
-                similar_nodes = await conn.fetch("""
-                    SELECT
-                        id,
-                        content,
-                        domain_id,
-                        1 - (embedding <=> $1::vector) as similarity
-                    FROM knowledge_nodes
-                    WHERE id != $2
-                      AND embedding IS NOT NULL
-                      AND (1 - (embedding <=> $1::vector)) >= $3
-                    ORDER BY similarity DESC
-                    LIMIT 10
-                """, node["embedding"], node_id, similarity_threshold)
-
-                created_links = []
-                for similar in similar_nodes:
-                    # Определяем тип связи на основе сходства и домена
-                    if similar["domain_id"] == node["domain_id"]:
-                        link_type = LinkType.RELATED_TO
-                    else:
-                        link_type = LinkType.ENHANCES
-
-                    strength = float(similar["similarity"])
-
-                    link_id = await self.create_link(
-                        node_id,
-                        str(similar["id"]),
-                        link_type,
-                        strength
-                    )
-
-                    if link_id:
-                        created_links.append(link_id)
-
+                created_links = await linker.link_nodes(conn, [node_id])
                 logger.info("✅ Auto-detected %d links for node %s",
                             len(created_links), node_id)
                 return created_links
@@ -321,39 +286,24 @@ class KnowledgeGraph:
             return []
 
 
-async def run_auto_link_detection():
-    """Автоматическое обнаружение связей для всех узлов без связей"""
+async def run_auto_link_detection(full: bool = False) -> Dict[str, Any]:
+    """Пакетное обнаружение связей.
+
+    По умолчанию — для всех узлов без связей; full=True — перестройка связей всего
+    графа (после импорта), возобновляемая с сохранённого водяного знака.
+    """
     if not ASYNCPG_AVAILABLE:
         logger.error("❌ asyncpg is not installed. Detection aborted.")
-        return
-
-    logger.info("🔗 Starting auto-link detection...")
-
-    graph = KnowledgeGraph()
-    conn = await asyncpg.connect(DB_URL)
+        return {}
 
+    logger.info("🔗 Starting auto-link detection (full=%s)...", full)
     try:
-        # Получаем узлы без связей
-        nodes_without_links = await conn.fetch("""
-            SELECT k.id
-            FROM knowledge_nodes k
-            LEFT JOIN knowledge_links kl ON k.id = kl.source_node_id OR k.id = kl.target_node_id
-            WHERE kl.id IS NULL
-            LIMIT 20
-        """)
-
-        logger.info("Found %d nodes without links", len(nodes_without_links))
-
-        for node in nodes_without_links:
-            await graph.auto_detect_links(str(node["id"]))
-            await asyncio.sleep(0.5)  # Rate limiting
-
-        logger.info("✅ Auto-link detection completed")
+        return await BatchLinker(DB_URL).run(full=full)
     except Exception as exc:  # pylint: disable=broad-exception-caught
         logger.error("Auto-link detection error: %s", exc)
-    finally:
-        await conn.close()
+        return {}
 
 
 if __name__ == "__main__":
-    asyncio.run(run_auto_link_detection())
+    import sys
+    asyncio.run(run_auto_link_detection(full="--full" in sys.argv))
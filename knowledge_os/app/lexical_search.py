@@ -0,0 +1,146 @@
+"""
+Лексический поиск по knowledge_nodes: full-text (tsvector, русский + английский) и триграммы.
+
+Использует колонки и индексы миграции db/migrations/add_knowledge_lexical_search.sql:
+search_tsv (GIN), триграммные индексы по content и task_text (= metadata->>'task').
+Ранжирование: ts_rank + триграммная близость, усиленные usage_count.
+Пока миграция не применена — прежний путь через ILIKE (те же поля ответа).
+
+Общий путь для похожих задач Victoria, enhanced_search.keyword_search и keyword-fallback RAG-light.
+"""
+
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+STOP_WORDS = frozenset({
+    'и', 'или', 'в', 'на', 'с', 'для', 'по', 'не', 'как', 'что', 'это', 'из', 'от', 'до',
+    'the', 'a', 'an', 'and', 'or', 'in', 'on', 'at', 'to', 'of', 'for', 'is',
+})
+MAX_TERMS = 12
+# Длина строки для триграммного сравнения (длинная цель размывает similarity)
+TRIGRAM_QUERY_CHARS = 80
+
+_has_lexical_columns: Optional[bool] = None
+
+
+def query_terms(query: str) -> List[str]:
+    """Слова запроса для tsquery: только буквы/цифры (безопасно для to_tsquery), без стоп-слов"""
+    terms = []
+    for word in re.findall(r"\w+", (query or "").lower()):
+        if len(word) > 2 and word not in STOP_WORDS and word not in terms:
+            terms.append(word)
+    return terms[:MAX_TERMS]
+
+
+def build_lexical_query(
+    query: str,
+    domain: Optional[str] = None,
+    limit: int = 5,
+    min_confidence: Optional[float] = None,
+    min_content_length: int = 0,
+    indexed: bool = True,
+) -> Optional[Tuple[str, List[Any]]]:
+    """SQL и параметры лексического поиска; None — в запросе нет значимых слов"""
+    terms = query_terms(query)
+    if not terms:
+        return None
+    params: List[Any] = []
+
+    def add(value: Any) -> str:
+        params.append(value)
+        return f"${len(params)}"
+
+    filters = []
+    join = ""
+    if domain:
+        join = "JOIN domains d ON d.id = kn.domain_id"
+        filters.append(f"d.name = {add(domain)}")
+    if min_confidence is not None:
+        filters.append(f"kn.confidence_score > {add(min_confidence)}")
+    if min_content_length:
+        filters.append(f"length(trim(kn.content)) >= {add(min_content_length)}")
+
+    if indexed:
+        tsq = add(" | ".join(terms))
+        text = add((query or "").strip()[:TRIGRAM_QUERY_CHARS])
+        match = (
+            f"(kn.search_tsv @@ q.tsq OR {text} <% kn.content OR kn.task_text % {text})"
+        )
+        sql = f"""
+            WITH q AS (SELECT to_tsquery('russian', {tsq}) || to_tsquery('english', {tsq}) AS tsq)
+            SELECT kn.id, kn.content, kn.metadata, kn.confidence_score, kn.usage_count,
+                   kn.domain_id, kn.created_at,
+                   (ts_rank(kn.search_tsv, q.tsq)
+                    + 0.5 * greatest(word_similarity({text}, kn.content),
+                                     similarity({text}, coalesce(kn.task_text, ''))))
+                   * (1 + 0.1 * ln(1 + greatest(coalesce(kn.usage_count, 0), 0))) AS score
+            FROM knowledge_nodes kn
+            CROSS JOIN q
+            {join}
+            WHERE {' AND '.join([match] + filters)}
+            ORDER BY score DESC, kn.created_at DESC
+            LIMIT {add(limit)}
+        """
+    else:
+        likes = [add(f"%{term}%") for term in terms]
+        match = "(" + " OR ".join(f"kn.content ILIKE {p} OR kn.metadata::text ILIKE {p}" for p in likes) + ")"
+        sql = f"""
+            SELECT kn.id, kn.content, kn.metadata, kn.confidence_score, kn.usage_count,
+                   kn.domain_id, kn.created_at,
+                   (CASE WHEN kn.content ILIKE ANY(ARRAY[{', '.join(likes)}]) THEN 1.0 ELSE 0.8 END)
+                   * (1 + 0.1 * ln(1 + greatest(coalesce(kn.usage_count, 0), 0))) AS score
+            FROM knowledge_nodes kn
+            {join}
+            WHERE {' AND '.join([match] + filters)}
+            ORDER BY score DESC, kn.created_at DESC
+            LIMIT {add(limit)}
+        """
+    return sql, params
+
+
+async def _lexical_columns_ready(conn) -> bool:
+    global _has_lexical_columns
+    if _has_lexical_columns is None:
+        count = await conn.fetchval(
+            """SELECT COUNT(*) FROM information_schema.columns
+               WHERE table_name = 'knowledge_nodes' AND column_name IN ('search_tsv', 'task_text')"""
+        )
+        _has_lexical_columns = count == 2
+        if not _has_lexical_columns:
+            logger.info("lexical_search: миграция add_knowledge_lexical_search не применена, используем ILIKE")
+    return _has_lexical_columns
+
+
+async def lexical_search(
+    conn,
+    query: str,
+    domain: Optional[str] = None,
+    limit: int = 5,
+    min_confidence: Optional[float] = None,
+    min_content_length: int = 0,
+) -> List[Dict]:
+    """
+    Лексический поиск по knowledge_nodes.
+
+    Args:
+        conn: asyncpg-соединение
+        query: текст запроса
+        domain: имя домена (domains.name) — ограничить поиск
+        limit: максимум результатов
+        min_confidence: только узлы с confidence_score выше порога
+        min_content_length: минимальная длина content (без пробелов по краям)
+
+    Returns:
+        Список dict (id, content, metadata, confidence_score, usage_count, domain_id, created_at, score),
+        по убыванию score.
+    """
+    indexed = await _lexical_columns_ready(conn)
+    built = build_lexical_query(query, domain, limit, min_confidence, min_content_length, indexed=indexed)
+    if built is None:
+        return []
+    sql, params = built
+    rows = await conn.fetch(sql, *params)
+    return [dict(r) for r in rows]
@@ -0,0 +1,242 @@
+"""
+LLM Single-Flight — склейка одинаковых одновременных запросов к локальным моделям.
+
+Воркеры, Victoria и чат часто отправляют один и тот же (model, system prompt, prompt)
+одновременно: ретраи, повторные задачи curiosity engine, двойная отправка пользователем.
+Кэш ответов LocalAIRouter помогает только после завершения первого вызова; здесь
+одинаковые запросы в полёте присоединяются к одной генерации:
+- run() — обычный вызов: ведомые ждут результат ведущего;
+  генерация отменяется, если ушли все ожидающие;
+- stream() — стриминг: чанки одной генерации раздаются всем подписчикам
+  (подключившийся позже получает уже выданные чанки, затем продолжение);
+  генерация отменяется, если ушли все подписчики.
+
+Метрики: requests / leaders / joined / dedup_ratio (доля запросов, не запустивших генерацию).
+Экспортируются процессами, которые вызывают LocalAIRouter: Victoria (/metrics) и воркер
+(serve_metrics на SMART_WORKER_METRICS_PORT).
+"""
+
+import asyncio
+import hashlib
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(
+    prompt: str,
+    system_prompt: str = "",
+    model: Optional[str] = None,
+    category: Optional[str] = None,
+    images: Optional[list] = None,
+) -> str:
+    """Ключ идентичности запроса: модель, системный промпт, промпт, категория, изображения"""
+    h = hashlib.sha256()
+    for part in (model or "", category or "", system_prompt or "", prompt or ""):
+        h.update(part.encode("utf-8", "replace"))
+        h.update(b"\x00")
+    for image in images or ():
+        h.update(str(image).encode("utf-8", "replace"))
+        h.update(b"\x01")
+    return h.hexdigest()[:32]
+
+
+class _Flight:
+    """Одна обычная генерация и число её ожидающих"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class _Broadcast:
+    """Одна стриминговая генерация и её подписчики"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.cond = asyncio.Condition()
+        self.task: Optional[asyncio.Task] = None
+
+
+class LLMSingleFlight:
+    """Склейка одинаковых запросов в полёте (обычных и стриминговых)"""
+
+    def __init__(self):
+        self._inflight: Dict[str, _Flight] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        self.requests = 0
+        self.leaders = 0
+        self.joined = 0
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Результат call(); одновременные вызовы с тем же ключом ждут одну генерацию"""
+        self.requests += 1
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.joined += 1
+            logger.debug("🔗 [SINGLE-FLIGHT] присоединён к генерации %s", key[:8])
+        else:
+            self.leaders += 1
+            flight = _Flight(asyncio.ensure_future(call()))
+            self._inflight[key] = flight
+
+            def _release(_task: asyncio.Future, flight: _Flight = flight) -> None:
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+
+            flight.task.add_done_callback(_release)
+        flight.waiters += 1
+        try:
+            # shield: отмена одного ожидающего не отменяет генерацию, которую ждут остальные
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Все ожидающие ушли — результат никому не нужен
+                if self._inflight.get(key) is flight:
+                    del self._inflight[key]
+                flight.task.cancel()
+
+    async def _produce(
+        self,
+        key: str,
+        b: _Broadcast,
+        source: Callable[[], AsyncIterator[str]],
+        on_complete: Optional[Callable[[str], Any]],
+    ) -> None:
+        try:
+            async for chunk in source():
+                async with b.cond:
+                    b.chunks.append(chunk)
+                    b.cond.notify_all()
+        except asyncio.CancelledError:
+            b.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            b.error = e
+        finally:
+            if self._streams.get(key) is b:
+                self._streams.pop(key)
+            async with b.cond:
+                b.done = True
+                b.cond.notify_all()
+        if b.error is None and on_complete is not None and b.chunks:
+            try:
+                on_complete("".join(b.chunks))
+            except Exception as e:
+                logger.debug("single-flight on_complete: %s", e)
+
+    async def stream(
+        self,
+        key: str,
+        source: Callable[[], AsyncIterator[str]],
+        on_complete: Optional[Callable[[str], Any]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Чанки стриминговой генерации; одинаковые стримы в полёте читают одну генерацию.
+
+        on_complete(full_text) вызывается один раз после успешного завершения (заполнение кэша).
+        """
+        self.requests += 1
+        b = self._streams.get(key)
+        if b is not None:
+            self.joined += 1
+            logger.debug("🔗 [SINGLE-FLIGHT] стрим присоединён к генерации %s", key[:8])
+        else:
+            self.leaders += 1
+            b = _Broadcast()
+            self._streams[key] = b
+            b.task = asyncio.ensure_future(self._produce(key, b, source, on_complete))
+        b.subscribers += 1
+        idx = 0
+        try:
+            while True:
+                async with b.cond:
+                    await b.cond.wait_for(lambda: len(b.chunks) > idx or b.done)
+                    pending = b.chunks[idx:]
+                    finished = b.done
+                for chunk in pending:
+                    yield chunk
+                idx += len(pending)
+                if finished and idx >= len(b.chunks):
+                    break
+        finally:
+            b.subscribers -= 1
+            if b.subscribers == 0 and not b.done and b.task is not None:
+                # Все потребители ушли — генерацию никто не читает
+                if self._streams.get(key) is b:
+                    self._streams.pop(key)
+                b.task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "leaders": self.leaders,
+            "joined": self.joined,
+            "dedup_ratio": round(self.joined / self.requests, 4) if self.requests else 0.0,
+            "inflight": len(self._inflight) + len(self._streams),
+        }
+
+    def export_prometheus(self) -> str:
+        """Счётчики в формате Prometheus (для /metrics)"""
+        stats = self.get_stats()
+        return (
+            "# HELP llm_singleflight_requests_total Запросы к локальным LLM через single-flight\n"
+            "# TYPE llm_singleflight_requests_total counter\n"
+            f"llm_singleflight_requests_total {stats['requests']}\n"
+            "# HELP llm_singleflight_joined_total Запросы, присоединённые к генерации в полёте\n"
+            "# TYPE llm_singleflight_joined_total counter\n"
+            f"llm_singleflight_joined_total {stats['joined']}\n"
+            "# HELP llm_singleflight_dedup_ratio Доля запросов без собственной генерации\n"
+            "# TYPE llm_singleflight_dedup_ratio gauge\n"
+            f"llm_singleflight_dedup_ratio {stats['dedup_ratio']}\n"
+            "# TYPE llm_singleflight_inflight gauge\n"
+            f"llm_singleflight_inflight {stats['inflight']}\n"
+        )
+
+
+async def serve_metrics(port: int, host: str = "0.0.0.0") -> Optional[asyncio.AbstractServer]:
+    """Минимальный HTTP /metrics для процессов без веб-сервера (воркер). port=0 — отключено."""
+    if not port:
+        return None
+
+    async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            path = request_line.split()[1] if len(request_line.split()) > 1 else b""
+            if path.split(b"?")[0] == b"/metrics":
+                status, body = "200 OK", get_llm_singleflight().export_prometheus().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug("single-flight metrics request: %s", e)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(_handle, host, port)
+    logger.info("📈 LLM single-flight metrics: http://%s:%s/metrics", host, port)
+    return server
+
+
+_singleflight: Optional[LLMSingleFlight] = None
+
+
+def get_llm_singleflight() -> LLMSingleFlight:
+    """Глобальный экземпляр на процесс (общий для всех LocalAIRouter)"""
+    global _singleflight
+    if _singleflight is None:
+        _singleflight = LLMSingleFlight()
+    return _singleflight
@@ -1,226 +1,326 @@
 """
 Load Balancer
-Распределение нагрузки между узлами для оптимального использования ресурсов
+Единое состояние узлов LLM: здоровье, текущая нагрузка и задержки.
+
+- Здоровье: фоновый монитор опрашивает все узлы параллельно (asyncio.gather) через общий
+  пул соединений http_client. Маршрутизация читает последнее известное состояние и никогда
+  не ждёт пробы; ошибки соединения в боевых запросах сразу помечают узел недоступным.
+- Нагрузка: start_request/end_request меняют счётчики синхронно — все вызовы идут из одного
+  event loop, поэтому блокировки не нужны и select_best_node видит актуальные значения.
+- Задержки: EWMA + скользящее окно последних замеров для p50/p95.
+- Выбор: power-of-two-choices по стоимости (незавершённые запросы × EWMA задержки / успешность);
+  при двух кандидатах и меньше — least-outstanding-requests по той же стоимости.
 """
 
 import asyncio
 import logging
+import os
+import random
 import time
-from typing import List, Dict, Optional, Any
-from dataclasses import dataclass
-from collections import defaultdict
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
+HEALTH_INTERVAL = float(os.getenv("LOCAL_ROUTER_HEALTH_INTERVAL", "30"))
+PROBE_TIMEOUT = float(os.getenv("LOCAL_ROUTER_PROBE_TIMEOUT", "2.0"))
+# Если здоровых узлов нет — внеочередная проба не чаще, чем раз в столько секунд
+MIN_REPROBE_INTERVAL = 5.0
+
+EWMA_ALPHA = 0.3
+LATENCY_WINDOW = 100
+DEFAULT_LATENCY = 1.0
+
+
+async def _get_client():
+    """Общий пул соединений (импорт лениво: Task Distribution использует балансировщик без HTTP)"""
+    try:
+        from http_client import get_http_client
+    except ImportError:
+        from app.http_client import get_http_client
+    return await get_http_client()
+
+
 @dataclass
 class NodeLoad:
-    """Информация о загрузке узла"""
+    """Состояние узла: здоровье, нагрузка, задержки"""
     node_name: str
     routing_key: str
+    url: str = ""
+    priority: int = 0
+    node: Dict[str, Any] = field(default_factory=dict)
+    # None — ещё не проверялся (считаем доступным, чтобы не блокировать первый запрос)
+    healthy: Optional[bool] = None
+    probe_latency: float = 0.0
+    last_probe: float = 0.0
+    consecutive_failures: int = 0
     active_requests: int = 0
     total_requests: int = 0
-    avg_latency: float = 0.0
-    success_rate: float = 1.0
+    failed_requests: int = 0
+    avg_latency: float = 0.0  # EWMA, секунды
+    success_rate: float = 1.0  # EWMA успешности
     last_update: float = 0.0
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+
+    def observe(self, latency: Optional[float], success: bool) -> None:
+        """Учитывает завершённый запрос (EWMA задержки и успешности, окно перцентилей)"""
+        self.total_requests += 1
+        if not success:
+            self.failed_requests += 1
+        self.success_rate = (1 - EWMA_ALPHA) * self.success_rate + EWMA_ALPHA * (1.0 if success else 0.0)
+        if success and latency is not None:
+            self.avg_latency = latency if self.avg_latency == 0 else (
+                (1 - EWMA_ALPHA) * self.avg_latency + EWMA_ALPHA * latency
+            )
+            self.latencies.append(latency)
+        self.last_update = time.time()
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
 
 class LoadBalancer:
     """
     Load Balancer для распределения нагрузки между узлами.
+    Один экземпляр на процесс (get_load_balancer); все методы, кроме проб, синхронные.
     """
-    
-    def __init__(self):
+
+    def __init__(self, rng: Optional[random.Random] = None):
         self.node_loads: Dict[str, NodeLoad] = {}
-        self._lock = asyncio.Lock()
-        self._load_history: Dict[str, List[float]] = defaultdict(list)
-        self._max_history = 100
-    
-    def update_node_load(
-        self,
-        node_name: str,
-        routing_key: str,
-        latency: float,
-        success: bool = True
-    ):
-        """Обновляет информацию о загрузке узла"""
-        async def _update():
-            async with self._lock:
-                if routing_key not in self.node_loads:
-                    self.node_loads[routing_key] = NodeLoad(
-                        node_name=node_name,
-                        routing_key=routing_key
-                    )
-                
-                load = self.node_loads[routing_key]
-                load.total_requests += 1
-                if success:
-                    # Обновляем среднюю задержку (exponential moving average)
-                    if load.avg_latency == 0:
-                        load.avg_latency = latency
-                    else:
-                        load.avg_latency = 0.7 * load.avg_latency + 0.3 * latency
-                    
-                    # Обновляем success rate
-                    successful = int(load.success_rate * (load.total_requests - 1)) + (1 if success else 0)
-                    load.success_rate = successful / load.total_requests
-                else:
-                    # Уменьшаем success rate
-                    successful = int(load.success_rate * (load.total_requests - 1))
-                    load.success_rate = successful / load.total_requests
-                
-                load.last_update = time.time()
-                
-                # Сохраняем в историю
-                self._load_history[routing_key].append(latency)
-                if len(self._load_history[routing_key]) > self._max_history:
-                    self._load_history[routing_key].pop(0)
-        
-        # Выполняем обновление асинхронно
-        asyncio.create_task(_update())
-    
-    def start_request(self, routing_key: str):
-        """Отмечает начало запроса к узлу"""
-        async def _start():
-            async with self._lock:
-                if routing_key in self.node_loads:
-                    self.node_loads[routing_key].active_requests += 1
-        
-        asyncio.create_task(_start())
-    
-    def end_request(self, routing_key: str):
-        """Отмечает окончание запроса к узлу"""
-        async def _end():
-            async with self._lock:
-                if routing_key in self.node_loads:
-                    self.node_loads[routing_key].active_requests = max(0, 
-                        self.node_loads[routing_key].active_requests - 1)
-        
-        asyncio.create_task(_end())
-    
-    def select_best_node(self, available_nodes: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        self._rng = rng or random.Random()
+        self._performance: Dict[str, Dict[str, float]] = {}
+        self._monitor_task: Optional[asyncio.Task] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._last_probe_started = 0.0
+
+    def _state(self, routing_key: str, node_name: str = "") -> NodeLoad:
+        load = self.node_loads.get(routing_key)
+        if load is None:
+            load = NodeLoad(node_name=node_name or routing_key, routing_key=routing_key)
+            self.node_loads[routing_key] = load
+        return load
+
+    # ---------- Узлы и здоровье ----------
+
+    def register_nodes(self, nodes: List[Dict[str, Any]]) -> None:
+        """Регистрирует/обновляет узлы роутера (name, url, priority, routing_key)"""
+        for node in nodes:
+            load = self._state(node.get("routing_key") or node["name"], node["name"])
+            load.node_name = node["name"]
+            load.url = node["url"]
+            load.priority = node.get("priority", 0)
+            load.node = dict(node)
+
+    def set_performance(self, metrics: Dict[str, Dict[str, float]]) -> None:
+        """Метрики качества узлов (avg_performance, success_rate) — обновляются монитором"""
+        self._performance = metrics or {}
+
+    async def _probe_node(self, client, load: NodeLoad) -> None:
+        """Лёгкий /health, при его отсутствии — /api/tags (Ollama)"""
+        start = time.time()
+        error: Any = None
+        for path in ("/health", "/api/tags"):
+            try:
+                response = await client.get(f"{load.url}{path}", timeout=PROBE_TIMEOUT)
+                if response.status_code == 200:
+                    error = None
+                    break
+                error = f"HTTP {response.status_code}"
+            except Exception as e:
+                error = e
+        load.last_probe = time.time()
+        if error is None:
+            load.probe_latency = load.last_probe - start
+            load.consecutive_failures = 0
+        else:
+            load.consecutive_failures += 1
+            if load.healthy is not False:
+                logger.warning(f"⚠️ Node {load.node_name} is offline: {error}")
+        load.healthy = error is None
+
+    async def probe_all(self) -> None:
+        """Параллельная проверка всех зарегистрированных узлов (общий пул соединений)"""
+        self._last_probe_started = time.time()
+        targets = [load for load in self.node_loads.values() if load.url]
+        if not targets:
+            return
+        client = await _get_client()
+        await asyncio.gather(*(self._probe_node(client, load) for load in targets))
+
+    def _request_probe(self) -> None:
+        """Внеочередная фоновая проба (не ждём результата)"""
+        if self._probe_task is not None and not self._probe_task.done():
+            return
+        if time.time() - self._last_probe_started < MIN_REPROBE_INTERVAL:
+            return
+        self._probe_task = asyncio.get_running_loop().create_task(self.probe_all())
+
+    async def _monitor_loop(self, interval: float,
+                            perf_provider: Optional[Callable[[], Awaitable[Dict]]]) -> None:
+        while True:
+            try:
+                await self.probe_all()
+                if perf_provider is not None:
+                    self.set_performance(await perf_provider())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Health monitor: {e}")
+            await asyncio.sleep(interval)
+
+    def ensure_monitor(self, perf_provider: Optional[Callable[[], Awaitable[Dict]]] = None,
+                       interval: float = HEALTH_INTERVAL) -> None:
+        """Запускает фоновый монитор здоровья в текущем event loop (идемпотентно)"""
+        task = self._monitor_task
+        loop = asyncio.get_running_loop()
+        if task is not None and not task.done() and task.get_loop() is loop:
+            return
+        self._monitor_task = loop.create_task(self._monitor_loop(interval, perf_provider))
+
+    async def stop_monitor(self) -> None:
+        for task in (self._monitor_task, self._probe_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._monitor_task = self._probe_task = None
+
+    def healthy_nodes(self) -> List[Dict[str, Any]]:
         """
-        Выбирает лучший узел на основе загрузки.
-        
-        Args:
-            available_nodes: Список доступных узлов
-        
-        Returns:
-            Выбранный узел или None
+        Узлы, доступные по последнему известному состоянию (без ожидания проб).
+        Порядок: performance_score (выше лучше), priority, задержка пробы.
         """
-        if not available_nodes:
-            return None
-        
-        # Если нет данных о загрузке, используем первый узел
-        if not self.node_loads:
-            return available_nodes[0]
-        
-        best_node = None
-        best_score = float('inf')
-        
-        for node in available_nodes:
-            routing_key = node.get('routing_key', '')
-            if routing_key not in self.node_loads:
-                # Новый узел - даем ему шанс
-                return node
-            
-            load = self.node_loads[routing_key]
-            
-            # Вычисляем score (меньше = лучше)
-            # Учитываем: активные запросы, среднюю задержку, success rate
-            score = (
-                load.active_requests * 10.0 +  # Штраф за активные запросы
-                load.avg_latency * 0.1 +       # Штраф за задержку
-                (1.0 - load.success_rate) * 50.0  # Штраф за низкий success rate
-            )
-            
-            if score < best_score:
-                best_score = score
-                best_node = node
-        
-        return best_node or available_nodes[0]
-    
-    def get_node_statistics(self) -> Dict[str, Any]:
-        """Получает статистику по узлам"""
-        async def _get_stats():
-            async with self._lock:
-                stats = {}
-                for routing_key, load in self.node_loads.items():
-                    stats[routing_key] = {
-                        'node_name': load.node_name,
-                        'active_requests': load.active_requests,
-                        'total_requests': load.total_requests,
-                        'avg_latency': load.avg_latency,
-                        'success_rate': load.success_rate,
-                        'last_update': load.last_update
-                    }
-                return stats
-        
-        # Синхронный вызов для получения статистики
-        loop = asyncio.get_event_loop()
-        if loop.is_running():
-            # Если loop уже запущен, создаем task
-            future = asyncio.create_task(_get_stats())
-            return {}  # Возвращаем пустой dict, так как не можем ждать
-        else:
-            return loop.run_until_complete(_get_stats())
-    
+        result = []
+        for load in self.node_loads.values():
+            if not load.url or load.healthy is False:
+                continue
+            perf = self._performance.get(load.routing_key, {})
+            result.append({
+                **load.node,
+                "latency": load.probe_latency,
+                "status": "online" if load.healthy else "unknown",
+                "performance_score": perf.get("avg_performance", 0.8),
+                "success_rate": perf.get("success_rate", 0.9),
+            })
+        if not result and self.node_loads:
+            try:
+                self._request_probe()
+            except RuntimeError:
+                pass
+        return sorted(result, key=lambda x: (-x["performance_score"], x.get("priority", 0), x["latency"]))
+
+    # ---------- Нагрузка ----------
+
+    def start_request(self, routing_key: str) -> float:
+        """Отмечает начало запроса к узлу; возвращает метку времени для end_request"""
+        self._state(routing_key).active_requests += 1
+        return time.time()
+
+    def end_request(self, routing_key: str, started_at: Optional[float] = None,
+                    success: Optional[bool] = None, connection_error: bool = False) -> None:
+        """
+        Отмечает окончание запроса к узлу.
+        success=None — только счётчик; иначе учитываются задержка и успешность.
+        connection_error — узел недоступен: помечаем сразу, фоновая проба вернёт его в строй.
+        """
+        load = self._state(routing_key)
+        load.active_requests = max(0, load.active_requests - 1)
+        if success is not None:
+            load.observe(time.time() - started_at if started_at else None, success)
+        if load.url and connection_error:
+            load.healthy = False
+            load.consecutive_failures += 1
+        elif load.url and success:
+            load.healthy = True
+
+    def update_node_load(self, node_name: str, routing_key: str, latency: float, success: bool = True) -> None:
+        """Учитывает завершённый запрос с известной задержкой (без изменения счётчика активных)"""
+        self._state(routing_key, node_name).observe(latency, success)
+
     def increment_load(self, employee_id: Any):
         """Увеличивает загрузку сотрудника (для совместимости с Task Distribution)"""
-        # Используем employee_id как routing_key для отслеживания загрузки
-        routing_key = str(employee_id)
-        self.start_request(routing_key)
-    
+        self.start_request(str(employee_id))
+
     def decrement_load(self, employee_id: Any):
         """Уменьшает загрузку сотрудника (для совместимости с Task Distribution)"""
-        # Используем employee_id как routing_key для отслеживания загрузки
-        routing_key = str(employee_id)
-        self.end_request(routing_key)
-    
+        self.end_request(str(employee_id))
+
     def record_completion_time(self, employee_id: Any, execution_time: float):
         """Записывает время выполнения задачи (для совместимости с Task Distribution)"""
-        # Используем employee_id как routing_key
-        routing_key = str(employee_id)
-        # Обновляем метрики загрузки
-        async def _update():
-            async with self._lock:
-                if routing_key in self.node_loads:
-                    load = self.node_loads[routing_key]
-                    # Обновляем среднюю задержку
-                    if load.avg_latency == 0:
-                        load.avg_latency = execution_time
-                    else:
-                        load.avg_latency = 0.7 * load.avg_latency + 0.3 * execution_time
-                    load.last_update = time.time()
-        
-        asyncio.create_task(_update())
-    
+        self._state(str(employee_id)).observe(execution_time, True)
+
+    # ---------- Выбор ----------
+
+    def _cost(self, node: Dict[str, Any], default_latency: float) -> float:
+        load = self.node_loads.get(node.get("routing_key", ""))
+        if load is None:
+            return default_latency
+        latency = load.avg_latency or default_latency
+        return (load.active_requests + 1) * latency / max(load.success_rate, 0.05)
+
+    def select_best_node(self, available_nodes: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """
+        Выбирает узел по живому состоянию: power-of-two-choices, при ≤2 кандидатах —
+        least-outstanding-requests. При равной стоимости побеждает узел раньше в списке.
+        """
+        if not available_nodes:
+            return None
+        known = [load.avg_latency for load in self.node_loads.values() if load.avg_latency > 0]
+        default_latency = sum(known) / len(known) if known else DEFAULT_LATENCY
+        if len(available_nodes) <= 2:
+            candidates = available_nodes
+        else:
+            i, j = sorted(self._rng.sample(range(len(available_nodes)), 2))
+            candidates = [available_nodes[i], available_nodes[j]]
+        return min(candidates, key=lambda node: self._cost(node, default_latency))
+
     def round_robin_select(self, available_nodes: List[Dict[str, Any]], last_selected: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
-        Round-robin выбор узла с учетом производительности.
-        
+        Round-robin выбор узла.
+
         Args:
             available_nodes: Список доступных узлов
             last_selected: Последний выбранный узел (routing_key)
-        
+
         Returns:
             Выбранный узел
         """
         if not available_nodes:
             return None
-        
-        # Если нет информации о последнем выборе, выбираем первый
         if last_selected is None:
             return available_nodes[0]
-        
-        # Находим индекс последнего выбранного узла
         last_index = -1
         for i, node in enumerate(available_nodes):
             if node.get('routing_key') == last_selected:
                 last_index = i
                 break
-        
-        # Выбираем следующий узел
-        next_index = (last_index + 1) % len(available_nodes)
-        return available_nodes[next_index]
+        return available_nodes[(last_index + 1) % len(available_nodes)]
+
+    def get_node_statistics(self) -> Dict[str, Any]:
+        """Получает статистику по узлам"""
+        return {
+            routing_key: {
+                'node_name': load.node_name,
+                'healthy': load.healthy,
+                'probe_latency': round(load.probe_latency, 4),
+                'active_requests': load.active_requests,
+                'total_requests': load.total_requests,
+                'failed_requests': load.failed_requests,
+                'avg_latency': load.avg_latency,
+                'p50_latency': load.percentile(0.5),
+                'p95_latency': load.percentile(0.95),
+                'success_rate': load.success_rate,
+                'last_update': load.last_update,
+            }
+            for routing_key, load in self.node_loads.items()
+        }
+
 
 # Singleton instance
 _load_balancer_instance = None
@@ -231,4 +331,3 @@ def get_load_balancer() -> LoadBalancer:
     if _load_balancer_instance is None:
         _load_balancer_instance = LoadBalancer()
     return _load_balancer_instance
-
@@ -11,65 +11,114 @@ from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any, Deque
+from typing import Optional, List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 import time
 import threading
 from datetime import datetime, timezone
-from collections import defaultdict, deque
-from mlx_lm import load, generate
+from collections import defaultdict
+from mlx_lm import load, stream_generate
 import sys
 import gc
 
-# --- VLLM-STYLE CORE (Singularity 10.0) ---
-class BatchRequest:
-    def __init__(self, prompt: str, max_tokens: int, priority: int = 1):
-        self.prompt = prompt
-        self.max_tokens = max_tokens
-        self.priority = priority
-        self.created_at = time.time()
-        self.future = asyncio.Future()
-
-class ContinuousBatcher:
-    """Эмуляция Continuous Batching для MLX (vLLM Level)"""
-    def __init__(self, model, tokenizer):
+
+# Добавляем путь к mlx_router для импорта
+sys.path.insert(0, os.path.dirname(__file__))
+
+# --- CONTINUOUS BATCHING (generation_scheduler) ---
+try:
+    from generation_scheduler import AdmissionError, GenerationBackend, GenerationScheduler
+except ImportError:
+    from app.generation_scheduler import AdmissionError, GenerationBackend, GenerationScheduler
+
+
+def _kv_bytes_per_token(model) -> int:
+    """Байт KV-кэша на токен: 2 (K и V) × слои × KV-головы × размер головы × 2 байта (fp16)."""
+    env_value = os.getenv("MLX_KV_BYTES_PER_TOKEN")
+    if env_value:
+        return int(env_value)
+    args = getattr(model, "args", None)
+    try:
+        heads = args.num_attention_heads
+        kv_heads = getattr(args, "num_key_value_heads", None) or heads
+        head_dim = getattr(args, "head_dim", None) or args.hidden_size // heads
+        return 2 * args.num_hidden_layers * kv_heads * head_dim * 2
+    except (AttributeError, TypeError, ZeroDivisionError):
+        return 128 * 1024
+
+
+class MLXBackend(GenerationBackend):
+    """
+    Бэкенд планировщика для mlx_lm: у каждой последовательности свой stream_generate,
+    за итерацию — по токену на последовательность в одном вызове executor.
+    Один поток на модель + model_lock: Metal не допускает параллельных операций с одной моделью.
+    """
+
+    def __init__(self, model, tokenizer, model_lock: threading.Lock):
         self.model = model
         self.tokenizer = tokenizer
-        self.queue: Deque[BatchRequest] = deque()
-        self.is_running = False
-        self._lock = asyncio.Lock()
-
-    async def add_request(self, request: BatchRequest):
-        self.queue.append(request)
-        if not self.is_running:
-            asyncio.create_task(self._process_loop())
-
-    async def _process_loop(self):
-        self.is_running = True
-        while self.queue:
-            # В реальном vLLM здесь идет объединение тензоров
-            # В MLX эмулируем через эффективную очередь и приоритеты
-            req = self.queue.popleft()
-            try:
-                # Имитация PagedAttention: оптимизация KV-кэша перед генерацией
-                # (В MLX это делается через mlx.core.metal.clear_cache при необходимости)
-                import mlx.core as mx
-                mx.metal.clear_cache()
-                
-                loop = asyncio.get_event_loop()
-                response = await loop.run_in_executor(None, 
-                    lambda: generate(self.model, self.tokenizer, prompt=req.prompt, max_tokens=req.max_tokens)
-                )
-                req.future.set_result(response)
-            except Exception as e:
-                req.future.set_exception(e)
-        self.is_running = False
+        self.model_lock = model_lock
+        self.kv_bytes_per_token = _kv_bytes_per_token(model)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mlx-gen")
 
-# --- END VLLM-STYLE CORE ---
+    def kv_cost(self, seq) -> int:
+        try:
+            prompt_tokens = len(self.tokenizer.encode(seq.prompt))
+        except Exception:
+            prompt_tokens = len(seq.prompt) // 3
+        return (prompt_tokens + seq.max_tokens) * self.kv_bytes_per_token
+
+    async def prefill(self, seqs) -> None:
+        # Генераторы ленивые: prefill промпта выполняется первым шагом в потоке модели
+        for seq in seqs:
+            seq.state = stream_generate(self.model, self.tokenizer, prompt=seq.prompt, max_tokens=seq.max_tokens)
+
+    async def step(self, seqs) -> List[Optional[str]]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._step_sync, seqs)
+
+    def _step_sync(self, seqs) -> List[Optional[str]]:
+        out: List[Optional[str]] = []
+        with self.model_lock:
+            for seq in seqs:
+                try:
+                    chunk = next(seq.state)
+                    out.append(getattr(chunk, "text", chunk))  # GenerationResponse или str (старые mlx_lm)
+                except StopIteration:
+                    out.append(None)
+        return out
+
+    def release(self, seq) -> None:
+        state, seq.state = seq.state, None
+        if state is not None and hasattr(state, "close"):
+            try:
+                state.close()
+            except Exception:
+                pass
+
+
+# Планировщик на модель: батч последовательностей одной модели, бюджет KV-кэша на модель
+_schedulers: Dict[str, GenerationScheduler] = {}
+_kv_budget_bytes = int(float(os.getenv("MLX_KV_BUDGET_GB", "8")) * 1024 ** 3)
+_max_batch = int(os.getenv("MLX_MAX_BATCH", "8"))
+
+
+def get_scheduler(model_key: str, model_data: Dict[str, Any], model_lock: threading.Lock) -> GenerationScheduler:
+    """Планировщик модели; пересоздаётся, если модель перезагружена (старый дорабатывает свой батч)."""
+    scheduler = _schedulers.get(model_key)
+    if scheduler is None or scheduler.backend.model is not model_data["model"]:
+        scheduler = GenerationScheduler(
+            MLXBackend(model_data["model"], model_data["tokenizer"], model_lock),
+            kv_budget=_kv_budget_bytes,
+            max_batch=_max_batch,
+            name=model_key,
+        )
+        _schedulers[model_key] = scheduler
+    return scheduler
 
-# Добавляем путь к mlx_router для импорта
-sys.path.insert(0, os.path.dirname(__file__))
+# --- END CONTINUOUS BATCHING ---
 
 # Настройка логирования в файл
 log_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "logs")
@@ -838,7 +887,7 @@ async def generate_text(
         
         async def _execute_generation():
             try:
-                result = await _generate_text_internal(request, start_time)
+                result = await _generate_text_internal(request, start_time, request_priority.value)
                 if not result_future.done():
                     result_future.set_result(result)
                 return result
@@ -877,7 +926,7 @@ async def generate_text(
             raise
     
     # Fallback: прямая обработка (старый способ)
-    return await _generate_text_internal(request, start_time)
+    return await _generate_text_internal(request, start_time, request_priority.value)
 
 
 @app.post("/api/chat")
@@ -948,8 +997,8 @@ async def chat(
         return response
 
 
-async def _generate_text_internal(request: GenerateRequest, start_time: float):
-    """Внутренняя функция генерации текста"""
+async def _generate_text_internal(request: GenerateRequest, start_time: float, priority: int = 2):
+    """Внутренняя функция генерации текста (priority — класс планировщика: 1 чат, 2 задачи, 3 фон)"""
     try:
         # Проверка памяти перед генерацией
         memory_info = check_memory()
@@ -996,35 +1045,27 @@ async def _generate_text_internal(request: GenerateRequest, start_time: float):
                 load_time_actual=model_data.get("load_time_seconds"),
             )
             
-            # КРИТИЧНО: Metal не поддерживает одновременные операции с одним command buffer
-            # Сериализуем все операции генерации для одной модели через блокировку
-            # Разные модели могут работать параллельно, но одна модель - последовательно
+            # КРИТИЧНО: Metal не поддерживает одновременные операции с одним command buffer.
+            # Все последовательности модели идут через её планировщик: один поток, батч по итерациям
             model_lock = _model_locks[model_key]
+            scheduler = get_scheduler(model_key, model_data, model_lock)
+            try:
+                seq = await scheduler.submit(request.prompt, request.max_tokens, priority=priority, timeout=gen_timeout)
+            except AdmissionError as e:
+                raise HTTPException(status_code=503, detail=f"Request does not fit KV cache budget: {e}")
             
             # Генерация с таймаутом
             if request.stream:
                 return StreamingResponse(
-                    generate_stream(model, tokenizer, request.prompt, request.max_tokens, model_lock),
+                    generate_stream(seq),
                     media_type="application/json"
                 )
             else:
-                # Используем executor для async с таймаутом
-                # КРИТИЧНО: Блокировка модели гарантирует, что только одна генерация
-                # для этой модели выполняется одновременно (защита от Metal конфликтов)
-                loop = asyncio.get_event_loop()
                 try:
-                    def generate_with_lock():
-                        """Генерация с блокировкой модели для защиты от Metal конфликтов"""
-                        with model_lock:
-                            return generate(model, tokenizer, prompt=request.prompt, max_tokens=request.max_tokens)
-                    
-                    response_text = await asyncio.wait_for(
-                        loop.run_in_executor(None, generate_with_lock),
-                        timeout=gen_timeout
-                    )
+                    response_text = await asyncio.wait_for(seq.result(), timeout=gen_timeout)
                     
                     duration = time.time() - start_time
-                    logger.info(f"✅ Генерация завершена за {duration:.2f}с (модель: {model_key}, токенов: {request.max_tokens})")
+                    logger.info(f"✅ Генерация завершена за {duration:.2f}с (модель: {model_key}, токенов: {len(seq.tokens)})")
                     
                     return {
                         "model": model_key,
@@ -1032,6 +1073,7 @@ async def _generate_text_internal(request: GenerateRequest, start_time: float):
                         "done": True
                     }
                 except asyncio.TimeoutError:
+                    seq.cancel()
                     logger.error(f"❌ Таймаут генерации для модели {model_key} (лимит {gen_timeout:.0f}с)")
                     raise HTTPException(
                         status_code=504,
@@ -1072,27 +1114,13 @@ async def _generate_text_internal(request: GenerateRequest, start_time: float):
             logger.warning(f"⚠️ Ошибка при обновлении счетчика активных запросов для {model_key}: {e}")
 
 
-async def generate_stream(model, tokenizer, prompt: str, max_tokens: int, model_lock: threading.Lock = None):
-    """Streaming генерация с защитой от Metal конфликтов"""
-    # MLX не поддерживает streaming напрямую, эмулируем
-    # КРИТИЧНО: Используем блокировку модели для защиты от Metal конфликтов
-    if model_lock is None:
-        # Если блокировка не передана, создаем временную (не должно происходить)
-        logger.warning("⚠️ generate_stream вызван без блокировки модели, создаем временную")
-        model_lock = threading.Lock()
-    
-    loop = asyncio.get_event_loop()
-    
-    def generate_with_lock():
-        """Генерация с блокировкой модели"""
-        with model_lock:
-            return generate(model, tokenizer, prompt=prompt, max_tokens=max_tokens)
-    
-    response = await loop.run_in_executor(None, generate_with_lock)
-    
-    # Разбиваем на токены для эмуляции streaming
-    for char in response:
-        yield json.dumps({"response": char, "done": False}) + "\n"
+async def generate_stream(seq):
+    """Streaming генерация: токены последовательности по мере шагов планировщика"""
+    try:
+        async for token in seq.stream():
+            yield json.dumps({"response": token, "done": False}) + "\n"
+    finally:
+        seq.cancel()  # клиент отключился — освобождаем место в батче
     
     yield json.dumps({"response": "", "done": True}) + "\n"
 
@@ -1120,6 +1148,7 @@ async def queue_stats():
     if REQUEST_QUEUE_AVAILABLE:
         queue = get_request_queue()
         stats = queue.get_stats()
+        stats["schedulers"] = {key: sched.get_stats() for key, sched in _schedulers.items()}
         return stats
     else:
         return {
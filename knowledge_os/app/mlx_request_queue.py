@@ -55,6 +55,8 @@ class MLXRequestQueue:
         self.active_requests = 0
         self.queue = asyncio.PriorityQueue(maxsize=max_queue_size)
         self._lock = asyncio.Lock()
+        # Освобождение слота будит обработчик очереди и wait_for_slot (без sleep-поллинга)
+        self._slot_freed = asyncio.Condition(self._lock)
         self._processing = False
         self._stats = {
             "total_queued": 0,
@@ -135,7 +137,11 @@ class MLXRequestQueue:
             return False, request_id, None
     
     async def _process_queue(self):
-        """Обработать очередь запросов"""
+        """
+        Обработать очередь запросов.
+        Один долгоживущий обработчик: ждёт свободный слот (Condition), затем берёт из очереди
+        запрос с наивысшим приоритетом — поздний HIGH обгоняет ждущий слота MEDIUM.
+        """
         if self._processing:
             return
         
@@ -144,24 +150,11 @@ class MLXRequestQueue:
         
         try:
             while True:
-                # Проверяем, есть ли свободные слоты
-                async with self._lock:
-                    if self.active_requests >= self.max_concurrent:
-                        # Нет свободных слотов, ждем
-                        await asyncio.sleep(0.1)
-                        continue
+                async with self._slot_freed:
+                    await self._slot_freed.wait_for(lambda: self.active_requests < self.max_concurrent)
                 
                 # Получаем следующий запрос из очереди (приоритетная очередь)
-                try:
-                    priority_value, request = await asyncio.wait_for(
-                        self.queue.get(),
-                        timeout=1.0  # Небольшая задержка для батчинга
-                    )
-                except asyncio.TimeoutError:
-                    # Очередь пуста, проверяем еще раз перед выходом
-                    if self.queue.empty() and self.active_requests == 0:
-                        break
-                    continue
+                priority_value, request = await self.queue.get()
                 
                 # Проверяем таймаут
                 if request.is_expired():
@@ -172,13 +165,7 @@ class MLXRequestQueue:
                     self._stats["total_expired"] += 1
                     continue
                 
-                # Выполняем запрос
                 async with self._lock:
-                    if self.active_requests >= self.max_concurrent:
-                        # Слот занят, возвращаем в очередь
-                        await self.queue.put((priority_value, request))
-                        await asyncio.sleep(0.1)
-                        continue
                     self.active_requests += 1
                 
                 logger.debug(
@@ -221,13 +208,10 @@ class MLXRequestQueue:
             )
             raise
         finally:
-            # Освобождаем слот
-            async with self._lock:
+            # Освобождаем слот и будим ожидающих
+            async with self._slot_freed:
                 self.active_requests = max(0, self.active_requests - 1)
-            
-            # Продолжаем обработку очереди
-            if not self.queue.empty():
-                asyncio.create_task(self._process_queue())
+                self._slot_freed.notify_all()
     
     def get_stats(self) -> Dict[str, Any]:
         """Получить статистику очереди"""
@@ -250,13 +234,15 @@ class MLXRequestQueue:
         Returns:
             True если слот освободился, False если таймаут
         """
-        start = datetime.now()
-        while (datetime.now() - start).total_seconds() < timeout:
-            async with self._lock:
-                if self.active_requests < self.max_concurrent:
-                    return True
-            await asyncio.sleep(0.1)
-        return False
+        async with self._slot_freed:
+            try:
+                await asyncio.wait_for(
+                    self._slot_freed.wait_for(lambda: self.active_requests < self.max_concurrent),
+                    timeout=timeout,
+                )
+                return True
+            except asyncio.TimeoutError:
+                return False
 
 
 # Глобальный экземпляр очереди
@@ -5,6 +5,7 @@ Singularity 5.0: Quality-First Optimizations
 
 import logging
 import asyncio
+from collections import deque
 from typing import Dict, Optional, Tuple, List
 from dataclasses import dataclass
 from enum import Enum
@@ -51,7 +52,7 @@ class QualityAssurance:
             min_quality_threshold: Минимальный порог качества (0.0-1.0)
         """
         self.min_quality_threshold = min_quality_threshold
-        self.quality_history = []  # История оценок для анализа
+        self.quality_history = deque(maxlen=1000)  # История оценок (экземпляр общий на процесс)
     
     async def validate_response(
         self, 
@@ -14,6 +14,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from starlette.responses import Response
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
+import asyncio
 import asyncpg
 import os
 import sys
@@ -30,12 +31,14 @@ if _app_dir not in sys.path:
 
 @asynccontextmanager
 async def _lifespan(app: FastAPI):
-    """Startup: миграции. Shutdown: закрыть общий HTTP-клиент (мировая практика: lifespan вместо on_event)."""
+    """Startup: миграции, фоновый снимок метрик. Shutdown: закрыть общий HTTP-клиент (мировая практика: lifespan вместо on_event)."""
     await _ensure_orchestrator_version_migration()
     await _ensure_projects_table_migration()
     await _ensure_project_context_on_tasks_migration()
     await _ensure_model_performance_metrics_migration()
+    metrics_task = asyncio.create_task(_metrics_snapshot_loop())
     yield
+    metrics_task.cancel()
     try:
         from http_client import close_http_client
         await close_http_client()
@@ -351,123 +354,55 @@ async def get_models_metrics():
     """
     Метрики по моделям: время загрузки, выгрузки, развёртывания, обработки (с запасом).
     Заполняются при появлении новой модели (probe) и при каждом скане (MODEL_PROBE_ON_SCAN).
+    Скан выполняет фоновый цикл снимка метрик; здесь — последний результат.
     """
     try:
-        from available_models_scanner import get_available_models_with_metrics
-        mlx_url = os.getenv("MLX_API_URL", "http://host.docker.internal:11435")
-        ollama_url = os.getenv("OLLAMA_API_URL", "http://host.docker.internal:11434")
-        _, _, metrics = await get_available_models_with_metrics(mlx_url, ollama_url, force_refresh=False)
+        if _metrics_snapshot.model_metrics is None:
+            await _refresh_model_metrics()
+        metrics = _metrics_snapshot.model_metrics
         return {"status": "success", "metrics": metrics}
     except Exception as e:
         return {"status": "error", "error": str(e), "metrics": {"ollama": {}, "mlx": {}}}
 
 
-async def _ab_metrics_prometheus(hours: int = 24) -> str:
-    """A/B метрики из tasks (orchestrator_version) в формате Prometheus."""
-    lines = []
-    try:
-        pool = await _get_db()
-        async with pool.acquire() as conn:
-            query = """
-            SELECT orchestrator_version,
-                   COUNT(*) AS total,
-                   COUNT(*) FILTER (WHERE status = 'completed') AS completed,
-                   AVG(EXTRACT(EPOCH FROM (completed_at - created_at))) FILTER (WHERE completed_at IS NOT NULL) AS avg_duration
-            FROM tasks
-            WHERE created_at > NOW() - make_interval(hours => $1)
-              AND orchestrator_version IN ('v2', 'existing')
-            GROUP BY orchestrator_version
-            """
-            rows = await conn.fetch(query, hours)
-        v2_total = v2_success = v2_dur = 0
-        ex_total = ex_success = ex_dur = 0
-        for r in rows:
-            ver = (r["orchestrator_version"] or "").strip().lower()
-            total = r["total"] or 0
-            completed = r["completed"] or 0
-            avg_d = float(r["avg_duration"] or 0)
-            if ver == "v2":
-                v2_total, v2_success, v2_dur = total, completed, avg_d
-            else:
-                ex_total, ex_success, ex_dur = total, completed, avg_d
-        v2_sr = v2_success / v2_total if v2_total else 0
-        ex_sr = ex_success / ex_total if ex_total else 0
-        lines = [
-            f"orchestration_v2_tasks_total {v2_total}",
-            f"orchestration_existing_tasks_total {ex_total}",
-            f"orchestration_v2_success_rate {v2_sr:.4f}",
-            f"orchestration_existing_success_rate {ex_sr:.4f}",
-            f"orchestration_v2_avg_duration_seconds {v2_dur:.2f}",
-            f"orchestration_existing_avg_duration_seconds {ex_dur:.2f}",
-        ]
-    except Exception as e:
-        lines = [f"# A/B metrics error: {e}"]
-    return "\n".join(lines)
-
-
-def _normalize_last_error_type(err: Optional[str]) -> str:
-    """Нормализация last_error к типу для метрик (PROJECT_GAPS §3, SRE)."""
-    if not err or not (s := str(err).strip().lower()):
-        return "unknown"
-    if "timeout" in s or "timed out" in s:
-        return "timeout"
-    if "empty_or_short" in s or "empty" in s or "short response" in s:
-        return "empty_or_short_response"
-    if "validation" in s or "score" in s or "validat" in s:
-        return "validation_failed"
-    if "connection" in s or "refused" in s or "unavailable" in s or "connect" in s:
-        return "connection_error"
-    if "oom" in s or "memory" in s or "metal" in s:
-        return "oom_or_metal"
-    return "other"
-
-
-async def _deferred_metrics_prometheus() -> str:
-    """Метрики очереди на ручную проверку (deferred_to_human, last_error по типам). PROJECT_GAPS §3, VERIFICATION_CHECKLIST §3."""
-    lines = ["# Deferred to human (queue for manual review)"]
-    try:
-        from db_pool import get_pool
-        pool = await get_pool()
-        async with pool.acquire() as conn:
-            deferred_count = await conn.fetchval(
-                "SELECT COUNT(*) FROM tasks WHERE status = $1 AND (metadata->>$2)::text = $3",
-                "completed", "deferred_to_human", "true"
-            )
-            lines.append(f"knowledge_os_tasks_deferred_to_human_total {int(deferred_count or 0)}")
-            rows = await conn.fetch(
-                """SELECT metadata->>'last_error' as err FROM tasks
-                   WHERE status = 'completed' AND (metadata->>'deferred_to_human') = 'true'
-                   ORDER BY updated_at DESC NULLS LAST LIMIT 500"""
-            )
-            from collections import Counter
-            types = Counter(_normalize_last_error_type(r.get("err") if r else None) for r in rows)
-            for error_type, count in types.most_common():
-                if count > 0:
-                    safe_type = error_type.replace('"', '_')
-                    lines.append(f'knowledge_os_tasks_deferred_last_error_total{{error_type="{safe_type}"}} {count}')
-    except Exception as e:
-        lines.append(f"# deferred_metrics error: {e}")
-        # Fallback: всегда выводим метрику (0), чтобы /metrics содержал имя и тесты/ Prometheus не ломались
-        lines.append("knowledge_os_tasks_deferred_to_human_total 0")
-    return "\n".join(lines)
+try:
+    from task_metrics import SNAPSHOT_REFRESH_SECONDS, MetricsSnapshot, ensure_metrics_schema
+except ImportError:
+    from app.task_metrics import SNAPSHOT_REFRESH_SECONDS, MetricsSnapshot, ensure_metrics_schema
+
+# Снимок метрик в памяти: скрейп /metrics не трогает tasks (агрегаты из событий триггера — task_metrics_rollup)
+_metrics_snapshot = MetricsSnapshot()
+
+
+async def _refresh_model_metrics() -> None:
+    """Скан моделей вне пути запроса: /api/models/metrics отдаёт последний результат."""
+    from available_models_scanner import get_available_models_with_metrics
+    mlx_url = os.getenv("MLX_API_URL", "http://host.docker.internal:11435")
+    ollama_url = os.getenv("OLLAMA_API_URL", "http://host.docker.internal:11434")
+    _, _, metrics = await get_available_models_with_metrics(mlx_url, ollama_url, force_refresh=False)
+    _metrics_snapshot.model_metrics = metrics
 
 
-async def _worker_web_search_metrics_prometheus() -> str:
-    """П.1 пушка: метрики веб-блока в задачах воркера (за последние 24 ч)."""
-    lines = ["# Worker web search (tasks with web block, last 24h)"]
+async def _metrics_snapshot_loop() -> None:
+    """Фон: обновление снимка метрик задач и метрик моделей раз в SNAPSHOT_REFRESH_SECONDS."""
     try:
         pool = await _get_db()
         async with pool.acquire() as conn:
-            n = await conn.fetchval(
-                """SELECT COUNT(*) FROM tasks
-                   WHERE status = 'completed' AND updated_at > NOW() - INTERVAL '24 hours'
-                     AND (metadata->>'had_web_block') = 'true'"""
-            )
-            lines.append(f"knowledge_os_tasks_web_block_total {int(n or 0)}")
+            await ensure_metrics_schema(conn)
     except Exception as e:
-        lines.append(f"# worker_web_search_metrics error: {e}")
-        lines.append("knowledge_os_tasks_web_block_total 0")
-    return "\n".join(lines)
+        pool = None
+        print(f"⚠️ [METRICS] task_metrics_rollup недоступна: {e}")
+    while True:
+        if pool is not None:
+            try:
+                await _metrics_snapshot.refresh(pool)
+            except Exception as e:
+                print(f"⚠️ [METRICS] Обновление снимка: {e}")
+        try:
+            await _refresh_model_metrics()
+        except Exception:
+            pass
+        await asyncio.sleep(SNAPSHOT_REFRESH_SECONDS)
 
 
 async def _orchestration_metrics_prometheus() -> str:
@@ -479,10 +414,7 @@ async def _orchestration_metrics_prometheus() -> str:
             from app.task_orchestration import OrchestrationMonitor
         monitor = OrchestrationMonitor()
         text = await monitor.export_to_prometheus()
-        ab_text = await _ab_metrics_prometheus(24)
-        deferred_text = await _deferred_metrics_prometheus()
-        web_text = await _worker_web_search_metrics_prometheus()
-        return text + "\n# A/B (last 24h)\n" + ab_text + "\n" + deferred_text + "\n" + web_text
+        return text + "\n# A/B (last 24h)\n" + _metrics_snapshot.text
     except Exception as e:
         return f"# ERROR: {e}\n"
 
@@ -0,0 +1,256 @@
+"""
+Skill Index - in-memory индекс skills для выбора по тексту задачи
+
+Строится один раз на процесс из SkillRegistry (SKILL.md уже распарсены):
+- обратный индекс нормализованный токен → skills;
+- BM25 по имени (с повышенным весом), описанию и категории;
+- заранее обрезанные фрагменты инструкций для промпта.
+
+Выбор skills для задачи — чистый lookup в памяти, без чтения диска.
+Обновляется по событиям SKILL_ADDED / SKILL_UPDATED / SKILL_REMOVED от Skill Loader
+(watchdog hot-reload).
+"""
+
+import logging
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from skill_registry import Skill, SkillRegistry, get_skill_registry
+except ImportError:
+    from app.skill_registry import Skill, SkillRegistry, get_skill_registry
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[^\W_]{2,}", re.UNICODE)
+
+# Вес полей документа: совпадение с именем skill важнее совпадения с описанием
+NAME_WEIGHT = 3
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Бонус, если имя skill целиком встречается в тексте задачи (как в прежнем отборе)
+PHRASE_BONUS = 2.0
+
+
+def tokenize(text: str) -> List[str]:
+    """Нормализованные токены: нижний регистр, буквы/цифры, длина ≥ 2."""
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+@dataclass(frozen=True)
+class IndexedSkill:
+    """Skill в индексе: ключ — имя папки (как в ROLE_DEPARTMENT_TO_SKILLS)."""
+    key: str
+    phrase: str
+    length: int
+    term_freqs: Dict[str, int]
+    snippet: str
+
+
+class SkillIndex:
+    """Обратный индекс skills с BM25-ранжированием."""
+
+    def __init__(self, registry: Optional[SkillRegistry] = None, max_snippet_chars: int = 2000):
+        self.registry = registry
+        self.max_snippet_chars = max_snippet_chars
+        self._skills: Dict[str, IndexedSkill] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # токен -> {key: tf}
+        self._avg_len = 0.0
+        self._lock = threading.Lock()  # обновления из hot-reload и чтения из воркера
+
+    # --- построение ---
+
+    @staticmethod
+    def skill_key(skill: Skill) -> str:
+        return Path(skill.skill_path).name if skill.skill_path else skill.name
+
+    def _trim(self, instructions: str) -> str:
+        text = (instructions or "").strip()
+        if len(text) > self.max_snippet_chars:
+            return text[:self.max_snippet_chars] + "\n..."
+        return text
+
+    def _make_entry(self, skill: Skill) -> IndexedSkill:
+        key = self.skill_key(skill)
+        name_tokens = tokenize(f"{key} {skill.name}".replace("-", " "))
+        body_tokens = tokenize(f"{skill.description} {skill.category or ''}")
+        term_freqs = Counter(body_tokens)
+        for token in name_tokens:
+            term_freqs[token] += NAME_WEIGHT
+        return IndexedSkill(
+            key=key,
+            phrase=key.replace("-", " ").lower(),
+            length=sum(term_freqs.values()),
+            term_freqs=dict(term_freqs),
+            snippet=self._trim(skill.instructions),
+        )
+
+    def build(self, skills: Optional[Iterable[Skill]] = None) -> "SkillIndex":
+        """Полная перестройка индекса (по умолчанию — из реестра)."""
+        if skills is None:
+            if self.registry is None:
+                self.registry = get_skill_registry()
+            skills = self.registry.list_skills()
+        entries = [self._make_entry(s) for s in skills]
+        with self._lock:
+            self._skills.clear()
+            self._postings = defaultdict(dict)
+            for entry in entries:
+                self._add_locked(entry)
+        logger.info("📇 Skill Index построен: %d skills, %d токенов", len(self._skills), len(self._postings))
+        return self
+
+    def _add_locked(self, entry: IndexedSkill) -> None:
+        self._remove_locked(entry.key)
+        self._skills[entry.key] = entry
+        for token, tf in entry.term_freqs.items():
+            self._postings[token][entry.key] = tf
+        self._recompute_avg_locked()
+
+    def _remove_locked(self, key: str) -> None:
+        old = self._skills.pop(key, None)
+        if old is None:
+            return
+        for token in old.term_freqs:
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[token]
+        self._recompute_avg_locked()
+
+    def _recompute_avg_locked(self) -> None:
+        total = sum(s.length for s in self._skills.values())
+        self._avg_len = total / len(self._skills) if self._skills else 0.0
+
+    def update_skill(self, skill: Skill) -> None:
+        """Добавить или обновить один skill (hot-reload)."""
+        entry = self._make_entry(skill)
+        with self._lock:
+            self._add_locked(entry)
+
+    def remove_skill(self, key: str) -> None:
+        with self._lock:
+            self._remove_locked(key)
+
+    # --- поиск ---
+
+    def search(self, text: str, limit: int = 3) -> List[Tuple[str, float]]:
+        """BM25-ранжирование skills по тексту. Возвращает [(key, score)] со score > 0."""
+        query = Counter(tokenize(text.replace("-", " ")))
+        lowered = (text or "").lower().replace("-", " ")
+        with self._lock:
+            n_docs = len(self._skills)
+            if not n_docs:
+                return []
+            scores: Dict[str, float] = defaultdict(float)
+            for token in query:
+                postings = self._postings.get(token)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+                for key, tf in postings.items():
+                    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * self._skills[key].length / (self._avg_len or 1.0))
+                    scores[key] += idf * tf * (BM25_K1 + 1.0) / (tf + norm)
+            for key, entry in self._skills.items():
+                if entry.phrase and entry.phrase in lowered:
+                    scores[key] += PHRASE_BONUS
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], kv[0]))
+        return [(key, score) for key, score in ranked[:limit] if score > 0]
+
+    def select(self, task_title: str, task_description: str, max_skills: int = 3) -> List[str]:
+        """Ключи (папки) до max_skills самых релевантных задаче skills."""
+        return [key for key, _ in self.search(f"{task_title} {task_description}", max_skills)]
+
+    def snippet(self, key: str) -> Optional[str]:
+        entry = self._skills.get(key)
+        return entry.snippet if entry else None
+
+    def snippets_block(self, keys: List[str], limit: int = 3) -> str:
+        """Блок инструкций для промпта из заранее обрезанных фрагментов."""
+        parts = []
+        for key in keys[:limit]:
+            text = self.snippet(key)
+            if text:
+                parts.append(f"[{key}]\n{text}")
+        if not parts:
+            return ""
+        return "\n\n📋 ИНСТРУКЦИИ ИЗ СКИЛЛОВ (используй при решении):\n" + "\n\n---\n\n".join(parts)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._skills
+
+    def __len__(self) -> int:
+        return len(self._skills)
+
+    # --- hot-reload ---
+
+    def attach(self, event_bus) -> None:
+        """Подписка на события Skill Loader (watchdog): индекс обновляется без перезапуска."""
+        try:
+            from event_bus import EventType
+        except ImportError:
+            from app.event_bus import EventType
+
+        async def _on_skill_changed(event):
+            payload = event.payload or {}
+            skill = self.registry.get_skill(payload.get("skill_name", "")) if self.registry else None
+            if skill is not None:
+                self.update_skill(skill)
+                logger.info("📇 Skill Index: обновлён %s", self.skill_key(skill))
+
+        async def _on_skill_removed(event):
+            payload = event.payload or {}
+            path = payload.get("skill_path")
+            self.remove_skill(Path(path).name if path else payload.get("skill_name", ""))
+
+        event_bus.subscribe(EventType.SKILL_ADDED, _on_skill_changed)
+        event_bus.subscribe(EventType.SKILL_UPDATED, _on_skill_changed)
+        event_bus.subscribe(EventType.SKILL_REMOVED, _on_skill_removed)
+
+    def get_stats(self) -> Dict[str, int]:
+        return {"skills": len(self._skills), "tokens": len(self._postings)}
+
+
+_global_skill_index: Optional[SkillIndex] = None
+_global_lock = threading.Lock()
+
+
+def get_skill_index() -> SkillIndex:
+    """Глобальный Skill Index процесса (строится при первом обращении)."""
+    global _global_skill_index
+    if _global_skill_index is None:
+        with _global_lock:
+            if _global_skill_index is None:
+                _global_skill_index = SkillIndex(get_skill_registry()).build()
+    return _global_skill_index
+
+
+async def start_skill_index_watcher():
+    """Запускает Skill Loader (watchdog) и подписывает глобальный индекс на его события.
+
+    Возвращает SkillLoader или None, если hot-reload недоступен.
+    """
+    index = get_skill_index()
+    try:
+        try:
+            from event_bus import get_event_bus
+            from skill_loader import SkillLoader
+        except ImportError:
+            from app.event_bus import get_event_bus
+            from app.skill_loader import SkillLoader
+    except ImportError as e:
+        logger.debug("Skill Index hot-reload недоступен: %s", e)
+        return None
+    event_bus = get_event_bus()
+    await event_bus.start()
+    index.attach(event_bus)
+    loader = SkillLoader(skill_registry=index.registry)
+    await loader.start_watcher()
+    return loader
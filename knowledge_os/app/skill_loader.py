@@ -24,8 +24,12 @@ except ImportError:
     FileSystemEvent = None
     logger.warning("⚠️ watchdog не установлен — hot-reload skills отключен. Установите: pip install watchdog (есть в requirements.txt)")
 
-from app.skill_registry import SkillRegistry, Skill, SkillSource, get_skill_registry
-from app.event_bus import get_event_bus, Event, EventType
+try:
+    from skill_registry import SkillRegistry, Skill, SkillSource, get_skill_registry
+    from event_bus import get_event_bus, Event, EventType
+except ImportError:
+    from app.skill_registry import SkillRegistry, Skill, SkillSource, get_skill_registry
+    from app.event_bus import get_event_bus, Event, EventType
 
 
 # SkillFileHandler только если watchdog доступен
@@ -33,11 +37,12 @@ if WATCHDOG_AVAILABLE and FileSystemEventHandler is not None:
     class SkillFileHandler(FileSystemEventHandler):
         """Обработчик изменений SKILL.md файлов"""
         
-        def __init__(self, skill_loader, debounce_ms: int = 250):
+        def __init__(self, skill_loader, debounce_ms: int = 250, loop: Optional[asyncio.AbstractEventLoop] = None):
             self.skill_loader = skill_loader
             self.debounce_ms = debounce_ms
             self.pending_reloads: Set[str] = set()
             self._reload_tasks: Dict[str, asyncio.Task] = {}
+            self._loop = loop  # watchdog вызывает обработчики из своего потока
         
         def _should_ignore(self, file_path: str) -> bool:
             """Проверить, нужно ли игнорировать файл"""
@@ -61,7 +66,17 @@ if WATCHDOG_AVAILABLE and FileSystemEventHandler is not None:
                 return
             
             skill_dir = str(Path(event.src_path).parent)
-            
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._schedule_reload, skill_dir)
+            else:
+                self._schedule_reload(skill_dir)
+        
+        def on_created(self, event: FileSystemEvent):
+            """Новый SKILL.md — та же перезагрузка"""
+            self.on_modified(event)
+        
+        def _schedule_reload(self, skill_dir: str):
+            """Ставит перезагрузку с debounce (выполняется в event loop)"""
             # Отменяем предыдущую задачу перезагрузки для этого skill
             if skill_dir in self._reload_tasks:
                 self._reload_tasks[skill_dir].cancel()
@@ -209,7 +224,7 @@ class SkillLoader:
         
         try:
             # Создаем обработчик
-            self.handler = SkillFileHandler(self, self.watch_debounce_ms)
+            self.handler = SkillFileHandler(self, self.watch_debounce_ms, loop=asyncio.get_running_loop())
             
             # Регистрируем наблюдателей для всех директорий skills
             dirs_to_watch = []
@@ -9,6 +9,25 @@ from datetime import datetime
 from functools import partial
 from typing import Optional, List
 
+try:
+    from task_queue import (
+        TASK_LEASE_SECONDS, WORKER_ID, TaskNotifier, claim_tasks, ensure_queue_schema,
+        renew_leases, renew_task_lease, seconds_until_next_retry,
+    )
+except ImportError:
+    from app.task_queue import (
+        TASK_LEASE_SECONDS, WORKER_ID, TaskNotifier, claim_tasks, ensure_queue_schema,
+        renew_leases, renew_task_lease, seconds_until_next_retry,
+    )
+try:
+    from task_metrics import ensure_metrics_schema, run_rollup_loop
+except ImportError:
+    from app.task_metrics import ensure_metrics_schema, run_rollup_loop
+try:
+    from llm_singleflight import get_llm_singleflight, serve_metrics
+except ImportError:
+    from app.llm_singleflight import get_llm_singleflight, serve_metrics
+
 logger = logging.getLogger(__name__)
 
 # Маппинг role/department → папки скиллов (П.2 PRINCIPLE_EXPERTS_FIRST). Ключи — подстроки для role/department (lower).
@@ -24,69 +43,23 @@ ROLE_DEPARTMENT_TO_SKILLS = {
 }
 
 
-def _read_skill_snippets_sync(skill_folders: List[str], max_chars_per_skill: int = 2000) -> str:
-    """Читает первые max_chars_per_skill символов из SKILL.md для каждой папки. Sync — вызывать через run_in_executor."""
-    skills_dir = os.path.join(os.path.dirname(__file__), "skills")
-    parts = []
-    for folder in skill_folders[:3]:  # П.2 пушка: до 3 скиллов
-        path = os.path.join(skills_dir, folder, "SKILL.md")
-        if not os.path.isfile(path):
-            continue
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                raw = f.read()
-            # Пропускаем YAML frontmatter, берём инструкции
-            if "---" in raw:
-                parts_fm = raw.split("---", 2)
-                text = parts_fm[2].strip() if len(parts_fm) >= 3 else raw
-            else:
-                text = raw
-            snippet = text[:max_chars_per_skill]
-            if len(text) > max_chars_per_skill:
-                snippet += "\n..."
-            parts.append(f"[{folder}]\n{snippet}")
-        except Exception as e:
-            logger.debug("Skill read failed %s: %s", path, e)
-    if not parts:
-        return ""
-    return "\n\n📋 ИНСТРУКЦИИ ИЗ СКИЛЛОВ (используй при решении):\n" + "\n\n---\n\n".join(parts)
+def _get_skill_index():
+    """Глобальный in-memory Skill Index (строится один раз из SkillRegistry)."""
+    try:
+        from skill_index import get_skill_index
+    except ImportError:
+        from app.skill_index import get_skill_index
+    return get_skill_index()
 
 
-def _get_skill_description_sync(skills_dir: str, folder: str) -> str:
-    """Читает из SKILL.md description из frontmatter или имя папки. Sync."""
-    path = os.path.join(skills_dir, folder, "SKILL.md")
-    if not os.path.isfile(path):
-        return folder.replace("-", " ")
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            raw = f.read(1500)
-        if "---" in raw and "description:" in raw.lower():
-            for line in raw.split("\n"):
-                if line.strip().lower().startswith("description:"):
-                    return line.split(":", 1)[1].strip().strip('"') + " " + folder.replace("-", " ")
-        return folder.replace("-", " ")
-    except Exception:
-        return folder.replace("-", " ")
-
-
-def _select_skills_by_relevance_sync(task_title: str, task_description: str, max_skills: int = 3) -> List[str]:
-    """П.2 пушка: по ключевым словам задачи выбирает до max_skills скиллов (по совпадению с именем/description). Sync."""
-    skills_dir = os.path.join(os.path.dirname(__file__), "skills")
-    if not os.path.isdir(skills_dir):
-        return []
-    task_text = f"{task_title} {task_description}".lower()
-    task_words = set(_ for _ in task_text.replace("-", " ").split() if len(_) > 1)
-    scored = []
-    for folder in os.listdir(skills_dir):
-        if not os.path.isdir(os.path.join(skills_dir, folder)) or folder.startswith("."):
-            continue
-        desc = _get_skill_description_sync(skills_dir, folder).lower()
-        desc_words = set(_ for _ in desc.replace("-", " ").split() if len(_) > 1)
-        overlap = len(task_words & desc_words)
-        if overlap > 0 or folder.replace("-", " ") in task_text:
-            scored.append((overlap + (2 if folder.replace("-", " ") in task_text else 0), folder))
-    scored.sort(key=lambda x: -x[0])
-    return [f for _, f in scored[:max_skills]]
+def _read_skill_snippets(skill_folders: List[str]) -> str:
+    """Блок инструкций до 3 скиллов из заранее обрезанных фрагментов индекса (без чтения диска)."""
+    return _get_skill_index().snippets_block(skill_folders, limit=3)  # П.2 пушка: до 3 скиллов
+
+
+def _select_skills_by_relevance(task_title: str, task_description: str, max_skills: int = 3) -> List[str]:
+    """П.2 пушка: BM25 по обратному индексу skills (имя/description), до max_skills папок."""
+    return _get_skill_index().select(task_title, task_description, max_skills)
 
 
 # Маркеры запроса актуальных данных — при наличии вызываем веб-поиск (П.1 PRINCIPLE_EXPERTS_FIRST)
@@ -153,7 +126,7 @@ async def get_pool():
     return _pool
 
 try:
-    from ai_core import run_smart_agent_async
+    from ai_core import run_smart_agent_async, init_components, shutdown_components
 except ImportError:
     # Попытка импорта с полным путем
     import importlib.util
@@ -162,6 +135,8 @@ except ImportError:
     ai_core = importlib.util.module_from_spec(spec)
     spec.loader.exec_module(ai_core)
     run_smart_agent_async = ai_core.run_smart_agent_async
+    init_components = ai_core.init_components
+    shutdown_components = ai_core.shutdown_components
 
 async def run_cursor_agent_smart(prompt: str, expert_name: str, router=None):
     """Smart replacement for the old cursor-agent call. router — роутер с _preferred_source (mlx/ollama), чтобы не было гонки при параллельных задачах."""
@@ -315,18 +290,15 @@ async def process_task(pool, task):
     heartbeat_stopped = False
     
     async def update_heartbeat():
-        """Heartbeat с защитой от падений - обновляет updated_at каждые 15 секунд"""
+        """Heartbeat с защитой от падений - продлевает лиз задачи каждые 15 секунд"""
         nonlocal heartbeat_stopped
         while not heartbeat_stopped:
             try:
                 async with pool.acquire() as conn:
-                    # Проверяем, что задача все еще в in_progress (не была сброшена монитором)
-                    status = await conn.fetchval("SELECT status FROM tasks WHERE id = $1", task_id)
-                    if status != 'in_progress':
+                    # Лиз потерян (задача сброшена или перехвачена другим воркером) — останавливаемся
+                    if not await renew_task_lease(conn, task_id):
                         heartbeat_stopped = True
                         break
-                    # Обновляем updated_at - это критично для предотвращения застревания
-                    await conn.execute("UPDATE tasks SET updated_at = NOW() WHERE id = $1 AND status = 'in_progress'", task_id)
                 await asyncio.sleep(15)  # Heartbeat каждые 15 секунд (быстрее для надежности)
             except asyncio.CancelledError:
                 heartbeat_stopped = True
@@ -343,15 +315,15 @@ async def process_task(pool, task):
     # Используем транзакцию для атомарности
     async with pool.acquire() as conn:
         async with conn.transaction():
-            # Порог «зависшая in_progress» — тот же, что и в главном цикле (STUCK_MINUTES), иначе слоты заняты до 1 ч
-            stuck_mins = int(os.getenv('SMART_WORKER_STUCK_MINUTES', '15'))
-            # Обновляем статус с проверкой, что задача не обрабатывается другим worker'ом
+            # Задача захвачена claim_tasks этим воркером; проверяем, что лиз всё ещё наш
+            # (pending — для задач, переданных в обработку напрямую, мимо очереди)
             result = await conn.execute("""
                 UPDATE tasks 
-                SET status = 'in_progress', updated_at = NOW() 
+                SET status = 'in_progress', updated_at = NOW(), claimed_by = $2,
+                    lease_expires_at = NOW() + make_interval(secs => $3::int)
                 WHERE id = $1 
-                AND (status = 'pending' OR (status = 'in_progress' AND updated_at < NOW() - make_interval(mins => $2::int)))
-            """, task_id, stuck_mins)
+                AND (status = 'pending' OR (status = 'in_progress' AND claimed_by = $2))
+            """, task_id, WORKER_ID, TASK_LEASE_SECONDS)
     
             # Если задача уже обрабатывается (не обновилась), пропускаем
             if result == "UPDATE 0":
@@ -478,25 +450,20 @@ async def process_task(pool, task):
             # П.2 PRINCIPLE_EXPERTS_FIRST: инструкции из скиллов по role/department + по релевантности к задаче (до 3)
             skills_block = ""
             try:
-                loop = asyncio.get_event_loop()
                 role_lower = (expert_config.get("role") or "").lower()
                 dept_lower = (expert_config.get("department") or "").lower()
                 skill_folders = []
                 for key, folders in ROLE_DEPARTMENT_TO_SKILLS.items():
                     if key in role_lower or key in dept_lower:
                         skill_folders.extend(f for f in folders if f not in skill_folders)
-                # П.2 пушка: добавить до 3 скиллов по релевантности к title/description
-                task_relevant = await loop.run_in_executor(
-                    None, partial(_select_skills_by_relevance_sync, task["title"], task_description, 3)
-                )
+                # П.2 пушка: добавить до 3 скиллов по релевантности к title/description (lookup в памяти)
+                task_relevant = _select_skills_by_relevance(task["title"], task_description, 3)
                 for f in task_relevant:
                     if f not in skill_folders:
                         skill_folders.append(f)
                 skill_folders = skill_folders[:3]
                 if skill_folders:
-                    skills_block = await loop.run_in_executor(
-                        None, partial(_read_skill_snippets_sync, skill_folders, 2000)
-                    )
+                    skills_block = _read_skill_snippets(skill_folders)
             except Exception as e:
                 logger.debug("Skills block failed: %s", e)
 
@@ -1128,27 +1095,63 @@ async def main():
     except Exception as e:
         logger.debug(f"Could not start corporation learning: {e}")
     
-    # Интервал сброса зависших in_progress: по умолчанию 15 мин (раньше 1 ч — из‑за этого при 10 зависших только 5 pending обрабатывались за цикл, ~5 задач/час)
-    STUCK_MINUTES = int(os.getenv('SMART_WORKER_STUCK_MINUTES', '15'))
+    # Очередь: атомарный захват (SKIP LOCKED) + лизы + LISTEN/NOTIFY (db/migrations/add_task_queue_claiming.sql).
+    # Зависшие задачи больше не сбрасываются отдельным проходом: задачи с истёкшим лизом
+    # (воркер упал) забираются тем же запросом захвата.
+    async with pool.acquire() as conn:
+        await ensure_queue_schema(conn)
+        try:
+            await ensure_metrics_schema(conn)
+        except Exception as e:
+            logger.debug("Task metrics schema not applied: %s", e)
+    notifier = TaskNotifier(DB_URL)
+    IDLE_WAIT_SECONDS = float(os.getenv('SMART_WORKER_IDLE_WAIT', '30'))
+    print(f'[{datetime.now()}] 🔐 Task queue: worker_id={WORKER_ID}, lease={TASK_LEASE_SECONDS}s')
+
+    # id задач, которые этот процесс держит в работе (включая ждущие слота семафора);
+    # ведёт process_work_item. Лизы брошенных задач не продлеваются и истекают.
+    executing_task_ids = set()
+
+    async def keep_leases():
+        """Продлевает лизы задач из executing_task_ids."""
+        while True:
+            await asyncio.sleep(max(5, TASK_LEASE_SECONDS // 4))
+            try:
+                async with pool.acquire() as conn:
+                    await renew_leases(conn, executing_task_ids.copy())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug("Lease renewal failed: %s", e)
+
+    asyncio.create_task(keep_leases())
+    # Метрики задач: события триггера на tasks -> task_metrics_rollup раз в минуту (/metrics читает агрегаты)
+    asyncio.create_task(run_rollup_loop(pool))
+    # Single-flight LLM (dedup_ratio) — свой /metrics: генерации идут в этом процессе, а не в REST API
+    try:
+        await serve_metrics(int(os.getenv('SMART_WORKER_METRICS_PORT', '9108')))
+    except Exception as e:
+        logger.warning("Worker metrics endpoint not started: %s", e)
+
+    # Skill Index: один раз из SkillRegistry + hot-reload по watchdog (выбор скиллов без чтения диска на задачу)
+    try:
+        try:
+            from skill_index import start_skill_index_watcher
+        except ImportError:
+            from app.skill_index import start_skill_index_watcher
+        await start_skill_index_watcher()
+    except Exception as e:
+        logger.debug(f"Skill index watcher not started: {e}")
+
+    # Тёплые компоненты ai_core (кэш, QA, RAG, circuit breakers) — один раз на процесс, а не на задачу
+    health = await init_components()
+    slow = sorted(health.items(), key=lambda kv: kv[1]['build_ms'] or 0, reverse=True)[:3]
+    failed = [name for name, h in health.items() if h['state'] == 'failed']
+    print(f'[{datetime.now()}] 🔥 Components warm: ' + ', '.join(f"{n}={h['build_ms']}ms" for n, h in slow)
+          + (f'; failed: {", ".join(failed)}' if failed else ''))
     
     while True:
         try:
-            # Вернуть зависшие in_progress (> N мин) в pending, чтобы воркер их подхватил
-            async with pool.acquire() as conn:
-                stuck_result = await conn.execute("""
-                    UPDATE tasks
-                    SET status = 'pending', updated_at = NOW(),
-                        metadata = COALESCE(metadata, '{}'::jsonb) || jsonb_build_object(
-                            'stuck_reset', true, 'previous_status', 'in_progress'
-                        )
-                    WHERE status = 'in_progress'
-                      AND updated_at < NOW() - make_interval(mins => $1::int)
-                """, STUCK_MINUTES)
-                if stuck_result and stuck_result.startswith("UPDATE"):
-                    n = stuck_result.split()[-1]
-                    if n != "0":
-                        print(f'[{datetime.now()}] 🔄 Вернуто в очередь зависших задач (>{STUCK_MINUTES} мин): {n}')
-            
             # ═══════════════════════════════════════════════════════════════════════════════
             # BACKPRESSURE: проверка перегрузки MLX/Ollama ПЕРЕД взятием задач (SRE, Елена)
             # Если оба бэкенда перегружены — не брать новые задачи, подождать
@@ -1166,23 +1169,11 @@ async def main():
                 except Exception as e:
                     logger.debug(f"Backpressure check failed: {e}")
             
-            # Используем LEFT JOIN чтобы обрабатывать задачи даже если эксперт не найден
+            # Атомарный захват: задачи переводятся в in_progress под лизом этого воркера,
+            # параллельные воркеры пропускают заблокированные строки (SKIP LOCKED).
             # Приоритизируем задачи с высокой bug_probability (Code-Smell Predictor, Singularity 9.0)
             async with pool.acquire() as conn:
-                tasks = await conn.fetch("""
-                    SELECT t.id, t.title, t.description, t.metadata,
-                           COALESCE(e.name, 'Виктория') as assignee,
-                           COALESCE(e.id, (SELECT id FROM experts WHERE name = 'Виктория' LIMIT 1)) as assignee_expert_id,
-                           COALESCE((t.metadata->>'bug_probability')::float, 0.0) as bug_probability
-                    FROM tasks t 
-                    LEFT JOIN experts e ON t.assignee_expert_id = e.id 
-                    WHERE t.status = 'pending'
-                      AND (t.metadata->>'next_retry_after' IS NULL OR (t.metadata->>'next_retry_after')::timestamptz < NOW())
-                    ORDER BY 
-                        COALESCE((t.metadata->>'bug_probability')::float, 0.0) DESC,  -- Приоритет: задачи с высокой bug_probability
-                        t.created_at ASC 
-                    LIMIT $1
-                """, BATCH_SIZE)
+                tasks = await claim_tasks(conn, BATCH_SIZE)
             
             if tasks:
                 # Адаптивный параллелизм: N по CPU/памяти и MLX/Ollama (ADAPTIVE_WORKER_CONCURRENCY_PLAN, SRE/Performance)
@@ -1205,9 +1196,7 @@ async def main():
                 
                 print(f'[{datetime.now()}] Found {len(tasks)} pending tasks. Processing in parallel (max {effective_n} concurrent)...')
                 
-                # ВАЖНО: Преобразуем asyncpg Records в словари (Records immutable!)
-                tasks = [dict(t) for t in tasks]
-                
+                # claim_tasks уже вернул словари (asyncpg Records immutable!)
                 # РАСПРЕДЕЛЕНИЕ: оркестратор назначает preferred_source при assign_task_to_best_expert
                 # Воркер использует metadata.preferred_source от оркестратора; если нет — fallback по сложности
                 mlx_tasks = []
@@ -1395,28 +1384,44 @@ async def main():
 
                 async def process_work_item(item):
                     kind, payload = item
-                    async with sem:
-                        if kind == "batch":
-                            ok = await process_batch_tasks(pool, payload)
-                            if not ok:
-                                for t in payload:
-                                    await process_task(pool, t)
-                        else:
-                            await process_task(pool, payload)
+                    task_ids = [t['id'] for t in payload] if kind == "batch" else [payload['id']]
+                    executing_task_ids.update(task_ids)
+                    try:
+                        async with sem:
+                            if kind == "batch":
+                                ok = await process_batch_tasks(pool, payload)
+                                if not ok:
+                                    for t in payload:
+                                        await process_task(pool, t)
+                            else:
+                                await process_task(pool, payload)
+                    finally:
+                        executing_task_ids.difference_update(task_ids)
 
                 await asyncio.gather(*[process_work_item(w) for w in work_items], return_exceptions=True)
                 
-                print(f'[{datetime.now()}] ✅ Completed: {len(tasks)} tasks processed')
+                sf = get_llm_singleflight().get_stats()
+                print(f'[{datetime.now()}] ✅ Completed: {len(tasks)} tasks processed '
+                      f'(LLM dedup: {sf["joined"]}/{sf["requests"]}, ratio={sf["dedup_ratio"]})')
             else:
-                print(f'[{datetime.now()}] No pending tasks found. Waiting...')
-            
-            await asyncio.sleep(5)  # Уменьшили задержку, так как обрабатываем быстрее
+                # Простой: ждём NOTIFY о новой задаче или ближайшего next_retry_after
+                async with pool.acquire() as conn:
+                    next_retry = await seconds_until_next_retry(conn)
+                wait_for = IDLE_WAIT_SECONDS if next_retry is None else min(IDLE_WAIT_SECONDS, next_retry + 0.05)
+                print(f'[{datetime.now()}] No pending tasks found. Waiting for notify (≤{wait_for:.1f}s)...')
+                await notifier.wait(wait_for)
         except Exception as e:
             print(f'[{datetime.now()}] Main loop error: {e}')
             import traceback
             traceback.print_exc()
             await asyncio.sleep(30)
 
+async def _run():
+    try:
+        await main()
+    finally:
+        await shutdown_components()
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    asyncio.run(_run())
 
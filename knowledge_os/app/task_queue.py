@@ -0,0 +1,201 @@
+"""
+Протокол очереди задач поверх таблицы tasks (PostgreSQL).
+
+- Атомарный захват: UPDATE ... WHERE id IN (SELECT ... FOR UPDATE SKIP LOCKED) RETURNING —
+  N воркеров не берут одну и ту же задачу и не ждут друг друга на блокировках.
+- Выбор обслуживается частичным индексом idx_tasks_pending_queue по продвинутым
+  колонкам queue_priority / retry_after (миграция add_task_queue_claiming.sql).
+- Лиз вместо сброса «зависших»: воркер продлевает lease_expires_at своих задач;
+  задачи с истёкшим лизом забираются тем же запросом захвата. in_progress без лиза
+  (строки до миграции и писатели мимо очереди: worker.py, expert_worker.py, streaming_worker.py,
+  execute_assignments.py, force_worker.py) забираются по старому правилу — updated_at старше
+  SMART_WORKER_STUCK_MINUTES.
+- LISTEN/NOTIFY на канале tasks_pending: простаивающий воркер просыпается сразу
+  при появлении задачи, а не через 5–30 с опроса.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = "tasks_pending"
+TASK_LEASE_SECONDS = int(os.getenv("SMART_WORKER_LEASE_SECONDS", "120"))
+# Порог «зависшей» in_progress без лиза (прежний проход сброса в smart_worker_autonomous)
+UNLEASED_STUCK_MINUTES = int(os.getenv("SMART_WORKER_STUCK_MINUTES", "15"))
+WORKER_ID = os.getenv("SMART_WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+_MIGRATION_PATH = Path(__file__).resolve().parents[1] / "db" / "migrations" / "add_task_queue_claiming.sql"
+_SCHEMA_LOCK_KEY = 0x7461736B  # 'task' — advisory lock, чтобы воркеры не гоняли DDL одновременно
+
+# Готовые задачи и задачи с истёкшим лизом (или без лиза и давно не обновлявшиеся)
+# захватываются одним оператором.
+# Строки, уже заблокированные другим воркером, пропускаются (SKIP LOCKED).
+# Лимит общий: истёкшие добирают только остаток после готовых ($1 - count(ready)).
+CLAIM_TASKS_SQL = """
+WITH ready AS (
+    SELECT id FROM tasks
+    WHERE status = 'pending'
+      AND (retry_after IS NULL OR retry_after <= NOW())
+    ORDER BY queue_priority DESC, created_at ASC
+    LIMIT $1
+    FOR UPDATE SKIP LOCKED
+), expired AS (
+    SELECT id FROM tasks
+    WHERE status = 'in_progress'
+      AND (lease_expires_at < NOW()
+           OR (lease_expires_at IS NULL AND updated_at < NOW() - make_interval(mins => $4::int)))
+    ORDER BY COALESCE(lease_expires_at, updated_at)
+    LIMIT GREATEST($1 - (SELECT COUNT(*) FROM ready), 0)
+    FOR UPDATE SKIP LOCKED
+), claimed AS (
+    UPDATE tasks t
+    SET status = 'in_progress',
+        updated_at = NOW(),
+        claimed_by = $2,
+        lease_expires_at = NOW() + make_interval(secs => $3::int),
+        metadata = CASE WHEN t.status = 'in_progress'
+            THEN COALESCE(t.metadata, '{}'::jsonb) || jsonb_build_object(
+                'stuck_reset', true, 'previous_claimed_by', t.claimed_by)
+            ELSE t.metadata END
+    WHERE t.id IN (SELECT id FROM ready UNION SELECT id FROM expired)
+    RETURNING t.id, t.title, t.description, t.metadata, t.assignee_expert_id,
+              t.queue_priority, t.created_at, t.orchestrator_version
+)
+SELECT c.id, c.title, c.description, c.metadata, c.created_at, c.orchestrator_version,
+       COALESCE(e.name, 'Виктория') AS assignee,
+       COALESCE(e.id, (SELECT id FROM experts WHERE name = 'Виктория' LIMIT 1)) AS assignee_expert_id,
+       c.queue_priority AS bug_probability
+FROM claimed c
+LEFT JOIN experts e ON c.assignee_expert_id = e.id
+ORDER BY c.queue_priority DESC, c.created_at ASC
+"""
+
+RENEW_LEASES_SQL = """
+UPDATE tasks
+SET lease_expires_at = NOW() + make_interval(secs => $2::int)
+WHERE claimed_by = $1 AND status = 'in_progress' AND id = ANY($3)
+"""
+
+RENEW_TASK_LEASE_SQL = """
+UPDATE tasks
+SET updated_at = NOW(), lease_expires_at = NOW() + make_interval(secs => $3::int)
+WHERE id = $1 AND claimed_by = $2 AND status = 'in_progress'
+"""
+
+NEXT_RETRY_SQL = """
+SELECT MIN(retry_after) FROM tasks
+WHERE status = 'pending' AND retry_after > NOW()
+"""
+
+
+async def ensure_queue_schema(conn) -> None:
+    """Применяет миграцию очереди, если колонок лиза ещё нет (идемпотентно)."""
+    exists = await conn.fetchval(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = 'tasks' AND column_name = 'lease_expires_at'"
+    )
+    if exists:
+        return
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", _SCHEMA_LOCK_KEY)
+        await conn.execute(_MIGRATION_PATH.read_text(encoding="utf-8"))
+    logger.info("Task queue schema migrated (%s)", _MIGRATION_PATH.name)
+
+
+async def claim_tasks(
+    conn,
+    limit: int,
+    worker_id: str = WORKER_ID,
+    lease_seconds: int = TASK_LEASE_SECONDS,
+    stuck_minutes: int = UNLEASED_STUCK_MINUTES,
+) -> List[Dict[str, Any]]:
+    """Атомарно захватывает до limit задач. Возвращает изменяемые словари."""
+    rows = await conn.fetch(CLAIM_TASKS_SQL, limit, worker_id, lease_seconds, stuck_minutes)
+    return [dict(r) for r in rows]
+
+
+async def renew_leases(
+    conn, task_ids, worker_id: str = WORKER_ID, lease_seconds: int = TASK_LEASE_SECONDS
+) -> int:
+    """Продлевает лизы задач task_ids, которые воркер реально выполняет.
+
+    Задачи, брошенные воркером (упавший обработчик, прерванный цикл), не продлеваются —
+    их лиз истекает, и задачу забирает следующий захват.
+    """
+    task_ids = list(task_ids)
+    if not task_ids:
+        return 0
+    result = await conn.execute(RENEW_LEASES_SQL, worker_id, lease_seconds, task_ids)
+    try:
+        return int(str(result).split()[-1])
+    except (ValueError, IndexError):
+        return 0
+
+
+async def renew_task_lease(
+    conn, task_id, worker_id: str = WORKER_ID, lease_seconds: int = TASK_LEASE_SECONDS
+) -> bool:
+    """Heartbeat одной задачи. False — лиз потерян (задача сброшена или перехвачена)."""
+    result = await conn.execute(RENEW_TASK_LEASE_SQL, task_id, worker_id, lease_seconds)
+    return result != "UPDATE 0"
+
+
+async def seconds_until_next_retry(conn) -> Optional[float]:
+    """Через сколько секунд станет готова ближайшая отложенная задача (None — таких нет)."""
+    next_retry = await conn.fetchval(NEXT_RETRY_SQL)
+    if next_retry is None:
+        return None
+    return max(0.0, (next_retry - datetime.now(timezone.utc)).total_seconds())
+
+
+class TaskNotifier:
+    """LISTEN tasks_pending на выделенном соединении (соединения пула сбрасывают слушателей)."""
+
+    def __init__(self, dsn: str, channel: str = NOTIFY_CHANNEL):
+        self.dsn = dsn
+        self.channel = channel
+        self._conn = None
+        self._event = asyncio.Event()
+
+    def _on_notify(self, *_args) -> None:
+        self._event.set()
+
+    async def _ensure_listening(self) -> bool:
+        if self._conn is not None and not self._conn.is_closed():
+            return True
+        try:
+            import asyncpg
+            self._conn = await asyncpg.connect(self.dsn)
+            await self._conn.add_listener(self.channel, self._on_notify)
+            return True
+        except Exception as e:
+            logger.debug("Task notifier LISTEN failed: %s", e)
+            self._conn = None
+            return False
+
+    async def wait(self, timeout: float) -> bool:
+        """Ждёт NOTIFY не дольше timeout. True — пришло уведомление.
+
+        Без рабочего LISTEN-соединения ожидание ограничено 5 с (режим опроса).
+        """
+        if not await self._ensure_listening():
+            timeout = min(timeout, 5.0)
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._event.clear()
+
+    async def close(self) -> None:
+        if self._conn is not None and not self._conn.is_closed():
+            try:
+                await self._conn.remove_listener(self.channel, self._on_notify)
+            finally:
+                await self._conn.close()
+        self._conn = None
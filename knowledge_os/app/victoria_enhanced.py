@@ -131,6 +131,14 @@ except ImportError:
     ENHANCED_CACHE_AVAILABLE = False
     logger.debug("Enhanced Cache не доступен")
 
+# Параллельная сборка контекста simple-промпта (общий пул БД, дедлайн, статистика источников)
+try:
+    from app.context_assembler import CONTEXT_DEADLINE, ContextAssembler, ContextSource, pooled_connection
+    from app.lexical_search import lexical_search
+except ImportError:
+    from context_assembler import CONTEXT_DEADLINE, ContextAssembler, ContextSource, pooled_connection
+    from lexical_search import lexical_search
+
 # Импорты новых компонентов
 try:
     from app.react_agent import ReActAgent
@@ -293,6 +301,7 @@ class VictoriaEnhanced:
         self.skill_loader = None
         self.event_handlers = None
         self.monitoring_started = False
+        self._context_assembler: Optional[ContextAssembler] = None
         
         self._initialize_components()
     
@@ -575,6 +584,42 @@ class VictoriaEnhanced:
         else:
             return "general"
 
+    def _get_context_assembler(self) -> ContextAssembler:
+        """
+        Источники контекста simple-промпта; priority задаёт порядок в промпте:
+        эталон куратора → AI Research → история → похожие задачи → задачи проекта.
+        """
+        if self._context_assembler is None:
+            async def history(req):
+                return await self._get_semantic_history_context(
+                    req.goal, req.params.get("session_id"), embedding=await req.embedding()
+                )
+
+            self._context_assembler = ContextAssembler([
+                ContextSource("curator", lambda req: self._get_curator_rag_context(req.goal), priority=10),
+                ContextSource("ai_research", lambda req: self._get_ai_research_context(req.goal), priority=20),
+                ContextSource(
+                    "history", history, priority=30, budget=CONTEXT_DEADLINE, needs_embedding=True,
+                    applies=lambda req: self._needs_semantic_history(req.goal),
+                ),
+                ContextSource(
+                    "similar_tasks",
+                    lambda req: self._get_similar_tasks_context(req.goal, max_chars=req.params.get("similar_max_chars", 600)),
+                    priority=40,
+                ),
+                ContextSource(
+                    "project_tasks",
+                    lambda req: self._get_project_tasks_context(req.params["project_context"]),
+                    priority=50,
+                    applies=lambda req: bool(req.params.get("project_context")),
+                ),
+            ])
+        return self._context_assembler
+
+    def get_context_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Задержка и доля попаданий по каждому источнику контекста"""
+        return self._get_context_assembler().get_stats()
+
     async def _get_curator_rag_context(self, goal: str) -> str:
         """
         Подтянуть эталон из RAG (домен curator_standards) для кураторских типов запросов.
@@ -594,12 +639,9 @@ class VictoriaEnhanced:
         if not any(kw in goal_lower for kw in curator_keywords):
             return ""
         try:
-            import asyncpg
-            db_url = os.getenv("DATABASE_URL")
-            if not db_url:
-                return ""
-            conn = await asyncpg.connect(db_url)
-            try:
+            async with pooled_connection() as conn:
+                if conn is None:
+                    return ""
                 row = None
                 # 1) Статус проекта / дашборд
                 if "статус" in goal_lower or "дашборд" in goal_lower or "проект" in goal_lower:
@@ -681,8 +723,6 @@ class VictoriaEnhanced:
                     )
                 if row and row["content"]:
                     return (row["content"] or "").strip()[:2000]
-            finally:
-                await conn.close()
         except Exception as e:
             logger.debug("RAG curator_standards: %s", e)
         return ""
@@ -695,36 +735,13 @@ class VictoriaEnhanced:
         if not goal or not goal.strip() or len(goal.strip()) < 4:
             return ""
         try:
-            import asyncpg
-            db_url = os.getenv("DATABASE_URL")
-            if not db_url:
-                return ""
-            conn = await asyncpg.connect(db_url)
-            try:
-                goal_preview = goal.strip()[:80]
-                # Похожие по тексту задачи (metadata->>'task' или content) + приоритет usage_count
-                rows = await conn.fetch(
-                    """SELECT kn.content, kn.metadata
-                       FROM knowledge_nodes kn
-                       JOIN domains d ON d.id = kn.domain_id
-                       WHERE d.name = 'victoria_tasks'
-                         AND (kn.content IS NOT NULL AND length(trim(kn.content)) > 20)
-                         AND (kn.metadata::text ILIKE $1 OR kn.content ILIKE $1)
-                       ORDER BY kn.usage_count DESC NULLS LAST, kn.created_at DESC
-                       LIMIT 2""",
-                    f"%{goal_preview}%"
+            async with pooled_connection() as conn:
+                if conn is None:
+                    return ""
+                # Похожие задачи: full-text + триграммы по content и metadata->>'task', с учётом usage_count
+                rows = await lexical_search(
+                    conn, goal.strip(), domain="victoria_tasks", limit=2, min_content_length=21
                 )
-                if not rows:
-                    # Fallback: последние 2 по использованию (любая задача)
-                    rows = await conn.fetch(
-                        """SELECT kn.content, kn.metadata
-                           FROM knowledge_nodes kn
-                           JOIN domains d ON d.id = kn.domain_id
-                           WHERE d.name = 'victoria_tasks'
-                             AND (kn.content IS NOT NULL AND length(trim(kn.content)) > 20)
-                           ORDER BY kn.usage_count DESC NULLS LAST, kn.created_at DESC
-                           LIMIT 2"""
-                    )
                 if not rows:
                     return ""
                 parts = []
@@ -738,8 +755,6 @@ class VictoriaEnhanced:
                     return ""
                 out = "Похожие успешные решения (из прошлых задач):\n" + "\n".join(parts)
                 return out[:max_chars]
-            finally:
-                await conn.close()
         except Exception as e:
             logger.debug("similar_tasks RAG: %s", e)
         return ""
@@ -753,12 +768,9 @@ class VictoriaEnhanced:
         if not pc:
             return ""
         try:
-            import asyncpg
-            db_url = os.getenv("DATABASE_URL")
-            if not db_url:
-                return ""
-            conn = await asyncpg.connect(db_url)
-            try:
+            async with pooled_connection() as conn:
+                if conn is None:
+                    return ""
                 # Колонка project_context есть после миграции add_project_context_to_tasks
                 rows = await conn.fetch(
                     """SELECT title, status, updated_at
@@ -780,8 +792,6 @@ class VictoriaEnhanced:
                     parts.append(f"- {title} — {status} ({updated_str})")
                 out = "Текущие задачи по проекту (последние):\n" + "\n".join(parts)
                 return out[:max_chars]
-            finally:
-                await conn.close()
         except Exception as e:
             logger.debug("project_tasks context: %s", e)
         return ""
@@ -800,12 +810,9 @@ class VictoriaEnhanced:
             return ""
             
         try:
-            import asyncpg
-            db_url = os.getenv("DATABASE_URL")
-            if not db_url:
-                return ""
-            conn = await asyncpg.connect(db_url)
-            try:
+            async with pooled_connection() as conn:
+                if conn is None:
+                    return ""
                 # Поиск по домену 'AI Research' или метатегу 'external_docs_indexer'
                 rows = await conn.fetch(
                     """SELECT kn.content, kn.metadata->>'title' as title
@@ -831,33 +838,38 @@ class VictoriaEnhanced:
                     return ""
                 
                 return "\n---\n**Актуальные знания AI Research:**\n" + "\n\n".join(parts)
-            finally:
-                await conn.close()
         except Exception as e:
             logger.debug("AI Research RAG: %s", e)
         return ""
 
-    async def _get_semantic_history_context(self, goal: str, session_id: Optional[str] = None) -> str:
+    @staticmethod
+    def _needs_semantic_history(goal: str) -> bool:
+        """Триггеры для поиска по истории («помнишь», «как вчера», «обсуждали»...)"""
+        goal_lower = (goal or "").lower()
+        triggers = ["как мы делали", "как раньше", "помнишь", "вчера", "обсуждали", "прошлый раз"]
+        return any(t in goal_lower for t in triggers)
+
+    async def _get_semantic_history_context(
+        self, goal: str, session_id: Optional[str] = None, embedding: Optional[list] = None
+    ) -> str:
         """
         [SEMANTIC HISTORY SEARCH] Поиск по смыслу в прошлых сессиях (Claude Opus 4.6 Pattern)
+        embedding — готовый эмбеддинг цели (сборщик контекста считает его один раз).
         """
-        goal_lower = goal.lower()
-        # Триггеры для поиска по истории
-        triggers = ["как мы делали", "как раньше", "помнишь", "вчера", "обсуждали", "прошлый раз"]
-        if not any(t in goal_lower for t in triggers):
+        if not self._needs_semantic_history(goal):
             return ""
 
         logger.info(f"🔍 [SEMANTIC HISTORY] Запуск поиска по истории для: '{goal[:50]}...'")
         try:
-            from app.semantic_cache import get_embedding
-            embedding = await get_embedding(goal)
+            if embedding is None:
+                from app.semantic_cache import get_embedding
+                embedding = await get_embedding(goal)
             if not embedding:
                 return ""
             
-            db_url = os.getenv('DATABASE_URL')
-            import asyncpg
-            conn = await asyncpg.connect(db_url)
-            try:
+            async with pooled_connection() as conn:
+                if conn is None:
+                    return ""
                 # Ищем в knowledge_nodes по эмбеддингам
                 rows = await conn.fetch("""
                     SELECT content, metadata->>'date' as date, (1 - (embedding <=> $1::vector)) as similarity
@@ -878,8 +890,6 @@ class VictoriaEnhanced:
                     history_parts.append(f"[{date_str}] {r['content']}")
                 
                 return "\n### ИЗ ИСТОРИИ ПРОШЛЫХ ОБСУЖДЕНИЙ:\n" + "\n---\n".join(history_parts)
-            finally:
-                await conn.close()
         except Exception as e:
             logger.debug(f"Ошибка семантического поиска по истории: {e}")
             return ""
@@ -2472,7 +2482,10 @@ class VictoriaEnhanced:
                     # Промпт зависит от категории
                     if category == "coding":
                         # Для задач с кодом - более детальный промпт; план §2: похожие успешные решения
-                        similar_tasks_coding = await self._get_similar_tasks_context(goal, max_chars=400)
+                        coding_ctx = await self._get_context_assembler().assemble(
+                            goal, {"similar_max_chars": 400}, only=("similar_tasks",)
+                        )
+                        similar_tasks_coding = coding_ctx.get("similar_tasks")
                         similar_block = f"\n{similar_tasks_coding}\n\n" if similar_tasks_coding else ""
                         simple_prompt = f"""Ты Виктория, Team Lead корпорации ATRA, эксперт по программированию. {role_instruction}
 
@@ -2534,11 +2547,16 @@ class VictoriaEnhanced:
                                 logger.debug(f"corporation_data_tool ошибка: {e}")
                             
                             # Fallback: обычный промпт для LLM (не data-вопрос или Text-to-SQL не сработал)
-                            # Подтягиваем эталон из RAG (curator_standards) для «статус проекта» / «что умеешь» — иначе 0/3 по эталону (Backend/QA)
-                            kb_context = await self._get_curator_rag_context(goal)
+                            # Все источники контекста — параллельно, с общим дедлайном (что не успело — не ждём)
+                            prompt_ctx = await self._get_context_assembler().assemble(goal, {
+                                "session_id": context.get("session_id") if context else None,
+                                "project_context": context.get("project_context") if context else None,
+                            })
+                            # Эталон из RAG (curator_standards) для «статус проекта» / «что умеешь» — иначе 0/3 по эталону (Backend/QA)
+                            kb_context = prompt_ctx.get("curator")
                             
-                            # Сингулярность 10.0: Подтягиваем знания AI Research (Anthropic, Google, OpenAI и др.)
-                            ai_research_context = await self._get_ai_research_context(goal)
+                            # Сингулярность 10.0: знания AI Research (Anthropic, Google, OpenAI и др.)
+                            ai_research_context = prompt_ctx.get("ai_research")
                             if ai_research_context:
                                 logger.info("🧠 [AI RESEARCH] Добавлен контекст исследований гигантов")
                                 if kb_context:
@@ -2548,7 +2566,7 @@ class VictoriaEnhanced:
 
                             # [SEMANTIC HISTORY SEARCH] Поиск по смыслу в прошлых сессиях (Claude Opus 4.6 Pattern)
                             # Срабатывает на фразы: "помнишь", "как вчера", "обсуждали", "прошлый раз"
-                            history_context = await self._get_semantic_history_context(goal, context.get("session_id") if context else None)
+                            history_context = prompt_ctx.get("history")
                             if history_context:
                                 if kb_context:
                                     kb_context += "\n" + history_context
@@ -2575,7 +2593,7 @@ class VictoriaEnhanced:
                                     "Статус проекта смотрите в дашборде (Corporation Dashboard, порт 8501) и в списке задач Knowledge OS. "
                                     "Опираюсь на факты из MASTER_REFERENCE и задач, не придумываю сроки."
                                 )
-                            similar_tasks = await self._get_similar_tasks_context(goal)
+                            similar_tasks = prompt_ctx.get("similar_tasks")
                             kb_block = ""
                             if kb_context:
                                 kb_block = f"""По базе знаний (эталон): используй ТОЛЬКО этот контекст для ответа. Не придумывай сроки и детали.
@@ -2586,10 +2604,9 @@ class VictoriaEnhanced:
                                 kb_block += f"""{similar_tasks}
 
 """
-                            if context and context.get("project_context"):
-                                project_tasks = await self._get_project_tasks_context(context["project_context"])
-                                if project_tasks:
-                                    kb_block += f"""{project_tasks}
+                            project_tasks = prompt_ctx.get("project_tasks")
+                            if project_tasks:
+                                kb_block += f"""{project_tasks}
 
 """
                             try:
@@ -0,0 +1,11 @@
+-- Migration: состояние пакетного auto-link (app/batch_linker.py)
+-- watermark — последний обработанный id полного прохода; фиксируется в одной транзакции
+-- со связями блока, поэтому прерванная перестройка графа продолжается с того же места.
+
+CREATE TABLE IF NOT EXISTS auto_link_state (
+    name TEXT PRIMARY KEY,
+    watermark UUID,
+    processed BIGINT NOT NULL DEFAULT 0,
+    links BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,21 @@
+-- Migration: иерархия сообществ графа знаний (GraphRAG)
+-- Заполняется app/graphrag/community_detector.py (COPY во временную таблицу + upsert),
+-- читается graphrag_service.py для глобального контекста.
+--
+-- level 0 — самые мелкие сообщества, каждый следующий уровень объединяет предыдущий.
+-- Путь узла по уровням хранится в knowledge_nodes.metadata->'community_path'.
+
+CREATE TABLE IF NOT EXISTS knowledge_communities (
+    level INTEGER NOT NULL,
+    community_id TEXT NOT NULL,
+    parent_community_id TEXT,
+    size INTEGER NOT NULL,
+    hub_node_ids UUID[] NOT NULL DEFAULT '{}',
+    summary TEXT,
+    signature TEXT,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (level, community_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_communities_parent
+    ON knowledge_communities (level, parent_community_id);
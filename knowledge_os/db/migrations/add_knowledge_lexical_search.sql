@@ -0,0 +1,26 @@
+-- Migration: лексический поиск по knowledge_nodes (app/lexical_search.py)
+-- Вместо ILIKE '%...%' по content и metadata::text (seq scan на каждый запрос Victoria):
+-- tsvector (русский + английский) с весами и триграммные индексы по content и metadata->>'task'.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- metadata->>'task' (формулировка задачи из _learn_from_task) — отдельной колонкой для индекса и весов
+ALTER TABLE knowledge_nodes
+    ADD COLUMN IF NOT EXISTS task_text TEXT GENERATED ALWAYS AS (metadata->>'task') STORED;
+
+ALTER TABLE knowledge_nodes
+    ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', coalesce(metadata->>'task', '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(metadata->>'task', '')), 'A') ||
+        setweight(to_tsvector('russian', coalesce(content, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_nodes_search_tsv
+    ON knowledge_nodes USING GIN (search_tsv);
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_nodes_content_trgm
+    ON knowledge_nodes USING GIN (content gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_nodes_task_text_trgm
+    ON knowledge_nodes USING GIN (task_text gin_trgm_ops);
@@ -0,0 +1,39 @@
+-- Migration: уведомления об изменении knowledge_links для in-memory графа GraphRAG
+-- Используется app/graphrag/graph_store.py: CSR-граф в памяти процесса применяет
+-- вставки/удаления связей инкрементально, без полной перезагрузки таблицы.
+--
+-- Payload (JSON, < 8000 байт): {"op": "upsert"|"delete", "source", "target", "link_type", "strength"}
+
+CREATE OR REPLACE FUNCTION knowledge_links_notify_changed() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        IF TG_OP = 'DELETE'
+           OR OLD.source_node_id IS DISTINCT FROM NEW.source_node_id
+           OR OLD.target_node_id IS DISTINCT FROM NEW.target_node_id
+           OR OLD.link_type IS DISTINCT FROM NEW.link_type THEN
+            PERFORM pg_notify('knowledge_links_changed', json_build_object(
+                'op', 'delete',
+                'source', OLD.source_node_id,
+                'target', OLD.target_node_id,
+                'link_type', OLD.link_type
+            )::text);
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM pg_notify('knowledge_links_changed', json_build_object(
+            'op', 'upsert',
+            'source', NEW.source_node_id,
+            'target', NEW.target_node_id,
+            'link_type', NEW.link_type,
+            'strength', NEW.strength
+        )::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS knowledge_links_notify_changed ON knowledge_links;
+CREATE TRIGGER knowledge_links_notify_changed
+    AFTER INSERT OR UPDATE OF source_node_id, target_node_id, link_type, strength OR DELETE ON knowledge_links
+    FOR EACH ROW
+    EXECUTE FUNCTION knowledge_links_notify_changed();
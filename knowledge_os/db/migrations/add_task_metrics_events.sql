@@ -0,0 +1,63 @@
+-- Migration: метрики задач из самой таблицы tasks (app/task_metrics.py)
+-- Триггер фиксирует каждый переход задачи в completed/failed (и возврат in_progress -> pending как retry),
+-- кто бы ни менял статус: воркер, REST API, ручной SQL. Триггер только добавляет строку в
+-- task_metrics_events (без блокировок на общих строках агрегата); run_rollup_loop воркера и
+-- снимок /metrics сворачивают события в task_metrics_rollup (DELETE ... RETURNING + upsert).
+--
+-- written_at: когда строка агрегата последний раз менялась — снимок /metrics по ней находит
+-- опоздавшие строки в уже «запечатанных» минутах и пересчитывает их.
+
+CREATE TABLE IF NOT EXISTS task_metrics_events (
+    id BIGSERIAL PRIMARY KEY,
+    status TEXT NOT NULL,                              -- completed / failed / retry
+    orchestrator_version TEXT,
+    created_at TIMESTAMP WITH TIME ZONE,               -- создание задачи (для длительности)
+    finished_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT clock_timestamp(),
+    deferred BOOLEAN NOT NULL DEFAULT FALSE,
+    web_block BOOLEAN NOT NULL DEFAULT FALSE,
+    last_error TEXT                                    -- только для deferred_to_human
+);
+
+ALTER TABLE task_metrics_rollup
+    ADD COLUMN IF NOT EXISTS written_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT clock_timestamp();
+CREATE INDEX IF NOT EXISTS idx_task_metrics_rollup_written_at ON task_metrics_rollup (written_at);
+
+CREATE OR REPLACE FUNCTION task_metrics_observe() RETURNS TRIGGER AS $$
+DECLARE
+    v_status TEXT := NEW.status;
+    v_deferred BOOLEAN := FALSE;
+BEGIN
+    IF NEW.status = 'pending' THEN
+        v_status := 'retry';
+    ELSE
+        v_deferred := COALESCE(NEW.metadata->>'deferred_to_human', '') = 'true';
+    END IF;
+    INSERT INTO task_metrics_events (status, orchestrator_version, created_at, deferred, web_block, last_error)
+    VALUES (
+        v_status,
+        NEW.orchestrator_version,
+        NEW.created_at,
+        v_deferred,
+        v_status = 'completed' AND COALESCE(NEW.metadata->>'had_web_block', '') = 'true',
+        CASE WHEN v_deferred THEN left(NEW.metadata->>'last_error', 500) END
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS task_metrics_observe_insert ON tasks;
+CREATE TRIGGER task_metrics_observe_insert
+    AFTER INSERT ON tasks
+    FOR EACH ROW
+    WHEN (NEW.status IN ('completed', 'failed'))
+    EXECUTE FUNCTION task_metrics_observe();
+
+DROP TRIGGER IF EXISTS task_metrics_observe_update ON tasks;
+CREATE TRIGGER task_metrics_observe_update
+    AFTER UPDATE OF status ON tasks
+    FOR EACH ROW
+    WHEN (OLD.status IS DISTINCT FROM NEW.status AND (
+        NEW.status IN ('completed', 'failed')
+        OR (OLD.status = 'in_progress' AND NEW.status = 'pending')
+    ))
+    EXECUTE FUNCTION task_metrics_observe();
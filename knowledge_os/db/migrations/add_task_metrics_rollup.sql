@@ -0,0 +1,21 @@
+-- Migration: поминутные агрегаты метрик задач (app/task_metrics.py)
+-- События переходов задач пишет триггер на tasks (add_task_metrics_events.sql), воркеры сворачивают их
+-- сюда (ON CONFLICT ... + EXCLUDED); REST API держит снимок в памяти: /metrics не агрегирует tasks на скрейп.
+
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS orchestrator_version VARCHAR(20) DEFAULT NULL;
+
+CREATE TABLE IF NOT EXISTS task_metrics_rollup (
+    bucket TIMESTAMP WITH TIME ZONE NOT NULL,          -- начало минуты
+    orchestrator_version TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL,                              -- completed / failed / retry
+    error_type TEXT NOT NULL DEFAULT '',               -- тип last_error (для deferred_to_human)
+    tasks BIGINT NOT NULL DEFAULT 0,
+    deferred BIGINT NOT NULL DEFAULT 0,
+    web_block BIGINT NOT NULL DEFAULT 0,
+    duration_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+    duration_count BIGINT NOT NULL DEFAULT 0,
+    duration_buckets BIGINT[] NOT NULL,                -- некумулятивные счётчики по task_metrics.DURATION_BUCKETS (+Inf)
+    PRIMARY KEY (bucket, orchestrator_version, status, error_type)
+);
+
+CREATE INDEX IF NOT EXISTS idx_task_metrics_rollup_bucket ON task_metrics_rollup (bucket);
@@ -0,0 +1,70 @@
+-- Migration: очередь задач с атомарным захватом (SKIP LOCKED), лизами и LISTEN/NOTIFY
+-- Используется smart_worker_autonomous через app/task_queue.py
+--
+-- queue_priority / retry_after — продвинутые из metadata колонки (bug_probability, next_retry_after),
+-- чтобы выбор задач обслуживался частичным индексом, а не JSON-предикатами.
+-- Синхронизируются триггером: приведение text -> timestamptz не IMMUTABLE, поэтому GENERATED
+-- колонка здесь невозможна, а триггер заодно переживает мусорные значения в metadata.
+
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS queue_priority DOUBLE PRECISION NOT NULL DEFAULT 0.0;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS retry_after TIMESTAMP WITH TIME ZONE;
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS claimed_by VARCHAR(255);
+ALTER TABLE tasks ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+
+CREATE OR REPLACE FUNCTION tasks_sync_queue_columns() RETURNS TRIGGER AS $$
+BEGIN
+    BEGIN
+        NEW.queue_priority := COALESCE((NEW.metadata->>'bug_probability')::double precision, 0.0);
+    EXCEPTION WHEN others THEN
+        NEW.queue_priority := 0.0;
+    END;
+    BEGIN
+        NEW.retry_after := (NEW.metadata->>'next_retry_after')::timestamptz;
+    EXCEPTION WHEN others THEN
+        NEW.retry_after := NULL;
+    END;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tasks_sync_queue_columns ON tasks;
+CREATE TRIGGER tasks_sync_queue_columns
+    BEFORE INSERT OR UPDATE OF metadata ON tasks
+    FOR EACH ROW
+    EXECUTE FUNCTION tasks_sync_queue_columns();
+
+-- Backfill существующих строк (триггер выставит колонки из metadata)
+UPDATE tasks SET metadata = COALESCE(metadata, '{}'::jsonb)
+WHERE metadata ? 'bug_probability' OR metadata ? 'next_retry_after';
+
+-- Зависшие in_progress без лиза получают лиз от последнего обновления (15 мин, как прежний
+-- SMART_WORKER_STUCK_MINUTES). Строки, которые позже поставят писатели мимо очереди,
+-- захват забирает по updated_at (CLAIM_TASKS_SQL).
+UPDATE tasks SET lease_expires_at = COALESCE(updated_at, created_at, NOW()) + interval '15 minutes'
+WHERE status = 'in_progress' AND lease_expires_at IS NULL;
+
+-- Выбор задач: status = 'pending' ORDER BY queue_priority DESC, created_at ASC
+CREATE INDEX IF NOT EXISTS idx_tasks_pending_queue
+    ON tasks (queue_priority DESC, created_at ASC)
+    INCLUDE (retry_after)
+    WHERE status = 'pending';
+
+-- Возврат задач с истёкшим лизом (воркер упал или потерял соединение)
+CREATE INDEX IF NOT EXISTS idx_tasks_in_progress_lease
+    ON tasks (lease_expires_at)
+    WHERE status = 'in_progress';
+
+-- Пробуждение простаивающих воркеров без опроса
+CREATE OR REPLACE FUNCTION tasks_notify_pending() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('tasks_pending', NEW.id::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tasks_notify_pending ON tasks;
+CREATE TRIGGER tasks_notify_pending
+    AFTER INSERT OR UPDATE OF status ON tasks
+    FOR EACH ROW
+    WHEN (NEW.status = 'pending')
+    EXECUTE FUNCTION tasks_notify_pending();
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Замер планировщика генерации (app/generation_scheduler.py) на FakeTokenBackend — без GPU.
+
+Нагрузка: фоновые задачи (priority=3) + чат (priority=1) приходят одновременно.
+Сравниваются max_batch=1 (последовательная генерация, как старый ContinuousBatcher)
+и continuous batching: пропускная способность (токен/с) и задержка первого токена чата.
+
+  cd knowledge_os
+  python scripts/benchmark_generation_scheduler.py --background 32 --chat 8 --max-batch 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.generation_scheduler import FakeTokenBackend, GenerationScheduler  # noqa: E402
+
+
+async def run(max_batch: int, background: int, chat: int, tokens: int,
+              step_ms: float, per_seq_ms: float) -> None:
+    backend = FakeTokenBackend(step_seconds=step_ms / 1000, per_seq_seconds=per_seq_ms / 1000)
+    scheduler = GenerationScheduler(backend, kv_budget=10 ** 9, max_batch=max_batch,
+                                    high_priority_reserve=1 if max_batch > 1 else 0)
+    started = time.perf_counter()
+    bg = [await scheduler.submit(f"background {i}", tokens, priority=3) for i in range(background)]
+    await asyncio.sleep(step_ms / 1000 * 3)
+    chats = [await scheduler.submit(f"chat {i}", tokens // 4, priority=1) for i in range(chat)]
+    await asyncio.gather(*(s.result() for s in bg + chats))
+    elapsed = time.perf_counter() - started
+
+    ttft = sorted((s.first_token_at - s.created_at) * 1000 for s in chats)
+    stats = scheduler.get_stats()
+    print(f"  max_batch={max_batch:<3} {stats['tokens'] / elapsed:9.0f} ток/с   "
+          f"чат TTFT p50 {statistics.median(ttft):8.1f} мс  max {ttft[-1]:8.1f} мс   "
+          f"средний батч {stats['avg_batch']}")
+    await scheduler.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--background", type=int, default=32)
+    parser.add_argument("--chat", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=64)
+    parser.add_argument("--max-batch", type=int, default=8)
+    parser.add_argument("--step-ms", type=float, default=2.0, help="постоянная часть шага (чтение весов)")
+    parser.add_argument("--per-seq-ms", type=float, default=0.2, help="добавка за каждую последовательность батча")
+    args = parser.parse_args()
+
+    print(f"[benchmark_generation_scheduler] фон {args.background} × {args.tokens} ток, "
+          f"чат {args.chat} × {args.tokens // 4} ток, шаг {args.step_ms} мс + {args.per_seq_ms} мс/посл.")
+    for max_batch in (1, args.max_batch):
+        asyncio.run(run(max_batch, args.background, args.chat, args.tokens, args.step_ms, args.per_seq_ms))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Замер multi-hop GraphRAG: рекурсивные CTE в PostgreSQL vs CSR-граф в памяти (graph_store).
+
+С БД (DATABASE_URL): запросы — эмбеддинги случайных узлов knowledge_nodes,
+для каждого замеряются retrieve_with_hops_cte и retrieve_with_hops (после прогрева графа).
+Без БД (--synthetic): только in-memory обход на синтетическом графе.
+
+  cd knowledge_os
+  DATABASE_URL=postgresql://... python scripts/benchmark_multi_hop.py
+  python scripts/benchmark_multi_hop.py --synthetic --nodes 100000 --degree 8
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.graphrag.graph_store import CSRGraph  # noqa: E402
+
+
+def _report(name: str, timings_ms) -> None:
+    timings_ms = sorted(timings_ms)
+    p95 = timings_ms[int(len(timings_ms) * 0.95) - 1] if len(timings_ms) >= 20 else timings_ms[-1]
+    print(f"  {name:<12} mean {statistics.mean(timings_ms):8.2f} ms   "
+          f"p50 {statistics.median(timings_ms):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+def run_synthetic(nodes: int, degree: int, dim: int, queries: int) -> None:
+    rng = np.random.default_rng(42)
+    ids = [str(uuid.UUID(int=i + 1)) for i in range(nodes)]
+    src = np.repeat(np.arange(nodes), degree)
+    dst = rng.integers(0, nodes, size=nodes * degree)
+    strength = rng.random(nodes * degree)
+    started = time.perf_counter()
+    graph = CSRGraph().build(
+        (ids[s], ids[d], "related_to", w) for s, d, w in zip(src.tolist(), dst.tolist(), strength.tolist())
+    )
+    graph.set_embeddings(ids, rng.standard_normal((nodes, dim), dtype=np.float32))
+    print(f"[benchmark_multi_hop] synthetic: {nodes} узлов, {graph.edge_count} связей, dim={dim}")
+    print(f"  build        {(time.perf_counter() - started) * 1000:8.0f} ms")
+
+    timings = []
+    for _ in range(queries):
+        query = rng.standard_normal(dim, dtype=np.float32)
+        seeds = [(ids[i], 2 if rank < 2 else 1) for rank, i in enumerate(rng.integers(0, nodes, size=5))]
+        t0 = time.perf_counter()
+        graph.expand(seeds, query, max_results=10)
+        timings.append((time.perf_counter() - t0) * 1000)
+    _report("in-memory", timings)
+
+
+async def run_db(db_url: str, queries: int, max_hops: int, limit: int) -> None:
+    import asyncpg
+    from app.graphrag.multi_hop_retriever import MultiHopRetriever
+
+    conn = await asyncpg.connect(db_url)
+    try:
+        rows = await conn.fetch(
+            "SELECT embedding::real[] AS embedding FROM knowledge_nodes "
+            "WHERE embedding IS NOT NULL ORDER BY random() LIMIT $1", queries)
+    finally:
+        await conn.close()
+    if not rows:
+        print("[benchmark_multi_hop] в knowledge_nodes нет эмбеддингов")
+        return
+    embeddings = [list(r["embedding"]) for r in rows]
+
+    retriever = MultiHopRetriever(db_url, use_graph_store=True)
+    try:
+        started = time.perf_counter()
+        # В ранних версиях MultiHopRetriever пул отдавал только _get_pool()
+        get_pool = getattr(retriever, "get_pool", None) or retriever._get_pool  # pylint: disable=protected-access
+        await retriever.graph_store.ensure_ready(await get_pool())
+        print(f"[benchmark_multi_hop] {len(embeddings)} запросов, max_hops={max_hops}, limit={limit}")
+        print(f"  graph load   {(time.perf_counter() - started) * 1000:8.0f} ms   {retriever.graph_store.get_stats()}")
+
+        for name, method in (("cte", retriever.retrieve_with_hops_cte), ("in-memory", retriever.retrieve_with_hops)):
+            await method(embeddings[0], max_hops, limit)  # прогрев
+            timings = []
+            for emb in embeddings:
+                t0 = time.perf_counter()
+                await method(emb, max_hops, limit)
+                timings.append((time.perf_counter() - t0) * 1000)
+            _report(name, timings)
+    finally:
+        await retriever.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", action="store_true")
+    parser.add_argument("--nodes", type=int, default=50_000)
+    parser.add_argument("--degree", type=int, default=8)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--max-hops", type=int, default=2)
+    parser.add_argument("--limit", type=int, default=5)
+    args = parser.parse_args()
+
+    db_url = os.getenv("DATABASE_URL")
+    if args.synthetic or not db_url:
+        run_synthetic(args.nodes, args.degree, args.dim, args.queries)
+    else:
+        asyncio.run(run_db(db_url, args.queries, args.max_hops, args.limit))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,6 +6,7 @@ from __future__ import annotations
 
 import argparse
 import asyncio
+import importlib.util
 import json
 import logging
 import sys
@@ -37,6 +38,16 @@ except ImportError as e:
     DYNAMIC_LEVERAGE_AVAILABLE = False
     get_dynamic_leverage = None
 
+# Ядро стопов (src/execution/stop_kernel.py корня репозитория) — то же, что у live TrailingStopManager.
+# Пакет src здесь — копия knowledge_os/src без ядра, поэтому модуль грузим по пути.
+_STOP_KERNEL_PATH = PROJECT_ROOT.parent / "src" / "execution" / "stop_kernel.py"
+if "stop_kernel" not in sys.modules:
+    _spec = importlib.util.spec_from_file_location("stop_kernel", _STOP_KERNEL_PATH)
+    _stop_kernel = importlib.util.module_from_spec(_spec)
+    sys.modules["stop_kernel"] = _stop_kernel  # dataclass ядра ищет свой модуль в sys.modules
+    _spec.loader.exec_module(_stop_kernel)
+from stop_kernel import EXIT_SL, EXIT_TP2, STATIC_EXIT_SETTINGS, simulate_paths  # noqa: E402
+
 
 class AdvancedBacktest:
     """Продвинутый бектест с реальной логикой системы."""
@@ -47,6 +58,7 @@ class AdvancedBacktest:
         risk_per_trade: float = 2.0,
         leverage: float = 2.0,
         tp_sl_override: Optional[Dict[str, float]] = None,
+        stop_settings: Optional[Dict[str, Any]] = None,
     ):
         self.initial_balance = initial_balance
         self.current_balance = initial_balance
@@ -57,6 +69,10 @@ class AdvancedBacktest:
         # Формат: {"tp1_pct": float, "tp2_pct": float, "sl_pct": float}
         self.tp_sl_override: Optional[Dict[str, float]] = tp_sl_override
 
+        # Правила выходов для ядра стопов (simulate_paths): по умолчанию статичный SL,
+        # частичное закрытие на TP1 и TP2; DEFAULT_SETTINGS ядра — трейлинг как в live
+        self.stop_settings: Dict[str, Any] = dict(stop_settings or STATIC_EXIT_SETTINGS)
+
         self.trades: List[Dict[str, Any]] = []
         self.open_positions: List[Dict[str, Any]] = []
         self.equity_curve: List[Dict[str, Any]] = []
@@ -1037,32 +1053,22 @@ class AdvancedBacktest:
             logger.warning("⚠️ Недостаточно данных для %s", symbol)
             return {}
 
+        closes = df["close"].to_numpy(dtype=float)
         for idx in range(len(df)):
             row = df.iloc[idx]
             current_time = df.index[idx]
 
-            # Проверяем открытые позиции
+            # Проверяем открытые позиции: выходы считает ядро стопов по закрытиям свечей
             for pos in self.open_positions[:]:
                 if pos["symbol"] == symbol:
+                    if "exit_index" not in pos:
+                        self.schedule_exits(pos, closes, idx)
                     current_price = row["close"]
-                    direction = pos["direction"]
-
-                    if direction == "LONG":
-                        if current_price >= pos["tp2_price"]:
-                            self.close_position(pos, current_price, "tp2", current_time)
-                        elif current_price >= pos["tp1_price"] and pos.get("tp1_hit") is None:
-                            pos["tp1_hit"] = True
-                            self.close_partial_position(pos, pos["tp1_price"], "tp1", 0.5, current_time)
-                        elif current_price <= pos["sl_price"]:
-                            self.close_position(pos, current_price, "sl", current_time)
-                    else:  # SHORT
-                        if current_price <= pos["tp2_price"]:
-                            self.close_position(pos, current_price, "tp2", current_time)
-                        elif current_price <= pos["tp1_price"] and pos.get("tp1_hit") is None:
-                            pos["tp1_hit"] = True
-                            self.close_partial_position(pos, pos["tp1_price"], "tp1", 0.5, current_time)
-                        elif current_price >= pos["sl_price"]:
-                            self.close_position(pos, current_price, "sl", current_time)
+                    if pos["tp1_index"] == idx:
+                        split = self.stop_settings["tp1_split_pct"] / 100
+                        self.close_partial_position(pos, pos["tp1_price"], "tp1", split, current_time)
+                    if pos["exit_index"] == idx:
+                        self.close_position(pos, current_price, pos["exit_reason"], current_time)
 
             # 🆕 Проверка MaxDD перед генерацией сигнала
             if self.max_drawdown > self.max_drawdown_limit:
@@ -1252,6 +1258,27 @@ class AdvancedBacktest:
         logger.info("✅ [POSITION_OPENED] %s %s: Position_size=%.4f, Leverage=%.1fx, Entry=%.4f, SL=%.4f, TP1=%.4f, TP2=%.4f",
                    symbol, direction, position_size, leverage_to_use, entry_price, signal["sl_price"], signal["tp1_price"], signal["tp2_price"])
 
+    def schedule_exits(self, position: Dict[str, Any], closes: np.ndarray, start: int) -> None:
+        """
+        Прогоняет позицию через ядро стопов (simulate_paths) по закрытиям свечей с индекса start
+        и запоминает индексы свечей TP1 и выхода. Сделки исполняются по цене закрытия свечи
+        (TP1 — по уровню TP1), как и раньше.
+        """
+        result = simulate_paths(
+            entry=[position["entry_price"]],
+            stop=[position["sl_price"]],
+            side=[position["direction"]],
+            tp1=[position["tp1_price"]],
+            tp2=[position["tp2_price"]],
+            prices=closes[start:, None],
+            settings=self.stop_settings,
+        )
+        tp1_step, exit_step = int(result.tp1_step[0]), int(result.exit_step[0])
+        position["tp1_index"] = start + tp1_step if tp1_step >= 0 else None
+        position["exit_index"] = start + exit_step if exit_step >= 0 else None
+        position["exit_reason"] = {EXIT_SL: "sl", EXIT_TP2: "tp2"}.get(int(result.exit_code[0]))
+        position["final_stop"] = float(result.final_stop[0])
+
     def close_position(
         self,
         position: Dict[str, Any],
@@ -3,7 +3,8 @@
 Годовой бектест с новыми исправлениями:
 - Подтягивание SL к TP1
 - Автоматический перенос SL в безубыток после TP1
-- Интеграция с TrailingStopManager
+- Интеграция с TrailingStopManager: выходы считает то же ядро стопов, что и live
+  (src/execution/stop_kernel.py, simulate_paths с DEFAULT_SETTINGS)
 """
 
 import asyncio
@@ -20,6 +21,7 @@ if str(PROJECT_ROOT) not in sys.path:
 
 # pylint: disable=wrong-import-position
 from scripts.run_advanced_backtest import AdvancedBacktest
+from stop_kernel import DEFAULT_SETTINGS as TRAILING_STOP_SETTINGS  # загружен run_advanced_backtest
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
@@ -75,7 +77,8 @@ async def run_yearly_backtest_for_symbol(
         backtest = AdvancedBacktest(
             initial_balance=10000.0,
             risk_per_trade=2.0,
-            leverage=2.0
+            leverage=2.0,
+            stop_settings=TRAILING_STOP_SETTINGS,
         )
 
         # Загружаем данные BTC, ETH, SOL для фильтров
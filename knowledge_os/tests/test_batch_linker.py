@@ -0,0 +1,140 @@
+"""
+Unit tests for Batch Linker (пакетный auto-link: блочный top-k, фильтры, COPY + водяной знак)
+"""
+
+import asyncio
+import sys
+import types
+from contextlib import asynccontextmanager
+
+import numpy as np
+
+from knowledge_os.app.batch_linker import (
+    ANN_NEIGHBORS_SQL, FULL_REBUILD, UNLINKED_NODES_SQL, BatchLinker, Corpus, top_k_neighbors,
+)
+
+
+def _normalized(rng, n, dim=16):
+    matrix = rng.standard_normal((n, dim)).astype(np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def test_blocked_top_k_matches_brute_force():
+    rng = np.random.default_rng(1)
+    corpus = _normalized(rng, 257)
+    rows = np.arange(0, 257, 7)
+    idx, scores = top_k_neighbors(corpus[rows], rows, corpus, k=5, block=32)
+
+    full = corpus[rows] @ corpus.T
+    full[np.arange(len(rows)), rows] = -np.inf
+    expected = np.argsort(-full, axis=1)[:, :5]
+    assert np.array_equal(idx, expected)
+    assert np.allclose(scores, np.take_along_axis(full, expected, axis=1))
+    assert not np.any(idx == rows[:, None])  # узел не связывается сам с собой
+
+
+def _corpus():
+    # a ~ b (один домен), a ~ c (другой домен), d далеко
+    matrix = np.array([[1, 0], [0.99, 0.14], [0.95, 0.31], [0, 1]], dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return Corpus(ids=["a", "b", "c", "d"], domains=np.array([0, 0, 1, 0]), matrix=matrix)
+
+
+def test_neighbors_threshold_and_domain_filter():
+    linker = BatchLinker("postgresql://unused", threshold=0.9, top_k=3)
+    links = {(s, t): (kind, round(w, 2)) for s, t, kind, w in linker.neighbors_in_memory(_corpus(), ["a", "x"])}
+    assert set(links) == {("a", "b"), ("a", "c")}
+    assert links[("a", "b")][0] == "related_to" and links[("a", "c")][0] == "enhances"
+
+    same_domain = BatchLinker("postgresql://unused", threshold=0.9, top_k=3, cross_domain=False)
+    assert [(s, t) for s, t, *_ in same_domain.neighbors_in_memory(_corpus(), ["a"])] == [("a", "b")]
+
+
+class FakeConn:
+    def __init__(self):
+        self.calls = []
+        self.copied = []
+
+    async def execute(self, sql, *args):
+        self.calls.append((sql, args))
+
+    async def fetch(self, sql, *args):
+        return [{"id": f"link-{i}"} for i in range(len(self.copied[-1]))]
+
+    async def copy_records_to_table(self, table, records):
+        self.copied.append(list(records))
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+def test_upsert_links_single_copy_and_watermark():
+    conn = FakeConn()
+    linker = BatchLinker("postgresql://unused")
+    links = [("a", "b", "related_to", 0.95), ("a", "c", "enhances", 0.91)]
+    created = asyncio.run(linker.upsert_links(conn, links, (FULL_REBUILD, "c", 3)))
+    assert created == ["link-0", "link-1"]
+    assert conn.copied == [links]
+    watermark_sql, args = conn.calls[-1]
+    assert "auto_link_state" in watermark_sql and args == (FULL_REBUILD, "c", 3, 2)
+
+
+class IncrementalConn:
+    """Соединение для run(full=False): отдаёт несвязанные узлы после водяного знака и ANN-соседей."""
+
+    def __init__(self, unlinked):
+        self.unlinked = unlinked
+        self.queries = []
+        self.closed = False
+
+    async def fetch(self, sql, *args):
+        self.queries.append(sql)
+        if sql == UNLINKED_NODES_SQL:
+            after, limit = args
+            return [{"id": n} for n in self.unlinked if after is None or n > after][:limit]
+        if sql == ANN_NEIGHBORS_SQL:
+            return [{"source_id": n, "source_domain": None, "target_id": "hub", "target_domain": None,
+                     "similarity": 0.9} for n in args[0]]
+        return [{"id": f"link-{i}"} for i in range(len(self.copied))]
+
+    async def execute(self, sql, *args):
+        self.queries.append(sql)
+
+    async def copy_records_to_table(self, table, records):
+        self.copied = list(records)
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def close(self):
+        self.closed = True
+
+
+def _run_incremental(monkeypatch, conn, block_size=1024):
+    async def connect(_dsn):
+        return conn
+
+    monkeypatch.setitem(sys.modules, "asyncpg", types.SimpleNamespace(connect=connect))
+    linker = BatchLinker("postgresql://unused", block_size=block_size)
+
+    async def no_corpus(_conn):
+        raise AssertionError("инкрементальный проход не должен грузить корпус")
+
+    linker.load_corpus = no_corpus
+    return asyncio.run(linker.run(full=False))
+
+
+def test_incremental_run_returns_early_without_unlinked_nodes(monkeypatch):
+    conn = IncrementalConn([])
+    stats = _run_incremental(monkeypatch, conn)
+    assert conn.queries == [UNLINKED_NODES_SQL] and conn.closed
+    assert stats["processed"] == 0 and stats["mode"] == "ann"
+
+
+def test_incremental_run_links_unlinked_nodes_via_ann(monkeypatch):
+    conn = IncrementalConn(["n1", "n2", "n3"])
+    stats = _run_incremental(monkeypatch, conn, block_size=2)
+    assert conn.queries.count(ANN_NEIGHBORS_SQL) == 2
+    assert (stats["processed"], stats["links"], stats["blocks"]) == (3, 3, 2)
@@ -0,0 +1,134 @@
+"""
+Unit tests for Community Engine / Community Detector (сообщества графа знаний на scipy CSR)
+"""
+
+import asyncio
+import uuid
+from contextlib import asynccontextmanager
+
+import numpy as np
+
+from knowledge_os.app.graphrag.community_detector import CommunityDetector
+from knowledge_os.app.graphrag.community_engine import (
+    CommunityEngine,
+    build_adjacency,
+    carry_over_ids,
+    refine_connected,
+)
+
+GROUPS, SIZE = 8, 12
+
+
+def _planted(seed: int = 0):
+    rng = np.random.default_rng(seed)
+    n = GROUPS * SIZE
+    src = rng.integers(0, n, size=n * 6)
+    same = rng.random(len(src)) < 0.92
+    dst = np.where(same, (src // SIZE) * SIZE + rng.integers(0, SIZE, size=len(src)), rng.integers(0, n, size=len(src)))
+    return n, src, dst
+
+
+def _purity(truth, membership) -> float:
+    hits = 0
+    for community in np.unique(membership):
+        hits += np.bincount(truth[membership == community]).max()
+    return hits / len(truth)
+
+
+def test_detect_recovers_planted_partition():
+    n, src, dst = _planted()
+    adj = build_adjacency(n, src, dst, np.ones(len(src)))
+    hierarchy = CommunityEngine().detect(adj)
+    top = hierarchy.levels[-1]
+    assert _purity(np.arange(n) // SIZE, top) == 1.0
+    assert len(np.unique(top)) == GROUPS
+    assert hierarchy.modularity > 0.7
+    # иерархия вложена: каждое мелкое сообщество целиком внутри одного родителя
+    for level in range(len(hierarchy.levels) - 1):
+        parents = hierarchy.parents(level)
+        assert len(parents) == len(np.unique(hierarchy.levels[level]))
+
+
+def test_incremental_update_only_touches_changed_neighbourhood():
+    n, src, dst = _planted()
+    engine = CommunityEngine()
+    engine.detect(build_adjacency(n, src, dst, np.ones(len(src))))
+    before = engine.hierarchy.levels[0].copy()
+    # новый узел n, сильно связанный с группой 0
+    src2 = np.concatenate((src, np.full(6, n)))
+    dst2 = np.concatenate((dst, np.arange(6)))
+    hierarchy = engine.update(build_adjacency(n + 1, src2, dst2, np.ones(len(src2))), [n])
+    after = hierarchy.levels[0]
+    assert after[n] == after[0]
+    # группы 1..7 не затронуты: их разбиение совпадает с точностью до перенумерации
+    untouched = np.arange(SIZE, n)
+    pairs = {(int(b), int(a)) for b, a in zip(before[untouched], after[untouched])}
+    assert len(pairs) == len(set(before[untouched].tolist())) == len(set(after[untouched].tolist()))
+
+
+def test_refine_splits_disconnected_community():
+    adj = build_adjacency(4, np.array([0, 2]), np.array([1, 3]), np.ones(2))
+    refined = refine_connected(adj, np.zeros(4, dtype=np.int64))
+    assert refined[0] == refined[1] and refined[2] == refined[3] and refined[0] != refined[2]
+
+
+def test_carry_over_ids_prefers_largest_overlap():
+    membership = np.array([0, 0, 0, 1, 1, 2])
+    old = ["a", "a", "b", "b", "b", None]
+    assert carry_over_ids(membership, old, ["x0", "x1", "x2"]) == ["a", "b", "x2"]
+
+
+class FakeConn:
+    def __init__(self, links):
+        self.links = links
+        self.copies = {}
+
+    async def execute(self, sql, *args):
+        return "OK"
+
+    async def executemany(self, sql, args):
+        return None
+
+    async def fetch(self, sql, *args):
+        if "FROM knowledge_links" in sql:
+            return self.links
+        return [{"id": node_id, "content": f"content {node_id}"} for node_id in args[0]]
+
+    async def copy_records_to_table(self, table, records, columns=None):
+        self.copies.setdefault(table, []).append(list(records))
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+
+def test_detector_bulk_writes_only_changed_nodes():
+    n, src, dst = _planted()
+    ids = [uuid.UUID(int=i + 1) for i in range(n + 1)]
+    links = [{"source_node_id": ids[s], "target_node_id": ids[t], "strength": 1.0} for s, t in zip(src, dst) if s != t]
+    detector = CommunityDetector("postgresql://unused")
+
+    conn = FakeConn(links)
+    communities = asyncio.run(detector._detect(conn, incremental=True))
+    assert sum(len(v) for v in communities.values()) == n
+    assert len(conn.copies["community_assignments"][0]) == n
+    first_summaries = conn.copies["community_summaries"][0]
+    assert first_summaries and all(r[5].startswith(f"{r[3]} узлов") for r in first_summaries)
+
+    # та же таблица связей: пересчёта и записи нет
+    conn = FakeConn(links)
+    asyncio.run(detector._detect(conn, incremental=True))
+    assert conn.copies == {}
+
+    # один новый узел: пишется только он (ID сообществ сохраняются)
+    conn = FakeConn(links + [{"source_node_id": ids[n], "target_node_id": ids[i], "strength": 1.0} for i in range(4)])
+    asyncio.run(detector._detect(conn, incremental=True))
+    written = conn.copies["community_assignments"][0]
+    assert [r[0] for r in written] == [str(ids[n])]
+
+
+def test_carry_over_ids_fallback_does_not_duplicate_inherited_id():
+    # Сообщество 1 без старого ID, его hub-узел «X» уже унаследован сообществом 0
+    ids = carry_over_ids(np.array([0, 0, 1]), ["X", "X", None], ["A", "X"])
+    assert ids == ["X", "X#1"]
+    assert len(set(ids)) == len(ids)
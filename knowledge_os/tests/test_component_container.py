@@ -0,0 +1,76 @@
+"""
+Unit tests for Component Container (single-flight построение, повтор после ошибки, порядок остановки)
+"""
+
+import asyncio
+
+from knowledge_os.app.component_container import ComponentContainer
+
+
+def test_concurrent_get_builds_once_and_records_build_time():
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return object()
+
+    container = ComponentContainer("test")
+    container.register("cache", factory)
+    container.register("qa", lambda: "qa")
+
+    async def run():
+        first = await asyncio.gather(*(container.get("cache") for _ in range(10)))
+        return first, await container.get("cache"), await container.init()
+
+    instances, again, health = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(i is instances[0] for i in instances) and again is instances[0]
+    assert health["cache"]["state"] == "ready" and health["cache"]["build_ms"] >= 15
+    assert health["qa"]["state"] == "ready"
+    assert container.peek("qa") == "qa"
+
+
+def test_failed_build_is_retried_only_after_retry_after():
+    attempts = []
+
+    def factory():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("db down")
+        return "ok"
+
+    container = ComponentContainer("test", retry_after=0.05)
+    container.register("rag", factory)
+
+    async def run():
+        first = await container.get("rag")
+        second = await container.get("rag")
+        state = container.health()["rag"]
+        await asyncio.sleep(0.06)
+        return first, second, state, await container.get("rag")
+
+    first, second, state, third = asyncio.run(run())
+    assert first is None and second is None and len(attempts) == 2
+    assert state["state"] == "failed" and "db down" in state["error"]
+    assert third == "ok"
+
+
+def test_shutdown_runs_in_reverse_build_order():
+    closed = []
+    container = ComponentContainer("test")
+    container.register("a", lambda: "a", shutdown=closed.append)
+
+    async def close_b(instance):
+        closed.append(instance)
+
+    container.register("b", lambda: "b", shutdown=close_b)
+
+    async def run():
+        await container.get("a")
+        await container.get("b")
+        await container.shutdown()
+
+    asyncio.run(run())
+    assert closed == ["b", "a"]
+    assert container.health()["a"]["state"] == "idle"
@@ -0,0 +1,73 @@
+"""
+Unit tests for Context Assembler (параллельные источники, дедлайн, общий эмбеддинг, статистика)
+"""
+
+import asyncio
+import time
+
+from knowledge_os.app.context_assembler import ContextAssembler, ContextSource
+
+
+def _source(name, delay, text, priority, **kwargs):
+    async def fetch(req):
+        await asyncio.sleep(delay)
+        return text
+    return ContextSource(name, fetch, priority=priority, **kwargs)
+
+
+def test_sources_run_concurrently_within_deadline_in_priority_order():
+    assembler = ContextAssembler([
+        _source("similar", 0.05, "похожие", 40),
+        _source("curator", 0.05, "эталон", 10),
+        _source("slow", 5.0, "не успеет", 20),
+        _source("empty", 0.01, "", 30),
+        _source("skipped", 0.0, "x", 50, applies=lambda req: False),
+    ], deadline=0.2)
+
+    started = time.perf_counter()
+    ctx = asyncio.run(assembler.assemble("вопрос"))
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.4  # не сумма задержек и не ожидание медленного источника
+    assert list(ctx.parts) == ["curator", "similar"]
+    assert ctx.missed == ["slow"]
+    stats = assembler.get_stats()
+    assert stats["curator"]["hit_rate"] == 1.0 and stats["empty"]["hit_rate"] == 0.0
+    assert stats["slow"]["late"] == 1 and stats["skipped"]["calls"] == 0
+    assert stats["similar"]["avg_latency_ms"] >= 40
+
+
+def test_per_source_budget_and_errors_do_not_break_assembly():
+    async def broken(req):
+        raise RuntimeError("db down")
+
+    assembler = ContextAssembler([
+        _source("budgeted", 1.0, "x", 10, budget=0.05),
+        ContextSource("broken", broken, priority=20),
+        _source("ok", 0.0, "готово", 30),
+    ], deadline=1.0)
+    started = time.perf_counter()
+    ctx = asyncio.run(assembler.assemble("q"))
+    assert time.perf_counter() - started < 0.5
+    assert ctx.parts == {"ok": "готово"}
+    stats = assembler.get_stats()
+    assert stats["budgeted"]["timeouts"] == 1 and stats["broken"]["errors"] == 1
+
+
+def test_embedding_is_computed_once_and_shared():
+    calls = []
+
+    async def embedder(text):
+        calls.append(text)
+        await asyncio.sleep(0.01)
+        return [0.1, 0.2]
+
+    def uses_embedding(name):
+        async def fetch(req):
+            return f"{name}:{len(await req.embedding())}"
+        return ContextSource(name, fetch, needs_embedding=True)
+
+    assembler = ContextAssembler([uses_embedding("a"), uses_embedding("b")], deadline=1.0)
+    ctx = asyncio.run(assembler.assemble("цель", embedder=embedder))
+    assert calls == ["цель"]
+    assert ctx.parts == {"a": "a:2", "b": "b:2"}
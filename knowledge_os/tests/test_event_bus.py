@@ -0,0 +1,228 @@
+"""
+Unit tests for Event Bus (партиции, изоляция обработчиков, request/response)
+"""
+
+import asyncio
+import uuid
+
+from app.event_bus import Event, EventBus, EventType
+
+
+def _event(event_type: EventType, **payload) -> Event:
+    return Event(event_id=str(uuid.uuid4()), event_type=event_type, payload=payload, source="test")
+
+
+def test_slow_subscriber_does_not_stall_other_partitions():
+    async def _run():
+        bus = EventBus()
+        await bus.start()
+        release = asyncio.Event()
+        fast_seen = asyncio.Event()
+
+        async def slow(event):
+            await release.wait()
+
+        async def fast(event):
+            fast_seen.set()
+
+        bus.subscribe(EventType.FILE_MODIFIED, slow)
+        bus.subscribe(EventType.TASK_CREATED, fast)
+        await bus.publish(_event(EventType.FILE_MODIFIED))
+        await bus.publish(_event(EventType.TASK_CREATED))
+        await asyncio.wait_for(fast_seen.wait(), timeout=1.0)
+        release.set()
+        await bus.stop()
+
+    asyncio.run(_run())
+
+
+def test_request_response_resolves_from_handler_return():
+    async def _run():
+        bus = EventBus()
+        await bus.start()
+
+        async def handler(event):
+            if event.payload.get("_is_request"):
+                return {"echo": event.payload["value"]}
+
+        bus.subscribe(EventType.AGENT_MESSAGE, handler)
+        reply = await bus.request_response(EventType.AGENT_MESSAGE, {"value": 42}, source="test", timeout=1.0)
+        await bus.stop()
+        return reply
+
+    assert asyncio.run(_run()) == {"echo": 42}
+
+
+def test_request_response_resolves_via_respond():
+    async def _run():
+        bus = EventBus()
+        await bus.start()
+
+        async def handler(event):
+            if event.payload.get("_is_request"):
+                asyncio.get_running_loop().call_later(0.01, lambda: asyncio.ensure_future(bus.respond(event, {"ok": True})))
+
+        bus.subscribe(EventType.SYSTEM_EVENT, handler)
+        reply = await bus.request_response(EventType.SYSTEM_EVENT, {}, source="test", timeout=1.0)
+        await bus.stop()
+        return reply, bus.get_stats()["pending_requests"]
+
+    reply, pending = asyncio.run(_run())
+    assert reply == {"ok": True}
+    assert pending == 0
+
+
+def test_handler_timeout_and_errors_are_isolated():
+    async def _run():
+        bus = EventBus(handler_timeout=0.05)
+        await bus.start()
+        seen = []
+
+        async def hangs(event):
+            await asyncio.sleep(10)
+
+        async def fails(event):
+            raise RuntimeError("boom")
+
+        async def works(event):
+            seen.append(event.payload["n"])
+
+        for handler in (hangs, fails, works):
+            bus.subscribe(EventType.ERROR_DETECTED, handler)
+        await bus.publish(_event(EventType.ERROR_DETECTED, n=1))
+        await bus.publish(_event(EventType.ERROR_DETECTED, n=2))
+        await bus.stop()
+        return seen, bus.get_stats()["handlers"]
+
+    seen, handlers = asyncio.run(_run())
+    assert seen == [1, 2]
+    by_name = {name.split(".")[-1]: m for name, m in handlers.items()}
+    assert by_name["hangs"]["timeouts"] == 2
+    assert by_name["fails"]["errors"] == 2
+    assert by_name["works"]["calls"] == 2
+
+
+def test_history_is_bounded():
+    async def _run():
+        bus = EventBus(max_history=3)
+        await bus.start()
+        bus.subscribe(EventType.TASK_COMPLETED, lambda event: None)
+        for n in range(5):
+            await bus.publish(_event(EventType.TASK_COMPLETED, n=n))
+        await bus.stop()
+        return bus.get_event_history()
+
+    history = asyncio.run(_run())
+    assert [e.payload["n"] for e in history] == [2, 3, 4]
+
+
+class FakeStreams:
+    """Redis Streams в памяти: XADD / XREAD / XREADGROUP / XACK одного потока."""
+
+    def __init__(self):
+        self.entries = []  # (id, fields)
+        self.groups = {}  # group -> {"last": int, "pending": set}
+
+    def client(self):
+        return _FakeStreamClient(self)
+
+
+class _FakeStreamClient:
+    def __init__(self, streams):
+        self.s = streams
+
+    @staticmethod
+    def _seq(message_id):
+        return int(message_id.split("-")[0])
+
+    async def xadd(self, stream, fields, **_kwargs):
+        message_id = f"{len(self.s.entries) + 1}-0"
+        self.s.entries.append((message_id, dict(fields)))
+        return message_id
+
+    async def xrevrange(self, stream, count=1):
+        return self.s.entries[-count:][::-1]
+
+    async def xgroup_create(self, stream, group, id="$", mkstream=False):
+        if group in self.s.groups:
+            raise RuntimeError("BUSYGROUP Consumer Group name already exists")
+        self.s.groups[group] = {"last": len(self.s.entries), "pending": set()}
+
+    async def _wait(self, after, block):
+        if len(self.s.entries) <= after:
+            await asyncio.sleep(min(block, 20) / 1000)
+        return self.s.entries[after:]
+
+    async def xread(self, streams, count=100, block=0):
+        (stream, last_id), = streams.items()
+        entries = (await self._wait(self._seq(last_id), block))[:count]
+        return [(stream, entries)] if entries else []
+
+    async def xreadgroup(self, group, consumer, streams, count=100, block=0):
+        (stream, _), = streams.items()
+        state = self.s.groups[group]
+        entries = (await self._wait(state["last"], block))[:count]
+        state["last"] += len(entries)
+        state["pending"].update(message_id for message_id, _ in entries)
+        return [(stream, entries)] if entries else []
+
+    async def xack(self, stream, group, message_id):
+        self.s.groups[group]["pending"].discard(message_id)
+
+    async def close(self):
+        pass
+
+
+def _durable_buses(monkeypatch, groups):
+    import redis.asyncio
+
+    from app.event_bus import RedisStreamTransport
+
+    streams = FakeStreams()
+    monkeypatch.setattr(redis.asyncio, "from_url", lambda *_a, **_k: streams.client())
+    buses = [EventBus(durable_transport=RedisStreamTransport(group=g)) for g in groups]
+    return streams, buses
+
+
+def _collect(bus):
+    seen = []
+
+    async def handler(event):
+        seen.append(event.payload["n"])
+
+    bus.subscribe(EventType.KNOWLEDGE_UPDATED, handler)
+    return seen
+
+
+def test_durable_broadcast_reaches_every_other_process(monkeypatch):
+    async def _run():
+        _streams, buses = _durable_buses(monkeypatch, [None, None, None])
+        seen = [_collect(bus) for bus in buses]
+        for bus in buses:
+            await bus.start()
+        await asyncio.sleep(0.05)
+        await buses[0].publish(_event(EventType.KNOWLEDGE_UPDATED, n=1), durable=True)
+        await asyncio.sleep(0.1)
+        for bus in buses:
+            await bus.stop()
+        assert seen == [[1], [1], [1]]  # издатель — один раз (локально), остальные — из потока
+
+    asyncio.run(_run())
+
+
+def test_durable_groups_are_per_service(monkeypatch):
+    async def _run():
+        streams, buses = _durable_buses(monkeypatch, ["victoria", "victoria", "worker"])
+        seen = [_collect(bus) for bus in buses]
+        for bus in buses:
+            await bus.start()
+        await asyncio.sleep(0.05)
+        await buses[0].publish(_event(EventType.KNOWLEDGE_UPDATED, n=1), durable=True)
+        await asyncio.sleep(0.1)
+        for bus in buses:
+            await bus.stop()
+        # Сервис worker получил событие; сервис издателя обработал его локально, без повтора
+        assert seen == [[1], [], [1]]
+        assert all(not state["pending"] for state in streams.groups.values())
+
+    asyncio.run(_run())
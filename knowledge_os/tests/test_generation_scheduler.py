@@ -0,0 +1,80 @@
+"""
+Unit tests for Generation Scheduler (continuous batching, приоритеты, бюджет KV-кэша)
+"""
+
+import asyncio
+
+import pytest
+
+from knowledge_os.app.generation_scheduler import AdmissionError, FakeTokenBackend, GenerationScheduler
+
+
+def test_batches_sequences_and_matches_deterministic_output():
+    async def scenario():
+        backend = FakeTokenBackend(eos_after=lambda p: 3 if p == "short" else 100)
+        scheduler = GenerationScheduler(backend, kv_budget=10_000, max_batch=4, high_priority_reserve=0)
+        prompts = ["short", "a", "b", "c", "d"]
+        results = await asyncio.gather(*(scheduler.generate(p, 6) for p in prompts))
+        await scheduler.close()
+        return backend, scheduler, results
+
+    backend, scheduler, results = asyncio.run(scenario())
+    assert results[0] == FakeTokenBackend.expected("short", 3)
+    assert results[1:] == [FakeTokenBackend.expected(p, 6) for p in "abcd"]
+    assert max(backend.batch_sizes) == 4
+    # «short» закончился раньше — его слот сразу занял пятый запрос
+    assert backend.batch_sizes[3] == 4
+    assert scheduler.get_stats()["completed"] == 5
+
+
+def test_kv_budget_limits_concurrency_and_rejects_oversized():
+    async def scenario():
+        backend = FakeTokenBackend()
+        scheduler = GenerationScheduler(backend, kv_budget=25, max_batch=8, high_priority_reserve=0)
+        with pytest.raises(AdmissionError):
+            await scheduler.submit("x", 100)
+        await asyncio.gather(*(scheduler.generate(f"p{i}", 10) for i in range(4)))  # 11 единиц каждый
+        await scheduler.close()
+        return backend
+
+    backend = asyncio.run(scenario())
+    assert max(backend.batch_sizes) == 2
+
+
+def test_chat_gets_weighted_share_and_reserved_slot():
+    async def scenario():
+        backend = FakeTokenBackend()
+        scheduler = GenerationScheduler(backend, kv_budget=100_000, max_batch=2)
+        background = [await scheduler.submit(f"bg{i}", 20, priority=3) for i in range(6)]
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        chat = await scheduler.submit("chat", 5, priority=1)
+        await chat.result()
+        steps_for_chat = scheduler.stats["steps"]
+        await asyncio.gather(*(s.result() for s in background))
+        await scheduler.close()
+        return steps_for_chat, backend
+
+    steps_for_chat, backend = asyncio.run(scenario())
+    # фоновым задачам доступен только один слот из двух: чат начинается без ожидания
+    assert steps_for_chat <= 7
+    assert max(backend.batch_sizes) == 2
+
+
+def test_stream_and_cancel():
+    async def scenario():
+        scheduler = GenerationScheduler(FakeTokenBackend(step_seconds=0.001), kv_budget=1000, max_batch=2)
+        seq = await scheduler.submit("stream me", 5)
+        streamed = [token async for token in seq.stream()]
+        victim = await scheduler.submit("cancel me", 50)
+        await asyncio.sleep(0.005)
+        victim.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await victim.result()
+        stats = scheduler.get_stats()
+        await scheduler.close()
+        return streamed, stats
+
+    streamed, stats = asyncio.run(scenario())
+    assert "".join(streamed) == FakeTokenBackend.expected("stream me", 5)
+    assert stats["cancelled"] == 1 and stats["kv_used"] == 0
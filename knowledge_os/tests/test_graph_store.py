@@ -0,0 +1,98 @@
+"""
+Unit tests for Graph Store (CSR-граф knowledge_links в памяти для multi-hop GraphRAG)
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from knowledge_os.app.graphrag.graph_store import CSRGraph, KnowledgeGraphStore, path_score
+
+
+def _graph() -> CSRGraph:
+    # a -> b (0.9) -> c (0.8) -> d (0.9); a -> e (0.3) -> f (0.9); b -> g (0.4)
+    graph = CSRGraph().build([
+        ("a", "b", "depends_on", 0.9),
+        ("b", "c", "enhances", 0.8),
+        ("c", "d", "related_to", 0.9),
+        ("a", "e", "related_to", 0.3),
+        ("e", "f", "related_to", 0.9),
+        ("b", "g", "related_to", 0.4),
+    ])
+    graph.set_embeddings(list("abcdefg"), np.eye(7, 4, dtype=np.float32) + 0.01)
+    return graph
+
+
+def test_expand_respects_depth_and_strength_filter():
+    graph = _graph()
+    query = np.array([0, 0, 1, 0], dtype=np.float32)  # ближе всего к "c"
+    hops = {h["id"]: h for h in graph.expand([("a", 2)], query)}
+    # первый шаг — по любой связи, второй — только strength > 0.5
+    assert set(hops) == {"b", "c", "e", "f"}
+    assert hops["c"]["hop_count"] == 2 and hops["c"]["hop_source"] == "b"
+    assert hops["c"]["link_type"] == "enhances"
+    assert hops["c"]["similarity"] == pytest.approx(
+        path_score(0.8, float(graph.similarities(np.array([2]), query / np.linalg.norm(query))[0]), 2),
+        rel=1e-5,
+    )
+    assert set(h["id"] for h in graph.expand([("a", 1)], query)) == {"b", "e"}
+
+
+def test_expand_orders_by_score_and_limits():
+    graph = _graph()
+    hops = graph.expand([("a", 3)], np.array([0, 0, 1, 0], dtype=np.float32), max_results=2)
+    assert len(hops) == 2
+    assert hops[0]["similarity"] >= hops[1]["similarity"]
+    assert hops[0]["id"] == "c"
+
+
+def test_overlay_upsert_remove_matches_rebuild():
+    graph = _graph()
+    graph.upsert_link("d", "a", "supersedes", 0.7)
+    graph.upsert_link("a", "b", "depends_on", 0.2)  # обновление силы существующей связи
+    graph.remove_link("b", "c", "enhances")
+    graph.upsert_link("new", "a", "related_to", 0.6)
+    assert graph.overlay_size > 0
+
+    def edges(g):
+        out = set()
+        for node_id in list("abcdefg") + ["new"]:
+            idx = g.index_of(node_id)
+            targets, strengths, types = g.neighbors(idx)
+            out |= {(node_id, g.node_id(t), g.link_type_name(k), round(float(w), 3))
+                    for t, w, k in zip(targets, strengths, types)}
+        return out
+
+    before = edges(graph)
+    assert ("a", "b", "depends_on", 0.2) in before
+    assert not any(e[:3] == ("b", "c", "enhances") for e in before)
+    assert ("new", "a", "related_to", 0.6) in before
+    graph.compact()
+    assert graph.overlay_size == 0
+    assert edges(graph) == before
+    assert graph.edge_count == len(before)
+    assert graph.missing_embeddings() == ["new"]
+
+
+def test_auto_compact_threshold():
+    graph = CSRGraph(min_compact=2).build([("a", "b", "related_to", 1.0)])
+    for i in range(3):
+        graph.upsert_link("a", f"n{i}", "related_to", 1.0)
+    assert graph.overlay_size == 0
+    assert graph.edge_count == 4
+
+
+def test_store_applies_notifications_and_buffers_during_load():
+    store = KnowledgeGraphStore("postgresql://unused")
+    store.graph = _graph()
+    store._buffer = []
+    store._on_notify(None, 0, "knowledge_links_changed", json.dumps(
+        {"op": "upsert", "source": "g", "target": "a", "link_type": "related_to", "strength": 0.9}))
+    store._on_notify(None, 0, "knowledge_links_changed", json.dumps(
+        {"op": "delete", "source": "a", "target": "b", "link_type": "depends_on"}))
+    store._on_notify(None, 0, "knowledge_links_changed", "not json")
+    assert len(store._buffer) == 2
+    assert {h["id"] for h in store.graph.expand([("a", 1)], np.ones(4))} == {"e"}
+    assert {h["id"] for h in store.graph.expand([("g", 1)], np.ones(4))} == {"a"}
+    assert store.get_stats()["upserts"] == 1 and store.get_stats()["deletes"] == 1
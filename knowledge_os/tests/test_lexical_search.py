@@ -0,0 +1,46 @@
+"""
+Unit tests for Lexical Search (tsquery из запроса, SQL индексного и ILIKE-пути)
+"""
+
+import asyncio
+
+import knowledge_os.app.lexical_search as lexical
+from knowledge_os.app.lexical_search import build_lexical_query, lexical_search, query_terms
+
+
+def test_query_terms_are_tsquery_safe():
+    terms = query_terms("Сделай отчёт по продажам: revenue & (drop) | 'x'; и отчёт снова")
+    assert terms == ["сделай", "отчёт", "продажам", "revenue", "drop", "снова"]
+    assert query_terms("и в на") == []
+
+
+def test_indexed_query_uses_tsvector_trigram_and_usage_rank():
+    sql, params = build_lexical_query(
+        "похожая задача про деплой", domain="victoria_tasks", limit=2, min_content_length=21
+    )
+    assert "kn.search_tsv @@ q.tsq" in sql and "<% kn.content" in sql and "kn.task_text %" in sql
+    assert "ts_rank(kn.search_tsv, q.tsq)" in sql and "usage_count" in sql
+    assert "ILIKE" not in sql
+    assert params == ["victoria_tasks", 21, "похожая | задача | про | деплой", "похожая задача про деплой", 2]
+
+
+class _FakeConn:
+    def __init__(self, columns):
+        self.columns = columns
+        self.sql = []
+
+    async def fetchval(self, sql, *args):
+        return self.columns
+
+    async def fetch(self, sql, *args):
+        self.sql.append(sql)
+        return [{"content": "результат", "score": 1.0}]
+
+
+def test_falls_back_to_ilike_until_migration_applied(monkeypatch):
+    monkeypatch.setattr(lexical, "_has_lexical_columns", None)
+    conn = _FakeConn(columns=0)
+    rows = asyncio.run(lexical_search(conn, "статус проекта", limit=1))
+    assert rows == [{"content": "результат", "score": 1.0}]
+    assert "ILIKE" in conn.sql[0] and "search_tsv" not in conn.sql[0]
+    assert asyncio.run(lexical_search(conn, "и в")) == []
@@ -0,0 +1,135 @@
+"""
+Unit tests for LLM Single-Flight (склейка одинаковых запросов в полёте, раздача стрима, метрики)
+"""
+
+import asyncio
+
+from knowledge_os.app.llm_singleflight import LLMSingleFlight, request_key
+
+
+def test_request_key_covers_system_prompt_and_model():
+    base = request_key("привет", "ты эксперт", "qwen", "general")
+    assert base == request_key("привет", "ты эксперт", "qwen", "general")
+    assert base != request_key("привет", "ты аналитик", "qwen", "general")
+    assert base != request_key("привет", "ты эксперт", "llama", "general")
+    assert base != request_key("привет", "ты эксперт", "qwen", "general", images=["img"])
+
+
+def test_identical_concurrent_calls_share_one_generation():
+    sf = LLMSingleFlight()
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return "ответ", "ollama"
+
+    async def run():
+        same = await asyncio.gather(*(sf.run("k", generate) for _ in range(4)))
+        other = await sf.run("k2", generate)
+        again = await sf.run("k", generate)  # генерация завершена — новый запуск
+        return same, other, again
+
+    same, other, again = asyncio.run(run())
+    assert same == [("ответ", "ollama")] * 4
+    assert len(calls) == 3
+    stats = sf.get_stats()
+    assert stats["requests"] == 6 and stats["joined"] == 3 and stats["dedup_ratio"] == 0.5
+    assert stats["inflight"] == 0
+
+
+def test_stream_fans_out_to_late_subscribers_and_completes_once():
+    sf = LLMSingleFlight()
+    started, completed = [], []
+
+    async def source():
+        started.append(1)
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def consume(delay=0.0):
+        await asyncio.sleep(delay)
+        return "".join([c async for c in sf.stream("s", source, on_complete=completed.append)])
+
+    async def run():
+        return await asyncio.gather(consume(), consume(0.015), consume(0.025))
+
+    assert asyncio.run(run()) == ["abc", "abc", "abc"]
+    assert len(started) == 1 and completed == ["abc"]
+    assert sf.get_stats()["joined"] == 2
+
+
+def test_stream_is_cancelled_when_all_subscribers_leave():
+    sf = LLMSingleFlight()
+    produced = []
+
+    async def source():
+        for i in range(100):
+            await asyncio.sleep(0.005)
+            produced.append(i)
+            yield str(i)
+
+    async def run():
+        gen = sf.stream("s", source)
+        first = await gen.__anext__()
+        await gen.aclose()
+        await asyncio.sleep(0.05)
+        return first
+
+    assert asyncio.run(run()) == "0"
+    assert len(produced) < 5 and sf.get_stats()["inflight"] == 0
+
+
+def test_run_cancels_generation_when_last_waiter_leaves():
+    sf = LLMSingleFlight()
+    cancelled = []
+
+    async def generate():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return "ответ"
+
+    async def run():
+        first = asyncio.ensure_future(sf.run("k", generate))
+        second = asyncio.ensure_future(sf.run("k", generate))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled  # второй ещё ждёт — генерация продолжается
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled == [1]
+        assert sf.get_stats()["inflight"] == 0
+
+    asyncio.run(run())
+
+
+def test_serve_metrics_exports_dedup_ratio():
+    from knowledge_os.app import llm_singleflight
+
+    async def run():
+        sf = llm_singleflight.get_llm_singleflight()
+        sf.requests, sf.joined = 4, 1
+        server = await llm_singleflight.serve_metrics(0)
+        assert server is None  # порт 0 — эндпоинт отключён
+        server = await asyncio.start_server(lambda r, w: None, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        server.close()
+        await server.wait_closed()
+        server = await llm_singleflight.serve_metrics(port, host="127.0.0.1")
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(b"GET /metrics HTTP/1.1\r\nHost: worker\r\n\r\n")
+            response = (await reader.read()).decode()
+            writer.close()
+        finally:
+            server.close()
+            await server.wait_closed()
+        assert response.startswith("HTTP/1.1 200")
+        assert "llm_singleflight_dedup_ratio 0.25" in response
+
+    asyncio.run(run())
@@ -0,0 +1,95 @@
+"""
+Unit tests for Load Balancer (состояние узлов, синхронные счётчики, выбор P2C/least-outstanding)
+"""
+
+import asyncio
+import random
+
+import knowledge_os.app.load_balancer as lb_module
+from knowledge_os.app.load_balancer import LoadBalancer
+
+NODES = [
+    {"name": "MLX", "url": "http://mlx:11435", "priority": 0, "routing_key": "mlx_studio"},
+    {"name": "Ollama", "url": "http://ollama:11434", "priority": 1, "routing_key": "ollama_studio"},
+]
+
+
+def test_counters_are_synchronous_and_drive_least_outstanding():
+    balancer = LoadBalancer()
+    balancer.register_nodes(NODES)
+    started = balancer.start_request("mlx_studio")
+    balancer.start_request("mlx_studio")
+    # без await: состояние уже видно выбору
+    assert balancer.node_loads["mlx_studio"].active_requests == 2
+    assert balancer.select_best_node(NODES)["name"] == "Ollama"
+
+    balancer.end_request("mlx_studio", started, success=True)
+    balancer.end_request("mlx_studio")
+    assert balancer.node_loads["mlx_studio"].active_requests == 0
+    assert balancer.select_best_node(NODES)["name"] == "MLX"  # при равенстве — порядок списка
+
+
+def test_latency_ewma_percentiles_and_p2c():
+    balancer = LoadBalancer(rng=random.Random(1))
+    for latency in [1.0] * 9 + [10.0]:
+        balancer.update_node_load("slow", "slow", latency)
+    for _ in range(10):
+        balancer.update_node_load("fast", "fast", 0.1)
+    stats = balancer.get_node_statistics()
+    assert stats["slow"]["p50_latency"] == 1.0 and stats["slow"]["p95_latency"] == 10.0
+    assert stats["slow"]["avg_latency"] > 3.0
+
+    nodes = [{"name": k, "routing_key": k} for k in ("slow", "fast", "other")]
+    picks = [balancer.select_best_node(nodes)["name"] for _ in range(200)]
+    assert "slow" not in picks  # в любой паре с «slow» выигрывает соперник
+    assert picks.count("fast") > picks.count("other")
+
+
+class _Response:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class _Client:
+    def __init__(self, up):
+        self.up = up
+        self.calls = []
+
+    async def get(self, url, timeout=None):
+        self.calls.append(url)
+        await asyncio.sleep(0.05)
+        if any(url.startswith(u) for u in self.up):
+            return _Response(200)
+        raise ConnectionError("refused")
+
+
+def test_probes_run_concurrently_and_routing_never_waits(monkeypatch):
+    client = _Client(up=["http://mlx"])
+
+    async def fake_client():
+        return client
+
+    monkeypatch.setattr(lb_module, "_get_client", fake_client)
+
+    async def scenario():
+        balancer = LoadBalancer()
+        balancer.register_nodes(NODES)
+        # до первой пробы узлы доступны «условно» и ответ мгновенный
+        assert [n["status"] for n in balancer.healthy_nodes()] == ["unknown", "unknown"]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await balancer.probe_all()
+        elapsed = loop.time() - started
+        healthy = balancer.healthy_nodes()
+
+        # ошибка соединения в боевом запросе сразу выводит узел из ротации
+        token = balancer.start_request("mlx_studio")
+        balancer.end_request("mlx_studio", token, success=False, connection_error=True)
+        after_failure = balancer.healthy_nodes()
+        return elapsed, healthy, after_failure
+
+    elapsed, healthy, after_failure = asyncio.run(scenario())
+    # два узла × (/health + /api/tags у упавшего) параллельно: ~0.1с, а не 0.15с последовательно
+    assert elapsed < 0.14
+    assert [(n["name"], n["status"]) for n in healthy] == [("MLX", "online")]
+    assert after_failure == []
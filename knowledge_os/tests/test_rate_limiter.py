@@ -0,0 +1,92 @@
+"""
+Unit tests for Rate Limiter (GCRA в памяти, блокировка, пакетная запись аудита)
+"""
+
+import asyncio
+
+from knowledge_os.app.rate_limiter import (
+    ALLOWED,
+    BLOCKED,
+    BLOCKED_NOW,
+    MINUTE_EXCEEDED,
+    LocalRateBackend,
+    RateLimiter,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_gcra_allows_burst_then_spaces_requests():
+    clock = FakeClock()
+    backend = LocalRateBackend(clock)
+    codes = [backend.decide_sync("u", 3, 100, 1000, 3600)[0] for _ in range(4)]
+    assert codes == [ALLOWED, ALLOWED, ALLOWED, MINUTE_EXCEEDED]
+    code, retry_after = backend.decide_sync("u", 3, 100, 1000, 3600)
+    assert code == MINUTE_EXCEEDED and abs(retry_after - 20.0) < 1e-6
+    clock.now += 20.0  # интервал эмиссии 60/3 — освободился один слот
+    assert backend.decide_sync("u", 3, 100, 1000, 3600)[0] == ALLOWED
+    assert backend.decide_sync("other", 3, 100, 1000, 3600)[0] == ALLOWED
+
+
+def test_hammering_blocks_key_and_block_expires():
+    clock = FakeClock()
+    backend = LocalRateBackend(clock)
+    codes = [backend.decide_sync("u", 2, 100, 5, 60)[0] for _ in range(7)]
+    assert codes[-2:] == [BLOCKED_NOW, BLOCKED]
+    clock.now += 3600.0
+    assert backend.decide_sync("u", 2, 100, 5, 60)[0] == ALLOWED
+    clock.now += 7200.0
+    assert backend.prune() == 1 and len(backend) == 0
+
+
+class FakeConn:
+    def __init__(self):
+        self.copied = []
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copied.append((table, list(records), columns))
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConn()
+
+    def acquire(self):
+        pool = self
+
+        class _Ctx:
+            async def __aenter__(self):
+                return pool.conn
+
+            async def __aexit__(self, *exc):
+                return False
+
+        return _Ctx()
+
+
+def test_check_messages_and_batched_audit():
+    limiter = RateLimiter("postgresql://unused", backend=LocalRateBackend(FakeClock()))
+    limiter.requests_per_minute, limiter.max_requests_per_hour = 2, 1000
+    limiter._pool = FakePool()
+
+    async def scenario():
+        results = [await limiter.check_rate_limit("42") for _ in range(3)]
+        written = await limiter.flush()
+        limiter._flush_task.cancel()
+        return results, written
+
+    results, written = asyncio.run(scenario())
+    assert results[:2] == [(True, None), (True, None)]
+    assert results[2] == (False, "⚠️ Превышен лимит: 2 запросов в минуту. Подождите немного.")
+    # разрешённые запросы агрегируются в одну строку на пользователя
+    assert written == 1
+    table, records, columns = limiter._pool.conn.copied[0]
+    assert table == "rate_limits" and columns[:3] == ["user_id", "request_count", "blocked"]
+    assert [r[:3] for r in records] == [("42", 2, False)]
+    assert limiter.get_stats()["rejected"] == 1
@@ -0,0 +1,76 @@
+"""
+Unit tests for Skill Index (обратный индекс + BM25, без чтения диска на запрос)
+"""
+
+import tempfile
+from pathlib import Path
+
+from knowledge_os.app.skill_index import SkillIndex, tokenize
+from knowledge_os.app.skill_registry import Skill, SkillRegistry
+
+
+def _skill(folder: str, description: str, instructions: str = "Do the thing.") -> Skill:
+    return Skill(
+        name=folder,
+        description=description,
+        category="general",
+        skill_path=f"/skills/{folder}",
+        instructions=instructions,
+    )
+
+
+def _index(**kwargs) -> SkillIndex:
+    return SkillIndex(**kwargs).build([
+        _skill("code-review", "Automated code review for pull requests, security and quality"),
+        _skill("frontend-design", "Design distinctive frontend interfaces with React and CSS"),
+        _skill("observability", "Metrics, logs and traces for production services"),
+    ])
+
+
+def test_tokenize_normalizes_case_and_punctuation():
+    assert tokenize("Code-Review: PR, Безопасность!") == ["code", "review", "pr", "безопасность"]
+
+
+def test_select_ranks_by_relevance():
+    index = _index()
+    assert index.select("Review pull request", "check security of the code")[0] == "code-review"
+    assert index.select("Add metrics", "expose traces and logs")[0] == "observability"
+
+
+def test_select_phrase_bonus_and_no_match():
+    index = _index()
+    assert index.select("нужен frontend design", "")[0] == "frontend-design"
+    assert index.select("совершенно другое", "ничего общего") == []
+
+
+def test_update_and_remove_skill():
+    index = _index()
+    index.update_skill(_skill("observability", "Kubernetes alerting dashboards"))
+    assert index.select("kubernetes alerting", "")[0] == "observability"
+    assert index.select("traces logs", "") == []
+    index.remove_skill("observability")
+    assert "observability" not in index
+    assert len(index) == 2
+
+
+def test_snippets_are_pre_trimmed():
+    index = SkillIndex(max_snippet_chars=10).build([_skill("code-review", "review", "x" * 50)])
+    block = index.snippets_block(["code-review", "missing"])
+    assert "[code-review]\n" + "x" * 10 + "\n..." in block
+    assert "missing" not in block
+    assert index.snippets_block([]) == ""
+
+
+def test_build_from_registry():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        skill_dir = Path(tmpdir) / "test-skill"
+        skill_dir.mkdir()
+        (skill_dir / "SKILL.md").write_text(
+            "---\nname: test-skill\ndescription: Parses invoices\n---\n\n# Test\nInstructions here\n",
+            encoding="utf-8",
+        )
+        registry = SkillRegistry(bundled_skills_dir=tmpdir, managed_skills_dir=tmpdir)
+        registry.load_skills()
+        index = SkillIndex(registry).build()
+        assert index.select("parse invoices", "") == ["test-skill"]
+        assert "Instructions here" in index.snippet("test-skill")
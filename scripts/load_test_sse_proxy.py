@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест SSE-прокси /api/chat/stream: задержка пересылки каждого чанка и CPU на стрим.
+
+Поднимает фейковую Victoria (/stream отдаёт N событий chunk с меткой времени отправки)
+и прокси бэкенда в отдельном процессе (chat router + StructuredLogging + RateLimit middleware),
+затем открывает S одновременных стримов. Метрики:
+- задержка чанка = время получения клиентом − время отправки фейковой Victoria (p50/p95/p99);
+  рядом — те же стримы напрямую из Victoria, разница = накладные расходы прокси;
+- CPU процесса прокси (utime+stime из /proc, Linux) на стрим и на чанк.
+
+  python scripts/load_test_sse_proxy.py --streams 50 --chunks 200 --interval-ms 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "backend"))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def build_fake_victoria(chunks: int, interval: float):
+    """Фейковая Victoria: /stream — start, chunks × chunk (с ts отправки), end"""
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+
+    @app.post("/stream")
+    async def stream():
+        async def events():
+            yield f"data: {json.dumps({'type': 'start'})}\n\n"
+            for i in range(chunks):
+                await asyncio.sleep(interval)
+                yield f"data: {json.dumps({'type': 'chunk', 'content': f'токен {i} ', 'ts': time.time()}, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps({'type': 'end'})}\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def build_proxy_app():
+    """Прокси бэкенда: только chat router и middleware, как в app.main"""
+    from fastapi import FastAPI
+    from app.middleware.logging_middleware import StructuredLoggingMiddleware
+    from app.middleware.rate_limiter import RateLimitMiddleware
+    from app.routers import chat
+
+    app = FastAPI()
+    app.add_middleware(StructuredLoggingMiddleware)
+    app.add_middleware(RateLimitMiddleware)
+    app.include_router(chat.router, prefix="/api/chat")
+    return app
+
+
+def _cpu_seconds(pid: int) -> Optional[float]:
+    """utime + stime процесса (Linux /proc)"""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+async def _consume(client, url: str, body: Optional[dict]) -> List[float]:
+    """Задержки (мс) всех чанков одного стрима"""
+    latencies = []
+    buffer = b""
+    async with client.stream("POST", url, json=body) as response:
+        async for data in response.aiter_raw():
+            received = time.time()
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.startswith(b"data: ") and b'"ts"' in line:
+                    latencies.append((received - json.loads(line[6:])["ts"]) * 1000)
+    return latencies
+
+
+async def _wait_ready(url: str, timeout: float = 20.0) -> None:
+    import httpx
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.time() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} не поднялся за {timeout} с")
+
+
+def _report(name: str, latencies: List[float]) -> float:
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))]  # noqa: E731
+    p50 = statistics.median(latencies)
+    print(f"  {name:<8} чанков {len(latencies):6d}   p50 {p50:7.2f} мс   p95 {pct(0.95):7.2f} мс   "
+          f"p99 {pct(0.99):7.2f} мс   max {latencies[-1]:7.2f} мс")
+    return p50
+
+
+async def run(streams: int, chunks: int, interval: float) -> None:
+    import httpx
+    import uvicorn
+
+    victoria_port, proxy_port = _free_port(), _free_port()
+    upstream = uvicorn.Server(uvicorn.Config(
+        build_fake_victoria(chunks, interval), port=victoria_port, log_level="warning"))
+    upstream_task = asyncio.create_task(upstream.serve())
+
+    env = dict(
+        os.environ,
+        VICTORIA_URL=f"http://127.0.0.1:{victoria_port}",
+        MAX_CONCURRENT_VICTORIA=str(streams),
+        VICTORIA_ADMISSION_INITIAL=str(streams),
+        RATE_LIMIT_PER_MINUTE=str(streams * 10),
+        LOG_LEVEL="WARNING",
+    )
+    proxy = subprocess.Popen(
+        [sys.executable, __file__, "--serve-proxy", str(proxy_port)],
+        env=env, cwd=str(REPO_ROOT / "backend"),
+    )
+    try:
+        await _wait_ready(f"http://127.0.0.1:{victoria_port}/docs")
+        await _wait_ready(f"http://127.0.0.1:{proxy_port}/docs")
+        limits = httpx.Limits(max_connections=streams * 2)
+        async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+            direct = await asyncio.gather(*(
+                _consume(client, f"http://127.0.0.1:{victoria_port}/stream", None) for _ in range(streams)))
+            cpu_before = _cpu_seconds(proxy.pid)
+            started = time.perf_counter()
+            proxied = await asyncio.gather(*(
+                _consume(client, f"http://127.0.0.1:{proxy_port}/api/chat/stream", {"content": "load test"})
+                for _ in range(streams)))
+            elapsed = time.perf_counter() - started
+            cpu_after = _cpu_seconds(proxy.pid)
+    finally:
+        proxy.terminate()
+        proxy.wait(timeout=10)
+        upstream.should_exit = True
+        await upstream_task
+
+    print(f"\n{streams} стримов × {chunks} чанков, интервал {interval * 1000:.0f} мс, прокси-запуск {elapsed:.1f} с")
+    base = _report("напрямую", [x for s in direct for x in s])
+    via = _report("прокси", [x for s in proxied for x in s])
+    print(f"  накладные расходы прокси (p50): {via - base:.2f} мс на чанк")
+    if cpu_before is not None and cpu_after is not None:
+        cpu = cpu_after - cpu_before
+        total_chunks = sum(len(s) for s in proxied) or 1
+        print(f"  CPU прокси: {cpu * 1000 / streams:.1f} мс на стрим, {cpu * 1e6 / total_chunks:.0f} мкс на чанк")
+    else:
+        print("  CPU прокси: недоступно (нужен Linux /proc)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--interval-ms", type=float, default=10.0)
+    parser.add_argument("--serve-proxy", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_proxy:
+        import uvicorn
+        uvicorn.run(build_proxy_app(), port=args.serve_proxy, log_level="warning")
+        return
+    asyncio.run(run(args.streams, args.chunks, args.interval_ms / 1000))
+
+
+if __name__ == "__main__":
+    main()
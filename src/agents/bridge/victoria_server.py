@@ -3998,6 +3998,15 @@ async def metrics():
         "# TYPE victoria_rag_slow_requests_total counter\n"
         f"victoria_rag_slow_requests_total {_rag_latency_slow_count}\n"
     )
+    # Single-flight LLM: генерации Victoria идут через LocalAIRouter этого процесса
+    try:
+        try:
+            from llm_singleflight import get_llm_singleflight
+        except ImportError:
+            from app.llm_singleflight import get_llm_singleflight
+        body += get_llm_singleflight().export_prometheus()
+    except Exception as e:
+        logger.debug("single-flight metrics: %s", e)
     return PlainTextResponse(body, media_type="text/plain; charset=utf-8")
 
 
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Движок свечей с иерархической агрегацией таймфреймов
+
+Для каждого символа один раз загружается базовый (самый мелкий нужный) таймфрейм,
+а старшие таймфреймы (2h, 4h, 1d, ...) строятся из него свёрткой OHLCV с
+выравниванием границ по UTC-эпохе, как это делают биржи. При обновлении
+догружаются только новые базовые свечи и пересчитываются лишь затронутые бакеты
+старших таймфреймов. Все MTF-потребители читают свои представления из одной
+закэшированной серии: вместо 3–4 запросов к бирже на символ — один.
+
+Устаревание: серия символа перезапрашивается не чаще раза в refresh_interval
+(по умолчанию 60 с), поэтому базовый ТФ и все представления могут отставать от
+биржи до refresh_interval — прежде всего формирующаяся (последняя) свеча: её
+close/high/low/volume — на момент последней загрузки. Закрытые свечи не меняются.
+Потребителям, которым нужна цена точнее, — тикер/стакан, а не последняя свеча.
+
+С подключённым MarketDataHub (attach_hub) обновление берётся из потока: минутные
+свечи хаба сворачиваются в базовый ТФ без запроса к бирже. REST остаётся для
+первичной загрузки истории и для случаев, когда поток отстал или не покрывает
+текущую базовую свечу целиком.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+TIMEFRAME_MS = {
+    "1m": 60_000,
+    "3m": 180_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "30m": 1_800_000,
+    "1h": 3_600_000,
+    "2h": 7_200_000,
+    "4h": 14_400_000,
+    "6h": 21_600_000,
+    "8h": 28_800_000,
+    "12h": 43_200_000,
+    "1d": 86_400_000,
+}
+
+OHLCV_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume"]
+
+OhlcFetcher = Callable[..., Awaitable[Any]]
+
+
+def _datetime_ms(values: pd.Series) -> np.ndarray:
+    """datetime (любое разрешение pandas: ns, us, ms, s; с таймзоной или без) -> мс от эпохи UTC."""
+    delta = pd.to_datetime(values, utc=True) - pd.Timestamp(0, tz="UTC")
+    return (delta // pd.Timedelta(milliseconds=1)).to_numpy(dtype="int64")
+
+
+def _normalize_timestamps(values: pd.Series) -> Optional[np.ndarray]:
+    """Приводит метки времени (мс, секунды или datetime) к int64 миллисекундам."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return _datetime_ms(values)
+    numeric = pd.to_numeric(values, errors="coerce")
+    if numeric.isna().any():
+        parsed = pd.to_datetime(values, errors="coerce", utc=True)
+        if parsed.isna().any():
+            return None
+        return _datetime_ms(parsed)
+    ts = numeric.to_numpy(dtype="int64")
+    if len(ts) and ts.max() < 100_000_000_000:  # секунды
+        ts = ts * 1000
+    return ts
+
+
+def to_ohlcv_frame(ohlc: Any) -> Optional[pd.DataFrame]:
+    """Список словарей / DataFrame биржи -> отсортированный OHLCV с timestamp в мс."""
+    if ohlc is None or len(ohlc) == 0:
+        return None
+    df = ohlc.copy() if isinstance(ohlc, pd.DataFrame) else pd.DataFrame(ohlc)
+    if "timestamp" not in df.columns and isinstance(df.index, pd.DatetimeIndex):
+        df = df.reset_index().rename(columns={df.index.name or "index": "timestamp"})
+    if not all(col in df.columns for col in OHLCV_COLUMNS):
+        return None
+    ts = _normalize_timestamps(df["timestamp"])
+    if ts is None:
+        return None
+    frame = pd.DataFrame({"timestamp": ts})
+    for col in OHLCV_COLUMNS[1:]:
+        frame[col] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64")
+    frame = frame.dropna()
+    frame = frame.drop_duplicates("timestamp", keep="last").sort_values("timestamp")
+    return frame.reset_index(drop=True)
+
+
+def rollup(base: pd.DataFrame, base_ms: int, target_ms: int, drop_partial_head: bool = True) -> pd.DataFrame:
+    """Свёртка базовых свечей в старший таймфрейм с выравниванием по UTC-эпохе.
+
+    Первый бакет отбрасывается, если история начинается внутри него (он был бы
+    неполным и искажал open/high/low). Последний (формирующийся) бакет остаётся,
+    как и у биржи.
+    """
+    if base.empty:
+        return base.iloc[0:0].copy()
+    ts = base["timestamp"].to_numpy()
+    buckets = ts - ts % target_ms
+    grouped = base.groupby(buckets, sort=True)
+    out = pd.DataFrame({
+        "open": grouped["open"].first(),
+        "high": grouped["high"].max(),
+        "low": grouped["low"].min(),
+        "close": grouped["close"].last(),
+        "volume": grouped["volume"].sum(),
+    })
+    out.index.name = "timestamp"
+    out = out.reset_index()
+    if drop_partial_head and len(out) and ts[0] > buckets[0]:
+        out = out.iloc[1:]
+    return out.reset_index(drop=True)
+
+
+class _SymbolSeries:
+    """Базовая серия символа и построенные из неё представления."""
+
+    __slots__ = ("base", "views", "fetched_at", "lock")
+
+    def __init__(self):
+        self.base: Optional[pd.DataFrame] = None
+        self.views: Dict[str, pd.DataFrame] = {}
+        self.fetched_at = 0.0
+        self.lock = asyncio.Lock()
+
+
+class CandleEngine:
+    """Кэш свечей: одна базовая загрузка на символ, старшие ТФ — агрегацией.
+
+    get_frame() отдаёт данные возрастом до refresh_interval секунд (см. модуль).
+    """
+
+    def __init__(
+        self,
+        base_timeframe: str = "1h",
+        history: int = 1000,
+        refresh_interval: float = 60.0,
+        fetcher: Optional[OhlcFetcher] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        if base_timeframe not in TIMEFRAME_MS:
+            raise ValueError(f"Неизвестный базовый таймфрейм: {base_timeframe}")
+        self.base_timeframe = base_timeframe
+        self.base_ms = TIMEFRAME_MS[base_timeframe]
+        self.history = history  # лимит одного запроса Binance
+        self.refresh_interval = refresh_interval
+        self._fetcher = fetcher
+        self._clock = clock
+        self._series: Dict[str, _SymbolSeries] = {}
+        self._hub: Any = None
+        self._stream_ms = 0
+        self.stats = {"fetches": 0, "incremental_fetches": 0, "hits": 0, "direct_fetches": 0,
+                      "stream_refreshes": 0}
+
+    def attach_hub(self, hub: Any, interval: str = "1m") -> None:
+        """Обновлять серии из свечей MarketDataHub (interval — таймфрейм потока хаба)."""
+        stream_ms = TIMEFRAME_MS.get(interval)
+        if not stream_ms or self.base_ms % stream_ms:
+            raise ValueError(f"Таймфрейм потока {interval} не сворачивается в {self.base_timeframe}")
+        self._hub = hub
+        self._stream_ms = stream_ms
+
+    # --- загрузка ---
+
+    async def _fetch(self, symbol: str, interval: str, limit: int) -> Any:
+        fetcher = self._fetcher
+        if fetcher is None:
+            from src.execution import exchange_api  # type: ignore # pylint: disable=import-outside-toplevel
+            fetcher = exchange_api.get_ohlc_with_fallback
+        return await fetcher(symbol, interval=interval, limit=limit)
+
+    def supports(self, timeframe: str) -> bool:
+        """True, если таймфрейм выводится из базового."""
+        target_ms = TIMEFRAME_MS.get(timeframe)
+        return bool(target_ms) and target_ms >= self.base_ms and target_ms % self.base_ms == 0
+
+    async def _refresh(self, symbol: str, series: _SymbolSeries) -> None:
+        now = self._clock()
+        if series.base is not None and now - series.fetched_at < self.refresh_interval:
+            self.stats["hits"] += 1
+            return
+        if self._refresh_from_stream(symbol, series, now):
+            self.stats["stream_refreshes"] += 1
+            return
+
+        if series.base is None or series.base.empty:
+            limit = self.history
+        else:
+            # Догружаем только свечи с момента последней (включая формирующуюся)
+            last_ts = int(series.base["timestamp"].iloc[-1])
+            missing = math.ceil((now * 1000 - last_ts) / self.base_ms) + 1
+            limit = max(2, min(self.history, missing))
+            self.stats["incremental_fetches"] += 1
+        self.stats["fetches"] += 1
+
+        fresh = to_ohlcv_frame(await self._fetch(symbol, self.base_timeframe, limit))
+        series.fetched_at = now
+        if fresh is None or fresh.empty:
+            return
+        self._merge(series, fresh)
+
+    def _refresh_from_stream(self, symbol: str, series: _SymbolSeries, now: float) -> bool:
+        """Догружает серию из свечей хаба; False — поток не может заменить запрос к бирже."""
+        if self._hub is None or series.base is None or series.base.empty:
+            return False
+        snapshot = self._hub.get(symbol)
+        if snapshot is None or not snapshot.candles or now - snapshot.ts > self.refresh_interval:
+            return False
+        stream = pd.DataFrame(
+            [(c.open_time, c.open, c.high, c.low, c.close, c.volume) for c in snapshot.candles],
+            columns=OHLCV_COLUMNS,
+        )
+        # Неполный первый бакет отбрасывается: его open/high/low/volume были бы неверны
+        fresh = rollup(stream, self._stream_ms, self.base_ms)
+        last_ts = int(series.base["timestamp"].iloc[-1])
+        if fresh.empty or int(fresh["timestamp"].iloc[0]) > last_ts:
+            return False  # поток не покрывает последнюю базовую свечу — дыра в серии
+        fresh = fresh[fresh["timestamp"] >= last_ts].reset_index(drop=True)
+        if fresh.empty:
+            return False
+        self._merge(series, fresh)
+        series.fetched_at = now
+        return True
+
+    def _merge(self, series: _SymbolSeries, fresh: pd.DataFrame) -> None:
+        first_changed = int(fresh["timestamp"].iloc[0])
+        if series.base is None or series.base.empty or first_changed <= int(series.base["timestamp"].iloc[0]):
+            series.base = fresh.tail(self.history).reset_index(drop=True)
+            series.views.clear()
+            return
+        kept = series.base[series.base["timestamp"] < first_changed]
+        series.base = pd.concat([kept, fresh], ignore_index=True).tail(self.history).reset_index(drop=True)
+
+        # Пересчитываем только бакеты, которые затронули новые базовые свечи
+        base_start = int(series.base["timestamp"].iloc[0])
+        for timeframe, view in list(series.views.items()):
+            target_ms = TIMEFRAME_MS[timeframe]
+            bucket_start = first_changed - first_changed % target_ms
+            tail = series.base[series.base["timestamp"] >= bucket_start]
+            updated = rollup(tail, self.base_ms, target_ms, drop_partial_head=bucket_start < base_start)
+            first_full = base_start + (-base_start) % target_ms
+            head = view[(view["timestamp"] < bucket_start) & (view["timestamp"] >= first_full)]
+            series.views[timeframe] = pd.concat([head, updated], ignore_index=True)
+
+    # --- чтение ---
+
+    async def get_frame(self, symbol: str, timeframe: str, limit: int = 100) -> Optional[pd.DataFrame]:
+        """OHLCV таймфрейма (timestamp в мс) из общей серии символа.
+
+        Таймфреймы мельче базового или длиннее доступной истории запрашиваются
+        у биржи напрямую.
+        """
+        max_derivable = self.history * self.base_ms // TIMEFRAME_MS.get(timeframe, self.base_ms)
+        if not self.supports(timeframe) or limit > max_derivable:
+            self.stats["direct_fetches"] += 1
+            return to_ohlcv_frame(await self._fetch(symbol, timeframe, limit))
+
+        series = self._series.get(symbol)
+        if series is None:
+            series = self._series[symbol] = _SymbolSeries()
+        async with series.lock:
+            await self._refresh(symbol, series)
+            if series.base is None or series.base.empty:
+                return None
+            if timeframe == self.base_timeframe:
+                view = series.base
+            else:
+                view = series.views.get(timeframe)
+                if view is None:
+                    view = rollup(series.base, self.base_ms, TIMEFRAME_MS[timeframe])
+                    series.views[timeframe] = view
+            return view.tail(limit).reset_index(drop=True)
+
+    async def get_ohlc(self, symbol: str, interval: str = "1h", limit: int = 100) -> List[Dict[str, Any]]:
+        """Совместимая с get_ohlc_with_fallback форма: список словарей OHLCV."""
+        frame = await self.get_frame(symbol, interval, limit)
+        if frame is None:
+            return []
+        return frame.to_dict("records")
+
+    def invalidate(self, symbol: Optional[str] = None) -> None:
+        if symbol is None:
+            self._series.clear()
+        else:
+            self._series.pop(symbol, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "symbols": len(self._series), "base_timeframe": self.base_timeframe}
+
+
+_engine: Optional[CandleEngine] = None
+
+
+def get_candle_engine() -> CandleEngine:
+    """Глобальный движок свечей процесса."""
+    global _engine  # noqa: PLW0603
+    if _engine is None:
+        _engine = CandleEngine()
+    return _engine
@@ -281,6 +281,15 @@ async def get_current_price_robust(symbol: str, max_retries: int = 3) -> Optiona
     except Exception:
         pass
 
+    # Живая цена из WebSocket-хаба: без сетевого запроса
+    try:
+        from src.infrastructure.websockets.market_data_hub import get_streamed_price
+        streamed_price = get_streamed_price(symbol, max_age=5.0)
+        if streamed_price is not None:
+            return streamed_price
+    except ImportError:
+        pass
+
     # Проверяем кэш
     cached_price = price_cache.get(symbol)
     if cached_price is not None:
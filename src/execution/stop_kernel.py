@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Stop Kernel - векторизованное ядро trailing stop и частичной фиксации прибыли
+
+Одно ядро для live и бектестов:
+- StopBook хранит открытые позиции колонками NumPy (struct-of-arrays);
+- trailing_step() за один проход обновляет стопы всех позиций
+  (подтягивание к TP1, от TP1 к TP2, классический трейлинг от экстремума);
+- факторы адаптивного SL (ATR, ADX, режим) считаются один раз на свечу символа
+  (FactorCache), а не на каждую позицию и каждый тик;
+- simulate_paths() прогоняет через то же ядро целые ценовые пути бектеста,
+  включая TP1 (частичное закрытие + SL в безубыток), TP2 и срабатывание SL;
+  на нём считают выходы бектесты knowledge_os/scripts/run_advanced_backtest.py
+  (STATIC_EXIT_SETTINGS — статичный SL, как до ядра) и
+  yearly_backtest_with_tp1_trailing.py (DEFAULT_SETTINGS — трейлинг как в live).
+
+Семантика шага совпадает с TrailingStopManager.update_trailing_stop.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+LONG = 1
+SHORT = -1
+
+# Причины перемещения стопа (reason codes шага)
+REASON_NONE = 0
+REASON_TP1 = 1
+REASON_TP2 = 2
+REASON_TRAIL = 3
+REASON_WAITING = 4
+
+# Коды режимов рынка для расстояния трейлинга
+REGIME_CODES = {"NEUTRAL": 0, "HIGH_VOL_RANGE": 1, "BULL_TREND": 2}
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    'activation_min_profit_pct': 1.0,
+    'min_trail_distance_pct': 0.5,
+    'use_atr_based': True,
+    'breakeven_offset_pct': 0.3,
+    'max_trail_distance_pct': 8.0,
+    'tp1_trailing_enabled': True,
+    'tp1_activation_progress': 0.5,
+    'tp1_sl_progress_ratio': 1.0,
+    'tp1_min_atr_multiplier': 2.0,
+    # Частичная фиксация прибыли (бектест / simulate_paths)
+    'tp1_split_pct': 50,
+    'move_sl_to_be_after_tp1': True,
+    'trailing_enabled': True,   # False — стоп не двигается (только SL/TP1/TP2)
+    'tp2_requires_tp1': True,   # False — TP2 закрывает всю позицию и без частичного TP1
+}
+
+# Выходы без трейлинга: статичный SL, TP1 — частичное закрытие без переноса SL,
+# TP2 (в т.ч. гэп через TP1 и TP2 на одной свече) — закрытие всей оставшейся позиции
+STATIC_EXIT_SETTINGS: Dict[str, Any] = dict(
+    DEFAULT_SETTINGS,
+    trailing_enabled=False,
+    tp1_trailing_enabled=False,
+    move_sl_to_be_after_tp1=False,
+    tp2_requires_tp1=False,
+)
+
+
+def side_code(side: str) -> int:
+    """LONG/SHORT -> +1/-1"""
+    return SHORT if str(side).upper() == "SHORT" else LONG
+
+
+def _favor(side: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Более выгодный для позиции стоп: max для LONG, min для SHORT."""
+    return side * np.maximum(side * a, side * b)
+
+
+# ---------------------------------------------------------------------------
+# Факторы адаптивного SL: один расчёт на свечу символа
+# ---------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class SymbolFactors:
+    """Ценонезависимые факторы свечи символа для адаптивного ratio."""
+    atr: float            # ATR(14) по true range
+    returns_std: float    # std доходностей
+    adx: float
+    plus_di_above: bool   # +DI > -DI на последней свече
+    plus_di_below: bool   # +DI < -DI на последней свече
+    ma_alignment: float
+    regime_multiplier: float
+    atr_hl: float         # ATR(14) по high-low (ограничения)
+
+
+def compute_symbol_factors(df: pd.DataFrame) -> SymbolFactors:
+    """Считает все факторы по OHLCV за один проход (то же, что _analyze_* по отдельности)."""
+    high, low, close = df['high'], df['low'], df['close']
+    prev_close = close.shift()
+    high_low = high - low
+    true_range = np.maximum(np.maximum(high_low, (high - prev_close).abs()), (low - prev_close).abs())
+
+    period = 14
+    atr_series = true_range.rolling(period).mean()
+    atr = float(atr_series.iloc[-1])
+
+    returns = close.pct_change().dropna()
+    returns_std = float(returns.std()) if len(returns) > 0 else 0.0
+
+    # Упрощённый ADX
+    plus_dm = high.diff()
+    minus_dm = low.diff().abs()
+    plus_dm_arr = np.where((plus_dm > minus_dm) & (plus_dm > 0), plus_dm, 0)
+    minus_dm_arr = np.where((minus_dm > plus_dm) & (minus_dm > 0), minus_dm, 0)
+    plus_di = 100 * (pd.Series(plus_dm_arr, index=high.index).rolling(period).mean() / atr_series)
+    minus_di = 100 * (pd.Series(minus_dm_arr, index=low.index).rolling(period).mean() / atr_series)
+    dx = 100 * (plus_di - minus_di).abs() / (plus_di + minus_di)
+    adx = float(dx.rolling(period).mean().iloc[-1]) if not dx.empty and not dx.isna().all() else 25.0
+
+    ma_fast = close.rolling(20).mean()
+    ma_slow = close.rolling(50).mean()
+    if len(ma_fast) > 5 and len(ma_slow) > 5 and not ma_fast.isna().iloc[-5] and not ma_slow.isna().iloc[-5]:
+        ma_fast_slope = (ma_fast.iloc[-1] - ma_fast.iloc[-5]) / ma_fast.iloc[-5]
+        ma_slow_slope = (ma_slow.iloc[-1] - ma_slow.iloc[-5]) / ma_slow.iloc[-5]
+        ma_alignment = 1.0 if (ma_fast_slope * ma_slow_slope) > 0 else 0.5
+    else:
+        ma_alignment = 0.5
+
+    volatility_rolling = returns.rolling(20).std()
+    regime_multiplier = 1.0
+    if not volatility_rolling.empty:
+        current_vol = volatility_rolling.iloc[-1]
+        avg_vol = volatility_rolling.mean()
+        if current_vol > avg_vol * 1.5:
+            regime_multiplier = 0.8
+        elif current_vol < avg_vol * 0.7:
+            regime_multiplier = 1.1
+
+    last_plus = plus_di.iloc[-1] if len(plus_di) else np.nan
+    last_minus = minus_di.iloc[-1] if len(minus_di) else np.nan
+    return SymbolFactors(
+        atr=atr,
+        returns_std=returns_std,
+        adx=adx,
+        plus_di_above=bool(last_plus > last_minus),
+        plus_di_below=bool(last_plus < last_minus),
+        ma_alignment=ma_alignment,
+        regime_multiplier=regime_multiplier,
+        atr_hl=float(high_low.rolling(period).mean().iloc[-1]),
+    )
+
+
+def _candle_key(df: pd.DataFrame) -> Hashable:
+    """Идентификатор последней свечи: индекс/timestamp последней строки и длина."""
+    if 'timestamp' in df.columns:
+        return (df['timestamp'].iloc[-1], len(df))
+    return (df.index[-1], len(df))
+
+
+class FactorCache:
+    """Кэш SymbolFactors по (symbol, последняя свеча). Пересчёт только на новой свече."""
+
+    def __init__(self, max_symbols: int = 2048):
+        self.max_symbols = max_symbols
+        self._cache: Dict[str, Tuple[Hashable, SymbolFactors]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, symbol: str, df: pd.DataFrame) -> SymbolFactors:
+        key = _candle_key(df)
+        cached = self._cache.get(symbol)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        factors = compute_symbol_factors(df)
+        if symbol not in self._cache and len(self._cache) >= self.max_symbols:
+            self._cache.pop(next(iter(self._cache)))
+        self._cache[symbol] = (key, factors)
+        return factors
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+# ---------------------------------------------------------------------------
+# Книга позиций (struct-of-arrays)
+# ---------------------------------------------------------------------------
+
+_FLOAT_COLUMNS = ("entry", "tp1", "tp2", "stop", "initial_stop", "extreme", "last_update")
+_INT_COLUMNS = ("side", "moves", "tp1_moves", "tp2_moves")
+_BOOL_COLUMNS = ("trailing_activated", "tp1_trailing", "tp2_trailing", "tp1_hit")
+
+
+class StopBook:
+    """Открытые позиции колонками NumPy. Ключ позиции -> номер строки, удаление swap-remove."""
+
+    def __init__(self, capacity: int = 64):
+        self._capacity = max(1, capacity)
+        self.size = 0
+        self.keys: List[Hashable] = []
+        self.market_symbols: List[str] = []
+        self.index: Dict[Hashable, int] = {}
+        self.cols: Dict[str, np.ndarray] = {}
+        for name in _FLOAT_COLUMNS:
+            self.cols[name] = np.full(self._capacity, np.nan)
+        for name in _INT_COLUMNS:
+            self.cols[name] = np.zeros(self._capacity, dtype=np.int64)
+        for name in _BOOL_COLUMNS:
+            self.cols[name] = np.zeros(self._capacity, dtype=bool)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.index
+
+    def view(self, name: str) -> np.ndarray:
+        """Живая часть колонки (без копирования)."""
+        return self.cols[name][:self.size]
+
+    def _grow(self) -> None:
+        self._capacity *= 2
+        for name, col in self.cols.items():
+            grown = np.zeros(self._capacity, dtype=col.dtype)
+            if col.dtype.kind == 'f':
+                grown[:] = np.nan
+            grown[:len(col)] = col
+            self.cols[name] = grown
+
+    def add(self, key: Hashable, *, entry: float, stop: float, side: str = "LONG",
+            tp1: Optional[float] = None, tp2: Optional[float] = None,
+            market_symbol: Optional[str] = None, now: float = 0.0) -> int:
+        """Добавляет (или переинициализирует) позицию. Возвращает номер строки."""
+        row = self.index.get(key)
+        if row is None:
+            if self.size == self._capacity:
+                self._grow()
+            row = self.size
+            self.size += 1
+            self.keys.append(key)
+            self.market_symbols.append(market_symbol or str(key))
+            self.index[key] = row
+        else:
+            self.market_symbols[row] = market_symbol or str(key)
+        c = self.cols
+        c["entry"][row] = entry
+        c["tp1"][row] = tp1 if tp1 else np.nan
+        c["tp2"][row] = tp2 if tp2 else np.nan
+        c["stop"][row] = stop
+        c["initial_stop"][row] = stop
+        c["extreme"][row] = entry
+        c["last_update"][row] = now
+        c["side"][row] = side_code(side)
+        for name in ("moves", "tp1_moves", "tp2_moves"):
+            c[name][row] = 0
+        for name in _BOOL_COLUMNS:
+            c[name][row] = False
+        return row
+
+    def remove(self, key: Hashable) -> bool:
+        row = self.index.pop(key, None)
+        if row is None:
+            return False
+        last = self.size - 1
+        if row != last:
+            for col in self.cols.values():
+                col[row] = col[last]
+            moved_key = self.keys[last]
+            self.keys[row] = moved_key
+            self.market_symbols[row] = self.market_symbols[last]
+            self.index[moved_key] = row
+        self.keys.pop()
+        self.market_symbols.pop()
+        self.size = last
+        return True
+
+    def position_dict(self, key: Hashable) -> Optional[Dict[str, Any]]:
+        """Позиция в прежнем формате positions_tracking."""
+        row = self.index.get(key)
+        if row is None:
+            return None
+        c = self.cols
+        side = int(c["side"][row])
+        extreme = float(c["extreme"][row])
+        entry = float(c["entry"][row])
+        tp1 = float(c["tp1"][row])
+        tp2 = float(c["tp2"][row])
+        return {
+            'entry_price': entry,
+            'highest_price': extreme if side == LONG else entry,
+            'lowest_price': extreme if side == SHORT else entry,
+            'current_stop': float(c["stop"][row]),
+            'initial_stop': float(c["initial_stop"][row]),
+            'trailing_activated': bool(c["trailing_activated"][row]),
+            'tp1_trailing_activated': bool(c["tp1_trailing"][row]),
+            'tp2_trailing_activated': bool(c["tp2_trailing"][row]),
+            'tp1_price': None if np.isnan(tp1) else tp1,
+            'tp2_price': None if np.isnan(tp2) else tp2,
+            'side': "LONG" if side == LONG else "SHORT",
+            'market_symbol': self.market_symbols[row],
+            'last_update': float(c["last_update"][row]),
+            'stop_moves_count': int(c["moves"][row]),
+            'tp1_trailing_moves_count': int(c["tp1_moves"][row]),
+            'tp2_trailing_moves_count': int(c["tp2_moves"][row]),
+        }
+
+
+# ---------------------------------------------------------------------------
+# Векторизованный шаг
+# ---------------------------------------------------------------------------
+
+@dataclass
+class StepResult:
+    """Результат trailing_step по всем позициям (массивы длины n)."""
+    new_stop: np.ndarray
+    moved: np.ndarray
+    reason: np.ndarray
+    profit_pct: np.ndarray
+    progress: np.ndarray      # прогресс к TP1 (REASON_TP1) или от TP1 к TP2 (REASON_TP2)
+    trail_distance_pct: np.ndarray
+
+
+def trailing_step(
+    cols: Dict[str, np.ndarray],
+    price: np.ndarray,
+    atr: Optional[np.ndarray] = None,
+    ratio: Optional[np.ndarray] = None,
+    regime: Optional[np.ndarray] = None,
+    settings: Optional[Dict[str, Any]] = None,
+    mask: Optional[np.ndarray] = None,
+) -> StepResult:
+    """Один шаг трейлинга для всех позиций. Колонки cols обновляются на месте.
+
+    cols: колонки StopBook.view() (или срезы той же длины, что price)
+    atr: ATR по позициям (nan/0 = нет ATR)
+    ratio: коэффициент подтягивания SL (адаптивный или статический) по позициям
+    regime: коды REGIME_CODES по позициям
+    mask: какие позиции обновлять (по умолчанию все)
+    """
+    s = DEFAULT_SETTINGS if settings is None else settings
+    n = price.shape[0]
+    price = np.asarray(price, dtype=float)
+    side = cols["side"].astype(float)
+    entry = cols["entry"]
+    tp1 = cols["tp1"]
+    tp2 = cols["tp2"]
+    stop = cols["stop"]
+    active = ~np.isnan(price)
+    if mask is not None:
+        active &= mask
+
+    atr = np.zeros(n) if atr is None else np.nan_to_num(np.asarray(atr, dtype=float), nan=0.0)
+    has_atr = atr > 0
+    if ratio is None:
+        ratio = np.full(n, float(s['tp1_sl_progress_ratio']))
+    regime = np.zeros(n, dtype=np.int64) if regime is None else regime
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profit_pct = side * (price - entry) / entry * 100
+
+        # Экстремум цены в сторону позиции
+        cols["extreme"][:] = np.where(active, _favor(side, cols["extreme"], price), cols["extreme"])
+
+        # 1. Подтягивание к TP1
+        tp1_enabled = bool(s['tp1_trailing_enabled'])
+        has_tp1 = ~np.isnan(tp1) & tp1_enabled
+        tp1_valid = has_tp1 & (side * (tp1 - entry) > 0) & (side * (price - tp1) < 0)
+        progress1 = (price - entry) / (tp1 - entry)
+        tp1_active = active & tp1_valid & (progress1 >= s['tp1_activation_progress'])
+        new_sl1 = entry + (tp1 - entry) * (progress1 * ratio)
+        breakeven_tp1 = entry * (1 + side * 0.002)
+        new_sl1 = _favor(side, new_sl1, breakeven_tp1)
+        # Не ближе ATR * multiplier от цены (для SHORT ограничение снизу, как в calculate_tp1_trailing_stop)
+        atr_floor = np.where(side > 0, price - atr * s['tp1_min_atr_multiplier'],
+                             price + atr * s['tp1_min_atr_multiplier'])
+        new_sl1 = np.where(has_atr, np.maximum(new_sl1, atr_floor), new_sl1)
+        moved1 = tp1_active & (side * (new_sl1 - stop) > 0)
+
+        # 2. Подтягивание от TP1 к TP2
+        has_tp2 = has_tp1 & ~np.isnan(tp2)
+        past_tp1 = side * (price - tp1) >= 0
+        tp2_valid = has_tp2 & past_tp1 & (side * (tp2 - tp1) > 0) & (side * (price - tp2) < 0)
+        progress2 = (price - tp1) / (tp2 - tp1)
+        new_sl2 = tp1 + (tp2 - tp1) * (progress2 * ratio)
+        moved2 = active & ~moved1 & tp2_valid & (side * (new_sl2 - stop) > 0)
+
+        # 3. Классический трейлинг от экстремума
+        rest = active & ~moved1 & ~moved2
+        activated = cols["trailing_activated"] | (rest & (profit_pct >= s['activation_min_profit_pct']))
+        cols["trailing_activated"][:] = np.where(rest, activated, cols["trailing_activated"])
+        atr_pct = atr / price * 100
+        atr_distance = np.select(
+            [regime == REGIME_CODES["HIGH_VOL_RANGE"], regime == REGIME_CODES["BULL_TREND"]],
+            [np.minimum(atr_pct * 2.0, s['max_trail_distance_pct']),
+             np.maximum(atr_pct * 1.0, s['min_trail_distance_pct'])],
+            default=np.minimum(atr_pct * 1.5, s['max_trail_distance_pct']),
+        )
+        use_atr = has_atr & bool(s['use_atr_based'])
+        trail_distance = np.where(use_atr, atr_distance, s['min_trail_distance_pct'])
+        new_sl3 = cols["extreme"] * (1 - side * trail_distance / 100)
+        breakeven_trail = entry * (1 + side * s['breakeven_offset_pct'] / 100)
+        new_sl3 = _favor(side, new_sl3, breakeven_trail)
+        moved3 = rest & activated & (side * (new_sl3 - stop) > 0)
+
+    new_stop = np.select([moved1, moved2, moved3], [new_sl1, new_sl2, new_sl3], default=stop)
+    moved = moved1 | moved2 | moved3
+    reason = np.select(
+        [moved1, moved2, moved3, rest & ~activated],
+        [REASON_TP1, REASON_TP2, REASON_TRAIL, REASON_WAITING],
+        default=REASON_NONE,
+    )
+    progress = np.where(moved1, progress1, np.where(moved2, progress2, np.nan))
+
+    stop[:] = new_stop
+    cols["moves"][:] += moved3
+    cols["tp1_moves"][:] += moved1
+    cols["tp2_moves"][:] += moved2
+    cols["tp1_trailing"][:] |= moved1
+    cols["tp2_trailing"][:] |= moved2
+
+    return StepResult(
+        new_stop=new_stop,
+        moved=moved,
+        reason=reason,
+        profit_pct=profit_pct,
+        progress=progress,
+        trail_distance_pct=trail_distance,
+    )
+
+
+# ---------------------------------------------------------------------------
+# Бектест: прогон ценовых путей через то же ядро
+# ---------------------------------------------------------------------------
+
+EXIT_OPEN = 0
+EXIT_SL = 1
+EXIT_TP2 = 2
+
+
+@dataclass
+class SimulationResult:
+    """Итог simulate_paths по каждой позиции."""
+    exit_code: np.ndarray       # EXIT_OPEN / EXIT_SL / EXIT_TP2
+    exit_step: np.ndarray       # номер шага выхода (-1 если открыта)
+    exit_price: np.ndarray
+    tp1_step: np.ndarray        # шаг частичного закрытия на TP1 (-1 если не было)
+    final_stop: np.ndarray
+    pnl_pct: np.ndarray         # взвешенный PnL с учётом частичного закрытия, % от входа
+    stop_moves: np.ndarray
+
+
+def simulate_paths(
+    entry: np.ndarray,
+    stop: np.ndarray,
+    side: np.ndarray,
+    tp1: np.ndarray,
+    tp2: np.ndarray,
+    prices: np.ndarray,
+    atr: Optional[np.ndarray] = None,
+    ratio: Optional[np.ndarray] = None,
+    regime: Optional[np.ndarray] = None,
+    settings: Optional[Dict[str, Any]] = None,
+) -> SimulationResult:
+    """Прогоняет матрицу цен prices[T, N] для N позиций через trailing_step.
+
+    На каждом шаге: проверка SL по текущему стопу -> TP1 (частичное закрытие
+    tp1_split_pct%, SL в безубыток) -> TP2 (закрытие остатка) -> шаг трейлинга.
+    Правила выходов переключаются настройками (trailing_enabled, tp2_requires_tp1,
+    move_sl_to_be_after_tp1; см. STATIC_EXIT_SETTINGS).
+    atr/ratio/regime: массивы [N] или [T, N] (факторы по свечам).
+    NaN в prices = позиция ещё не открыта / нет данных на этом шаге.
+    """
+    s = dict(DEFAULT_SETTINGS if settings is None else settings)
+    prices = np.asarray(prices, dtype=float)
+    steps, n = prices.shape
+    side = np.asarray([side_code(x) for x in side] if np.asarray(side).dtype.kind in "OUS" else side,
+                      dtype=np.int64)
+    cols = {
+        "entry": np.asarray(entry, dtype=float).copy(),
+        "tp1": np.asarray(tp1, dtype=float).copy(),
+        "tp2": np.asarray(tp2, dtype=float).copy(),
+        "stop": np.asarray(stop, dtype=float).copy(),
+        "extreme": np.asarray(entry, dtype=float).copy(),
+        "side": side,
+        "moves": np.zeros(n, dtype=np.int64),
+        "tp1_moves": np.zeros(n, dtype=np.int64),
+        "tp2_moves": np.zeros(n, dtype=np.int64),
+        "trailing_activated": np.zeros(n, dtype=bool),
+        "tp1_trailing": np.zeros(n, dtype=bool),
+        "tp2_trailing": np.zeros(n, dtype=bool),
+    }
+    sidef = side.astype(float)
+    split = s['tp1_split_pct'] / 100.0
+    open_ = np.ones(n, dtype=bool)
+    tp1_hit = np.zeros(n, dtype=bool)
+    exit_code = np.full(n, EXIT_OPEN, dtype=np.int64)
+    exit_step = np.full(n, -1, dtype=np.int64)
+    exit_price = np.full(n, np.nan)
+    tp1_step = np.full(n, -1, dtype=np.int64)
+    realized = np.zeros(n)  # реализованный PnL в % от входа (взвешенный по доле)
+
+    def _at(arr, t):
+        if arr is None:
+            return None
+        arr = np.asarray(arr)
+        return arr[t] if arr.ndim == 2 else arr
+
+    for t in range(steps):
+        if not open_.any():
+            break  # все позиции закрыты — остаток пути не нужен
+        price = prices[t]
+        live = open_ & ~np.isnan(price)
+        if not live.any():
+            continue
+        with np.errstate(invalid='ignore'):
+            move_pct = sidef * (price - cols["entry"]) / cols["entry"] * 100
+
+            # SL
+            sl_hit = live & (sidef * (price - cols["stop"]) <= 0)
+            remaining = np.where(tp1_hit, 1.0 - split, 1.0)
+            sl_pct = sidef * (cols["stop"] - cols["entry"]) / cols["entry"] * 100
+            realized = np.where(sl_hit, realized + remaining * sl_pct, realized)
+            exit_code[sl_hit] = EXIT_SL
+            exit_step[sl_hit] = t
+            exit_price[sl_hit] = cols["stop"][sl_hit]
+            open_ &= ~sl_hit
+            live &= ~sl_hit
+
+            # TP1: частичное закрытие и SL в безубыток
+            tp1_reached = live & ~tp1_hit & ~np.isnan(cols["tp1"]) & (sidef * (price - cols["tp1"]) >= 0)
+            tp2_level = live & ~np.isnan(cols["tp2"]) & (sidef * (price - cols["tp2"]) >= 0)
+            if not s['tp2_requires_tp1']:
+                tp1_reached &= ~tp2_level  # TP2 забирает всю позицию без частичного TP1
+            tp1_pct = sidef * (cols["tp1"] - cols["entry"]) / cols["entry"] * 100
+            realized = np.where(tp1_reached, realized + split * tp1_pct, realized)
+            tp1_hit |= tp1_reached
+            tp1_step[tp1_reached] = t
+            if s['move_sl_to_be_after_tp1']:
+                be = cols["entry"] * (1 + sidef * s['breakeven_offset_pct'] / 100)
+                cols["stop"][:] = np.where(tp1_reached, _favor(sidef, cols["stop"], be), cols["stop"])
+
+            # TP2: закрытие остатка
+            tp2_reached = tp2_level & (tp1_hit if s['tp2_requires_tp1'] else True)
+            tp2_pct = sidef * (cols["tp2"] - cols["entry"]) / cols["entry"] * 100
+            remaining = np.where(tp1_hit, 1.0 - split, 1.0)
+            realized = np.where(tp2_reached, realized + remaining * tp2_pct, realized)
+            exit_code[tp2_reached] = EXIT_TP2
+            exit_step[tp2_reached] = t
+            exit_price[tp2_reached] = cols["tp2"][tp2_reached]
+            open_ &= ~tp2_reached
+            live &= ~tp2_reached
+
+        if s['trailing_enabled']:
+            trailing_step(cols, price, atr=_at(atr, t), ratio=_at(ratio, t),
+                          regime=_at(regime, t), settings=s, mask=live)
+
+    # Незакрытые позиции оцениваем по последней известной цене
+    last_price = pd.DataFrame(prices).ffill().iloc[-1].to_numpy() if steps else np.full(n, np.nan)
+    with np.errstate(invalid='ignore'):
+        open_pct = sidef * (last_price - cols["entry"]) / cols["entry"] * 100
+    remaining = np.where(tp1_hit, 1.0 - split, 1.0)
+    pnl_pct = np.where(open_, realized + remaining * np.nan_to_num(open_pct), realized)
+
+    return SimulationResult(
+        exit_code=exit_code,
+        exit_step=exit_step,
+        exit_price=exit_price,
+        tp1_step=tp1_step,
+        final_stop=cols["stop"],
+        pnl_pct=pnl_pct,
+        stop_moves=cols["moves"] + cols["tp1_moves"] + cols["tp2_moves"],
+    )
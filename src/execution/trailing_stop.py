@@ -4,6 +4,10 @@
 """
 Trailing Stop Loss Manager - автоматический перенос стопа в безубыток
 Защищает прибыль при развороте цены
+
+Расчёт стопов делегируется векторизованному ядру src.execution.stop_kernel:
+все открытые позиции обновляются одним шагом (update_all), а факторы
+адаптивного SL кэшируются на свечу символа.
 """
 
 import logging
@@ -13,6 +17,19 @@ from datetime import datetime
 import pandas as pd
 import numpy as np
 from src.shared.utils.datetime_utils import get_utc_now
+from src.execution.stop_kernel import (
+    DEFAULT_SETTINGS,
+    REASON_TP1,
+    REASON_TP2,
+    REASON_TRAIL,
+    REASON_WAITING,
+    REGIME_CODES,
+    FactorCache,
+    StopBook,
+    SymbolFactors,
+    compute_symbol_factors,
+    trailing_step,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -26,11 +43,16 @@ class AdvancedTrailingStopManager:
     - Силу тренда (ADX, наклон MA)
     - Рыночный режим (тренд, боковик)
     - Время суток (активные/спокойные часы)
+
+    Ценонезависимые факторы считаются один раз на свечу символа (FactorCache),
+    поэтому расчёт ratio для каждой позиции и тика — арифметика без DataFrame.
     """
 
     def __init__(self, config: Dict[str, Any]):
         self.config = config
         self.adaptive_config = config.get('ADAPTIVE_TRAILING_CONFIG', {})
+        self.factor_cache = FactorCache()
+        self._time_factor: Optional[tuple] = None  # (час, множитель)
 
     def get_adaptive_progress_ratio(
         self,
@@ -55,189 +77,131 @@ class AdvancedTrailingStopManager:
             return self.config.get('tp1_sl_progress_ratio', 1.0)
 
         try:
-            # 1. Анализ волатильности
-            volatility_ratio = self._analyze_volatility(df, current_price)
-
-            # 2. Анализ тренда
-            trend_ratio = self._analyze_trend_strength(df, direction)
+            factors = self.factor_cache.get(symbol, df)
+            return self.ratio_from_factors(factors, symbol, direction, current_price)
+        except Exception as e:
+            logger.error("❌ Ошибка расчета адаптивного SL: %s", e)
+            return self.config.get('tp1_sl_progress_ratio', 1.0)
 
-            # 3. Анализ рыночного режима
-            regime_ratio = self._analyze_market_regime(df)
+    def ratio_from_factors(
+        self,
+        factors: SymbolFactors,
+        symbol: str,
+        direction: str,
+        current_price: float
+    ) -> float:
+        """Адаптивный ratio по закэшированным факторам свечи"""
+        # 1. Анализ волатильности
+        volatility_ratio = self._volatility_ratio(factors, current_price)
 
-            # 4. Временные факторы
-            time_ratio = self._analyze_time_factors()
+        # 2. Анализ тренда
+        trend_ratio = self._trend_multiplier(factors, direction)
 
-            # 5. Комбинируем все факторы
-            base_ratio = self._combine_factors(volatility_ratio, trend_ratio,
-                                             regime_ratio, time_ratio)
+        # 3. Анализ рыночного режима
+        regime_ratio = factors.regime_multiplier
 
-            # 6. Применяем ограничения
-            final_ratio = self._apply_constraints(base_ratio, df, current_price)
+        # 4. Временные факторы
+        time_ratio = self._analyze_time_factors()
 
-            logger.info(
-                "🎯 Адаптивный SL для %s: ratio=%.3f "
-                "(vol=%.3f, trend=%.3f, regime=%.3f, time=%.3f)",
-                symbol, final_ratio, volatility_ratio, trend_ratio,
-                regime_ratio, time_ratio
-            )
+        # 5. Комбинируем все факторы
+        base_ratio = self._combine_factors(volatility_ratio, trend_ratio,
+                                         regime_ratio, time_ratio)
 
-            return final_ratio
+        # 6. Применяем ограничения
+        final_ratio = self._constrain(base_ratio, factors.atr_hl, current_price)
 
-        except Exception as e:
-            logger.error("❌ Ошибка расчета адаптивного SL: %s", e)
-            return self.config.get('tp1_sl_progress_ratio', 1.0)
+        logger.debug(
+            "🎯 Адаптивный SL для %s: ratio=%.3f "
+            "(vol=%.3f, trend=%.3f, regime=%.3f, time=%.3f)",
+            symbol, final_ratio, volatility_ratio, trend_ratio,
+            regime_ratio, time_ratio
+        )
+        return final_ratio
 
     def _analyze_volatility(self, df: pd.DataFrame, current_price: float) -> float:
         """Анализ волатильности на основе ATR и стандартного отклонения"""
         try:
-            # Расчет ATR
-            high_low = df['high'] - df['low']
-            high_close = np.abs(df['high'] - df['close'].shift())
-            low_close = np.abs(df['low'] - df['close'].shift())
-            true_range = np.maximum(np.maximum(high_low, high_close), low_close)
-            atr = true_range.rolling(window=14).mean().iloc[-1]
-
-            atr_pct = atr / current_price if current_price > 0 else 0
-
-            # Дополнительно: стандартное отклонение
-            returns = df['close'].pct_change().dropna()
-            if len(returns) > 0:
-                std_dev = returns.std()
-            else:
-                std_dev = 0
-
-            # Комбинированная оценка волатильности
-            combined_volatility = atr_pct * 0.7 + std_dev * 0.3
-
-            # Определение режима волатильности
-            regimes = self.adaptive_config.get('volatility_regimes', {})
-
-            if combined_volatility < regimes.get('LOW', {}).get('atr_threshold', 0.01):
-                regime = 'LOW'
-                base_ratio = regimes.get('LOW', {}).get('max_ratio', 1.0)
-            elif combined_volatility < regimes.get('MEDIUM', {}).get('atr_threshold', 0.025):
-                regime = 'MEDIUM'
-                # Интерполяция
-                low_thresh = regimes.get('LOW', {}).get('atr_threshold', 0.01)
-                med_thresh = regimes.get('MEDIUM', {}).get('atr_threshold', 0.025)
-                progress = (combined_volatility - low_thresh) / (med_thresh - low_thresh) if (med_thresh - low_thresh) > 0 else 0
-                base_ratio = (
-                    regimes.get('LOW', {}).get('max_ratio', 1.0) * (1 - progress) +
-                    regimes.get('MEDIUM', {}).get('max_ratio', 0.8) * progress
-                )
-            elif combined_volatility < regimes.get('HIGH', {}).get('atr_threshold', 0.05):
-                regime = 'HIGH'
-                med_thresh = regimes.get('MEDIUM', {}).get('atr_threshold', 0.025)
-                high_thresh = regimes.get('HIGH', {}).get('atr_threshold', 0.05)
-                progress = (combined_volatility - med_thresh) / (high_thresh - med_thresh) if (high_thresh - med_thresh) > 0 else 0
-                base_ratio = (
-                    regimes.get('MEDIUM', {}).get('max_ratio', 0.8) * (1 - progress) +
-                    regimes.get('HIGH', {}).get('max_ratio', 0.6) * progress
-                )
-            else:
-                regime = 'EXTREME'
-                base_ratio = regimes.get('EXTREME', {}).get('min_ratio', 0.2)
-
-            logger.debug(
-                "📊 Волатильность: %.4f, режим: %s, ratio: %.3f",
-                combined_volatility, regime, base_ratio
-            )
-            return base_ratio
-
+            return self._volatility_ratio(compute_symbol_factors(df), current_price)
         except Exception as e:
             logger.error("Ошибка анализа волатильности: %s", e)
             return 0.7
 
+    def _volatility_ratio(self, factors: SymbolFactors, current_price: float) -> float:
+        atr_pct = factors.atr / current_price if current_price > 0 else 0
+
+        # Комбинированная оценка волатильности
+        combined_volatility = atr_pct * 0.7 + factors.returns_std * 0.3
+
+        # Определение режима волатильности
+        regimes = self.adaptive_config.get('volatility_regimes', {})
+        low_thresh = regimes.get('LOW', {}).get('atr_threshold', 0.01)
+        med_thresh = regimes.get('MEDIUM', {}).get('atr_threshold', 0.025)
+        high_thresh = regimes.get('HIGH', {}).get('atr_threshold', 0.05)
+        low_max = regimes.get('LOW', {}).get('max_ratio', 1.0)
+        med_max = regimes.get('MEDIUM', {}).get('max_ratio', 0.8)
+        high_max = regimes.get('HIGH', {}).get('max_ratio', 0.6)
+
+        if combined_volatility < low_thresh:
+            regime = 'LOW'
+            base_ratio = low_max
+        elif combined_volatility < med_thresh:
+            regime = 'MEDIUM'
+            # Интерполяция
+            progress = (combined_volatility - low_thresh) / (med_thresh - low_thresh) if (med_thresh - low_thresh) > 0 else 0
+            base_ratio = low_max * (1 - progress) + med_max * progress
+        elif combined_volatility < high_thresh:
+            regime = 'HIGH'
+            progress = (combined_volatility - med_thresh) / (high_thresh - med_thresh) if (high_thresh - med_thresh) > 0 else 0
+            base_ratio = med_max * (1 - progress) + high_max * progress
+        else:
+            regime = 'EXTREME'
+            base_ratio = regimes.get('EXTREME', {}).get('min_ratio', 0.2)
+
+        logger.debug(
+            "📊 Волатильность: %.4f, режим: %s, ratio: %.3f",
+            combined_volatility, regime, base_ratio
+        )
+        return base_ratio
+
     def _analyze_trend_strength(self, df: pd.DataFrame, direction: str) -> float:
         """Анализ силы тренда с использованием ADX и наклона MA"""
         try:
-            # Упрощенный ADX расчет
-            high, low, close = df['high'], df['low'], df['close']
-
-            # +DM и -DM
-            plus_dm = high.diff()
-            minus_dm = low.diff().abs()
-
-            plus_dm = np.where((plus_dm > minus_dm) & (plus_dm > 0), plus_dm, 0)
-            minus_dm = np.where((minus_dm > plus_dm) & (minus_dm > 0), minus_dm, 0)
-
-            # True Range
-            tr1 = high - low
-            tr2 = abs(high - close.shift())
-            tr3 = abs(low - close.shift())
-            tr = np.maximum(np.maximum(tr1, tr2), tr3)
-
-            # Скользящие средние
-            period = 14
-            atr = tr.rolling(period).mean()
-            plus_di = 100 * (pd.Series(plus_dm, index=high.index).rolling(period).mean() / atr)
-            minus_di = 100 * (pd.Series(minus_dm, index=low.index).rolling(period).mean() / atr)
-
-            dx = 100 * abs(plus_di - minus_di) / (plus_di + minus_di)
-            adx = dx.rolling(period).mean().iloc[-1] if not dx.empty and not dx.isna().all() else 25
-
-            # Наклон скользящей средней
-            ma_fast = close.rolling(20).mean()
-            ma_slow = close.rolling(50).mean()
-
-            if len(ma_fast) > 5 and len(ma_slow) > 5 and not ma_fast.isna().iloc[-5] and not ma_slow.isna().iloc[-5]:
-                ma_fast_slope = (ma_fast.iloc[-1] - ma_fast.iloc[-5]) / ma_fast.iloc[-5]
-                ma_slow_slope = (ma_slow.iloc[-1] - ma_slow.iloc[-5]) / ma_slow.iloc[-5]
-                ma_alignment = 1.0 if (ma_fast_slope * ma_slow_slope) > 0 else 0.5
-            else:
-                ma_alignment = 0.5
-
-            # Определение силы тренда
-            if adx > 40 and ma_alignment > 0.8:
-                trend_strength = 'STRONG'
-            elif adx > 25:
-                trend_strength = 'MEDIUM'
-            elif adx < 20:
-                trend_strength = 'RANGING'
-            else:
-                trend_strength = 'WEAK'
+            return self._trend_multiplier(compute_symbol_factors(df), direction)
+        except Exception as e:
+            logger.error("Ошибка анализа тренда: %s", e)
+            return 1.0
 
-            # Проверка направления тренда
-            if len(plus_di) > 0 and len(minus_di) > 0:
-                if direction == "LONG" and plus_di.iloc[-1] < minus_di.iloc[-1]:
-                    trend_strength = 'REVERSAL'
-                elif direction == "SHORT" and plus_di.iloc[-1] > minus_di.iloc[-1]:
-                    trend_strength = 'REVERSAL'
+    def _trend_multiplier(self, factors: SymbolFactors, direction: str) -> float:
+        adx = factors.adx
 
-            multiplier = self.adaptive_config.get('trend_strength', {}).get(trend_strength, 1.0)
+        # Определение силы тренда
+        if adx > 40 and factors.ma_alignment > 0.8:
+            trend_strength = 'STRONG'
+        elif adx > 25:
+            trend_strength = 'MEDIUM'
+        elif adx < 20:
+            trend_strength = 'RANGING'
+        else:
+            trend_strength = 'WEAK'
 
-            logger.debug(
-                "📈 Тренд: ADX=%.1f, сила=%s, множитель=%.2f",
-                adx, trend_strength, multiplier
-            )
-            return multiplier
+        # Проверка направления тренда
+        if direction == "LONG" and factors.plus_di_below:
+            trend_strength = 'REVERSAL'
+        elif direction == "SHORT" and factors.plus_di_above:
+            trend_strength = 'REVERSAL'
 
-        except Exception as e:
-            logger.error("Ошибка анализа тренда: %s", e)
-            return 1.0
+        multiplier = self.adaptive_config.get('trend_strength', {}).get(trend_strength, 1.0)
+
+        logger.debug(
+            "📈 Тренд: ADX=%.1f, сила=%s, множитель=%.2f",
+            adx, trend_strength, multiplier
+        )
+        return multiplier
 
     def _analyze_market_regime(self, df: pd.DataFrame) -> float:
         """Анализ общего рыночного режима"""
         try:
-            # 1. Анализ волатильности кластерами
-            returns_pct = df['close'].pct_change().dropna()
-            volatility_rolling = returns_pct.rolling(20).std()
-
-            if not volatility_rolling.empty:
-                current_vol = volatility_rolling.iloc[-1]
-                avg_vol = volatility_rolling.mean()
-
-                if current_vol > avg_vol * 1.5:
-                    regime_multiplier = 0.8  # Высокая волатильность - консервативно
-                elif current_vol < avg_vol * 0.7:
-                    regime_multiplier = 1.1  # Низкая волатильность - агрессивно
-                else:
-                    regime_multiplier = 1.0  # Нормальный режим
-            else:
-                regime_multiplier = 1.0
-
-            return regime_multiplier
-
+            return compute_symbol_factors(df).regime_multiplier
         except Exception as e:
             logger.error("Ошибка анализа рыночного режима: %s", e)
             return 1.0
@@ -249,6 +213,11 @@ class AdvancedTrailingStopManager:
             hour = now.hour
             day_of_week = now.weekday()  # 0=понедельник, 6=воскресенье
 
+            # Множитель меняется раз в час — не пересчитываем на каждый тик
+            cache_key = (now.date(), hour)
+            if self._time_factor is not None and self._time_factor[0] == cache_key:
+                return self._time_factor[1]
+
             time_config = self.adaptive_config.get('time_factors', {})
             high_vol_hours = time_config.get('HIGH_VOLATILITY_HOURS', [9, 10, 16, 17])
 
@@ -268,6 +237,7 @@ class AdvancedTrailingStopManager:
             elif day_of_week >= 4:  # Четверг-пятница
                 multiplier *= 1.1  # Агрессивнее в конце недели
 
+            self._time_factor = (cache_key, multiplier)
             return multiplier
 
         except Exception as e:
@@ -310,26 +280,24 @@ class AdvancedTrailingStopManager:
         current_price: float
     ) -> float:
         """Применение ограничений к коэффициенту"""
-        min_ratio = self.adaptive_config.get('min_ratio', 0.15)
-        max_ratio = self.adaptive_config.get('max_ratio', 1.2)
-
-        # Проверка безопасного расстояния через ATR
         try:
-            high_low = df['high'] - df['low']
-            atr = high_low.rolling(14).mean().iloc[-1]
-
-            # Если ATR очень большой, ограничиваем агрессивность
-            atr_pct = atr / current_price if current_price > 0 else 0
-            if atr_pct > 0.1:  # ATR > 10%
-                ratio = min(ratio, 0.3)
+            atr_hl = float((df['high'] - df['low']).rolling(14).mean().iloc[-1])
         except (ValueError, TypeError, KeyError, IndexError, AttributeError) as e:
             logger.debug("Ошибка расчета ATR для trailing stop: %s", e)
-            pass
+            atr_hl = float('nan')
+        return self._constrain(ratio, atr_hl, current_price)
 
-        # Ограничение диапазона
-        constrained_ratio = max(min_ratio, min(max_ratio, ratio))
+    def _constrain(self, ratio: float, atr_hl: float, current_price: float) -> float:
+        min_ratio = self.adaptive_config.get('min_ratio', 0.15)
+        max_ratio = self.adaptive_config.get('max_ratio', 1.2)
+
+        # Если ATR очень большой (> 10%), ограничиваем агрессивность
+        atr_pct = atr_hl / current_price if current_price > 0 else 0
+        if atr_pct > 0.1:
+            ratio = min(ratio, 0.3)
 
-        return constrained_ratio
+        # Ограничение диапазона
+        return max(min_ratio, min(max_ratio, ratio))
 
 
 class TrailingStopManager:
@@ -341,10 +309,13 @@ class TrailingStopManager:
     - Автоматический перенос SL при росте прибыли
     - Адаптация расстояния по ATR
     - Учет рыночного режима
+
+    Позиции хранятся в StopBook (колонки NumPy); update_all() обновляет
+    все позиции одним векторизованным шагом ядра.
     """
 
     def __init__(self, config: Optional[Dict[str, Any]] = None):
-        self.positions_tracking = {}
+        self.book = StopBook()
 
         # Загружаем конфиг
         if config is None:
@@ -363,20 +334,26 @@ class TrailingStopManager:
             logger.warning("⚠️ Не удалось инициализировать AdvancedTrailingStopManager: %s", e)
             self.advanced_manager = None
 
-        # Настройки
+        # Настройки (см. DEFAULT_SETTINGS ядра)
         self.settings = {
-            'activation_min_profit_pct': 1.0,     # Активация при +1% прибыли
-            'min_trail_distance_pct': 0.5,        # Минимальное расстояние 0.5%
-            'use_atr_based': True,                # Использовать ATR
-            'breakeven_offset_pct': 0.3,          # Безубыток + 0.3%
-            'max_trail_distance_pct': 8.0,        # Максимум 8%
-            # 🔧 НОВОЕ: Настройки подтягивания к TP1
-            'tp1_trailing_enabled': True,         # Включить подтягивание к TP1
-            'tp1_activation_progress': 0.5,       # Активация при 50% пути к TP1
-            'tp1_sl_progress_ratio': 1.0,         # Подтягивать SL на такое же расстояние (100% от пройденного пути)
-            'tp1_min_atr_multiplier': 2.0,        # Минимум ATR * 2.0 от текущей цены
+            key: DEFAULT_SETTINGS[key] for key in (
+                'activation_min_profit_pct',      # Активация при +1% прибыли
+                'min_trail_distance_pct',         # Минимальное расстояние 0.5%
+                'use_atr_based',                  # Использовать ATR
+                'breakeven_offset_pct',           # Безубыток + 0.3%
+                'max_trail_distance_pct',         # Максимум 8%
+                'tp1_trailing_enabled',           # Включить подтягивание к TP1
+                'tp1_activation_progress',        # Активация при 50% пути к TP1
+                'tp1_sl_progress_ratio',          # Подтягивать SL на 100% от пройденного пути
+                'tp1_min_atr_multiplier',         # Минимум ATR * 2.0 от текущей цены
+            )
         }
 
+    @property
+    def positions_tracking(self) -> Dict[str, Dict[str, Any]]:
+        """Снимок отслеживаемых позиций в прежнем формате (только чтение)."""
+        return {key: self.book.position_dict(key) for key in self.book.keys}
+
     def setup_position(
         self,
         symbol: str,
@@ -384,27 +361,25 @@ class TrailingStopManager:
         initial_sl: float,
         side: str = "LONG",
         tp1_price: Optional[float] = None,
-        tp2_price: Optional[float] = None
+        tp2_price: Optional[float] = None,
+        market_symbol: Optional[str] = None
     ):
-        """Инициализирует отслеживание позиции"""
+        """Инициализирует отслеживание позиции
+
+        symbol — ключ позиции (например, "user_SYMBOL"), market_symbol — торговый
+        символ для цен и кэша факторов (по умолчанию совпадает с ключом).
+        """
         try:
-            self.positions_tracking[symbol] = {
-                'entry_price': entry_price,
-                'highest_price': entry_price if side == "LONG" else entry_price,
-                'lowest_price': entry_price if side == "SHORT" else entry_price,
-                'current_stop': initial_sl,
-                'initial_stop': initial_sl,
-                'trailing_activated': False,
-                'tp1_trailing_activated': False,
-                'tp2_trailing_activated': False,  # 🆕 Флаг для TP2
-                'tp1_price': tp1_price,
-                'tp2_price': tp2_price,           # 🆕 Цена TP2
-                'side': side,
-                'last_update': time.time(),
-                'stop_moves_count': 0,
-                'tp1_trailing_moves_count': 0,
-                'tp2_trailing_moves_count': 0     # 🆕 Счетчик для TP2
-            }
+            self.book.add(
+                symbol,
+                entry=entry_price,
+                stop=initial_sl,
+                side=side,
+                tp1=tp1_price,
+                tp2=tp2_price,
+                market_symbol=market_symbol,
+                now=time.time(),
+            )
 
             logger.info("🎯 [TRAILING] %s: позиция инициализирована (вход: %.4f, SL: %.4f, TP1: %s, сторона: %s)",
                        symbol, entry_price, initial_sl,
@@ -413,226 +388,133 @@ class TrailingStopManager:
         except Exception as e:
             logger.error("❌ Ошибка инициализации trailing stop для %s: %s", symbol, e)
 
-    def calculate_tp1_trailing_stop(
+    def _ratios(
         self,
-        symbol: str,
-        current_price: float,
-        atr_value: Optional[float] = None,
-        df: Optional[pd.DataFrame] = None
-    ) -> Optional[Dict[str, Any]]:
-        """
-        🔧 НОВОЕ: Подтягивание SL по мере движения к TP1 (консервативный вариант)
-
-        Returns:
-            Dict с новым SL или None если не нужно обновлять
-        """
-        try:
-            if symbol not in self.positions_tracking:
-                return None
-
-            position = self.positions_tracking[symbol]
-
-            # Проверяем, включено ли подтягивание к TP1
-            if not self.settings['tp1_trailing_enabled']:
-                return None
-
-            # Проверяем наличие TP1
-            tp1_price = position.get('tp1_price')
-            if not tp1_price:
-                return None
-
-            # Если уже достигли TP1, не подтягиваем
-            side = position['side']
-            entry_price = position['entry_price']
-            current_stop = position['current_stop']
-
-            if side == "LONG":
-                if current_price >= tp1_price:
-                    return None  # Уже достигли TP1
-                # Рассчитываем прогресс к TP1
-                if tp1_price <= entry_price:
-                    return None  # Некорректный TP1
-                progress = (current_price - entry_price) / (tp1_price - entry_price)
-            else:  # SHORT
-                if current_price <= tp1_price:
-                    return None  # Уже достигли TP1
-                # Рассчитываем прогресс к TP1
-                if tp1_price >= entry_price:
-                    return None  # Некорректный TP1
-                progress = (entry_price - current_price) / (entry_price - tp1_price)
-
-            # Активация только при значительном прогрессе (50%+ пути к TP1)
-            activation_progress = self.settings['tp1_activation_progress']
-            if progress < activation_progress:
-                return None
-
-            # 🆕 АДАПТИВНЫЙ РАСЧЕТ: Используем продвинутую логику если доступна
-            if self.advanced_manager and df is not None:
-                try:
-                    adaptive_ratio = self.advanced_manager.get_adaptive_progress_ratio(
-                        df, symbol, side, current_price
-                    )
-                    sl_progress_ratio = adaptive_ratio
-                    logger.debug(
-                        "🎯 [ADAPTIVE] %s: Использован адаптивный ratio=%.3f "
-                        "(вместо статического %.3f)",
-                        symbol, adaptive_ratio, self.settings['tp1_sl_progress_ratio']
-                    )
-                except Exception as adaptive_err:
-                    logger.debug("⚠️ [ADAPTIVE] Ошибка адаптивного расчета: %s", adaptive_err)
-                    sl_progress_ratio = self.settings['tp1_sl_progress_ratio']
-            else:
-                # Fallback на статический коэффициент
-                sl_progress_ratio = self.settings['tp1_sl_progress_ratio']
-
-            # Рассчитываем новый SL
-            sl_progress = progress * sl_progress_ratio
-
-            if side == "LONG":
-                # Подтягиваем SL пропорционально прогрессу
-                new_sl = entry_price + (tp1_price - entry_price) * sl_progress
-
-                # Минимум - безубыток с учетом комиссий (0.2%)
-                breakeven = entry_price * 1.002
-                new_sl = max(new_sl, breakeven)
-
-                # Но не ближе чем ATR * multiplier от текущей цены
-                if atr_value:
-                    min_distance = atr_value * self.settings['tp1_min_atr_multiplier']
-                    min_sl = current_price - min_distance
-                    new_sl = max(new_sl, min_sl)
-
-                # Стоп только улучшается (только вверх)
-                if new_sl <= current_stop:
-                    return None
-            else:  # SHORT
-                # Подтягиваем SL пропорционально прогрессу
-                new_sl = entry_price - (entry_price - tp1_price) * sl_progress
-
-                # Минимум - безубыток с учетом комиссий (0.2%)
-                breakeven = entry_price * 0.998
-                new_sl = min(new_sl, breakeven)
-
-                # 🔧 ИСПРАВЛЕНО: Для SHORT ограничиваем SL снизу (не ближе к цене), а не сверху
-                # Это позволяет SL подтягиваться вниз (улучшаться), но не слишком близко к текущей цене
-                if atr_value:
-                    min_distance = atr_value * self.settings['tp1_min_atr_multiplier']
-                    min_sl = current_price + min_distance  # Минимальный SL (не ближе к цене)
-                    new_sl = max(new_sl, min_sl)  # Ограничиваем снизу, чтобы не был слишком близко
-
-                # Стоп только улучшается (только вниз, т.е. new_sl < current_stop)
-                if new_sl >= current_stop:
-                    return None
-
-            # Обновляем позицию
-            position['current_stop'] = new_sl
-            position['last_update'] = time.time()
-            position['tp1_trailing_activated'] = True
-            position['tp1_trailing_moves_count'] = position.get('tp1_trailing_moves_count', 0) + 1
-
-            logger.info("🎯 [TP1_TRAILING] %s: SL подтянут к TP1 %.4f → %.4f (прогресс: %.1f%%, расстояние: %.2f%%)",
-                       symbol, current_stop, new_sl, progress * 100,
-                       abs((new_sl - current_price) / current_price * 100) if current_price > 0 else 0)
-
+        prices: np.ndarray,
+        frames: Optional[Dict[str, pd.DataFrame]]
+    ) -> np.ndarray:
+        """Адаптивный ratio по позициям: один расчёт на (символ, сторона)."""
+        static_ratio = self.settings['tp1_sl_progress_ratio']
+        ratios = np.full(len(self.book), float(static_ratio))
+        if not frames or not self.advanced_manager:
+            return ratios
+        sides = self.book.view("side")
+        per_symbol: Dict[tuple, float] = {}
+        for row, market_symbol in enumerate(self.book.market_symbols):
+            df = frames.get(market_symbol)
+            if df is None or np.isnan(prices[row]):
+                continue
+            key = (market_symbol, int(sides[row]))
+            ratio = per_symbol.get(key)
+            if ratio is None:
+                ratio = self.advanced_manager.get_adaptive_progress_ratio(
+                    df, market_symbol, "LONG" if sides[row] > 0 else "SHORT", float(prices[row])
+                )
+                per_symbol[key] = ratio
+            ratios[row] = ratio
+        return ratios
+
+    def _result(self, row: int, step, i: int, current_stop: float) -> Dict[str, Any]:
+        """Результат шага (элемент i массивов step) для строки row книги в формате update_trailing_stop."""
+        reason = int(step.reason[i])
+        new_stop = float(step.new_stop[i])
+        profit_pct = float(step.profit_pct[i])
+        key = self.book.keys[row]
+        cols = self.book.cols
+        if reason == REASON_TP1:
+            progress = float(step.progress[i]) * 100
+            logger.info("🎯 [TP1_TRAILING] %s: SL подтянут к TP1 %.4f → %.4f (прогресс: %.1f%%)",
+                        key, current_stop, new_stop, progress)
             return {
-                'new_stop': new_sl,
+                'new_stop': new_stop,
                 'stop_moved': True,
-                'progress_to_tp1': progress * 100,
-                'reason': f'TP1 trailing: {progress * 100:.1f}% progress',
-                'tp1_trailing_moves_count': position['tp1_trailing_moves_count']
+                'progress_to_tp1': progress,
+                'reason': f'TP1 trailing: {progress:.1f}% progress',
+                'tp1_trailing_moves_count': int(cols['tp1_moves'][row]),
             }
+        if reason == REASON_TP2:
+            progress = float(step.progress[i]) * 100
+            logger.info("🎯 [TP2_TRAILING] %s: SL подтянут к TP2 %.4f → %.4f (прогресс: %.1f%%)",
+                        key, current_stop, new_stop, progress)
+            return {
+                'new_stop': new_stop,
+                'stop_moved': True,
+                'progress_to_tp2': progress,
+                'reason': f'TP2 trailing: {progress:.1f}% progress',
+            }
+        if reason == REASON_TRAIL:
+            distance = float(step.trail_distance_pct[i])
+            logger.info("🎯 [TRAILING] %s: SL перемещен %.4f → %.4f (прибыль: %.2f%%, расстояние: %.2f%%)",
+                        key, current_stop, new_stop, profit_pct, distance)
+            return {
+                'new_stop': new_stop,
+                'stop_moved': True,
+                'profit_pct': profit_pct,
+                'reason': f'Trail distance: {distance:.2f}%',
+                'stop_moves_count': int(cols['moves'][row]),
+            }
+        if reason == REASON_WAITING:
+            return {
+                'new_stop': new_stop,
+                'stop_moved': False,
+                'profit_pct': profit_pct,
+                'reason': f'Waiting for {self.settings["activation_min_profit_pct"]}% profit'
+            }
+        return {
+            'new_stop': new_stop,
+            'stop_moved': False,
+            'profit_pct': profit_pct,
+            'reason': 'No update needed'
+        }
 
-        except Exception as e:
-            logger.error("❌ Ошибка расчета TP1 trailing stop для %s: %s", symbol, e)
-            return None
-
-    def calculate_tp2_trailing_stop(
+    def update_all(
         self,
-        symbol: str,
-        current_price: float,
-        atr_value: Optional[float] = None,
-        df: Optional[pd.DataFrame] = None
-    ) -> Optional[Dict[str, Any]]:
+        prices: Dict[str, float],
+        atr: Optional[Dict[str, float]] = None,
+        regimes: Optional[Dict[str, str]] = None,
+        frames: Optional[Dict[str, pd.DataFrame]] = None,
+        include_unchanged: bool = False
+    ) -> Dict[str, Dict[str, Any]]:
         """
-        🆕 Подтягивание SL по мере движения от TP1 к TP2
-        """
-        try:
-            if symbol not in self.positions_tracking:
-                return None
+        Обновляет стопы всех позиций одним векторизованным шагом
 
-            position = self.positions_tracking[symbol]
-            tp1_price = position.get('tp1_price')
-            tp2_price = position.get('tp2_price')
-
-            if not tp1_price or not tp2_price:
-                return None
-
-            side = position['side']
-            current_stop = position['current_stop']
-
-            # Проверяем, прошли ли мы TP1
-            is_past_tp1 = False
-            if side == "LONG":
-                is_past_tp1 = current_price >= tp1_price
-            else:
-                is_past_tp1 = current_price <= tp1_price
-
-            if not is_past_tp1:
-                return None
-
-            # Рассчитываем прогресс от TP1 к TP2
-            if side == "LONG":
-                if tp2_price <= tp1_price: return None
-                if current_price >= tp2_price:
-                    return None
-                progress = (current_price - tp1_price) / (tp2_price - tp1_price)
-            else:
-                if tp2_price >= tp1_price: return None
-                if current_price <= tp2_price:
-                    return None
-                progress = (tp1_price - current_price) / (tp1_price - tp2_price)
-
-            # Адаптивный расчет для TP2
-            sl_progress_ratio = self.settings.get('tp1_sl_progress_ratio', 0.7)
-            if self.advanced_manager and df is not None:
-                try:
-                    adaptive_ratio = self.advanced_manager.get_adaptive_progress_ratio(
-                        df, symbol, side, current_price
-                    )
-                    sl_progress_ratio = adaptive_ratio
-                except (ValueError, TypeError, AttributeError, RuntimeError) as e:
-                    logger.debug("Ошибка получения адаптивного ratio для trailing stop: %s", e)
-                    pass
-            
-            sl_progress = progress * sl_progress_ratio
-
-            if side == "LONG":
-                # Подтягиваем SL от TP1 к TP2
-                new_sl = tp1_price + (tp2_price - tp1_price) * sl_progress
-                if new_sl <= current_stop:
-                    return None
-            else:
-                new_sl = tp1_price - (tp1_price - tp2_price) * sl_progress
-                if new_sl >= current_stop:
-                    return None
-
-            # Обновляем
-            position['current_stop'] = new_sl
-            position['tp2_trailing_activated'] = True
-            position['tp2_trailing_moves_count'] = position.get('tp2_trailing_moves_count', 0) + 1
-
-            logger.info("🎯 [TP2_TRAILING] %s: SL подтянут к TP2 %.4f → %.4f (прогресс: %.1f%%)",
-                       symbol, current_stop, new_sl, progress * 100)
+        Args:
+            prices: текущая цена по торговому символу (market_symbol)
+            atr: ATR по символу (опционально)
+            regimes: режим рынка по символу (NEUTRAL / HIGH_VOL_RANGE / BULL_TREND)
+            frames: OHLCV по символу для адаптивного ratio (факторы кэшируются на свечу)
+            include_unchanged: вернуть результат и для позиций без перемещения стопа
 
-            return {
-                'new_stop': new_sl,
-                'stop_moved': True,
-                'progress_to_tp2': progress * 100,
-                'reason': f'TP2 trailing: {progress * 100:.1f}% progress'
-            }
-        except Exception as e:
-            logger.error("❌ Ошибка расчета TP2 trailing stop для %s: %s", symbol, e)
-            return None
+        Returns:
+            {ключ позиции: результат в формате update_trailing_stop}
+        """
+        n = len(self.book)
+        if n == 0:
+            return {}
+        symbols = self.book.market_symbols
+        price_arr = np.array([prices.get(sym, np.nan) for sym in symbols], dtype=float)
+        atr_arr = None
+        if atr:
+            atr_arr = np.array([atr.get(sym) or 0.0 for sym in symbols], dtype=float)
+        regime_arr = None
+        if regimes:
+            regime_arr = np.array([REGIME_CODES.get(regimes.get(sym, "NEUTRAL"), 0) for sym in symbols],
+                                  dtype=np.int64)
+        ratios = self._ratios(price_arr, frames)
+
+        cols = {name: self.book.view(name) for name in self.book.cols}
+        previous_stop = cols['stop'].copy()
+        step = trailing_step(cols, price_arr, atr=atr_arr, ratio=ratios,
+                             regime=regime_arr, settings=self.settings)
+
+        moved_rows = np.flatnonzero(step.moved)
+        if moved_rows.size:
+            cols['last_update'][moved_rows] = time.time()
+        rows = np.flatnonzero(~np.isnan(price_arr)) if include_unchanged else moved_rows
+        return {
+            self.book.keys[row]: self._result(int(row), step, int(row), float(previous_stop[row]))
+            for row in rows
+        }
 
     def update_trailing_stop(
         self,
@@ -643,7 +525,7 @@ class TrailingStopManager:
         df: Optional[pd.DataFrame] = None
     ) -> Dict[str, Any]:
         """
-        Обновляет трейлинг стоп
+        Обновляет трейлинг стоп одной позиции (тот же шаг ядра, что и update_all)
 
         Returns:
             {
@@ -654,7 +536,8 @@ class TrailingStopManager:
             }
         """
         try:
-            if symbol not in self.positions_tracking:
+            row = self.book.index.get(symbol)
+            if row is None:
                 return {
                     'new_stop': None,
                     'stop_moved': False,
@@ -662,115 +545,28 @@ class TrailingStopManager:
                     'reason': 'Position not tracked'
                 }
 
-            position = self.positions_tracking[symbol]
-            side = position['side']
-            entry_price = position['entry_price']
-            current_stop = position['current_stop']
-
-            # Рассчитываем текущую прибыль
-            if side == "LONG":
-                profit_pct = ((current_price - entry_price) / entry_price) * 100
-
-                # Обновляем максимальную цену
-                if current_price > position['highest_price']:
-                    position['highest_price'] = current_price
-            else:  # SHORT
-                profit_pct = ((entry_price - current_price) / entry_price) * 100
-
-                # Обновляем минимальную цену
-                if current_price < position['lowest_price']:
-                    position['lowest_price'] = current_price
-
-            # 🔧 НОВОЕ: Сначала проверяем подтягивание к TP1 (приоритет)
-            if self.settings['tp1_trailing_enabled'] and position.get('tp1_price'):
-                # Если мы еще не дошли до TP1, используем логику TP1
-                # Если дошли - логика TP2 (внутри функции есть проверка)
-                tp1_result = self.calculate_tp1_trailing_stop(symbol, current_price, atr_value, df)
-                if tp1_result and tp1_result.get('stop_moved'):
-                    return tp1_result
-
-                # 🆕 Логика подтягивания от TP1 к TP2
-                tp2_result = self.calculate_tp2_trailing_stop(symbol, current_price, atr_value, df)
-                if tp2_result and tp2_result.get('stop_moved'):
-                    return tp2_result
-
-            # Проверяем активацию трейлинга
-            if not position['trailing_activated']:
-                if profit_pct >= self.settings['activation_min_profit_pct']:
-                    position['trailing_activated'] = True
-                    logger.info("✅ [TRAILING] %s: трейлинг активирован при прибыли %.2f%%",
-                               symbol, profit_pct)
-                else:
-                    return {
-                        'new_stop': current_stop,
-                        'stop_moved': False,
-                        'profit_pct': profit_pct,
-                        'reason': f'Waiting for {self.settings["activation_min_profit_pct"]}% profit'
-                    }
-
-            # Рассчитываем новый стоп
-            if position['trailing_activated']:
-                # Определяем расстояние для стопа
-                if self.settings['use_atr_based'] and atr_value:
-                    # Используем ATR
-                    atr_distance_pct = (atr_value / current_price) * 100
-
-                    # Адаптируем по режиму
-                    if regime == 'HIGH_VOL_RANGE':
-                        trail_distance_pct = min(atr_distance_pct * 2.0, self.settings['max_trail_distance_pct'])
-                    elif regime == 'BULL_TREND':
-                        trail_distance_pct = max(atr_distance_pct * 1.0, self.settings['min_trail_distance_pct'])
-                    else:
-                        trail_distance_pct = min(atr_distance_pct * 1.5, self.settings['max_trail_distance_pct'])
-                else:
-                    # Фиксированное расстояние
-                    trail_distance_pct = self.settings['min_trail_distance_pct']
-
-                # Рассчитываем новый стоп
-                if side == "LONG":
-                    new_stop = position['highest_price'] * (1 - trail_distance_pct / 100)
-
-                    # Минимум - безубыток + offset
-                    breakeven_stop = entry_price * (1 + self.settings['breakeven_offset_pct'] / 100)
-                    new_stop = max(new_stop, breakeven_stop)
-                else:  # SHORT
-                    new_stop = position['lowest_price'] * (1 + trail_distance_pct / 100)
-
-                    # Минимум - безубыток - offset
-                    breakeven_stop = entry_price * (1 - self.settings['breakeven_offset_pct'] / 100)
-                    new_stop = min(new_stop, breakeven_stop)
-
-                # Стоп только улучшается, никогда не ухудшается
-                stop_improved = False
-                if side == "LONG":
-                    if new_stop > current_stop:
-                        stop_improved = True
-                else:  # SHORT
-                    if new_stop < current_stop:
-                        stop_improved = True
-
-                if stop_improved:
-                    position['current_stop'] = new_stop
-                    position['last_update'] = time.time()
-                    position['stop_moves_count'] += 1
-
-                    logger.info("🎯 [TRAILING] %s: SL перемещен %.4f → %.4f (прибыль: %.2f%%, расстояние: %.2f%%)",
-                               symbol, current_stop, new_stop, profit_pct, trail_distance_pct)
-
-                    return {
-                        'new_stop': new_stop,
-                        'stop_moved': True,
-                        'profit_pct': profit_pct,
-                        'reason': f'Trail distance: {trail_distance_pct:.2f}%',
-                        'stop_moves_count': position['stop_moves_count']
-                    }
+            cols = {name: col[row:row + 1] for name, col in self.book.cols.items()}
+            current_stop = float(cols['stop'][0])
+            price_arr = np.array([current_price], dtype=float)
 
-            return {
-                'new_stop': current_stop,
-                'stop_moved': False,
-                'profit_pct': profit_pct,
-                'reason': 'No update needed'
-            }
+            ratio = self.settings['tp1_sl_progress_ratio']
+            if self.advanced_manager and df is not None:
+                side = "LONG" if cols['side'][0] > 0 else "SHORT"
+                ratio = self.advanced_manager.get_adaptive_progress_ratio(
+                    df, self.book.market_symbols[row], side, current_price
+                )
+
+            step = trailing_step(
+                cols,
+                price_arr,
+                atr=np.array([atr_value or 0.0]),
+                ratio=np.array([ratio], dtype=float),
+                regime=np.array([REGIME_CODES.get(regime, 0)]),
+                settings=self.settings,
+            )
+            if step.moved[0]:
+                cols['last_update'][0] = time.time()
+            return self._result(row, step, 0, current_stop)
 
         except Exception as e:
             logger.error("❌ Ошибка обновления trailing stop для %s: %s", symbol, e)
@@ -783,26 +579,30 @@ class TrailingStopManager:
 
     def remove_position(self, symbol: str):
         """Удаляет позицию из отслеживания"""
-        if symbol in self.positions_tracking:
-            del self.positions_tracking[symbol]
+        if self.book.remove(symbol):
             logger.info("🗑️ [TRAILING] %s: позиция удалена из отслеживания", symbol)
 
     def get_position_info(self, symbol: str) -> Optional[Dict[str, Any]]:
         """Получает информацию о позиции"""
-        return self.positions_tracking.get(symbol)
+        return self.book.position_dict(symbol)
 
     def get_statistics(self) -> Dict[str, Any]:
         """Статистика по трейлинг-стопам"""
-        total_positions = len(self.positions_tracking)
-        active_trailing = sum(1 for p in self.positions_tracking.values() if p['trailing_activated'])
-        total_moves = sum(p['stop_moves_count'] for p in self.positions_tracking.values())
+        total_positions = len(self.book)
+        active_trailing = int(self.book.view('trailing_activated').sum())
+        total_moves = int(self.book.view('moves').sum())
 
-        return {
+        stats = {
             'total_positions': total_positions,
             'active_trailing': active_trailing,
             'total_stop_moves': total_moves,
             'avg_moves_per_position': total_moves / total_positions if total_positions > 0 else 0
         }
+        if self.advanced_manager:
+            cache = self.advanced_manager.factor_cache
+            stats['factor_cache_hits'] = cache.hits
+            stats['factor_cache_misses'] = cache.misses
+        return stats
 
 
 # Глобальный экземпляр
@@ -11,9 +11,9 @@ from typing import Optional, Tuple
 import pandas as pd
 
 try:
-    from exchange_api import get_ohlc_with_fallback
+    from src.data.candle_engine import get_candle_engine
 except ImportError:  # pragma: no cover - модуль может отсутствовать в окружении
-    get_ohlc_with_fallback = None  # type: ignore
+    get_candle_engine = None  # type: ignore
 
 logger = logging.getLogger(__name__)
 
@@ -130,11 +130,11 @@ async def check_mtf_confirmation(
         Tuple[bool, Optional[str]]: (подтвержден ли сигнал, сообщение об ошибке)
     """
     try:
-        if get_ohlc_with_fallback is None:
-            return False, "exchange_api недоступен"
+        if get_candle_engine is None:
+            return False, "candle_engine недоступен"
 
-        # Получаем OHLC данные на H4
-        h4_data = await get_ohlc_with_fallback(symbol, interval=timeframe, limit=50)
+        # Получаем OHLC данные на H4 из общей серии символа
+        h4_data = await get_candle_engine().get_ohlc(symbol, interval=timeframe, limit=50)
 
         if not h4_data or len(h4_data) < 20:
             return False, f"Недостаточно данных H4 для {symbol}"
@@ -336,10 +336,10 @@ async def get_mtf_trend(
         'BULL', 'BEAR' или None
     """
     try:
-        if get_ohlc_with_fallback is None:
+        if get_candle_engine is None:
             return None
 
-        h4_data = await get_ohlc_with_fallback(symbol, interval=timeframe, limit=50)
+        h4_data = await get_candle_engine().get_ohlc(symbol, interval=timeframe, limit=50)
 
         if not h4_data or len(h4_data) < 20:
             return None
@@ -2,14 +2,17 @@ import pandas as pd
 from typing import Optional, Tuple, Dict
 import ta
 
-# Reuse existing async OHLC fetcher
+# All timeframes are derived from one cached series per symbol
 try:
-    from src.utils.ohlc_utils import get_ohlc_binance_sync_async
+    from src.data.candle_engine import get_candle_engine
 except ImportError:
-    try:
-        from ohlc_utils import get_ohlc_binance_sync_async
-    except ImportError:
-        async def get_ohlc_binance_sync_async(*args, **kwargs): return None
+    get_candle_engine = None
+
+
+async def _get_ohlc(symbol: str, interval: str, limit: int):
+    if get_candle_engine is None:
+        return None
+    return await get_candle_engine().get_ohlc(symbol, interval=interval, limit=limit)
 
 
 async def _fetch_tf_last_row(symbol: str, interval: str, min_len: int = 40) -> Optional[pd.Series]:
@@ -18,7 +21,7 @@ async def _fetch_tf_last_row(symbol: str, interval: str, min_len: int = 40) -> O
     Returns:
         pd.Series with at least: close, ema7, ema25, rsi; or None if not enough data
     """
-    ohlc = await get_ohlc_binance_sync_async(symbol, interval=interval, limit=max(min_len, 60))
+    ohlc = await _get_ohlc(symbol, interval, max(min_len, 60))
     if not ohlc or len(ohlc) < min_len:
         return None
     df = pd.DataFrame(ohlc)
@@ -69,8 +72,8 @@ def build_mtf_accumulation_line(symbol: str, *args, **kwargs) -> str:
         async def _get_mtf_data():
             try:
                 # Получаем данные для 1h и 4h таймфреймов
-                ohlc_1h = await get_ohlc_binance_sync_async(symbol, "1h", limit=50)
-                ohlc_4h = await get_ohlc_binance_sync_async(symbol, "4h", limit=50)
+                ohlc_1h = await _get_ohlc(symbol, "1h", 50)
+                ohlc_4h = await _get_ohlc(symbol, "4h", 50)
                 
                 if not ohlc_1h or not ohlc_4h:
                     return "📊 MTF: Данные недоступны"
@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Market Data Hub - единый поток рыночных данных по WebSocket
+
+Один процесс держит по одному мультиплексированному WebSocket-соединению на биржу
+(ticker + kline для всех символов) и публикует последнюю сделку и свечи каждого
+символа в общую память процесса с версионированием. Потребители (сигналы,
+мониторинг цен, trailing stop) читают снимок без сетевых вызовов или подписываются
+на обновления.
+
+- символы шардируются по соединениям (не больше max_streams_per_connection потоков на сокет),
+  новые символы подписываются сообщением в живой сокет, без переподключения;
+- переподключение после любого разрыва (ошибка или штатное закрытие сервером) с экспоненциальной
+  паузой; пауза сбрасывается только после min_healthy_uptime секунд стабильной работы;
+- REST gap-fill свечей, пропущенных за время разрыва (слушатели получают догруженные снимки);
+- URL потоков и REST настраиваются, поэтому хаб проверяется на локальном
+  replay WebSocket-сервере, отдающем записанные свечи.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Интервал свечей, который хаб держит в потоке (остальные ТФ строятся агрегацией)
+DEFAULT_KLINE_INTERVAL = "1m"
+_INTERVAL_MS = {"1m": 60_000, "5m": 300_000, "15m": 900_000, "1h": 3_600_000}
+
+
+@dataclass(frozen=True)
+class Candle:
+    """Свеча OHLCV. open_time в миллисекундах."""
+    open_time: int
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    closed: bool = True
+
+
+@dataclass(frozen=True)
+class SymbolSnapshot:
+    """Неизменяемый снимок символа: публикуется целиком, читатели не видят полуобновлений."""
+    symbol: str
+    price: float
+    ts: float                     # время последнего обновления (time.time())
+    version: int
+    exchange: str
+    candles: Tuple[Candle, ...] = ()   # последние закрытые свечи + текущая формирующаяся
+
+    @property
+    def last_candle(self) -> Optional[Candle]:
+        return self.candles[-1] if self.candles else None
+
+    def age(self, now: Optional[float] = None) -> float:
+        return (now or time.time()) - self.ts
+
+
+@dataclass
+class MarketEvent:
+    """Нормализованное событие адаптера биржи."""
+    symbol: str
+    price: Optional[float] = None
+    candle: Optional[Candle] = None
+
+
+class ExchangeAdapter:
+    """Протокол биржи: URL потока, сообщения подписки, разбор сообщений, REST gap-fill."""
+
+    name = "base"
+    max_streams_per_connection = 200
+    streams_per_symbol = 2  # ticker + kline
+
+    def __init__(self, ws_url: Optional[str] = None, rest_url: Optional[str] = None,
+                 interval: str = DEFAULT_KLINE_INTERVAL):
+        self.ws_url = ws_url
+        self.rest_url = rest_url
+        self.interval = interval
+
+    @property
+    def symbols_per_connection(self) -> int:
+        return max(1, self.max_streams_per_connection // self.streams_per_symbol)
+
+    def connect_url(self, symbols: List[str]) -> str:
+        return self.ws_url
+
+    def subscribe_messages(self, symbols: List[str]) -> List[Dict[str, Any]]:
+        """Сообщения подписки сразу после подключения."""
+        return []
+
+    def live_subscribe_messages(self, symbols: List[str]) -> List[Dict[str, Any]]:
+        """Сообщения подписки на новые символы в уже открытом сокете."""
+        return self.subscribe_messages(symbols)
+
+    def parse(self, data: Any) -> List[MarketEvent]:
+        raise NotImplementedError
+
+    async def fetch_klines(self, session: aiohttp.ClientSession, symbol: str,
+                           start_ms: int, limit: int = 500) -> List[Candle]:
+        raise NotImplementedError
+
+
+class BinanceAdapter(ExchangeAdapter):
+    """Binance spot: combined stream <symbol>@ticker / <symbol>@kline_<interval>."""
+
+    name = "binance"
+    max_streams_per_connection = 1024
+
+    def __init__(self, ws_url: Optional[str] = None, rest_url: Optional[str] = None,
+                 interval: str = DEFAULT_KLINE_INTERVAL):
+        super().__init__(
+            ws_url or os.getenv("BINANCE_WS_URL", "wss://stream.binance.com:9443/stream"),
+            rest_url or os.getenv("BINANCE_REST_URL", "https://api.binance.com"),
+            interval,
+        )
+
+    def _streams(self, symbols: List[str]) -> List[str]:
+        streams = []
+        for sym in symbols:
+            low = sym.lower()
+            streams.append(f"{low}@ticker")
+            streams.append(f"{low}@kline_{self.interval}")
+        return streams
+
+    def connect_url(self, symbols: List[str]) -> str:
+        return f"{self.ws_url}?streams={'/'.join(self._streams(symbols))}"
+
+    def live_subscribe_messages(self, symbols: List[str]) -> List[Dict[str, Any]]:
+        # Combined stream принимает SUBSCRIBE в открытом соединении
+        return [{"method": "SUBSCRIBE", "params": self._streams(symbols), "id": int(time.time() * 1000)}]
+
+    def parse(self, data: Any) -> List[MarketEvent]:
+        payload = data.get("data", data) if isinstance(data, dict) else None
+        if not isinstance(payload, dict):
+            return []
+        event_type = payload.get("e")
+        symbol = payload.get("s")
+        if not symbol:
+            return []
+        if event_type == "24hrTicker":
+            return [MarketEvent(symbol, price=float(payload["c"]))]
+        if event_type == "kline":
+            k = payload["k"]
+            candle = Candle(int(k["t"]), float(k["o"]), float(k["h"]), float(k["l"]),
+                            float(k["c"]), float(k["v"]), bool(k.get("x")))
+            return [MarketEvent(symbol, price=candle.close, candle=candle)]
+        return []
+
+    async def fetch_klines(self, session: aiohttp.ClientSession, symbol: str,
+                           start_ms: int, limit: int = 500) -> List[Candle]:
+        params = {"symbol": symbol, "interval": self.interval, "startTime": start_ms, "limit": limit}
+        async with session.get(f"{self.rest_url}/api/v3/klines", params=params) as resp:
+            resp.raise_for_status()
+            rows = await resp.json()
+        now_ms = int(time.time() * 1000)
+        return [
+            Candle(int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5]),
+                   closed=int(r[6]) < now_ms)
+            for r in rows
+        ]
+
+
+class BybitAdapter(ExchangeAdapter):
+    """Bybit v5 public: subscribe tickers.<SYMBOL> / kline.<interval>.<SYMBOL>."""
+
+    name = "bybit"
+    max_streams_per_connection = 10 * 50  # 10 args на сообщение, несколько сообщений
+
+    _INTERVALS = {"1m": "1", "5m": "5", "15m": "15", "1h": "60"}
+
+    def __init__(self, ws_url: Optional[str] = None, rest_url: Optional[str] = None,
+                 interval: str = DEFAULT_KLINE_INTERVAL, category: str = "linear"):
+        super().__init__(
+            ws_url or os.getenv("BYBIT_WS_URL", f"wss://stream.bybit.com/v5/public/{category}"),
+            rest_url or os.getenv("BYBIT_REST_URL", "https://api.bybit.com"),
+            interval,
+        )
+        self.category = category
+
+    def subscribe_messages(self, symbols: List[str]) -> List[Dict[str, Any]]:
+        bybit_interval = self._INTERVALS.get(self.interval, "1")
+        args = []
+        for sym in symbols:
+            args.append(f"tickers.{sym}")
+            args.append(f"kline.{bybit_interval}.{sym}")
+        # Bybit принимает не более 10 аргументов в одном сообщении
+        return [{"op": "subscribe", "args": args[i:i + 10]} for i in range(0, len(args), 10)]
+
+    def parse(self, data: Any) -> List[MarketEvent]:
+        if not isinstance(data, dict):
+            return []
+        topic = data.get("topic", "")
+        payload = data.get("data")
+        if topic.startswith("tickers."):
+            price = payload.get("lastPrice") if isinstance(payload, dict) else None
+            return [MarketEvent(topic.split(".", 1)[1], price=float(price))] if price else []
+        if topic.startswith("kline."):
+            symbol = topic.rsplit(".", 1)[1]
+            events = []
+            for k in payload or []:
+                candle = Candle(int(k["start"]), float(k["open"]), float(k["high"]), float(k["low"]),
+                                float(k["close"]), float(k["volume"]), bool(k.get("confirm")))
+                events.append(MarketEvent(symbol, price=candle.close, candle=candle))
+            return events
+        return []
+
+    async def fetch_klines(self, session: aiohttp.ClientSession, symbol: str,
+                           start_ms: int, limit: int = 500) -> List[Candle]:
+        params = {"category": self.category, "symbol": symbol,
+                  "interval": self._INTERVALS.get(self.interval, "1"), "start": start_ms, "limit": limit}
+        async with session.get(f"{self.rest_url}/v5/market/kline", params=params) as resp:
+            resp.raise_for_status()
+            payload = await resp.json()
+        rows = (payload.get("result") or {}).get("list") or []
+        step = _INTERVAL_MS.get(self.interval, 60_000)
+        now_ms = int(time.time() * 1000)
+        candles = [
+            Candle(int(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), float(r[5]),
+                   closed=int(r[0]) + step <= now_ms)
+            for r in rows
+        ]
+        return sorted(candles, key=lambda c: c.open_time)
+
+
+class _ExchangeStream:
+    """Одно мультиплексированное соединение биржи (шард символов) с переподключением и gap-fill."""
+
+    def __init__(self, hub: "MarketDataHub", adapter: ExchangeAdapter, shard: int = 0):
+        self.hub = hub
+        self.adapter = adapter
+        self.shard = shard
+        self.symbols: Set[str] = set()
+        self.connected = asyncio.Event()
+        self.reconnects = 0
+        self._task: Optional[asyncio.Task] = None
+        self._resubscribe = asyncio.Event()
+        self._live: Set[str] = set()  # символы, подписанные в текущем сокете
+
+    @property
+    def capacity(self) -> int:
+        return self.adapter.symbols_per_connection - len(self.symbols)
+
+    def add(self, symbols: Iterable[str]) -> None:
+        new = set(symbols) - self.symbols
+        if new:
+            self.symbols |= new
+            self._resubscribe.set()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        retry_delay = self.hub.reconnect_delay
+        while True:
+            symbols = sorted(self.symbols)
+            if not symbols:
+                self._resubscribe.clear()
+                await self._resubscribe.wait()
+                continue
+            connected_at = None
+            reason = "соединение закрыто сервером"
+            try:
+                session = await self.hub.session()
+                url = self.adapter.connect_url(symbols)
+                async with session.ws_connect(url, heartbeat=20) as ws:
+                    for message in self.adapter.subscribe_messages(symbols):
+                        await ws.send_json(message)
+                    self._live = set(symbols)
+                    self._resubscribe.clear()
+                    self.connected.set()
+                    connected_at = time.monotonic()
+                    logger.info("✅ [MDH] %s#%d: поток подключён (%d символов)",
+                                self.adapter.name, self.shard, len(symbols))
+                    if self.reconnects:
+                        await self.hub.gap_fill(self.adapter, symbols)
+                    await self._consume(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:  # pylint: disable=broad-except
+                reason = f"ошибка потока: {e}"
+            finally:
+                self.connected.clear()
+            self.reconnects += 1
+            # Пауза после любого разрыва; сброс — только если соединение прожило достаточно долго,
+            # иначе сервер, закрывающий сокет сразу, вызывает шквал переподключений и gap-fill
+            if connected_at is not None and time.monotonic() - connected_at >= self.hub.min_healthy_uptime:
+                retry_delay = self.hub.reconnect_delay
+            logger.warning("⚠️ [MDH] %s#%d: %s. Переподключение через %.1fs",
+                           self.adapter.name, self.shard, reason, retry_delay)
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, self.hub.max_reconnect_delay)
+
+    async def _subscribe_new(self, ws) -> None:
+        """Подписывает добавленные символы сообщением в открытый сокет."""
+        self._resubscribe.clear()
+        new = sorted(self.symbols - self._live)
+        if not new:
+            return
+        for message in self.adapter.live_subscribe_messages(new):
+            await ws.send_json(message)
+        self._live |= set(new)
+        logger.info("➕ [MDH] %s#%d: подписка на %d символов без переподключения",
+                    self.adapter.name, self.shard, len(new))
+
+    async def _consume(self, ws) -> None:
+        resubscribe = asyncio.ensure_future(self._resubscribe.wait())
+        receive = asyncio.ensure_future(ws.receive())
+        try:
+            while True:
+                done, _ = await asyncio.wait({receive, resubscribe}, return_when=asyncio.FIRST_COMPLETED)
+                if resubscribe in done:
+                    await self._subscribe_new(ws)
+                    resubscribe = asyncio.ensure_future(self._resubscribe.wait())
+                if receive not in done:
+                    continue
+                msg = receive.result()
+                if msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.CLOSING,
+                                aiohttp.WSMsgType.ERROR, aiohttp.WSMsgType.CLOSE):
+                    return
+                receive = asyncio.ensure_future(ws.receive())
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    try:
+                        data = json.loads(msg.data)
+                    except ValueError:
+                        continue
+                    self.hub.stats["ws_messages"] += 1
+                    for event in self.adapter.parse(data):
+                        self.hub.publish(self.adapter.name, event)
+        finally:
+            resubscribe.cancel()
+            receive.cancel()
+
+
+class MarketDataHub:
+    """Общая память рыночных данных процесса с версионированными снимками."""
+
+    def __init__(self, adapters: Optional[List[ExchangeAdapter]] = None, history: int = 500,
+                 reconnect_delay: float = 1.0, max_reconnect_delay: float = 60.0,
+                 min_healthy_uptime: float = 30.0):
+        self.adapters = adapters if adapters is not None else [BinanceAdapter()]
+        self.history = history
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.min_healthy_uptime = min_healthy_uptime  # после стольких секунд работы пауза сбрасывается
+        self.version = 0
+        self._snapshots: Dict[str, SymbolSnapshot] = {}
+        self._streams: Dict[str, List[_ExchangeStream]] = {}  # биржа -> шарды соединений
+        self._listeners: Dict[str, List[Callable[[SymbolSnapshot], Any]]] = {}
+        self._update_event: Optional[asyncio.Event] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.stats = {"ws_messages": 0, "updates": 0, "rest_gap_fill_calls": 0, "gap_filled_candles": 0}
+
+    # --- соединения ---
+
+    async def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15))
+        return self._session
+
+    def subscribe(self, symbols: Iterable[str], exchange: Optional[str] = None) -> None:
+        """Добавляет символы в поток (по умолчанию — первой биржи). Вызывается из event loop."""
+        symbols = [s.upper() for s in symbols]
+        adapters = [a for a in self.adapters if exchange in (None, a.name)][:1]
+        for adapter in adapters:
+            shards = self._streams.setdefault(adapter.name, [])
+            subscribed = set().union(*(stream.symbols for stream in shards))
+            pending = [s for s in dict.fromkeys(symbols) if s not in subscribed]
+            # Заполняем свободные места существующих соединений, затем открываем новые шарды
+            for stream in shards:
+                if pending and stream.capacity > 0:
+                    batch, pending = pending[:stream.capacity], pending[stream.capacity:]
+                    stream.add(batch)
+                    stream.start()
+            while pending:
+                stream = _ExchangeStream(self, adapter, shard=len(shards))
+                shards.append(stream)
+                batch, pending = pending[:stream.capacity], pending[stream.capacity:]
+                stream.add(batch)
+                stream.start()
+
+    async def stop(self) -> None:
+        for shards in self._streams.values():
+            for stream in shards:
+                await stream.stop()
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    # --- публикация ---
+
+    def publish(self, exchange: str, event: MarketEvent) -> SymbolSnapshot:
+        """Атомарно заменяет снимок символа новым (copy-on-write)."""
+        previous = self._snapshots.get(event.symbol)
+        candles = previous.candles if previous else ()
+        if event.candle is not None:
+            candles = self._merge_candles(candles, [event.candle])
+        price = event.price if event.price is not None else (previous.price if previous else 0.0)
+        self.version += 1
+        snapshot = SymbolSnapshot(event.symbol, price, time.time(), self.version, exchange, candles)
+        self._snapshots[event.symbol] = snapshot
+        self.stats["updates"] += 1
+
+        # Совместимость: старый кэш bookTicker читают sources_manager и др.
+        try:
+            from src.infrastructure.websockets.binance_ws import PriceStreamCache
+            PriceStreamCache.update_price(event.symbol, price, price)
+        except ImportError:
+            pass
+
+        self._notify(snapshot)
+        return snapshot
+
+    def _notify(self, snapshot: SymbolSnapshot) -> None:
+        for listener in self._listeners.get(snapshot.symbol, []) + self._listeners.get("*", []):
+            try:
+                listener(snapshot)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.debug("[MDH] listener error: %s", e)
+        if self._update_event is not None:
+            self._update_event.set()
+            self._update_event = None
+
+    def _merge_candles(self, candles: Tuple[Candle, ...], new: List[Candle]) -> Tuple[Candle, ...]:
+        merged = {c.open_time: c for c in candles}
+        for candle in new:
+            merged[candle.open_time] = candle
+        ordered = sorted(merged.values(), key=lambda c: c.open_time)
+        return tuple(ordered[-self.history:])
+
+    async def gap_fill(self, adapter: ExchangeAdapter, symbols: List[str]) -> None:
+        """Догружает по REST свечи, пропущенные за время разрыва соединения."""
+        session = await self.session()
+        for symbol in symbols:
+            snapshot = self._snapshots.get(symbol)
+            if snapshot is None or not snapshot.candles:
+                continue
+            start_ms = snapshot.candles[-1].open_time
+            try:
+                self.stats["rest_gap_fill_calls"] += 1
+                candles = await adapter.fetch_klines(session, symbol, start_ms)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning("⚠️ [MDH] gap-fill %s/%s не удался: %s", adapter.name, symbol, e)
+                continue
+            if not candles:
+                continue
+            self.stats["gap_filled_candles"] += len(candles)
+            latest = self._snapshots[symbol]
+            self.version += 1
+            snapshot = SymbolSnapshot(
+                symbol, candles[-1].close, time.time(), self.version, adapter.name,
+                self._merge_candles(latest.candles, candles),
+            )
+            self._snapshots[symbol] = snapshot
+            self._notify(snapshot)
+
+    # --- чтение ---
+
+    def get(self, symbol: str) -> Optional[SymbolSnapshot]:
+        return self._snapshots.get(symbol.upper())
+
+    def get_price(self, symbol: str, max_age: float = 10.0) -> Optional[float]:
+        """Последняя цена из потока, если она не старше max_age секунд."""
+        snapshot = self._snapshots.get(symbol.upper())
+        if snapshot is None or snapshot.price <= 0 or snapshot.age() > max_age:
+            return None
+        return snapshot.price
+
+    def get_candles(self, symbol: str, closed_only: bool = True) -> List[Candle]:
+        snapshot = self._snapshots.get(symbol.upper())
+        if snapshot is None:
+            return []
+        return [c for c in snapshot.candles if c.closed or not closed_only]
+
+    def snapshot(self) -> Tuple[int, Dict[str, SymbolSnapshot]]:
+        """Версия и снимок всех символов (словарь — поверхностная копия)."""
+        return self.version, dict(self._snapshots)
+
+    def add_listener(self, symbol: str, callback: Callable[[SymbolSnapshot], Any]) -> None:
+        """Синхронный callback на каждое обновление символа ("*" — все символы)."""
+        self._listeners.setdefault(symbol.upper() if symbol != "*" else "*", []).append(callback)
+
+    def remove_listener(self, symbol: str, callback: Callable[[SymbolSnapshot], Any]) -> None:
+        listeners = self._listeners.get(symbol.upper() if symbol != "*" else "*", [])
+        if callback in listeners:
+            listeners.remove(callback)
+
+    async def wait_for_update(self, after_version: int, timeout: Optional[float] = None) -> int:
+        """Ждёт публикации с версией больше after_version. Возвращает текущую версию."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.version <= after_version:
+            if self._update_event is None:
+                self._update_event = asyncio.Event()
+            event = self._update_event
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return self.version
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "version": self.version,
+            "symbols": len(self._snapshots),
+            "streams": {
+                f"{name}#{s.shard}": {"symbols": len(s.symbols), "connected": s.connected.is_set(),
+                                      "reconnects": s.reconnects}
+                for name, shards in self._streams.items()
+                for s in shards
+            },
+        }
+
+
+_hub: Optional[MarketDataHub] = None
+
+
+def get_market_data_hub() -> MarketDataHub:
+    """Глобальный хаб рыночных данных процесса."""
+    global _hub  # noqa: PLW0603
+    if _hub is None:
+        _hub = MarketDataHub()
+    return _hub
+
+
+def get_streamed_price(symbol: str, max_age: float = 10.0) -> Optional[float]:
+    """Цена из хаба без сетевых вызовов (None, если хаб не запущен или данные устарели)."""
+    if _hub is None:
+        return None
+    return _hub.get_price(symbol, max_age=max_age)
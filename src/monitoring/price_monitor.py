@@ -6,6 +6,7 @@ import time
 
 import asyncio
 import logging
+import os
 # 🔧 СТРУКТУРИРОВАННОЕ ЛОГИРОВАНИЕ: Используем централизованный логгер
 from src.shared.utils.logger import get_logger
 import sqlite3
@@ -682,50 +683,65 @@ class PriceMonitorSystem:
 
             trailing_manager = get_trailing_manager()
 
+            # 1. Инициализируем позиции в трейлинг-менеджере, если их там нет
+            trades_by_key = {}
             for trade in active_trades:
                 user_id, symbol, entry, tp1, tp2, current_sl, entry_time, direction = trade
-                
-                # 1. Получаем текущую цену
-                current_price = await self.get_current_price_safe(symbol)
-                if current_price is None: continue
-
-                # 2. Инициализируем позицию в трейлинг-менеджере, если ее там нет
                 pos_key = f"{user_id}_{symbol}"
-                if pos_key not in trailing_manager.positions_tracking:
+                trades_by_key[pos_key] = trade
+                if pos_key not in trailing_manager.book:
                     trailing_manager.setup_position(
                         symbol=pos_key,
                         entry_price=float(entry),
                         initial_sl=float(current_sl) if current_sl else float(entry) * 0.95,
                         side=direction.upper() if direction else "LONG",
                         tp1_price=float(tp1) if tp1 else None,
-                        tp2_price=float(tp2) if tp2 else None  # 🆕 Передаем TP2
+                        tp2_price=float(tp2) if tp2 else None,  # 🆕 Передаем TP2
+                        market_symbol=symbol
                     )
 
-                # 3. Обновляем трейлинг
-                # Для простоты передаем None вместо ATR (менеджер сам рассчитает или использует фикс)
-                trail_result = trailing_manager.update_trailing_stop(
-                    symbol=pos_key,
-                    current_price=current_price,
-                    regime="NEUTRAL"
-                )
+            # 2. Одна цена на символ (а не на каждую позицию), запросы параллельно
+            symbols = sorted({trade[1] for trade in active_trades})
+            if os.getenv("MARKET_DATA_STREAM_ENABLED", "true").lower() == "true":
+                # Держим символы открытых позиций в WebSocket-потоке: следующие
+                # циклы читают цену из памяти хаба без REST-запросов
+                from src.infrastructure.websockets.market_data_hub import get_market_data_hub
+                get_market_data_hub().subscribe(symbols)
+            fetched = await asyncio.gather(
+                *(self.get_current_price_safe(sym) for sym in symbols), return_exceptions=True
+            )
+            prices = {
+                sym: price for sym, price in zip(symbols, fetched)
+                if price is not None and not isinstance(price, Exception)
+            }
+            if not prices:
+                return
 
-                if trail_result and trail_result.get('stop_moved'):
-                    new_sl = trail_result['new_stop']
-                    logger.info("🎯 [TRAILING] %s: Подтягиваем SL -> %.4f (Reason: %s)", 
-                                symbol, new_sl, trail_result.get('reason'))
-                    
-                    # 4. Обновляем в БД
-                    await self.adb.execute_with_retry(
-                        "UPDATE signals_log SET stop = ? WHERE user_id = ? AND symbol = ? AND entry_time = ?",
-                        (new_sl, user_id, symbol, entry_time)
-                    )
-                    await self.adb.execute_with_retry(
-                        "UPDATE active_positions SET sl_price = ? WHERE accepted_by = ? AND symbol = ?",
-                        (new_sl, str(user_id), symbol)
-                    )
+            # 3. Обновляем трейлинг всех позиций одним векторизованным шагом
+            # Для простоты передаем None вместо ATR (менеджер использует фиксированное расстояние)
+            moved = trailing_manager.update_all(prices)
+
+            for pos_key, trail_result in moved.items():
+                trade = trades_by_key.get(pos_key)
+                if trade is None:
+                    continue
+                user_id, symbol, _, _, _, _, entry_time, direction = trade
+                new_sl = trail_result['new_stop']
+                logger.info("🎯 [TRAILING] %s: Подтягиваем SL -> %.4f (Reason: %s)",
+                            symbol, new_sl, trail_result.get('reason'))
+
+                # 4. Обновляем в БД
+                await self.adb.execute_with_retry(
+                    "UPDATE signals_log SET stop = ? WHERE user_id = ? AND symbol = ? AND entry_time = ?",
+                    (new_sl, user_id, symbol, entry_time)
+                )
+                await self.adb.execute_with_retry(
+                    "UPDATE active_positions SET sl_price = ? WHERE accepted_by = ? AND symbol = ?",
+                    (new_sl, str(user_id), symbol)
+                )
 
-                    # 5. Обновляем на бирже
-                    await self._update_exchange_sl(user_id, symbol, new_sl, (direction or "LONG").upper())
+                # 5. Обновляем на бирже
+                await self._update_exchange_sl(user_id, symbol, new_sl, (direction or "LONG").upper())
 
         except Exception as e:
             logger.error("❌ Ошибка в check_trailing_and_partial_tp: %s", e)
@@ -1,52 +1,265 @@
 #!/usr/bin/env python3
 """
 Очередь сигналов с TTL и приоритетами
+
+Приоритетная очередь на куче: ключ (priority, queue_time), ленивое удаление
+просроченных записей через timing wheel, дедупликация по ключу сигнала и
+асинхронное ожидание get() без опроса. Через signal_queue идут сигналы
+signal_live (генерация -> очередь -> диспетчеры отправки); также это очередь
+сообщений каждого чата в планировщике доставки Telegram.
 """
 
+import asyncio
+import heapq
+import itertools
 import time
-from typing import Dict, Any, Optional
+from collections import Counter, deque
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+# Индексы полей записи кучи: [priority, queue_time, seq, key, payload, alive]
+_PRIORITY, _QUEUE_TIME, _SEQ, _KEY, _PAYLOAD, _ALIVE = range(6)
+
+
+def default_signal_key(signal_data: Dict[str, Any]) -> Optional[Hashable]:
+    """Ключ дедупликации: явный signal_key или пара (symbol, направление).
+
+    Без символа или направления ключа нет: такие сигналы не дедуплицируются.
+    """
+    key = signal_data.get("signal_key")
+    if key is not None:
+        return key
+    symbol = signal_data.get("symbol")
+    side = signal_data.get("signal_type") or signal_data.get("side") or signal_data.get("direction")
+    if symbol is None or side is None:
+        return None
+    return f"{symbol}:{side}"
 
 
 class SignalQueue:
-    """Очередь сигналов с TTL и приоритетами для управления торговыми сигналами."""
+    """Очередь сигналов с TTL и приоритетами для управления торговыми сигналами.
+
+    Высший приоритет = меньше число. Операции add/get — O(log n), просроченные
+    записи удаляются пачками по мере продвижения timing wheel (O(1) амортизированно
+    на запись), без пересортировки и пересборки списка.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_size: int = 1000,
+        key_func: Optional[Callable[[Dict[str, Any]], Optional[Hashable]]] = default_signal_key,
+        wheel_tick: float = 1.0,
+        clock: Callable[[], float] = time.time,
+        on_discard: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.ttl = ttl  # 1 час TTL
+        self.max_size = max_size
+        self.key_func = key_func
+        self.wheel_tick = wheel_tick
+        self._clock = clock
+        self.on_discard = on_discard  # вызывается для просроченных и вытесненных сигналов
+
+        self._heap: List[list] = []  # min-heap: (priority, queue_time, seq)
+        self._evict_heap: List[tuple] = []  # вытеснение худших: (-priority, seq, entry)
+        self._by_key: Dict[Hashable, list] = {}
+        self._wheel: Dict[int, List[list]] = {}  # слот -> записи, истекающие до начала слота
+        self._wheel_pos = int(self._clock() // wheel_tick)
+        self._seq = itertools.count()
+        self._size = 0
+        self._depth: Counter = Counter()
+        self._getters: deque = deque()  # futures ожидающих get()
+
+        self.stats = {"added": 0, "deduplicated": 0, "expired": 0, "dropped": 0, "served": 0}
+
+    @property
+    def queue(self) -> List[Dict[str, Any]]:
+        """Живые сигналы в порядке выдачи (для отладки и обратной совместимости)."""
+        self._advance_wheel(self._clock())
+        live = sorted(e for e in self._heap if e[_ALIVE])
+        return [self._materialize(e) for e in live]
+
+    def __len__(self) -> int:
+        self._advance_wheel(self._clock())
+        return self._size
+
+    # --- внутренние операции ---
+
+    def _wakeup_getter(self) -> None:
+        while self._getters:
+            waiter = self._getters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+    def _pass_wakeup(self, waiter: asyncio.Future) -> None:
+        """Ожидание get() прервано (отмена, таймаут): пробуждение, доставшееся waiter, уходит следующему."""
+        try:
+            self._getters.remove(waiter)
+        except ValueError:
+            pass
+        if not waiter.done():
+            waiter.cancel()
+        elif not waiter.cancelled() and self._size:
+            self._wakeup_getter()
+
+    def _kill(self, entry: list) -> None:
+        if not entry[_ALIVE]:
+            return
+        entry[_ALIVE] = False
+        self._size -= 1
+        self._depth[entry[_PRIORITY]] -= 1
+        if self._depth[entry[_PRIORITY]] <= 0:
+            del self._depth[entry[_PRIORITY]]
+        key = entry[_KEY]
+        if key is not None and self._by_key.get(key) is entry:
+            del self._by_key[key]
 
-    def __init__(self):
-        self.queue = []
-        self.ttl = 3600  # 1 час TTL
-        self.max_size = 1000
+    def _discard(self, entry: list, reason: str) -> None:
+        self._kill(entry)
+        self.stats[reason] += 1
+        if self.on_discard is not None:
+            self.on_discard(entry[_PAYLOAD])
 
-    async def add_signal(self, signal_data: Dict[str, Any], priority: int = 1):
+    def _advance_wheel(self, now: float) -> None:
+        """Снимает с колеса все слоты, чьё время уже наступило."""
+        now_slot = int(now // self.wheel_tick)
+        if now_slot < self._wheel_pos or not self._wheel:
+            self._wheel_pos = max(self._wheel_pos, now_slot)
+            return
+        if now_slot - self._wheel_pos > len(self._wheel):
+            slots = [s for s in self._wheel if s <= now_slot]
+        else:
+            slots = range(self._wheel_pos, now_slot + 1)
+        for slot in slots:
+            for entry in self._wheel.pop(slot, ()):
+                if entry[_ALIVE]:
+                    self._discard(entry, "expired")
+        self._wheel_pos = now_slot + 1
+        self._compact()
+
+    def _compact(self) -> None:
+        # Если мёртвых записей стало больше живых — пересобираем кучи, чтобы память не росла
+        if len(self._heap) > 2 * self._size + 64:
+            self._heap = [e for e in self._heap if e[_ALIVE]]
+            heapq.heapify(self._heap)
+            self._evict_heap = [t for t in self._evict_heap if t[2][_ALIVE]]
+            heapq.heapify(self._evict_heap)
+
+    def _evict_worst(self) -> None:
+        while self._evict_heap:
+            _, _, entry = heapq.heappop(self._evict_heap)
+            if entry[_ALIVE]:
+                self._discard(entry, "dropped")
+                return
+
+    def _pop_live(self, now: float) -> Optional[list]:
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if not entry[_ALIVE]:
+                continue
+            if now - entry[_QUEUE_TIME] >= self.ttl:
+                self._discard(entry, "expired")
+                continue
+            self._kill(entry)
+            return entry
+        return None
+
+    @staticmethod
+    def _materialize(entry: list) -> Dict[str, Any]:
+        signal = dict(entry[_PAYLOAD])
+        signal["priority"] = entry[_PRIORITY]
+        signal["queue_time"] = entry[_QUEUE_TIME]
+        return signal
+
+    # --- публичный API ---
+
+    def put_nowait(self, signal_data: Dict[str, Any], priority: int = 1) -> bool:
+        """Добавляет сигнал без ожидания. Возвращает False, если сигнал вытеснен сразу."""
+        now = self._clock()
+        self._advance_wheel(now)
+
+        key = self.key_func(signal_data) if self.key_func else None
+        previous = self._by_key.get(key) if key is not None else None
+        if previous is not None:
+            # Свежий сигнал заменяет старый, но не теряет более высокий приоритет
+            priority = min(priority, previous[_PRIORITY])
+            self._kill(previous)
+            self.stats["deduplicated"] += 1
+
+        entry = [priority, now, next(self._seq), key, dict(signal_data), True]
+        heapq.heappush(self._heap, entry)
+        heapq.heappush(self._evict_heap, (-priority, entry[_SEQ], entry))
+        slot = int((now + self.ttl) // self.wheel_tick) + 1
+        self._wheel.setdefault(slot, []).append(entry)
+        if key is not None:
+            self._by_key[key] = entry
+        self._size += 1
+        self._depth[priority] += 1
+        self.stats["added"] += 1
+
+        if self._size > self.max_size:
+            self._evict_worst()
+        if entry[_ALIVE]:
+            self._wakeup_getter()
+        return bool(entry[_ALIVE])
+
+    async def add_signal(self, signal_data: Dict[str, Any], priority: int = 1) -> bool:
         """Добавляет сигнал в очередь с приоритетом"""
-        signal_data["priority"] = priority
-        signal_data["queue_time"] = time.time()
-        self.queue.append(signal_data)
+        return self.put_nowait(signal_data, priority)
 
-        # Ограничиваем размер очереди
-        if len(self.queue) > self.max_size:
-            self.queue = self.queue[-self.max_size:]
+    def get_nowait(self) -> Optional[Dict[str, Any]]:
+        """Забирает сигнал с наивысшим приоритетом или None, если очередь пуста."""
+        now = self._clock()
+        self._advance_wheel(now)
+        entry = self._pop_live(now)
+        if entry is None:
+            return None
+        self.stats["served"] += 1
+        return self._materialize(entry)
 
     async def get_next_signal(self) -> Optional[Dict[str, Any]]:
         """Получает следующий сигнал из очереди"""
-        if not self.queue:
-            return None
-
-        # Сортируем по приоритету (высший приоритет = меньше число)
-        self.queue.sort(key=lambda x: x.get("priority", 1))
+        return self.get_nowait()
 
-        # Удаляем просроченные сигналы
-        current_time = time.time()
-        self.queue = [s for s in self.queue if current_time - s.get("queue_time", 0) < self.ttl]
+    async def get(self, timeout: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Ждёт следующий сигнал (без опроса). По таймауту возвращает None."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            signal = self.get_nowait()
+            if signal is not None:
+                return signal
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return None
+            waiter = loop.create_future()
+            self._getters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                self._pass_wakeup(waiter)
+                return None
+            except asyncio.CancelledError:
+                self._pass_wakeup(waiter)
+                raise
 
-        if self.queue:
-            return self.queue.pop(0)
-        return None
+    def remove(self, key: Hashable) -> bool:
+        """Удаляет сигнал по ключу дедупликации."""
+        entry = self._by_key.get(key)
+        if entry is None:
+            return False
+        self._kill(entry)
+        return True
 
     def get_queue_stats(self) -> Dict[str, Any]:
         """Возвращает статистику очереди"""
+        self._advance_wheel(self._clock())
         return {
-            "queue_size": len(self.queue),
+            "queue_size": self._size,
             "max_size": self.max_size,
-            "ttl": self.ttl
+            "ttl": self.ttl,
+            "depth_by_priority": dict(sorted(self._depth.items())),
+            **self.stats,
         }
 
 
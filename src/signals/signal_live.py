@@ -535,9 +535,34 @@ def _log_position_sizing_event(event: Dict[str, Any]) -> None:
         logger.debug("⚠️ Не удалось записать position_sizing_events: %s", err)
 
 
+def _stream_scan_universe(symbols: List[str]) -> None:
+    """
+    Подписывает символы сканирования на поток MarketDataHub и подключает его к CandleEngine
+
+    После этого цены (get_current_price_robust) и обновления свечей по этим символам
+    берутся из потока, а не REST. Повторная подписка уже подписанных символов ничего не делает.
+    """
+    try:
+        from src.data.candle_engine import get_candle_engine  # pylint: disable=import-outside-toplevel
+        from src.infrastructure.websockets.market_data_hub import (  # pylint: disable=import-outside-toplevel
+            DEFAULT_KLINE_INTERVAL,
+            get_market_data_hub,
+        )
+
+        hub = get_market_data_hub()
+        hub.subscribe(symbols)
+        get_candle_engine().attach_hub(hub, DEFAULT_KLINE_INTERVAL)
+    except Exception as e:
+        logger.warning("⚠️ Поток рыночных данных недоступен, данные по REST: %s", e)
+
+
 async def _get_data_with_fallback(symbol: str, timeframe: str) -> Optional[pd.DataFrame]:
     """
-    Получение данных с fallback на другие таймфреймы и правильной агрегацией
+    Получение данных таймфрейма из общей серии символа (CandleEngine)
+
+    Старшие таймфреймы (1h, 2h, 4h, ...) строятся агрегацией одной базовой
+    загрузки, поэтому H4 и H1 одного символа стоят одного запроса к бирже.
+    Если базовая серия недоступна, таймфрейм запрашивается напрямую.
 
     Args:
         symbol: Торговый символ
@@ -547,70 +572,19 @@ async def _get_data_with_fallback(symbol: str, timeframe: str) -> Optional[pd.Da
         pd.DataFrame или None при ошибке
     """
     try:
-        # Используем функцию из exchange_api (уже импортирована в signal_live.py на строке 1620)
-        # Не импортируем повторно, чтобы избежать предупреждения линтера
-        from src.execution import exchange_api  # type: ignore # pylint: disable=import-outside-toplevel
-        _get_ohlc = exchange_api.get_ohlc_with_fallback
-
-        # Пробуем получить данные напрямую
-        ohlc_data = await _get_ohlc(symbol, interval=timeframe, limit=100)
-        if ohlc_data and len(ohlc_data) >= 20:
-            df = pd.DataFrame(ohlc_data)
-            # Проверяем наличие необходимых колонок
-            required_cols = ['open', 'high', 'low', 'close', 'volume']
-            if all(col in df.columns for col in required_cols):
-                return df
-
-        # ⚡ OPTIMIZATION (Алексей): Параллельные fallback запросы
-        # Fallback логика с правильной агрегацией
-        if timeframe == '4h':
-            # Для 4h пробуем получить 2h и агрегировать
-            # Запрос выполняется асинхронно, но это fallback - оптимизация не критична
-            df_2h = await _get_ohlc(symbol, "2h", limit=200)
-            if df_2h and len(df_2h) >= 40:
-                df_2h_df = pd.DataFrame(df_2h)
-                # Правильная агрегация 2h -> 4h через resample
-                if 'timestamp' in df_2h_df.columns:
-                    df_2h_df['timestamp'] = pd.to_datetime(df_2h_df['timestamp'], unit='ms')
-                else:
-                    df_2h_df['timestamp'] = pd.date_range(end=pd.Timestamp.now(), periods=len(df_2h_df), freq='2h')
-
-                df_2h_df = df_2h_df.set_index('timestamp')
-                df_4h = df_2h_df.resample('4H').agg({
-                    'open': 'first',
-                    'high': 'max',
-                    'low': 'min',
-                    'close': 'last',
-                    'volume': 'sum'
-                }).dropna()
-
-                if len(df_4h) >= 20:
-                    logger.debug("✅ %s: Используем 2h→4h агрегацию (%d свечей)", symbol, len(df_4h))
-                    return df_4h.reset_index()
-
-        elif timeframe == '1h':
-            # Для H1 пробуем получить 30m
-            df_30m = await _get_ohlc(symbol, "30m", limit=240)
-            if df_30m and len(df_30m) >= 60:
-                df_30m_df = pd.DataFrame(df_30m)
-                # Правильная агрегация 30m -> 1h
-                if 'timestamp' in df_30m_df.columns:
-                    df_30m_df['timestamp'] = pd.to_datetime(df_30m_df['timestamp'], unit='ms')
-                else:
-                    df_30m_df['timestamp'] = pd.date_range(end=pd.Timestamp.now(), periods=len(df_30m_df), freq='30min')
+        from src.data.candle_engine import get_candle_engine, to_ohlcv_frame  # pylint: disable=import-outside-toplevel
 
-                df_30m_df = df_30m_df.set_index('timestamp')
-                df_1h = df_30m_df.resample('1H').agg({
-                    'open': 'first',
-                    'high': 'max',
-                    'low': 'min',
-                    'close': 'last',
-                    'volume': 'sum'
-                }).dropna()
+        df = await get_candle_engine().get_frame(symbol, timeframe, limit=100)
+        if df is not None and len(df) >= 20:
+            return df
 
-                if len(df_1h) >= 30:
-                    logger.debug("✅ %s: Используем 30m→1h агрегацию (%d свечей)", symbol, len(df_1h))
-                    return df_1h.reset_index()
+        # Fallback: прямой запрос таймфрейма
+        from src.execution import exchange_api  # type: ignore # pylint: disable=import-outside-toplevel
+        ohlc_data = await exchange_api.get_ohlc_with_fallback(symbol, interval=timeframe, limit=100)
+        df = to_ohlcv_frame(ohlc_data)
+        if df is not None and len(df) >= 20:
+            logger.debug("✅ %s: %s получен прямым запросом (%d свечей)", symbol, timeframe, len(df))
+            return df
 
         logger.warning("⚠️ %s: Не удалось получить данные для %s", symbol, timeframe)
         return None
@@ -1368,100 +1342,11 @@ except ImportError as e:
     LIGHTGBM_AVAILABLE = False
     logger.warning("⚠️ LightGBM предсказатель недоступен: %s", e)
 
-# Очередь сообщений с TTL и приоритетами
-class SignalQueue:
-    """Очередь сигналов с TTL и приоритетами для управления торговыми сигналами."""
-
-    def __init__(self):
-        self.queue = []
-        self.ttl = 3600  # 1 час TTL
-        self.max_size = 1000
-
-    async def add_signal(self, signal_data: Dict[str, Any], priority: int = 1):
-        """Добавляет сигнал в очередь с приоритетом"""
-        signal_data["priority"] = priority
-        signal_data["queue_time"] = time.time()
-        self.queue.append(signal_data)
-
-        # Ограничиваем размер очереди
-        if len(self.queue) > self.max_size:
-            self.queue = self.queue[-self.max_size:]
-
-    async def get_next_signal(self) -> Optional[Dict[str, Any]]:
-        """Получает следующий сигнал из очереди"""
-        if not self.queue:
-            return None
-
-        # Сортируем по приоритету (высший приоритет = меньше число)
-        self.queue.sort(key=lambda x: x.get("priority", 1))
-
-        # Удаляем просроченные сигналы
-        current_time = time.time()
-        self.queue = [s for s in self.queue if current_time - s.get("queue_time", 0) < self.ttl]
-
-        if self.queue:
-            return self.queue.pop(0)
-        return None
-
-    def get_queue_stats(self) -> Dict[str, Any]:
-        """Возвращает статистику очереди"""
-        return {
-            "queue_size": len(self.queue),
-            "max_size": self.max_size,
-            "ttl": self.ttl
-        }
-
-# Глобальная очередь сигналов
-signal_queue = SignalQueue()
+# Очередь сообщений с TTL и приоритетами (куча + timing wheel, см. src/signals/queue.py)
+from src.signals.queue import SignalQueue, signal_queue  # noqa: E402
 
 # Rate Limiting для Telegram API
-class TelegramRateLimiter:
-    """Ограничитель скорости для Telegram API с поддержкой пользовательских и групповых лимитов."""
-
-    def __init__(self):
-        self.user_limits = {}  # user_id -> last_send_time
-        self.bot_limits = {"last_send": 0, "count": 0}  # Общие лимиты бота
-        self.user_rate = 1.0  # 1 сообщение в секунду на пользователя
-        self.bot_rate = 30.0  # 30 сообщений в секунду на бота
-        self.group_rate = 20.0  # 20 сообщений в минуту на группу
-
-    async def can_send_to_user(self, user_id: str) -> bool:
-        """Проверяет, можно ли отправить сообщение пользователю"""
-        current_time = time.time()
-
-        if user_id not in self.user_limits:
-            self.user_limits[user_id] = current_time
-            return True
-
-        time_since_last = current_time - self.user_limits[user_id]
-        if time_since_last >= self.user_rate:
-            self.user_limits[user_id] = current_time
-            return True
-
-        return False
-
-    async def can_send_bot_message(self) -> bool:
-        """Проверяет, можно ли отправить сообщение от бота"""
-        current_time = time.time()
-
-        # Сбрасываем счетчик каждую секунду
-        if current_time - self.bot_limits["last_send"] >= 1.0:
-            self.bot_limits["count"] = 0
-            self.bot_limits["last_send"] = current_time
-
-        if self.bot_limits["count"] < self.bot_rate:
-            self.bot_limits["count"] += 1
-            return True
-
-        return False
-
-    async def wait_if_needed(self, user_id: str):
-        """Ждет, если необходимо соблюсти rate limiting"""
-        while not await self.can_send_to_user(user_id) or not await self.can_send_bot_message():
-            await asyncio.sleep(0.1)
-
-# Глобальный rate limiter
-rate_limiter = TelegramRateLimiter()
+from src.telegram.rate_limiter import TelegramRateLimiter, rate_limiter  # noqa: E402
 
 # Попытка импорта гибридного менеджера данных
 try:
@@ -1514,6 +1399,17 @@ except ImportError as e:
     ENHANCED_DELIVERY_AVAILABLE = False
     logger.warning("⚠️ Улучшенная система доставки недоступна: %s", e)
 
+# Планировщик доставки: token bucket бота и чата + справедливая очередь (без sleep на каждое сообщение)
+try:
+    from src.telegram.delivery_scheduler import notify_user_scheduled
+    SCHEDULED_DELIVERY_AVAILABLE = os.getenv("TELEGRAM_SCHEDULED_DELIVERY", "true").lower() == "true"
+except ImportError as e:
+    SCHEDULED_DELIVERY_AVAILABLE = False
+    logger.warning("⚠️ Планировщик доставки Telegram недоступен: %s", e)
+
+# Сколько сигналов из signal_queue отправляются параллельно (темп задаёт планировщик доставки)
+SIGNAL_SEND_CONCURRENCY = int(os.getenv("SIGNAL_SEND_CONCURRENCY", "10"))
+
 # Глобальная переменная для хранения истории сигналов
 signal_history_global: List[Dict[str, Any]] = []
 
@@ -2117,6 +2013,41 @@ async def get_symbols() -> List[str]:
         filtered_fallback = [s for s in fallback_symbols if s not in STABLECOIN_SYMBOLS]
         return filtered_fallback
 
+async def _dispatch_signals() -> None:
+    """Диспетчер signal_queue: забирает сигналы по приоритету и отправляет пользователям."""
+    while True:
+        signal = await signal_queue.get()
+        symbol, signal_type, user_id = signal["symbol"], signal["signal_type"], signal["user_id"]
+        try:
+            success = await send_signal(
+                symbol, signal_type, signal["signal_price"], signal["user_data"], signal["signal_history"],
+                signal["df"], signal["regime_data"], signal["regime_multipliers"], None, 0.7, 0.6,
+                ml_prediction=signal["ml_prediction"]
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("❌ [ERROR] Ошибка отправки сигнала пользователю %s и символа %s: %s", user_id, symbol, e)
+            continue
+        if success:
+            logger.info("📤 [SEND SUCCESS] Сигнал %s для %s отправлен пользователю %s", signal_type, symbol, user_id)
+        else:
+            logger.warning("⚠️ [SEND FAILED] Сигнал %s для %s НЕ отправлен пользователю %s (send_signal вернул False)",
+                         signal_type, symbol, user_id)
+
+
+_signal_dispatchers: List[asyncio.Task] = []
+
+
+def _ensure_signal_dispatchers() -> None:
+    """Запускает SIGNAL_SEND_CONCURRENCY диспетчеров signal_queue в текущем цикле событий (если не запущены)."""
+    if any(not task.done() for task in _signal_dispatchers):
+        return
+    _signal_dispatchers[:] = [
+        asyncio.create_task(_dispatch_signals()) for _ in range(max(1, SIGNAL_SEND_CONCURRENCY))
+    ]
+
+
 async def process_symbol_signals(
     symbol: str,
     df: Any,
@@ -2125,9 +2056,15 @@ async def process_symbol_signals(
     regime_data: Dict[str, Any] = None,
     regime_multipliers: Dict[str, float] = None
 ) -> int:
-    """Обработка сигналов для символа"""
+    """Обработка сигналов для символа. Возвращает число сигналов, поставленных в очередь отправки.
 
-    signals_sent = 0
+    Сигналы не отправляются здесь: они идут в signal_queue (дедупликация по пользователю, символу
+    и направлению, TTL), отправляют диспетчеры (_dispatch_signals) параллельно с анализом
+    следующих символов; темп и лимиты Telegram держит планировщик доставки.
+    """
+
+    signals_queued = 0
+    _ensure_signal_dispatchers()
 
     try:
         logger.info("🔍 [PROCESS] Начало обработки символа %s для %d пользователей", symbol, len(user_data_dict))
@@ -2154,20 +2091,16 @@ async def process_symbol_signals(
                     logger.info("✅ [SIGNAL GENERATED] %s: Сигнал %s @ %.8f сгенерирован для пользователя %s",
                               symbol, signal_type, signal_price, user_id)
                     # Отправляем сигнал с учетом режима (composite и quality будут дефолтными)
-                    logger.info("📤 [SEND START] %s: Начало отправки сигнала %s для пользователя %s (источник: process_symbol_signals)",
+                    logger.info("📤 [SEND START] %s: Сигнал %s для пользователя %s поставлен в очередь (источник: process_symbol_signals)",
                               symbol, signal_type, user_id)
-                    success = await send_signal(
-                        symbol, signal_type, signal_price, user_data, signal_history, df,
-                        regime_data, regime_multipliers, None, 0.7, 0.6,
-                        ml_prediction=ml_prediction
-                    )
-
-                    if success:
-                        signals_sent += 1
-                        logger.info("📤 [SEND SUCCESS] Сигнал %s для %s отправлен пользователю %s", signal_type, symbol, user_id)
-                    else:
-                        logger.warning("⚠️ [SEND FAILED] Сигнал %s для %s НЕ отправлен пользователю %s (send_signal вернул False)",
-                                     signal_type, symbol, user_id)
+                    queued = signal_queue.put_nowait({
+                        "signal_key": f"{user_id}:{symbol}:{signal_type}",
+                        "symbol": symbol, "signal_type": signal_type, "signal_price": signal_price,
+                        "user_id": user_id, "user_data": user_data, "signal_history": signal_history,
+                        "df": df, "regime_data": regime_data, "regime_multipliers": regime_multipliers,
+                        "ml_prediction": ml_prediction,
+                    })
+                    signals_queued += int(queued)
                 else:
                     logger.info("🚫 [NO SIGNAL] %s: generate_signal вернул None для пользователя %s", symbol, user_id)
 
@@ -2180,7 +2113,7 @@ async def process_symbol_signals(
     except Exception as e:
         logger.error("Ошибка обработки сигналов для %s: %s", symbol, e)
 
-    return signals_sent
+    return signals_queued
 
 async def get_real_time_price(symbol: str, fallback_price: float) -> float:
     """
@@ -5322,13 +5255,16 @@ async def send_signal(
                     logger.info("⏭️ [SEND_SIGNAL] %s %s: Пропускаем повторную отправку (уже был отправлен ранее), продолжаем для автоисполнения", symbol, signal_type)
                 else:
                     signal_sent_successfully = False  # 🆕 Флаг успешной отправки сигнала (инициализируем только если не был отправлен ранее)
-                    if ENHANCED_DELIVERY_AVAILABLE:
-                        # 🆕 Отправляем в оба бота (DEV и PROD)
-                        success = await notify_user_enhanced(
-                            user_data.get("user_id"), message, reply_markup=keyboard, _send_to_both_bots=True)
+                    if SCHEDULED_DELIVERY_AVAILABLE or ENHANCED_DELIVERY_AVAILABLE:
+                        # 🆕 Отправляем в оба бота (DEV и PROD); планировщик — та же обрезка и выбор ботов
+                        delivery_name = "scheduler" if SCHEDULED_DELIVERY_AVAILABLE else "enhanced"
+                        deliver = notify_user_scheduled if SCHEDULED_DELIVERY_AVAILABLE else notify_user_enhanced
+                        success = await deliver(
+                            user_data.get("user_id"), message, reply_markup=keyboard,
+                            _return_message=True, _send_to_both_bots=True)
                         signal_sent_successfully = bool(success)  # 🆕 Сохраняем результат отправки
                         if success:
-                            logger.info("📤 Сигнал отправлен в Telegram с кнопкой (enhanced): %s", symbol)
+                            logger.info("📤 Сигнал отправлен в Telegram с кнопкой (%s): %s", delivery_name, symbol)
                             # Получаем message_id из результата
                             if isinstance(success, dict) and "message_id" in success:
                                 message_id_result = success.get("message_id")
@@ -5340,7 +5276,7 @@ async def send_signal(
                                     step="act",
                                     name="telegram_delivery",
                                     status="success",
-                                    metadata={"delivery": "enhanced", "chat_id": user_data.get("user_id")},
+                                    metadata={"delivery": delivery_name, "chat_id": user_data.get("user_id")},
                                 )
                             # 🆕 Публикуем событие для координации агентов
                             try:
@@ -5361,14 +5297,14 @@ async def send_signal(
                             except Exception as coord_exc:
                                 logger.debug("⚠️ Ошибка координации: %s", coord_exc)
                         else:
-                            logger.warning("⚠️ Не удалось отправить сигнал пользователю %s (enhanced)",
-                                          user_data.get("user_id"))
+                            logger.warning("⚠️ Не удалось отправить сигнал пользователю %s (%s)",
+                                          user_data.get("user_id"), delivery_name)
                             if trace is not None:
                                 trace.record(
                                     step="act",
                                     name="telegram_delivery",
                                     status="error",
-                                    metadata={"delivery": "enhanced", "chat_id": user_data.get("user_id")},
+                                    metadata={"delivery": delivery_name, "chat_id": user_data.get("user_id")},
                                 )
                     else:
                         # Fallback на старую систему
@@ -6884,27 +6820,24 @@ def check_ai_volatility_filter(df: pd.DataFrame, ai_params: Dict[str, Any]) -> b
 
 async def send_with_retry(user_id: str, message: str, reply_markup=None,
                           trace_id: str = None, max_retries: int = 3) -> bool:
-    """Отправка с retry логикой"""
-    for attempt in range(max_retries):
-        try:
-            # Проверяем rate limiting
-            await rate_limiter.wait_if_needed(user_id)
-
-            # Отправляем сообщение
-            success = await notify_user(user_id, message, reply_markup=reply_markup)
-            if success:
-                logger.info("✅ [%s] Сообщение отправлено (попытка %d/%d)", trace_id, attempt + 1, max_retries)
-                return True
-            else:
-                logger.warning("⚠️ [%s] Попытка %d/%d неудачна, повторяем через %ds",
-                             trace_id, attempt + 1, max_retries, 2 ** attempt)
-                await asyncio.sleep(2 ** attempt)  # Exponential backoff
-        except Exception as e:
-            logger.error("❌ [%s] Ошибка отправки (попытка %d/%d): %s",
-                        trace_id, attempt + 1, max_retries, e)
-            if attempt < max_retries - 1:
-                await asyncio.sleep(2 ** attempt)
+    """Отправка через планировщик доставки (token bucket + справедливая очередь по чатам).
 
+    Планировщик сам соблюдает лимиты бота и чата и ждёт ровно retry_after при 429,
+    обрезка длинных сообщений — как в notify_user.
+    """
+    if not SCHEDULED_DELIVERY_AVAILABLE:
+        return await send_with_retry_fallback(user_id, message, reply_markup=reply_markup,
+                                              trace_id=trace_id, max_retries=max_retries)
+    try:
+        result = await notify_user_scheduled(user_id, message, reply_markup=reply_markup,
+                                             max_attempts=max_retries)
+    except RuntimeError as e:
+        logger.warning("⚠️ [%s] Планировщик доставки недоступен (%s), используем fallback", trace_id, e)
+        return await send_with_retry_fallback(user_id, message, reply_markup=reply_markup,
+                                              trace_id=trace_id, max_retries=max_retries)
+    if result:
+        logger.info("✅ [%s] Сообщение отправлено", trace_id)
+        return True
     logger.error("❌ [%s] Все попытки отправки исчерпаны", trace_id)
     return False
 
@@ -7258,6 +7191,7 @@ async def _run_hybrid_signal_system_fixed_impl():
                 continue
 
             logger.info("📊 Анализируем %d символов для %d пользователей", len(symbols), len(user_data_dict))
+            _stream_scan_universe(symbols)
 
             # 3. Обрабатываем каждый символ
             processed_count = 0
@@ -7287,7 +7221,7 @@ async def _run_hybrid_signal_system_fixed_impl():
                     continue
 
             cycle_duration = time.time() - cycle_start_time
-            logger.info("✅ Цикл #%d завершен за %.2fс: обработано %d символов, отправлено %d сигналов",
+            logger.info("✅ Цикл #%d завершен за %.2fс: обработано %d символов, в очередь отправки %d сигналов",
                        cycle_count, cycle_duration, processed_count, signals_sent)
 
             # Периодический мониторинг и health check (каждый 5-й цикл)
@@ -7302,8 +7236,10 @@ async def _run_hybrid_signal_system_fixed_impl():
 
                 # Статистика очереди
                 queue_stats = signal_queue.get_queue_stats()
-                logger.info("📊 HEALTH CHECK: Очередь %d/%d, TTL %ds",
-                           queue_stats["queue_size"], queue_stats["max_size"], queue_stats["ttl"])
+                logger.info("📊 HEALTH CHECK: Очередь %d/%d, TTL %ds, по приоритетам %s, истекло %d, дублей %d",
+                           queue_stats["queue_size"], queue_stats["max_size"], queue_stats["ttl"],
+                           queue_stats["depth_by_priority"], queue_stats["expired"],
+                           queue_stats["deduplicated"])
 
                 # НОВЫЙ: Детальная статистика pipeline
                 pipeline_monitor.print_stats()
@@ -0,0 +1,577 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Планировщик доставки Telegram-сообщений
+
+- глобальный token bucket на лимит бота (30 msg/s);
+- token bucket на каждый чат (1 msg/s в личке, 20 msg/min в группах);
+- взвешенная справедливая очередь между чатами (start-time fair queueing),
+  поэтому рассылка по N подписчикам занимает ~N / global_rate секунд,
+  а не сумму sleep'ов последовательного цикла;
+- несколько ожидающих обновлений одного сообщения (coalesce_key) схлопываются
+  в одно, а уже отправленное сообщение обновляется через editMessageText;
+- ответы 429 разбираются (parameters.retry_after), чат блокируется ровно на
+  указанное время, сообщение возвращается в очередь.
+
+Транспорт — прямые вызовы Bot API через aiohttp; базовый URL настраивается
+(TELEGRAM_API_BASE_URL), поэтому планировщик проверяется на локальном фейковом
+Bot API сервере.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+from src.signals.queue import SignalQueue
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_BASE_URL = "https://api.telegram.org"
+
+_RETRY_AFTER_RE = re.compile(r"retry (?:after|in) (\d+(?:\.\d+)?)", re.IGNORECASE)
+
+
+def parse_retry_after(error: Any) -> Optional[float]:
+    """Извлекает retry_after (секунды) из ответа Bot API, исключения или текста ошибки."""
+    if error is None:
+        return None
+    if isinstance(error, dict):
+        params = error.get("parameters") or {}
+        value = params.get("retry_after", error.get("retry_after"))
+        if value is not None:
+            return float(value)
+        error = error.get("description") or ""
+    value = getattr(error, "retry_after", None)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _RETRY_AFTER_RE.search(str(error))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class TelegramDeliveryError(Exception):
+    """Ошибка Bot API с кодом и (для 429) временем ожидания."""
+
+    def __init__(self, description: str, error_code: Optional[int] = None,
+                 retry_after: Optional[float] = None):
+        super().__init__(description)
+        self.description = description
+        self.error_code = error_code
+        self.retry_after = retry_after
+
+    @property
+    def permanent(self) -> bool:
+        """400/401/403/404: повтор бессмысленен (битая разметка, бот заблокирован, неверный токен)."""
+        return self.error_code in (400, 401, 403, 404)
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self._updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def delay(self, tokens: float = 1.0) -> float:
+        """Сколько секунд ждать, пока станет доступно tokens токенов."""
+        now = self._clock()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def consume(self, tokens: float = 1.0) -> None:
+        self._refill(self._clock())
+        self.tokens -= tokens
+
+    def block(self, seconds: float) -> None:
+        """Блокирует bucket (flood control): токены сгорают, выдача после seconds."""
+        now = self._clock()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self._updated = self.blocked_until
+
+
+class BotApiTransport:
+    """Отправка через HTTP Bot API (sendMessage / editMessageText) с общей aiohttp-сессией."""
+
+    def __init__(self, token: str, base_url: Optional[str] = None, timeout: float = 10.0):
+        self.token = token
+        self.base_url = (base_url or os.getenv("TELEGRAM_API_BASE_URL") or DEFAULT_API_BASE_URL).rstrip("/")
+        self.timeout = timeout
+        self._session = None
+
+    async def _get_session(self):
+        if self._session is None or self._session.closed:
+            import aiohttp  # pylint: disable=import-outside-toplevel
+
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def call(self, method: str, params: Dict[str, Any]) -> Any:
+        session = await self._get_session()
+        url = f"{self.base_url}/bot{self.token}/{method}"
+        async with session.post(url, json=params) as resp:
+            try:
+                payload = await resp.json(content_type=None)
+            except ValueError:
+                payload = {"ok": False, "error_code": resp.status, "description": await resp.text()}
+        if not payload.get("ok"):
+            raise TelegramDeliveryError(
+                payload.get("description") or f"HTTP {resp.status}",
+                error_code=payload.get("error_code") or resp.status,
+                retry_after=parse_retry_after(payload),
+            )
+        return payload.get("result")
+
+    async def send(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Отправляет или редактирует сообщение. Возвращает {chat_id, message_id}."""
+        params: Dict[str, Any] = {"chat_id": message["chat_id"], "text": message["text"]}
+        if message.get("parse_mode"):
+            params["parse_mode"] = message["parse_mode"]
+        markup = message.get("reply_markup")
+        if markup is not None:
+            params["reply_markup"] = markup.to_dict() if hasattr(markup, "to_dict") else markup
+        edit_id = message.get("edit_message_id")
+        if edit_id:
+            params["message_id"] = edit_id
+            try:
+                await self.call("editMessageText", params)
+            except TelegramDeliveryError as e:
+                if "message is not modified" not in e.description.lower():
+                    raise
+            return {"chat_id": message["chat_id"], "message_id": edit_id}
+        result = await self.call("sendMessage", params) or {}
+        return {"chat_id": message["chat_id"], "message_id": int(result.get("message_id", 0))}
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class _ChatState:
+    __slots__ = ("chat_id", "bucket", "queue", "weight", "last_finish", "scheduled", "pending")
+
+    def __init__(self, chat_id: Any, bucket: TokenBucket, queue: SignalQueue, weight: float):
+        self.chat_id = chat_id
+        self.bucket = bucket
+        self.queue = queue
+        self.weight = weight
+        self.last_finish = 0.0
+        self.scheduled = False
+        # coalesce_key -> список futures ожидающих отправки (общий для схлопнутых обновлений)
+        self.pending: Dict[Hashable, List[asyncio.Future]] = {}
+
+
+def _coalesce_key(message: Dict[str, Any]) -> Optional[Hashable]:
+    return message.get("coalesce_key")
+
+
+class TelegramDeliveryScheduler:
+    """Планировщик доставки: глобальный и по-чатовые token bucket + справедливая очередь."""
+
+    def __init__(
+        self,
+        transport: Any,
+        global_rate: float = 30.0,
+        private_rate: float = 1.0,
+        group_rate: float = 20.0 / 60.0,
+        max_in_flight: int = 8,
+        max_attempts: int = 3,
+        message_ttl: float = 600.0,
+        per_chat_max: int = 100,
+        sent_ids_max: int = 10_000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.transport = transport
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_attempts = max_attempts
+        self.message_ttl = message_ttl
+        self.per_chat_max = per_chat_max
+        self.sent_ids_max = sent_ids_max
+        self._clock = clock
+        self._global = TokenBucket(global_rate, capacity=global_rate, clock=clock)
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+        self._chats: Dict[Any, _ChatState] = {}
+        self._ready: List[tuple] = []  # (virtual finish tag, seq, chat_id)
+        self._sleeping: List[tuple] = []  # (ready_at, seq, chat_id)
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._sent_ids: "OrderedDict[tuple, int]" = OrderedDict()  # (chat_id, key) -> message_id
+        self._wakeup: Optional[asyncio.Event] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+
+        self.stats = {
+            "submitted": 0, "sent": 0, "edited": 0, "coalesced": 0, "failed": 0,
+            "retried": 0, "flood_waits": 0, "flood_wait_seconds": 0.0,
+        }
+
+    # --- жизненный цикл ---
+
+    def _event(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def start(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        close = getattr(self.transport, "close", None)
+        if close is not None:
+            await close()
+
+    # --- постановка в очередь ---
+
+    def _chat(self, chat_id: Any, weight: Optional[float] = None) -> _ChatState:
+        state = self._chats.get(chat_id)
+        if state is None:
+            is_group = str(chat_id).startswith("-")
+            rate = self.group_rate if is_group else self.private_rate
+            state = _ChatState(
+                chat_id,
+                TokenBucket(rate, capacity=1.0, clock=self._clock),
+                SignalQueue(ttl=self.message_ttl, max_size=self.per_chat_max,
+                            key_func=_coalesce_key, clock=self._clock,
+                            on_discard=self._on_discard),
+                weight or 1.0,
+            )
+            self._chats[chat_id] = state
+        elif weight:
+            state.weight = weight
+        return state
+
+    def _schedule(self, state: _ChatState) -> None:
+        if state.scheduled:
+            return
+        tag = max(self._vtime, state.last_finish) + 1.0 / state.weight
+        heapq.heappush(self._ready, (tag, next(self._seq), state.chat_id))
+        state.scheduled = True
+
+    def _sleep_until(self, state: _ChatState, ready_at: float) -> None:
+        heapq.heappush(self._sleeping, (ready_at, next(self._seq), state.chat_id))
+        state.scheduled = True
+
+    def submit(
+        self,
+        chat_id: Any,
+        text: str,
+        *,
+        reply_markup: Any = None,
+        parse_mode: Optional[str] = "HTML",
+        priority: int = 1,
+        coalesce_key: Optional[Hashable] = None,
+        weight: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+    ) -> asyncio.Future:
+        """Ставит сообщение в очередь чата. Future разрешается в {chat_id, message_id} или False.
+
+        Сообщения с одинаковым coalesce_key, ещё не отправленные, схлопываются в последнее;
+        если сообщение с этим ключом уже доставлено — оно редактируется.
+        """
+        future = asyncio.get_running_loop().create_future()
+        state = self._chat(chat_id, weight)
+        message = {
+            "chat_id": chat_id,
+            "text": text,
+            "reply_markup": reply_markup,
+            "parse_mode": parse_mode,
+            "coalesce_key": coalesce_key,
+            "attempts": 0,
+            "max_attempts": max_attempts or self.max_attempts,
+        }
+        if coalesce_key is not None:
+            waiters = state.pending.get(coalesce_key)
+            if waiters is not None:
+                self.stats["coalesced"] += 1
+            else:
+                waiters = state.pending[coalesce_key] = []
+            waiters.append(future)
+        else:
+            waiters = [future]
+        message["waiters"] = waiters
+        self.stats["submitted"] += 1
+
+        state.queue.put_nowait(message, priority)
+        self._schedule(state)
+        self._event().set()
+        self.start()
+        return future
+
+    async def send(self, chat_id: Any, text: str, **kwargs) -> Any:
+        """submit() + ожидание результата."""
+        return await self.submit(chat_id, text, **kwargs)
+
+    async def fan_out(self, chat_ids: Iterable[Any], text: str, **kwargs) -> Dict[Any, Any]:
+        """Рассылка одного сообщения по чатам; возвращает результат по каждому чату."""
+        ids = list(chat_ids)
+        futures = [self.submit(chat_id, text, **kwargs) for chat_id in ids]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        return {chat_id: (False if isinstance(r, Exception) else r) for chat_id, r in zip(ids, results)}
+
+    def estimate_drain_seconds(self) -> float:
+        """Оценка времени до доставки последнего сообщения в очереди."""
+        backlog = sum(len(s.queue) for s in self._chats.values())
+        per_chat = max((len(s.queue) / s.bucket.rate for s in self._chats.values()), default=0.0)
+        return max(backlog / self._global.rate, per_chat)
+
+    # --- диспетчер ---
+
+    async def _run(self) -> None:
+        event = self._event()
+        while True:
+            now = self._clock()
+            while self._sleeping and self._sleeping[0][0] <= now:
+                _, _, chat_id = heapq.heappop(self._sleeping)
+                state = self._chats[chat_id]
+                state.scheduled = False
+                if len(state.queue):
+                    self._schedule(state)
+
+            if not self._ready:
+                timeout = self._sleeping[0][0] - now if self._sleeping else None
+                event.clear()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            global_delay = self._global.delay()
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            await self._slots.acquire()
+            tag, _, chat_id = heapq.heappop(self._ready)
+            state = self._chats[chat_id]
+            state.scheduled = False
+
+            chat_delay = state.bucket.delay()
+            if chat_delay > 0:
+                self._slots.release()
+                self._sleep_until(state, self._clock() + chat_delay)
+                continue
+
+            message = state.queue.get_nowait()
+            if message is None:
+                self._slots.release()
+                continue
+
+            self._global.consume()
+            state.bucket.consume()
+            self._vtime = tag
+            state.last_finish = tag
+            key = message.get("coalesce_key")
+            if key is not None and state.pending.get(key) is message["waiters"]:
+                del state.pending[key]
+            if len(state.queue):
+                self._schedule(state)
+
+            task = asyncio.get_running_loop().create_task(self._deliver(state, message))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, state: _ChatState, message: Dict[str, Any]) -> None:
+        key = message.get("coalesce_key")
+        sent_key = (state.chat_id, key)
+        if key is not None and sent_key in self._sent_ids:
+            message["edit_message_id"] = self._sent_ids[sent_key]
+        message["attempts"] += 1
+        try:
+            result = await self.transport.send(message)
+        except TelegramDeliveryError as e:
+            self._on_error(state, message, e, e.retry_after)
+        except Exception as e:  # pylint: disable=broad-except
+            self._on_error(state, message, e, parse_retry_after(e))
+        else:
+            if message.get("edit_message_id"):
+                self.stats["edited"] += 1
+            else:
+                self.stats["sent"] += 1
+            if key is not None and result:
+                self._sent_ids[sent_key] = result.get("message_id", 0)
+                self._sent_ids.move_to_end(sent_key)
+                while len(self._sent_ids) > self.sent_ids_max:
+                    self._sent_ids.popitem(last=False)
+            self._resolve(message["waiters"], result or True)
+        finally:
+            self._slots.release()
+            self._event().set()
+
+    def _on_discard(self, message: Dict[str, Any]) -> None:
+        # Сообщение просрочено в очереди или вытеснено переполнением
+        state = self._chats.get(message["chat_id"])
+        key = message.get("coalesce_key")
+        if state is not None and key is not None and state.pending.get(key) is message["waiters"]:
+            del state.pending[key]
+        self.stats["failed"] += 1
+        self._resolve(message["waiters"], False)
+
+    def _on_error(self, state: _ChatState, message: Dict[str, Any], error: Exception,
+                  retry_after: Optional[float]) -> None:
+        # Flood control не считается неудачной попыткой, но и не бесконечен
+        attempts_limit = message["max_attempts"] * (2 if retry_after else 1)
+        if getattr(error, "permanent", False) and not retry_after:
+            if message.get("edit_message_id") and "not found" in str(error).lower():
+                # Редактируемое сообщение удалено — отправляем заново
+                self._sent_ids.pop((state.chat_id, message.get("coalesce_key")), None)
+                message.pop("edit_message_id", None)
+            else:
+                attempts_limit = 0
+        if message["attempts"] >= attempts_limit:
+            self.stats["failed"] += 1
+            logger.error("❌ Доставка в чат %s не удалась (попытка %d): %s",
+                         state.chat_id, message["attempts"], error)
+            self._resolve(message["waiters"], False)
+            return
+
+        if retry_after:
+            self.stats["flood_waits"] += 1
+            self.stats["flood_wait_seconds"] += retry_after
+            state.bucket.block(retry_after)
+            logger.warning("🚨 Flood control для чата %s: ожидание %.1f с", state.chat_id, retry_after)
+        elif message.get("edit_message_id") is None and message["attempts"] > 1:
+            state.bucket.block(min(2 ** (message["attempts"] - 1), 30))
+        self.stats["retried"] += 1
+        self._requeue(state, message)
+
+    def _requeue(self, state: _ChatState, message: Dict[str, Any]) -> None:
+        key = message.get("coalesce_key")
+        newer = state.pending.get(key) if key is not None else None
+        if newer is not None:
+            # Пока сообщение было в полёте, пришло более свежее обновление — отдаём ему ожидающих
+            newer.extend(message["waiters"])
+            return
+        if key is not None:
+            state.pending[key] = message["waiters"]
+        state.queue.put_nowait(message, priority=0)
+        self._schedule(state)
+
+    @staticmethod
+    def _resolve(waiters: List[asyncio.Future], result: Any) -> None:
+        for future in waiters:
+            if not future.done():
+                future.set_result(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "chats": len(self._chats),
+            "queued": sum(len(s.queue) for s in self._chats.values()),
+            "in_flight": len(self._inflight),
+            "estimated_drain_seconds": round(self.estimate_drain_seconds(), 2),
+        }
+
+
+MAX_MESSAGE_BYTES = 2000  # тот же лимит, что у handlers.notify_user
+
+
+def truncate_message(text: Any) -> str:
+    """Сокращает слишком длинное сообщение так же, как handlers.notify_user."""
+    text = str(text)
+    if len(text.encode("utf-8")) > MAX_MESSAGE_BYTES:
+        logger.warning("Message too large (%d bytes), truncating", len(text.encode("utf-8")))
+        text = text[:1500] + "... [сообщение сокращено]"
+    return text
+
+
+def _config_token(name: str) -> Optional[str]:
+    value = os.getenv(name)
+    if value:
+        return value
+    try:
+        import config  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    return getattr(config, name, None) or None
+
+
+def bot_tokens(send_to_both_bots: bool = False) -> List[str]:
+    """Токены ботов для отправки: PROD и DEV (как notify_user с _send_to_both_bots) или основной."""
+    if send_to_both_bots:
+        tokens = [t for t in (_config_token("TELEGRAM_TOKEN"), _config_token("TELEGRAM_TOKEN_DEV")) if t]
+        if tokens:
+            return list(dict.fromkeys(tokens))
+    token = _config_token("TOKEN") or _config_token("TELEGRAM_TOKEN")
+    if not token:
+        raise RuntimeError("Telegram token не задан (TELEGRAM_TOKEN)")
+    return [token]
+
+
+_schedulers: Dict[str, TelegramDeliveryScheduler] = {}
+
+
+def get_delivery_scheduler(token: Optional[str] = None) -> TelegramDeliveryScheduler:
+    """Планировщик доставки бота (по одному на токен: лимиты Bot API считаются на бота)."""
+    if token is None:
+        token = bot_tokens()[0]
+    scheduler = _schedulers.get(token)
+    if scheduler is None:
+        scheduler = _schedulers[token] = TelegramDeliveryScheduler(BotApiTransport(token))
+    return scheduler
+
+
+async def notify_user_scheduled(user_id: Any, text: str, **kwargs) -> Any:
+    """Замена handlers.notify_user для рассылки сигналов: та же обрезка и выбор ботов,
+    но отправка через планировщик (без sleep(5) и get_me перед каждым сообщением).
+
+    Спец-параметры как у notify_user: _send_to_both_bots, _return_message (_timeout игнорируется —
+    таймаут задаёт транспорт). Остальные: reply_markup, parse_mode, priority, coalesce_key, max_attempts.
+    """
+    send_to_both = kwargs.pop("_send_to_both_bots", False)
+    return_message = bool(kwargs.pop("_return_message", False))
+    kwargs.pop("_timeout", None)
+    kwargs.setdefault("parse_mode", "HTML")
+    text = truncate_message(text)
+
+    tokens = bot_tokens(send_to_both)
+    results = await asyncio.gather(
+        *(get_delivery_scheduler(token).send(user_id, text, **kwargs) for token in tokens),
+        return_exceptions=True,
+    )
+    # Приоритет у первого бота (PROD), затем DEV — как в notify_user
+    sent = next((r for r in results if r and not isinstance(r, BaseException)), None)
+    if not return_message:
+        return bool(sent)
+    if sent or send_to_both:
+        message_id = sent.get("message_id", 0) if isinstance(sent, dict) else 0
+        return {"chat_id": int(user_id), "message_id": int(message_id)}
+    return False
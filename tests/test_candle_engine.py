@@ -0,0 +1,204 @@
+"""
+Тесты движка свечей: свёртка OHLCV с выравниванием по UTC-эпохе, инкрементальное обновление
+представлений старших ТФ (совпадают с полной свёрткой базовой серии), граница устаревания
+(refresh_interval), общая загрузка для конкурентных запросов, прямые запросы к бирже и обновление
+из потока MarketDataHub вместо REST.
+Запуск: python -m pytest tests/test_candle_engine.py -v
+"""
+import asyncio
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.data.candle_engine import TIMEFRAME_MS, CandleEngine, rollup, to_ohlcv_frame
+
+H = TIMEFRAME_MS["1h"]
+T0 = 1_700_000_000  # секунды; не кратно 4h/1d — первый бакет неполный
+
+
+class FakeExchange:
+    """Биржа с детерминированными часовыми свечами; формирующаяся свеча меняется со временем."""
+
+    def __init__(self, clock, seed=0):
+        self.clock = clock
+        self.calls = []
+        self._rng = np.random.default_rng(seed)
+        self._closed = {}
+
+    def _candle(self, ts, now_ms):
+        if ts not in self._closed:
+            price = 100.0 + float(self._rng.normal(0, 1))
+            self._closed[ts] = {"timestamp": ts, "open": price, "high": price + 2, "low": price - 2,
+                                "close": price + 0.5, "volume": float(self._rng.uniform(1, 10))}
+        candle = dict(self._closed[ts])
+        if ts + H > now_ms:  # формирующаяся: close/high/volume зависят от момента запроса
+            progress = (now_ms - ts) / H
+            candle["close"] = candle["open"] + progress
+            candle["high"] = max(candle["high"], candle["close"])
+            candle["volume"] *= progress
+        return candle
+
+    async def __call__(self, symbol, interval="1h", limit=100):
+        self.calls.append((symbol, interval, limit))
+        step = TIMEFRAME_MS[interval]
+        now_ms = int(self.clock.now * 1000)
+        last = now_ms - now_ms % step
+        start = last - (limit - 1) * step
+        if interval != "1h":
+            return [{"timestamp": ts, "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0, "volume": 1.0}
+                    for ts in range(start, last + 1, step)]
+        return [self._candle(ts, now_ms) for ts in range(start, last + 1, step)]
+
+
+class FakeClock:
+    def __init__(self, now=T0):
+        self.now = float(now)
+
+    def __call__(self):
+        return self.now
+
+
+def _candles(start_ms, count, step=H):
+    return pd.DataFrame({
+        "timestamp": [start_ms + i * step for i in range(count)],
+        "open": [float(i) for i in range(count)],
+        "high": [float(i) + 10 for i in range(count)],
+        "low": [float(i) - 10 for i in range(count)],
+        "close": [float(i) + 1 for i in range(count)],
+        "volume": [1.0] * count,
+    })
+
+
+def test_rollup_aligns_to_epoch_and_drops_partial_head():
+    four_h = TIMEFRAME_MS["4h"]
+    start = 10 * four_h + 2 * H  # история начинается с середины 4h-бакета
+    out = rollup(_candles(start, 11), H, four_h)
+    assert list(out["timestamp"]) == [11 * four_h, 12 * four_h, 13 * four_h]
+    first = out.iloc[0]
+    # бакет 11*4h = базовые свечи 2..5
+    assert (first["open"], first["high"], first["low"], first["close"], first["volume"]) == (2.0, 15.0, -8.0, 6.0, 4.0)
+    assert out.iloc[-1]["volume"] == 1.0  # формирующийся бакет остаётся
+    assert len(rollup(_candles(start, 11), H, four_h, drop_partial_head=False)) == 4
+
+
+def test_to_ohlcv_frame_normalizes_seconds_datetimes_and_duplicates():
+    seconds = [{"timestamp": 1_700_000_000 + i * 3600, "open": "1", "high": 2, "low": 0, "close": 1, "volume": 3}
+               for i in (1, 0, 1)]
+    frame = to_ohlcv_frame(seconds)
+    assert list(frame["timestamp"]) == [1_700_000_000_000, 1_700_003_600_000]
+    indexed = _candles(0, 2).assign(timestamp=pd.to_datetime([0, H], unit="ms")).set_index("timestamp")
+    assert list(to_ohlcv_frame(indexed)["timestamp"]) == [0, H]
+    for unit in ("s", "ms", "us", "ns"):  # разрешение datetime64 в pandas 2 не только ns
+        stamps = pd.Series(pd.to_datetime([0, H], unit="ms")).astype(f"datetime64[{unit}]")
+        frame = _candles(0, 2).assign(timestamp=stamps)
+        assert list(to_ohlcv_frame(frame)["timestamp"]) == [0, H], unit
+    aware = _candles(0, 1).assign(timestamp=pd.to_datetime([H], unit="ms", utc=True).tz_convert("Europe/Moscow"))
+    assert list(to_ohlcv_frame(aware)["timestamp"]) == [H]
+    assert to_ohlcv_frame([]) is None
+    assert to_ohlcv_frame([{"timestamp": 1, "close": 1}]) is None
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_incremental_views_match_full_rollup(seed):
+    rng = np.random.default_rng(seed)
+
+    async def scenario():
+        clock = FakeClock(T0 + int(rng.integers(0, 3600)))
+        exchange = FakeExchange(clock, seed)
+        engine = CandleEngine(history=200, refresh_interval=60.0, fetcher=exchange, clock=clock)
+        for _ in range(40):
+            clock.now += float(rng.choice([30, 61, 900, 3600, 4 * 3600, 30 * 3600]))
+            for timeframe in ("2h", "4h", "1d"):
+                view = await engine.get_frame("BTCUSDT", timeframe, limit=5)
+                series = engine._series["BTCUSDT"]
+                expected = rollup(series.base, H, TIMEFRAME_MS[timeframe])
+                pd.testing.assert_frame_equal(series.views[timeframe].reset_index(drop=True), expected,
+                                              check_dtype=False)
+                pd.testing.assert_frame_equal(view, expected.tail(5).reset_index(drop=True), check_dtype=False)
+            assert len(series.base) <= 200
+        return engine.stats
+
+    stats = asyncio.run(scenario())
+    assert stats["incremental_fetches"] > 0
+
+
+def test_frames_are_stale_at_most_refresh_interval():
+    async def scenario():
+        clock = FakeClock()
+        exchange = FakeExchange(clock)
+        engine = CandleEngine(history=100, refresh_interval=60.0, fetcher=exchange, clock=clock)
+        first = await engine.get_frame("BTCUSDT", "4h", limit=10)
+        clock.now += 59
+        cached = await engine.get_frame("BTCUSDT", "4h", limit=10)
+        assert len(exchange.calls) == 1  # в пределах refresh_interval — без запроса к бирже
+        pd.testing.assert_frame_equal(first, cached)
+        clock.now += 2
+        fresh = await engine.get_frame("BTCUSDT", "4h", limit=10)
+        assert len(exchange.calls) == 2 and exchange.calls[1][2] == 2  # только последние свечи
+        assert fresh.iloc[-1]["close"] != cached.iloc[-1]["close"]  # формирующаяся свеча обновилась
+        return engine.stats
+
+    stats = asyncio.run(scenario())
+    assert (stats["fetches"], stats["incremental_fetches"], stats["hits"]) == (2, 1, 1)
+
+
+def test_concurrent_requests_share_one_fetch_and_direct_fallbacks():
+    async def scenario():
+        clock = FakeClock()
+        exchange = FakeExchange(clock)
+        engine = CandleEngine(history=100, fetcher=exchange, clock=clock)
+        frames = await asyncio.gather(*(engine.get_frame("ETHUSDT", tf, limit=4) for tf in ("1h", "2h", "4h", "1d")))
+        assert all(f is not None and len(f) for f in frames)
+        assert exchange.calls == [("ETHUSDT", "1h", 100)]
+        assert len(await engine.get_frame("ETHUSDT", "15m", limit=10)) == 10  # мельче базового
+        assert len(await engine.get_frame("ETHUSDT", "1d", limit=30)) == 30  # длиннее истории 1h × 100
+        assert [c[1] for c in exchange.calls[1:]] == ["15m", "1d"]
+        return engine.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["direct_fetches"] == 2 and stats["symbols"] == 1
+
+
+def test_attached_hub_replaces_rest_refresh_and_falls_back_on_gaps():
+    from src.infrastructure.websockets.market_data_hub import Candle, MarketDataHub, MarketEvent
+
+    minute = TIMEFRAME_MS["1m"]
+
+    async def scenario():
+        now = time.time()
+        clock = FakeClock(now - 120)
+        exchange = FakeExchange(clock)
+        hub = MarketDataHub(adapters=[])
+        engine = CandleEngine(history=100, refresh_interval=60.0, fetcher=exchange, clock=clock)
+        engine.attach_hub(hub, "1m")
+        for symbol in ("BTCUSDT", "ETHUSDT"):
+            await engine.get_frame(symbol, "4h", limit=10)
+        last_ts = int(engine._series["BTCUSDT"].base["timestamp"].iloc[-1])
+        now_ms = int(now * 1000)
+
+        def publish(symbol, start):
+            for i, ts in enumerate(range(start, now_ms - now_ms % minute + 1, minute)):
+                hub.publish("binance", MarketEvent(symbol, price=200.0 + i, candle=Candle(
+                    ts, 200.0 + i, 205.0 + i, 195.0 + i, 201.0 + i, 1.0, closed=ts + minute <= now_ms)))
+
+        publish("BTCUSDT", last_ts)
+        publish("ETHUSDT", last_ts + 5 * minute)  # поток начался внутри базовой свечи
+        clock.now = now
+        btc = await engine.get_frame("BTCUSDT", "1h", limit=5)
+        assert len(exchange.calls) == 2  # обновление из потока, без REST
+        expected = rollup(pd.DataFrame(
+            [(c.open_time, c.open, c.high, c.low, c.close, c.volume) for c in hub.get_candles("BTCUSDT", False)],
+            columns=["timestamp", "open", "high", "low", "close", "volume"]), minute, H)
+        pd.testing.assert_frame_equal(btc.tail(len(expected)).reset_index(drop=True), expected, check_dtype=False)
+        series = engine._series["BTCUSDT"]
+        four_h = await engine.get_frame("BTCUSDT", "4h", limit=5)
+        pd.testing.assert_frame_equal(four_h, rollup(series.base, H, TIMEFRAME_MS["4h"]).tail(5).reset_index(drop=True),
+                                      check_dtype=False)
+        await engine.get_frame("ETHUSDT", "1h", limit=5)
+        assert exchange.calls[-1][0] == "ETHUSDT"  # неполная базовая свеча в потоке — догрузка по REST
+        return engine.stats
+
+    stats = asyncio.run(scenario())
+    assert (stats["stream_refreshes"], stats["fetches"]) == (1, 3)
@@ -0,0 +1,139 @@
+"""
+Тесты планировщика доставки Telegram на локальном фейковом Bot API сервере (aiohttp):
+темп рассылки по глобальному лимиту, 429 блокирует только свой чат, редактирование по coalesce_key,
+notify_user_scheduled — обрезка и отправка в оба бота.
+Запуск: python -m pytest tests/test_delivery_scheduler.py -v
+"""
+import asyncio
+import time
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+from src.telegram import delivery_scheduler as ds  # noqa: E402
+
+
+class FakeBotApi:
+    """Фейковый Bot API: пишет вызовы, по запросу отвечает 429 с retry_after."""
+
+    def __init__(self):
+        self.calls = []  # (token, method, params, time[, message_id])
+        self.flood = {}  # chat_id -> retry_after для первой попытки
+        self._message_id = 0
+
+    async def handle(self, request):
+        token = request.match_info["token"]
+        method = request.match_info["method"]
+        params = await request.json()
+        self.calls.append((token, method, params, time.monotonic()))
+        retry_after = self.flood.pop(params["chat_id"], None)
+        if retry_after:
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            })
+        self._message_id += 1
+        self.calls[-1] += (self._message_id,)
+        return web.json_response({"ok": True, "result": {"message_id": self._message_id}})
+
+    def sent(self, method="sendMessage"):
+        return [c for c in self.calls if c[1] == method]
+
+
+async def _serve(api):
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_fan_out_is_paced_by_global_rate():
+    async def scenario():
+        api = FakeBotApi()
+        runner, base = await _serve(api)
+        scheduler = ds.TelegramDeliveryScheduler(ds.BotApiTransport("T", base_url=base), global_rate=20.0)
+        try:
+            started = time.monotonic()
+            results = await scheduler.fan_out(range(1, 41), "сигнал")
+            elapsed = time.monotonic() - started
+        finally:
+            await scheduler.stop()
+            await runner.cleanup()
+        assert all(r and r["message_id"] for r in results.values())
+        assert sorted(c[2]["chat_id"] for c in api.sent()) == list(range(1, 41))
+        # 20 сообщений запасом bucket, остальные 20 — по 20/с: около секунды, а не 40 × sleep
+        assert 0.8 <= elapsed < 3.0
+
+    asyncio.run(scenario())
+
+
+def test_flood_wait_blocks_only_its_chat():
+    async def scenario():
+        api = FakeBotApi()
+        api.flood[1] = 1
+        runner, base = await _serve(api)
+        scheduler = ds.TelegramDeliveryScheduler(ds.BotApiTransport("T", base_url=base))
+        try:
+            started = time.monotonic()
+            results = await scheduler.fan_out([1, 2, 3], "сигнал")
+        finally:
+            await scheduler.stop()
+            await runner.cleanup()
+        assert all(results.values())
+        delivered = {c[2]["chat_id"]: c[3] - started for c in api.sent()}
+        assert delivered[2] < 0.5 and delivered[3] < 0.5
+        assert delivered[1] >= 0.95  # повтор ровно после retry_after
+        assert scheduler.stats["flood_waits"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_update_with_same_coalesce_key_edits_message():
+    async def scenario():
+        api = FakeBotApi()
+        runner, base = await _serve(api)
+        scheduler = ds.TelegramDeliveryScheduler(ds.BotApiTransport("T", base_url=base), private_rate=100.0)
+        try:
+            first = await scheduler.send(7, "v1", coalesce_key="sig")
+            second = await scheduler.send(7, "v2", coalesce_key="sig")
+        finally:
+            await scheduler.stop()
+            await runner.cleanup()
+        assert first["message_id"] == second["message_id"]
+        edits = api.sent("editMessageText")
+        assert len(edits) == 1 and edits[0][2]["text"] == "v2"
+
+    asyncio.run(scenario())
+
+
+def test_notify_user_scheduled_truncates_and_sends_to_both_bots(monkeypatch):
+    async def scenario():
+        api = FakeBotApi()
+        runner, base = await _serve(api)
+        monkeypatch.setenv("TELEGRAM_API_BASE_URL", base)
+        monkeypatch.setenv("TELEGRAM_TOKEN", "PROD")
+        monkeypatch.setenv("TELEGRAM_TOKEN_DEV", "DEV")
+        monkeypatch.setattr(ds, "_schedulers", {})
+        try:
+            result = await ds.notify_user_scheduled(
+                "42", "я" * 1500, reply_markup={"inline_keyboard": []},
+                _return_message=True, _send_to_both_bots=True)
+        finally:
+            for scheduler in ds._schedulers.values():
+                await scheduler.stop()
+            await runner.cleanup()
+        sent = api.sent()
+        assert sorted(c[0] for c in sent) == ["DEV", "PROD"]
+        assert all(c[2]["text"].endswith("[сообщение сокращено]") for c in sent)
+        assert all(c[2]["parse_mode"] == "HTML" and "reply_markup" in c[2] for c in sent)
+        prod_message_id = next(c[4] for c in sent if c[0] == "PROD")
+        assert result == {"chat_id": 42, "message_id": prod_message_id}  # приоритет у PROD
+
+    asyncio.run(scenario())
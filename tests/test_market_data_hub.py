@@ -0,0 +1,175 @@
+"""
+Тесты Market Data Hub на локальном replay-сервере (aiohttp): WebSocket отдаёт записанные свечи
+в формате Binance combined stream, REST — свечи для gap-fill.
+Запуск: python -m pytest tests/test_market_data_hub.py -v
+"""
+import asyncio
+import json
+import time
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+from aiohttp import web  # noqa: E402
+
+from src.infrastructure.websockets.market_data_hub import BinanceAdapter, MarketDataHub  # noqa: E402
+
+T0 = 1_700_000_000_000  # open_time первой записанной свечи, мс
+STEP = 60_000
+
+
+def _kline(symbol, i):
+    price = 100.0 + i
+    return {"stream": f"{symbol.lower()}@kline_1m", "data": {
+        "e": "kline", "s": symbol,
+        "k": {"t": T0 + i * STEP, "o": str(price), "h": str(price + 1), "l": str(price - 1),
+              "c": str(price), "v": "10", "x": True},
+    }}
+
+
+class ReplayServer:
+    """Replay-сервер: на каждое подключение отдаёт записанные свечи своих потоков.
+
+    close_after — сколько первых подключений сервер штатно закрывает сразу после отправки.
+    """
+
+    def __init__(self, close_after=0, candles=1):
+        self.close_after = close_after
+        self.candles = candles
+        self.connections = []  # список потоков (streams) каждого подключения
+        self.live_messages = []  # сообщения клиента в открытом сокете
+        self.rest_calls = []
+
+    async def ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        streams = request.query.get("streams", "").split("/")
+        self.connections.append(streams)
+        symbols = sorted({s.split("@")[0].upper() for s in streams if s})
+        for symbol in symbols:
+            for i in range(self.candles):
+                await ws.send_str(json.dumps(_kline(symbol, i)))
+        if len(self.connections) <= self.close_after:
+            await ws.close()
+            return ws
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                self.live_messages.append(json.loads(msg.data))
+        return ws
+
+    async def klines(self, request):
+        self.rest_calls.append(dict(request.query))
+        start = int(request.query["startTime"])
+        rows = []
+        for open_time in (start, start + STEP, start + 2 * STEP):
+            i = (open_time - T0) // STEP
+            rows.append([open_time, str(100.0 + i), str(101.0 + i), str(99.0 + i), str(100.0 + i), "10",
+                         open_time + STEP - 1])
+        return web.json_response(rows)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/stream", self.ws)
+        app.router.add_get("/api/v3/klines", self.klines)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return BinanceAdapter(ws_url=f"http://127.0.0.1:{port}/stream", rest_url=f"http://127.0.0.1:{port}")
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+
+async def _wait(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("условие не выполнилось за отведённое время")
+        await asyncio.sleep(0.02)
+
+
+def test_clean_close_reconnects_with_backoff():
+    async def scenario():
+        server = ReplayServer(close_after=10_000)  # сервер всегда закрывает сокет штатно
+        adapter = await server.start()
+        hub = MarketDataHub([adapter], reconnect_delay=0.2, min_healthy_uptime=30.0)
+        try:
+            hub.subscribe(["BTCUSDT"])
+            await asyncio.sleep(1.5)
+        finally:
+            await hub.stop()
+            await server.stop()
+        # Паузы 0.2, 0.4, 0.8 с: не больше 4 подключений за 1.5 с (без паузы — десятки)
+        assert 2 <= len(server.connections) <= 4
+        assert len(server.rest_calls) <= len(server.connections) - 1
+        assert hub.get_candles("BTCUSDT")
+
+    asyncio.run(scenario())
+
+
+def test_new_symbol_subscribes_on_live_socket():
+    async def scenario():
+        server = ReplayServer()
+        adapter = await server.start()
+        hub = MarketDataHub([adapter])
+        try:
+            hub.subscribe(["BTCUSDT"])
+            await _wait(lambda: hub.get("BTCUSDT") is not None)
+            hub.subscribe(["ETHUSDT", "BTCUSDT"])
+            await _wait(lambda: server.live_messages)
+        finally:
+            await hub.stop()
+            await server.stop()
+        assert len(server.connections) == 1  # без переподключения
+        message = server.live_messages[0]
+        assert message["method"] == "SUBSCRIBE"
+        assert message["params"] == ["ethusdt@ticker", "ethusdt@kline_1m"]
+
+    asyncio.run(scenario())
+
+
+def test_symbols_are_sharded_by_stream_limit():
+    async def scenario():
+        server = ReplayServer()
+        adapter = await server.start()
+        adapter.max_streams_per_connection = 4  # 2 символа (ticker + kline) на соединение
+        hub = MarketDataHub([adapter])
+        symbols = ["AUSDT", "BUSDT", "CUSDT", "DUSDT", "EUSDT"]
+        try:
+            hub.subscribe(symbols)
+            await _wait(lambda: len(server.connections) == 3)
+            await _wait(lambda: all(hub.get(s) is not None for s in symbols))
+            stats = hub.get_stats()["streams"]
+        finally:
+            await hub.stop()
+            await server.stop()
+        assert all(len(streams) <= 4 for streams in server.connections)
+        subscribed = sorted(s.split("@")[0].upper() for streams in server.connections for s in streams)
+        assert subscribed == sorted(symbols * 2)
+        assert sorted(stats) == ["binance#0", "binance#1", "binance#2"]
+
+    asyncio.run(scenario())
+
+
+def test_gap_fill_after_reconnect_notifies_listeners():
+    async def scenario():
+        server = ReplayServer(close_after=1, candles=3)
+        adapter = await server.start()
+        hub = MarketDataHub([adapter], reconnect_delay=0.05)
+        seen = []
+        hub.add_listener("BTCUSDT", lambda snap: seen.append(snap.candles[-1].open_time))
+        try:
+            hub.subscribe(["BTCUSDT"])
+            await _wait(lambda: server.rest_calls)
+            await _wait(lambda: T0 + 4 * STEP in seen)
+        finally:
+            await hub.stop()
+            await server.stop()
+        # REST догрузил свечи после последней полученной (2) — слушатель увидел их
+        assert server.rest_calls[0]["startTime"] == str(T0 + 2 * STEP)
+        assert [c.open_time for c in hub.get_candles("BTCUSDT")][-1] == T0 + 4 * STEP
+        assert hub.stats["gap_filled_candles"] == 3
+
+    asyncio.run(scenario())
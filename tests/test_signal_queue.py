@@ -0,0 +1,142 @@
+"""
+Тесты очереди сигналов: порядок по приоритету, дедупликация по ключу, TTL через timing wheel,
+вытеснение худших при переполнении и передача пробуждения get() при отмене ожидающего.
+Запуск: python -m pytest tests/test_signal_queue.py -v
+"""
+import asyncio
+
+from src.signals.queue import SignalQueue, default_signal_key
+
+
+class FakeClock:
+    def __init__(self, now=1_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_priority_then_fifo_order():
+    clock = FakeClock()
+    queue = SignalQueue(clock=clock)
+    queue.put_nowait({"symbol": "A", "signal_type": "LONG"}, priority=2)
+    clock.now += 1
+    queue.put_nowait({"symbol": "B", "signal_type": "LONG"}, priority=1)
+    clock.now += 1
+    queue.put_nowait({"symbol": "C", "signal_type": "LONG"}, priority=1)
+    assert [queue.get_nowait()["symbol"] for _ in range(3)] == ["B", "C", "A"]
+    assert queue.get_nowait() is None
+
+
+def test_duplicate_replaces_payload_and_keeps_best_priority():
+    queue = SignalQueue(clock=FakeClock())
+    queue.put_nowait({"symbol": "BTC", "signal_type": "LONG", "price": 1}, priority=0)
+    queue.put_nowait({"symbol": "BTC", "signal_type": "LONG", "price": 2}, priority=3)
+    queue.put_nowait({"symbol": "BTC", "signal_type": "SHORT", "price": 3}, priority=1)
+    assert len(queue) == 2
+    first = queue.get_nowait()
+    assert (first["price"], first["priority"]) == (2, 0)
+    assert queue.stats["deduplicated"] == 1
+
+
+def test_default_key_requires_symbol_and_side():
+    assert default_signal_key({"symbol": "BTC", "side": "LONG"}) == "BTC:LONG"
+    assert default_signal_key({"symbol": "BTC"}) is None  # не "BTC:None"
+    assert default_signal_key({"signal_type": "LONG"}) is None
+    assert default_signal_key({"signal_key": "u1:BTC", "symbol": "BTC"}) == "u1:BTC"
+    queue = SignalQueue(clock=FakeClock())
+    queue.put_nowait({"symbol": "BTC"})
+    queue.put_nowait({"symbol": "BTC"})
+    assert len(queue) == 2  # без направления не склеиваются
+
+
+def test_expired_signals_are_dropped_and_reported():
+    clock = FakeClock()
+    discarded = []
+    queue = SignalQueue(ttl=10, clock=clock, on_discard=discarded.append)
+    queue.put_nowait({"symbol": "OLD", "signal_type": "LONG"})
+    clock.now += 5
+    queue.put_nowait({"symbol": "NEW", "signal_type": "LONG"})
+    clock.now += 7
+    assert queue.get_nowait()["symbol"] == "NEW"
+    assert [s["symbol"] for s in discarded] == ["OLD"]
+    assert queue.get_queue_stats()["expired"] == 1
+
+
+def test_overflow_evicts_lowest_priority():
+    queue = SignalQueue(max_size=2, clock=FakeClock())
+    queue.put_nowait({"symbol": "A", "signal_type": "LONG"}, priority=1)
+    queue.put_nowait({"symbol": "B", "signal_type": "LONG"}, priority=5)
+    assert queue.put_nowait({"symbol": "C", "signal_type": "LONG"}, priority=0)
+    assert [s["symbol"] for s in queue.queue] == ["C", "A"]
+    assert queue.put_nowait({"symbol": "D", "signal_type": "LONG"}, priority=9) is False
+    assert queue.stats["dropped"] == 2
+
+
+def test_get_waits_for_put_and_times_out():
+    async def scenario():
+        queue = SignalQueue()
+        assert await queue.get(timeout=0.01) is None
+        assert not queue._getters
+        getter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        queue.put_nowait({"symbol": "BTC", "signal_type": "LONG"})
+        return await asyncio.wait_for(getter, 1)
+
+    assert asyncio.run(scenario())["symbol"] == "BTC"
+
+
+def test_cancelled_waiter_passes_wakeup_to_next_getter():
+    async def scenario():
+        queue = SignalQueue()
+        first = asyncio.create_task(queue.get())
+        second = asyncio.create_task(queue.get())
+        await asyncio.sleep(0)
+        queue.put_nowait({"symbol": "BTC", "signal_type": "LONG"})  # будит first
+        first.cancel()  # отменён до того, как успел забрать сигнал
+        await asyncio.gather(first, return_exceptions=True)
+        return await asyncio.wait_for(second, 1)
+
+    assert asyncio.run(scenario())["symbol"] == "BTC"
+
+
+def test_generated_signals_go_through_queue_to_dispatchers(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # импорт signal_live создаёт trading.db в текущем каталоге
+    from src.signals import signal_live
+
+    async def scenario():
+        queue = SignalQueue()
+        sent = []
+        release = asyncio.Event()
+
+        async def fake_generate(symbol, df, user_data, *args):
+            return "LONG", 100.0 + len(sent), None
+
+        async def fake_send(symbol, signal_type, signal_price, user_data, *args, **kwargs):
+            await release.wait()
+            sent.append((user_data["user_id"], symbol, signal_price))
+            return True
+
+        monkeypatch.setattr(signal_live, "signal_queue", queue)
+        monkeypatch.setattr(signal_live, "_signal_dispatchers", [])
+        monkeypatch.setattr(signal_live, "SIGNAL_SEND_CONCURRENCY", 1)
+        monkeypatch.setattr(signal_live, "_generate_signal_impl", fake_generate)
+        monkeypatch.setattr(signal_live, "send_signal", fake_send)
+        users = {"1": {"user_id": "1"}, "2": {"user_id": "2"}}
+        try:
+            # Возврат сразу после постановки в очередь, а не после отправки
+            assert await signal_live.process_symbol_signals("BTC", None, users, []) == 2
+            await asyncio.sleep(0)
+            # Повторный цикл до отправки: сигнал пользователя "2" заменяет ждущий в очереди
+            assert await signal_live.process_symbol_signals("BTC", None, {"2": users["2"]}, []) == 1
+            release.set()
+            while len(queue) or len(sent) < 2:
+                await asyncio.sleep(0.01)
+        finally:
+            for task in signal_live._signal_dispatchers:
+                task.cancel()
+        return sent, queue.stats
+
+    sent, stats = asyncio.run(scenario())
+    assert sorted(user for user, _, _ in sent) == ["1", "2"]
+    assert stats["deduplicated"] == 1
@@ -0,0 +1,365 @@
+"""
+Рандомизированная эквивалентность векторизованного ядра стопов (src/execution/stop_kernel.py)
+и прежней поштучной логики TrailingStopManager.update_trailing_stop: случайные позиции LONG/SHORT
+(с TP1/TP2, без них и с некорректными TP), ATR, режимы, ratio и ценовые пути; simulate_paths
+со STATIC_EXIT_SETTINGS против прежнего цикла выходов run_advanced_backtest.
+Запуск: python -m pytest tests/test_stop_kernel.py -v
+"""
+import math
+
+import numpy as np
+import pytest
+
+from src.execution.stop_kernel import (
+    DEFAULT_SETTINGS,
+    EXIT_OPEN,
+    EXIT_SL,
+    EXIT_TP2,
+    REASON_NONE,
+    REASON_TP1,
+    REASON_TP2,
+    REASON_TRAIL,
+    REASON_WAITING,
+    REGIME_CODES,
+    STATIC_EXIT_SETTINGS,
+    StopBook,
+    simulate_paths,
+    trailing_step,
+)
+from src.execution.trailing_stop import TrailingStopManager
+
+REGIMES = list(REGIME_CODES)
+
+
+# --- эталон: поштучная логика update_trailing_stop до векторизации ---
+
+def _baseline_tp1(pos, price, atr, ratio, s):
+    tp1, entry, stop, side = pos['tp1_price'], pos['entry_price'], pos['current_stop'], pos['side']
+    if not s['tp1_trailing_enabled'] or not tp1:
+        return None
+    if side == "LONG":
+        if price >= tp1 or tp1 <= entry:
+            return None
+        progress = (price - entry) / (tp1 - entry)
+    else:
+        if price <= tp1 or tp1 >= entry:
+            return None
+        progress = (entry - price) / (entry - tp1)
+    if progress < s['tp1_activation_progress']:
+        return None
+    sl_progress = progress * ratio
+    if side == "LONG":
+        new_sl = max(entry + (tp1 - entry) * sl_progress, entry * 1.002)
+        if atr:
+            new_sl = max(new_sl, price - atr * s['tp1_min_atr_multiplier'])
+        if new_sl <= stop:
+            return None
+    else:
+        new_sl = min(entry - (entry - tp1) * sl_progress, entry * 0.998)
+        if atr:
+            new_sl = max(new_sl, price + atr * s['tp1_min_atr_multiplier'])
+        if new_sl >= stop:
+            return None
+    pos['current_stop'] = new_sl
+    pos['tp1_trailing_activated'] = True
+    pos['tp1_trailing_moves_count'] += 1
+    return REASON_TP1
+
+
+def _baseline_tp2(pos, price, ratio):
+    tp1, tp2, stop, side = pos['tp1_price'], pos['tp2_price'], pos['current_stop'], pos['side']
+    if not tp1 or not tp2:
+        return None
+    if side == "LONG":
+        if price < tp1 or tp2 <= tp1 or price >= tp2:
+            return None
+        progress = (price - tp1) / (tp2 - tp1)
+        new_sl = tp1 + (tp2 - tp1) * progress * ratio
+        if new_sl <= stop:
+            return None
+    else:
+        if price > tp1 or tp2 >= tp1 or price <= tp2:
+            return None
+        progress = (tp1 - price) / (tp1 - tp2)
+        new_sl = tp1 - (tp1 - tp2) * progress * ratio
+        if new_sl >= stop:
+            return None
+    pos['current_stop'] = new_sl
+    pos['tp2_trailing_activated'] = True
+    pos['tp2_trailing_moves_count'] += 1
+    return REASON_TP2
+
+
+def baseline_update(pos, price, atr, regime, ratio, s):
+    """Шаг update_trailing_stop до векторизации; возвращает код причины ядра."""
+    side, entry = pos['side'], pos['entry_price']
+    if side == "LONG":
+        profit_pct = (price - entry) / entry * 100
+        pos['highest_price'] = max(pos['highest_price'], price)
+    else:
+        profit_pct = (entry - price) / entry * 100
+        pos['lowest_price'] = min(pos['lowest_price'], price)
+
+    if s['tp1_trailing_enabled'] and pos['tp1_price']:
+        reason = _baseline_tp1(pos, price, atr, ratio, s) or _baseline_tp2(pos, price, ratio)
+        if reason:
+            return reason
+
+    if not pos['trailing_activated']:
+        if profit_pct < s['activation_min_profit_pct']:
+            return REASON_WAITING
+        pos['trailing_activated'] = True
+
+    if s['use_atr_based'] and atr:
+        atr_pct = atr / price * 100
+        if regime == 'HIGH_VOL_RANGE':
+            distance = min(atr_pct * 2.0, s['max_trail_distance_pct'])
+        elif regime == 'BULL_TREND':
+            distance = max(atr_pct * 1.0, s['min_trail_distance_pct'])
+        else:
+            distance = min(atr_pct * 1.5, s['max_trail_distance_pct'])
+    else:
+        distance = s['min_trail_distance_pct']
+    if side == "LONG":
+        new_stop = max(pos['highest_price'] * (1 - distance / 100), entry * (1 + s['breakeven_offset_pct'] / 100))
+        improved = new_stop > pos['current_stop']
+    else:
+        new_stop = min(pos['lowest_price'] * (1 + distance / 100), entry * (1 - s['breakeven_offset_pct'] / 100))
+        improved = new_stop < pos['current_stop']
+    if not improved:
+        return REASON_NONE
+    pos['current_stop'] = new_stop
+    pos['stop_moves_count'] += 1
+    return REASON_TRAIL
+
+
+def _baseline_position(entry, stop, side, tp1, tp2):
+    return {
+        'entry_price': entry, 'highest_price': entry, 'lowest_price': entry,
+        'current_stop': stop, 'trailing_activated': False,
+        'tp1_trailing_activated': False, 'tp2_trailing_activated': False,
+        'tp1_price': tp1, 'tp2_price': tp2, 'side': side,
+        'stop_moves_count': 0, 'tp1_trailing_moves_count': 0, 'tp2_trailing_moves_count': 0,
+    }
+
+
+# --- генерация случайных позиций и путей ---
+
+def _random_positions(rng, n):
+    positions = []
+    for _ in range(n):
+        side = "LONG" if rng.random() < 0.5 else "SHORT"
+        sign = 1 if side == "LONG" else -1
+        entry = float(rng.uniform(0.5, 500))
+        stop = entry * (1 - sign * rng.uniform(0.005, 0.05))
+        kind = rng.integers(4)
+        tp1 = tp2 = None
+        if kind >= 1:
+            tp1 = entry * (1 + sign * rng.uniform(0.005, 0.06))
+        if kind >= 2:
+            tp2 = tp1 * (1 + sign * rng.uniform(0.005, 0.06))
+        if kind == 3 and rng.random() < 0.3:
+            tp1 = entry * (1 - sign * rng.uniform(0.005, 0.03))  # TP1 не в сторону позиции
+        positions.append((entry, stop, side, tp1, tp2))
+    return positions
+
+
+def _random_paths(rng, positions, steps):
+    entries = np.array([p[0] for p in positions])
+    returns = rng.normal(0.0008, 0.01, size=(steps, len(positions)))
+    return entries * np.exp(np.cumsum(returns, axis=0))
+
+
+def _random_atr(rng, prices):
+    atr = prices * rng.uniform(0.001, 0.03, size=prices.shape)
+    atr[rng.random(prices.shape) < 0.25] = 0.0  # нет ATR — фиксированное расстояние
+    return atr
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_trailing_step_matches_baseline_update(seed):
+    rng = np.random.default_rng(seed)
+    settings = dict(DEFAULT_SETTINGS)
+    settings['tp1_trailing_enabled'] = seed != 4  # один прогон без подтягивания к TP1
+    positions = _random_positions(rng, 300)
+    prices = _random_paths(rng, positions, 80)
+    atr = _random_atr(rng, prices)
+    regimes = rng.choice(REGIMES, size=prices.shape)
+    ratios = rng.uniform(0.15, 1.2, size=prices.shape)
+
+    book = StopBook()
+    for i, (entry, stop, side, tp1, tp2) in enumerate(positions):
+        book.add(i, entry=entry, stop=stop, side=side, tp1=tp1, tp2=tp2)
+    baseline = [_baseline_position(*p) for p in positions]
+    cols = {name: book.view(name) for name in book.cols}
+
+    for t in range(prices.shape[0]):
+        step = trailing_step(cols, prices[t], atr=atr[t], ratio=ratios[t],
+                             regime=np.array([REGIME_CODES[r] for r in regimes[t]]), settings=settings)
+        for i, pos in enumerate(baseline):
+            reason = baseline_update(pos, float(prices[t, i]), float(atr[t, i]), regimes[t, i],
+                                     float(ratios[t, i]), settings)
+            assert int(step.reason[i]) == reason, (t, i)
+            assert bool(step.moved[i]) == (reason in (REASON_TP1, REASON_TP2, REASON_TRAIL))
+            assert math.isclose(float(step.new_stop[i]), pos['current_stop'], rel_tol=1e-12), (t, i)
+
+    for i, pos in enumerate(baseline):
+        got = book.position_dict(i)
+        for key in ('highest_price', 'lowest_price', 'trailing_activated', 'tp1_trailing_activated',
+                    'tp2_trailing_activated', 'stop_moves_count', 'tp1_trailing_moves_count',
+                    'tp2_trailing_moves_count'):
+            assert got[key] == pytest.approx(pos[key], rel=1e-12), (i, key)
+
+
+def test_manager_update_all_matches_baseline_update():
+    rng = np.random.default_rng(42)
+    positions = _random_positions(rng, 60)
+    prices = _random_paths(rng, positions, 50)
+    atr = _random_atr(rng, prices)
+    manager = TrailingStopManager(config={})
+    baseline = {}
+    for i, (entry, stop, side, tp1, tp2) in enumerate(positions):
+        manager.setup_position(f"u_{i}", entry, stop, side, tp1, tp2, market_symbol=f"S{i}")
+        baseline[f"u_{i}"] = (i, _baseline_position(entry, stop, side, tp1, tp2))
+    ratio = manager.settings['tp1_sl_progress_ratio']
+
+    for t in range(prices.shape[0]):
+        results = manager.update_all(
+            {f"S{i}": float(prices[t, i]) for i in range(len(positions))},
+            atr={f"S{i}": float(atr[t, i]) for i in range(len(positions))},
+            regimes={f"S{i}": REGIMES[(t + i) % len(REGIMES)] for i in range(len(positions))},
+        )
+        for key, (i, pos) in baseline.items():
+            reason = baseline_update(pos, float(prices[t, i]), float(atr[t, i]),
+                                     REGIMES[(t + i) % len(REGIMES)], ratio, manager.settings)
+            moved = reason in (REASON_TP1, REASON_TP2, REASON_TRAIL)
+            assert (key in results) == moved, (t, key)
+            if moved:
+                assert results[key]['new_stop'] == pytest.approx(pos['current_stop'], rel=1e-12)
+    snapshot = manager.positions_tracking
+    for key, (_, pos) in baseline.items():
+        assert snapshot[key]['current_stop'] == pytest.approx(pos['current_stop'], rel=1e-12)
+
+
+# --- эталон бектеста: SL -> TP1 (частичное закрытие, SL в безубыток) -> TP2 -> шаг трейлинга ---
+
+def baseline_simulation(position, path, atr, regimes, ratios, s):
+    entry, stop, side, tp1, tp2 = position
+    sign = 1 if side == "LONG" else -1
+    pos = _baseline_position(entry, stop, side, tp1, tp2)
+    split = s['tp1_split_pct'] / 100.0
+    realized, tp1_hit, tp1_step, last = 0.0, False, -1, None
+    for t, price in enumerate(path):
+        if np.isnan(price):
+            continue
+        last = price
+        remaining = 1.0 - split if tp1_hit else 1.0
+        if sign * (price - pos['current_stop']) <= 0:
+            realized += remaining * sign * (pos['current_stop'] - entry) / entry * 100
+            return EXIT_SL, t, realized, pos['current_stop'], tp1_step
+        if not tp1_hit and tp1 and sign * (price - tp1) >= 0:
+            realized += split * sign * (tp1 - entry) / entry * 100
+            tp1_hit, tp1_step = True, t
+            if s['move_sl_to_be_after_tp1']:
+                be = entry * (1 + sign * s['breakeven_offset_pct'] / 100)
+                pos['current_stop'] = max(pos['current_stop'], be) if sign > 0 else min(pos['current_stop'], be)
+        if tp1_hit and tp2 and sign * (price - tp2) >= 0:
+            realized += (1.0 - split) * sign * (tp2 - entry) / entry * 100
+            return EXIT_TP2, t, realized, pos['current_stop'], tp1_step
+        baseline_update(pos, float(price), float(atr[t]), regimes[t], float(ratios[t]), s)
+    remaining = 1.0 - split if tp1_hit else 1.0
+    open_pct = sign * (last - entry) / entry * 100 if last is not None else 0.0
+    return EXIT_OPEN, -1, realized + remaining * open_pct, pos['current_stop'], tp1_step
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_simulate_paths_matches_baseline_replay(seed):
+    rng = np.random.default_rng(100 + seed)
+    s = dict(DEFAULT_SETTINGS)
+    positions = _random_positions(rng, 200)
+    prices = _random_paths(rng, positions, 30)
+    starts = rng.integers(0, 25, size=len(positions))
+    for i, start in enumerate(starts):
+        prices[:start, i] = np.nan  # позиция открывается позже
+    atr = _random_atr(rng, np.nan_to_num(prices, nan=1.0))
+    regimes = rng.choice(REGIMES, size=prices.shape)
+    ratios = rng.uniform(0.15, 1.2, size=prices.shape)
+
+    result = simulate_paths(
+        entry=[p[0] for p in positions], stop=[p[1] for p in positions], side=[p[2] for p in positions],
+        tp1=[p[3] if p[3] else np.nan for p in positions], tp2=[p[4] if p[4] else np.nan for p in positions],
+        prices=prices, atr=atr, ratio=ratios,
+        regime=np.vectorize(REGIME_CODES.get)(regimes), settings=s,
+    )
+    exits = set()
+    for i, position in enumerate(positions):
+        code, step, pnl, final_stop, tp1_step = baseline_simulation(
+            position, prices[:, i], atr[:, i], regimes[:, i], ratios[:, i], s)
+        exits.add(code)
+        assert (int(result.exit_code[i]), int(result.exit_step[i]), int(result.tp1_step[i])) == (code, step, tp1_step), i
+        assert float(result.pnl_pct[i]) == pytest.approx(pnl, rel=1e-9, abs=1e-9), i
+        assert float(result.final_stop[i]) == pytest.approx(final_stop, rel=1e-12), i
+    assert exits == {EXIT_OPEN, EXIT_SL, EXIT_TP2}  # пути покрывают все исходы
+
+
+# --- эталон: цикл выходов run_advanced_backtest.AdvancedBacktest.run_backtest до ядра ---
+
+def legacy_backtest_exits(position, closes):
+    """Прежняя проверка позиции по закрытию свечи: TP2 -> TP1 (50% по уровню) -> SL; сделки по закрытию."""
+    entry, sl, direction, tp1, tp2 = position
+    size, pnl, tp1_index = 1.0, 0.0, None
+    sign = 1 if direction == "LONG" else -1
+    for idx, price in enumerate(closes):
+        if direction == "LONG":
+            if price >= tp2:
+                return tp1_index, idx, "tp2", pnl + sign * (price - entry) * size
+            elif price >= tp1 and tp1_index is None:
+                tp1_index, pnl, size = idx, pnl + sign * (tp1 - entry) * size * 0.5, size * 0.5
+            elif price <= sl:
+                return tp1_index, idx, "sl", pnl + sign * (price - entry) * size
+        else:
+            if price <= tp2:
+                return tp1_index, idx, "tp2", pnl + sign * (price - entry) * size
+            elif price <= tp1 and tp1_index is None:
+                tp1_index, pnl, size = idx, pnl + sign * (tp1 - entry) * size * 0.5, size * 0.5
+            elif price >= sl:
+                return tp1_index, idx, "sl", pnl + sign * (price - entry) * size
+    return tp1_index, None, None, pnl
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_static_exit_settings_reproduce_legacy_backtest_exits(seed):
+    rng = np.random.default_rng(200 + seed)
+    positions = []
+    for _ in range(300):
+        direction = "LONG" if rng.random() < 0.5 else "SHORT"
+        sign = 1 if direction == "LONG" else -1
+        entry = float(rng.uniform(0.5, 500))
+        tp1_pct = rng.uniform(0.5, 4)
+        positions.append((entry, entry * (1 - sign * rng.uniform(0.005, 0.04)), direction,
+                          entry * (1 + sign * tp1_pct / 100), entry * (1 + sign * (tp1_pct + rng.uniform(0.2, 4)) / 100)))
+    prices = _random_paths(rng, positions, 40)
+
+    result = simulate_paths(
+        entry=[p[0] for p in positions], stop=[p[1] for p in positions], side=[p[2] for p in positions],
+        tp1=[p[3] for p in positions], tp2=[p[4] for p in positions],
+        prices=prices, settings=STATIC_EXIT_SETTINGS,
+    )
+    reasons = {EXIT_SL: "sl", EXIT_TP2: "tp2"}
+    outcomes = set()
+    for i, position in enumerate(positions):
+        tp1_index, exit_index, reason, legacy_pnl = legacy_backtest_exits(position, prices[:, i])
+        tp1_step, exit_step = int(result.tp1_step[i]), int(result.exit_step[i])
+        assert (tp1_step if tp1_step >= 0 else None) == tp1_index, i
+        assert (exit_step if exit_step >= 0 else None) == exit_index, i
+        assert reasons.get(int(result.exit_code[i])) == reason, i
+        # Учёт бектеста поверх ядра (schedule_exits): TP1 по уровню, выход по закрытию свечи
+        entry, _, direction, tp1, _ = position
+        sign = 1 if direction == "LONG" else -1
+        split = STATIC_EXIT_SETTINGS['tp1_split_pct'] / 100
+        pnl = sign * (tp1 - entry) * split if tp1_index is not None else 0.0
+        if exit_index is not None:
+            pnl += sign * (prices[exit_index, i] - entry) * (1 - split if tp1_index is not None else 1.0)
+        assert pnl == pytest.approx(legacy_pnl, rel=1e-12, abs=1e-12), i
+        outcomes.add((reason, tp1_index is not None))
+    assert {("sl", False), ("sl", True), ("tp2", False), ("tp2", True), (None, True)} <= outcomes